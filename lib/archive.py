@@ -0,0 +1,725 @@
+# stdlib
+import concurrent.futures
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import threading
+import zlib
+from typing import Any, Optional
+
+# local
+import lib.chunk_store
+import lib.ignore
+import lib.trace
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+# gnu tar, without the pax headers whose contents vary between runs
+ARCHIVE_FORMAT = tarfile.GNU_FORMAT
+# every member gets the same owner, timestamp and one of a few modes, so the
+# archive only depends on the paths and contents of the files in it
+ARCHIVE_MTIME = 0
+ARCHIVE_UID = 0
+ARCHIVE_GID = 0
+DIR_MODE = 0o755
+FILE_MODE = 0o644
+EXECUTABLE_FILE_MODE = 0o755
+SYMLINK_MODE = 0o777
+# holds values such as the work dir, stored as the first member so reading
+# it never decompresses the rest of the archive
+METADATA_MEMBER_NAME = ".tfarchive.json"
+# the checksum of every file, stored as the last member once they are known
+CHECKSUMS_MEMBER_NAME = ".tfarchive-checksums.json"
+# members of a pipelined archive which were deleted after being added, such
+# as terraform's lock info, removed again once they are extracted
+DELETED_MEMBERS_MEMBER_NAME = ".tfarchive-deleted.json"
+ARCHIVE_MANIFEST_FILE_NAME = "archive-manifest.json"
+# written in place of an archive, when its members are kept in a chunk store
+CHUNK_MANIFEST_SUFFIX = ".tfchunks.json"
+CHECKSUM_ALGORITHM = "sha256"
+COPY_BUFFER_SIZE = 1024 * 1024
+# threads checksumming extracted files, while the next members are extracted.
+# hashlib releases the gil, so they run on separate cores
+VERIFY_WORKERS = min(8, os.cpu_count() or 1)
+
+# (mode, size, mtime) of a member's source, when it was added
+MemberStat = tuple[int, int, int]
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# ArchiveIntegrityError
+# =============================================================================
+class ArchiveIntegrityError(Exception):
+    pass
+
+
+# =============================================================================
+# PipelinedArchive
+# =============================================================================
+class PipelinedArchive:
+    # archives a tree which is still being written to, such as during a
+    # plan. start adds the tree on a background thread, and finish adds the
+    # files created or changed since after the rest, so the archive extracts
+    # to the tree as it was when finished. a tree which did not change gives
+    # the same bytes as create_archive. files deleted in the meantime are
+    # listed in a member of their own, and removed again when extracted
+    def __init__(
+        self,
+        source_dir: str,
+        archive_file_path: str,
+        arcname: str,
+        metadata: Optional[dict[str, Any]] = None,
+        ignore_matcher: Optional[lib.ignore.IgnoreMatcher] = None,
+    ) -> None:
+        self.source_dir = source_dir
+        self.archive_file_path = archive_file_path
+        self._arcname = arcname
+        self._metadata = metadata
+        self._ignore_matcher = ignore_matcher
+        self._added_members: dict[str, MemberStat] = {}
+        self._member_checksums: dict[str, str] = {}
+        self._stop_event = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._temp_file: Any = None
+        self._gzip_file: Optional[gzip.GzipFile] = None
+        self._archive_file: Optional[tarfile.TarFile] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _add_source_tree(self) -> None:
+        try:
+            _add_tree(
+                self._archive_file,
+                self.source_dir,
+                self._arcname,
+                ignore_matcher=self._ignore_matcher,
+                added_members=self._added_members,
+                member_checksums=self._member_checksums,
+                stop_event=self._stop_event,
+            )
+        except BaseException as error:
+            # raised by finish, on the thread which started the archive
+            self._error = error
+
+    def _close(self) -> None:
+        # closing the tar file writes its end of archive blocks
+        for open_file in (
+            self._archive_file,
+            self._gzip_file,
+            self._temp_file,
+        ):
+            if open_file is not None:
+                open_file.close()
+
+    def start(self) -> None:
+        self._temp_file = _create_temp_archive_file(self.archive_file_path)
+        try:
+            self._gzip_file = _open_gzip_file(self._temp_file)
+            self._archive_file = tarfile.open(
+                fileobj=self._gzip_file,
+                mode="w",
+                format=ARCHIVE_FORMAT,
+            )
+            if self._metadata:
+                _add_json_member(
+                    self._archive_file,
+                    METADATA_MEMBER_NAME,
+                    self._metadata,
+                )
+        except BaseException:
+            self.abort()
+            raise
+        # zlib releases the gil while it compresses, so the compression
+        # runs alongside the main thread as well as alongside terraform
+        self._thread = threading.Thread(
+            target=self._add_source_tree,
+            name="archive",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def finish(self) -> str:
+        if self._thread is None:
+            raise RuntimeError("archive was not started")
+        self._thread.join()
+        try:
+            if self._error is not None:
+                raise self._error
+            # the whole tree is walked again, so the ignored bytes counted
+            # are those of the tree as it is now
+            walked_members: set[str] = set()
+            skipped_bytes = _add_tree(
+                self._archive_file,
+                self.source_dir,
+                self._arcname,
+                ignore_matcher=self._ignore_matcher,
+                added_members=self._added_members,
+                member_checksums=self._member_checksums,
+                walked_members=walked_members,
+            )
+            # added while the tree was walked, and gone by the time it was
+            # walked again
+            deleted_members = sorted(
+                set(self._added_members) - walked_members
+            )
+            if deleted_members:
+                for member_name in deleted_members:
+                    self._member_checksums.pop(member_name, None)
+                _add_json_member(
+                    self._archive_file,
+                    DELETED_MEMBERS_MEMBER_NAME,
+                    {"members": deleted_members},
+                )
+            # a file added twice is checksummed as it was added last, which
+            # is the one extracted
+            _add_json_member(
+                self._archive_file,
+                CHECKSUMS_MEMBER_NAME,
+                self._member_checksums,
+            )
+            self._close()
+            checksum = get_file_checksum(self._temp_file.name)
+            os.replace(self._temp_file.name, self.archive_file_path)
+        except BaseException:
+            self.abort()
+            raise
+        if self._ignore_matcher:
+            print(
+                f"skipped {skipped_bytes} bytes of ignored files in: "
+                f"{self.source_dir}"
+            )
+        return checksum
+
+    def abort(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self._close()
+        finally:
+            if self._temp_file is not None and os.path.exists(
+                self._temp_file.name
+            ):
+                os.remove(self._temp_file.name)
+
+
+# =============================================================================
+# _ChecksumReader
+# =============================================================================
+class _ChecksumReader:
+    # checksums a file as tarfile reads it into the archive, so every file
+    # is only read once
+    def __init__(self, source_file: Any) -> None:
+        self._source_file = source_file
+        self.checksum = hashlib.new(CHECKSUM_ALGORITHM)
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._source_file.read(size)
+        self.checksum.update(data)
+        return data
+
+
+# =============================================================================
+# _ChunkingTarFile
+# =============================================================================
+class _ChunkingTarFile(tarfile.TarFile):
+    # every member starts a new chunk, so a changed plan file never changes
+    # the chunks of the providers archived after it
+    def addfile(
+        self,
+        tarinfo: tarfile.TarInfo,
+        fileobj: Optional[Any] = None,
+    ) -> None:
+        super().addfile(tarinfo, fileobj)
+        self.fileobj.cut()
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _add_json_member
+# =============================================================================
+def _add_json_member(
+    archive_file: tarfile.TarFile,
+    member_name: str,
+    value: dict[str, Any],
+) -> None:
+    contents = json.dumps(value, sort_keys=True).encode("utf-8")
+    tarinfo = tarfile.TarInfo(member_name)
+    tarinfo.size = len(contents)
+    archive_file.addfile(normalize_tarinfo(tarinfo), io.BytesIO(contents))
+
+
+# =============================================================================
+# _is_external_file_link
+# =============================================================================
+def _is_external_file_link(path: str, source_root: str) -> bool:
+    # links within the tree, such as those into the plugin cache, are kept
+    if not os.path.islink(path):
+        return False
+    target = os.path.realpath(path)
+    if not os.path.isfile(target):
+        return False
+    return os.path.commonpath([target, source_root]) != source_root
+
+
+# =============================================================================
+# _get_member_stat
+# =============================================================================
+def _get_member_stat(path: str) -> MemberStat:
+    path_stat = os.lstat(path)
+    if stat.S_ISDIR(path_stat.st_mode):
+        # a dir's mtime changes with every file added to it, while its
+        # member never does
+        return (path_stat.st_mode, 0, 0)
+    return (path_stat.st_mode, path_stat.st_size, path_stat.st_mtime_ns)
+
+
+# =============================================================================
+# _add_tree
+# =============================================================================
+def _add_tree(
+    archive_file: tarfile.TarFile,
+    source_dir: str,
+    arcname: str,
+    ignore_matcher: Optional[lib.ignore.IgnoreMatcher] = None,
+    added_members: Optional[dict[str, MemberStat]] = None,
+    member_checksums: Optional[dict[str, str]] = None,
+    stop_event: Optional[threading.Event] = None,
+    walked_members: Optional[set[str]] = None,
+) -> int:
+    # paths deleted while the tree is walked, such as the lock info terraform
+    # writes during a plan, are skipped
+    skipped_bytes = 0
+    source_root = os.path.realpath(source_dir)
+    # members in name order, whatever order the filesystem lists them in
+    for path, relative_path, skipped_size in lib.ignore.iter_tree(
+        source_dir,
+        ignore_matcher,
+    ):
+        if stop_event is not None and stop_event.is_set():
+            break
+        if skipped_size is not None:
+            skipped_bytes += skipped_size
+            continue
+        member_name = (
+            f"{arcname}/{relative_path}" if relative_path else arcname
+        )
+        # files staged as links into the inputs are stored as the files
+        # themselves, so the archive holds everything the plan needs
+        if _is_external_file_link(path, source_root):
+            path = os.path.realpath(path)
+        try:
+            if added_members is not None:
+                # taken before the member is read, so a file changed while
+                # it is being read differs the next time the tree is added
+                member_stat = _get_member_stat(path)
+                if walked_members is not None:
+                    walked_members.add(member_name)
+                if added_members.get(member_name) == member_stat:
+                    continue
+            tarinfo = archive_file.gettarinfo(path, member_name)
+            if tarinfo is None:
+                # sockets and the like cannot be archived
+                continue
+            # hard links are stored as regular files, since which path
+            # tarfile sees first depends on the inodes rather than the
+            # contents
+            if tarinfo.islnk():
+                tarinfo.type = tarfile.REGTYPE
+                tarinfo.linkname = ""
+                tarinfo.size = os.path.getsize(path)
+            normalize_tarinfo(tarinfo)
+            member_file = open(path, "rb") if tarinfo.isreg() else None
+        except FileNotFoundError:
+            if walked_members is not None:
+                walked_members.discard(member_name)
+            continue
+        if member_file is not None:
+            # once open, the file is read whole even if it is deleted
+            with lib.trace.file_span(
+                "archive", "file", member_name, tarinfo.size
+            ), member_file:
+                checksum_reader = _ChecksumReader(member_file)
+                archive_file.addfile(tarinfo, checksum_reader)
+            if member_checksums is not None:
+                member_checksums[member_name] = (
+                    checksum_reader.checksum.hexdigest()
+                )
+        else:
+            archive_file.addfile(tarinfo)
+        if added_members is not None:
+            added_members[member_name] = member_stat
+    return skipped_bytes
+
+
+# =============================================================================
+# _create_temp_archive_file
+# =============================================================================
+def _create_temp_archive_file(archive_file_path: str) -> Any:
+    archive_dir = os.path.dirname(os.path.abspath(archive_file_path))
+    # written next to the destination, without a .tar.gz suffix, so a
+    # partial archive is never picked up by a restore
+    return tempfile.NamedTemporaryFile(
+        dir=archive_dir,
+        prefix=".tfarchive.",
+        suffix=".tmp",
+        delete=False,
+    )
+
+
+# =============================================================================
+# _open_gzip_file
+# =============================================================================
+def _open_gzip_file(temp_file: Any) -> gzip.GzipFile:
+    # no file name or timestamp in the gzip header
+    return gzip.GzipFile(filename="", mode="wb", fileobj=temp_file, mtime=0)
+
+
+# =============================================================================
+# _remove_deleted_members
+# =============================================================================
+def _remove_deleted_members(output_dir: str, member_names: list[str]) -> None:
+    output_root = os.path.abspath(output_dir)
+    # children before their dirs
+    for member_name in sorted(member_names, reverse=True):
+        path = os.path.abspath(os.path.join(output_root, member_name))
+        if os.path.commonpath([path, output_root]) != output_root:
+            raise ArchiveIntegrityError(
+                f"deleted member is outside the output dir: {member_name}"
+            )
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+
+# =============================================================================
+# _extract_and_verify
+# =============================================================================
+def _extract_and_verify(
+    archive_file: tarfile.TarFile,
+    output_dir: str,
+) -> None:
+    # each file is checksummed on another thread once it is extracted,
+    # while the next members are, and checked against the checksums member
+    # at the end of the archive
+    expected_checksums: Optional[dict[str, str]] = None
+    checksums: dict[str, concurrent.futures.Future] = {}
+    member_name = ""
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=VERIFY_WORKERS,
+        thread_name_prefix="archive-verify",
+    ) as executor:
+        try:
+            for tarinfo in archive_file:
+                if tarinfo.name == CHECKSUMS_MEMBER_NAME:
+                    expected_checksums = json.load(
+                        archive_file.extractfile(tarinfo)
+                    )
+                    continue
+                if tarinfo.name == DELETED_MEMBERS_MEMBER_NAME:
+                    deleted_members = json.load(
+                        archive_file.extractfile(tarinfo)
+                    )["members"]
+                    # never checksummed once they are removed
+                    concurrent.futures.wait([
+                        checksums.pop(name)
+                        for name in deleted_members
+                        if name in checksums
+                    ])
+                    _remove_deleted_members(output_dir, deleted_members)
+                    continue
+                archive_file.extract(tarinfo, path=output_dir)
+                member_name = tarinfo.name
+                if tarinfo.isreg():
+                    # a member added twice is only checked as extracted last
+                    checksums[tarinfo.name] = executor.submit(
+                        get_file_checksum,
+                        os.path.join(output_dir, tarinfo.name),
+                    )
+        except (
+            tarfile.TarError,
+            EOFError,
+            gzip.BadGzipFile,
+            zlib.error,
+        ) as error:
+            executor.shutdown(cancel_futures=True)
+            raise ArchiveIntegrityError(
+                "archive is truncated or corrupt, after member: "
+                f"{member_name or 'none'}: {error}"
+            ) from error
+        if expected_checksums is None:
+            # created before archives carried checksums
+            print("archive has no member checksums, skipping verification")
+            return
+        corrupt_members = [
+            name
+            for name, checksum in sorted(expected_checksums.items())
+            if name not in checksums or checksums[name].result() != checksum
+        ]
+    if corrupt_members:
+        raise ArchiveIntegrityError(
+            "archive members failed verification: "
+            f"{', '.join(corrupt_members)}"
+        )
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# normalize_tarinfo
+# =============================================================================
+def normalize_tarinfo(tarinfo: tarfile.TarInfo) -> tarfile.TarInfo:
+    tarinfo.mtime = ARCHIVE_MTIME
+    tarinfo.uid = ARCHIVE_UID
+    tarinfo.gid = ARCHIVE_GID
+    tarinfo.uname = ""
+    tarinfo.gname = ""
+    if tarinfo.isdir():
+        tarinfo.mode = DIR_MODE
+    elif tarinfo.issym():
+        tarinfo.mode = SYMLINK_MODE
+    elif tarinfo.mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH):
+        # provider binaries must stay executable
+        tarinfo.mode = EXECUTABLE_FILE_MODE
+    else:
+        tarinfo.mode = FILE_MODE
+    return tarinfo
+
+
+# =============================================================================
+# get_file_checksum
+# =============================================================================
+def get_file_checksum(file_path: str) -> str:
+    checksum = hashlib.new(CHECKSUM_ALGORITHM)
+    with open(file_path, "rb") as checksum_file:
+        for chunk in iter(lambda: checksum_file.read(COPY_BUFFER_SIZE), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+# =============================================================================
+# get_uncompressed_size
+# =============================================================================
+def get_uncompressed_size(archive_file_path: str) -> int:
+    # from the gzip trailer, rather than decompressing the archive. it holds
+    # the size modulo 4 GiB
+    with open(archive_file_path, "rb") as archive_file:
+        archive_file.seek(-4, os.SEEK_END)
+        return int.from_bytes(archive_file.read(4), "little")
+
+
+# =============================================================================
+# create_archive
+# =============================================================================
+def create_archive(
+    source_dir: str,
+    archive_file_path: str,
+    arcname: str,
+    metadata: Optional[dict[str, Any]] = None,
+    ignore_matcher: Optional[lib.ignore.IgnoreMatcher] = None,
+) -> str:
+    # the same tree always produces the same bytes, so archives can be
+    # deduplicated by their checksum, which is returned
+    temp_file = _create_temp_archive_file(archive_file_path)
+    try:
+        with temp_file:
+            with _open_gzip_file(temp_file) as gzip_file:
+                with tarfile.open(
+                    fileobj=gzip_file,
+                    mode="w",
+                    format=ARCHIVE_FORMAT,
+                ) as archive_file:
+                    if metadata:
+                        _add_json_member(
+                            archive_file,
+                            METADATA_MEMBER_NAME,
+                            metadata,
+                        )
+                    member_checksums: dict[str, str] = {}
+                    skipped_bytes = _add_tree(
+                        archive_file,
+                        source_dir,
+                        arcname,
+                        ignore_matcher=ignore_matcher,
+                        member_checksums=member_checksums,
+                    )
+                    _add_json_member(
+                        archive_file,
+                        CHECKSUMS_MEMBER_NAME,
+                        member_checksums,
+                    )
+        checksum = get_file_checksum(temp_file.name)
+        os.replace(temp_file.name, archive_file_path)
+    except BaseException:
+        if os.path.exists(temp_file.name):
+            os.remove(temp_file.name)
+        raise
+    if ignore_matcher:
+        print(
+            f"skipped {skipped_bytes} bytes of ignored files in: {source_dir}"
+        )
+    return checksum
+
+
+# =============================================================================
+# extract_archive
+# =============================================================================
+def extract_archive(
+    archive_file_path: str,
+    output_dir: str,
+    debug: bool = False,
+) -> None:
+    with tarfile.open(archive_file_path, "r:gz") as archive_file:
+        if debug:
+            archive_file.debug = 3
+        _extract_and_verify(archive_file, output_dir)
+
+
+# =============================================================================
+# create_chunked_archive
+# =============================================================================
+def create_chunked_archive(
+    source_dir: str,
+    manifest_file_path: str,
+    arcname: str,
+    store_dir: str,
+    metadata: Optional[dict[str, Any]] = None,
+    ignore_matcher: Optional[lib.ignore.IgnoreMatcher] = None,
+) -> str:
+    # the same uncompressed tar as create_archive, stored in chunks, with a
+    # manifest listing them written in place of the archive. the checksum
+    # of the manifest is returned, which is as reproducible as the archive
+    chunk_writer = lib.chunk_store.ChunkWriter(store_dir)
+    with _ChunkingTarFile.open(
+        fileobj=chunk_writer,
+        mode="w",
+        format=ARCHIVE_FORMAT,
+    ) as archive_file:
+        if metadata:
+            _add_json_member(archive_file, METADATA_MEMBER_NAME, metadata)
+        member_checksums: dict[str, str] = {}
+        skipped_bytes = _add_tree(
+            archive_file,
+            source_dir,
+            arcname,
+            ignore_matcher=ignore_matcher,
+            member_checksums=member_checksums,
+        )
+        _add_json_member(archive_file, CHECKSUMS_MEMBER_NAME, member_checksums)
+    # stores the end of archive blocks
+    chunk_writer.close()
+    manifest = {
+        "algorithm": CHECKSUM_ALGORITHM,
+        "checksum": chunk_writer.checksum(),
+        "size": chunk_writer.tell(),
+        "metadata": metadata or {},
+        "store_dir": os.path.abspath(store_dir),
+        "chunks": chunk_writer.chunks,
+    }
+    temp_file = _create_temp_archive_file(manifest_file_path)
+    try:
+        with temp_file:
+            temp_file.write(
+                json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+            )
+        checksum = get_file_checksum(temp_file.name)
+        os.replace(temp_file.name, manifest_file_path)
+    except BaseException:
+        if os.path.exists(temp_file.name):
+            os.remove(temp_file.name)
+        raise
+    print(
+        f"stored {chunk_writer.stored_chunks} of {len(chunk_writer.chunks)} "
+        f"chunks, {chunk_writer.stored_bytes} bytes, in: {store_dir}"
+    )
+    if ignore_matcher:
+        print(
+            f"skipped {skipped_bytes} bytes of ignored files in: {source_dir}"
+        )
+    return checksum
+
+
+# =============================================================================
+# read_chunk_manifest
+# =============================================================================
+def read_chunk_manifest(manifest_file_path: str) -> dict[str, Any]:
+    with open(manifest_file_path, "r", encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+
+# =============================================================================
+# extract_chunked_archive
+# =============================================================================
+def extract_chunked_archive(
+    manifest_file_path: str,
+    output_dir: str,
+    store_dir: str = "",
+) -> None:
+    manifest = read_chunk_manifest(manifest_file_path)
+    # the store may be mounted somewhere else than where it was written
+    chunk_reader = lib.chunk_store.ChunkReader(
+        store_dir or manifest["store_dir"],
+        [(checksum, size) for checksum, size in manifest["chunks"]],
+    )
+    # read as a stream, so only one chunk is ever held in memory
+    with tarfile.open(fileobj=chunk_reader, mode="r|") as archive_file:
+        _extract_and_verify(archive_file, output_dir)
+
+
+# =============================================================================
+# read_archive_metadata
+# =============================================================================
+def read_archive_metadata(archive_file_path: str) -> dict[str, Any]:
+    if archive_file_path.endswith(CHUNK_MANIFEST_SUFFIX):
+        return read_chunk_manifest(archive_file_path)["metadata"]
+    with tarfile.open(archive_file_path, "r:gz") as archive_file:
+        tarinfo = archive_file.next()
+        if tarinfo is None or tarinfo.name != METADATA_MEMBER_NAME:
+            return {}
+        metadata_file = archive_file.extractfile(tarinfo)
+        return json.load(metadata_file)
+
+
+# =============================================================================
+# write_archive_manifest
+# =============================================================================
+def write_archive_manifest(archive_file_path: str, checksum: str) -> str:
+    manifest_file_path = os.path.join(
+        os.path.dirname(archive_file_path),
+        ARCHIVE_MANIFEST_FILE_NAME,
+    )
+    manifest = {
+        "file": os.path.basename(archive_file_path),
+        "algorithm": CHECKSUM_ALGORITHM,
+        "checksum": checksum,
+        "size": os.path.getsize(archive_file_path),
+    }
+    with open(manifest_file_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    print(f"wrote archive manifest to: {manifest_file_path}")
+    return manifest_file_path
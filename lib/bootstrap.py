@@ -0,0 +1,97 @@
+# stdlib
+import os
+import sys
+from typing import Optional
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+# step modules are imported lazily, so these prefixes are duplicated here
+# rather than read from the modules that own them
+TRUSTED_CA_CERTS_VAR_PREFIX = 'CT_TRUSTED_CA_CERT_'
+CONSUL_CONFIG_VAR_PREFIX = 'CT_CONSUL_TF_CONFIG_'
+# set by consul-wrapper once it has already written the consul config
+CONSUL_CONFIG_INSTALLED_VAR = 'CT_CONSUL_CONFIG_INSTALLED'
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _log
+# =============================================================================
+def _log(message: str) -> None:
+    print(f"[bootstrap] {message}", file=sys.stderr)
+
+
+# =============================================================================
+# _has_var_with_prefix
+# =============================================================================
+def _has_var_with_prefix(environment: dict, prefix: str) -> bool:
+    return any(key.startswith(prefix) for key in environment)
+
+
+# =============================================================================
+# _install_ssh_keys
+# =============================================================================
+def _install_ssh_keys(environment: dict) -> None:
+    import lib.ssh_keys
+    lib.ssh_keys.main(environment)
+
+
+# =============================================================================
+# _install_trusted_ca_certs
+# =============================================================================
+def _install_trusted_ca_certs(environment: dict) -> None:
+    if not _has_var_with_prefix(environment, TRUSTED_CA_CERTS_VAR_PREFIX):
+        return
+    import lib.trusted_ca_certs
+    lib.trusted_ca_certs.main(environment)
+
+
+# =============================================================================
+# _install_consul_config
+# =============================================================================
+def _install_consul_config(environment: dict) -> None:
+    if environment.get(CONSUL_CONFIG_INSTALLED_VAR):
+        _log("consul config already installed, skipping")
+        return
+    if not _has_var_with_prefix(environment, CONSUL_CONFIG_VAR_PREFIX):
+        return
+    import lib.consul_config
+    lib.consul_config.main(environment)
+
+
+# =============================================================================
+# _run_command
+# =============================================================================
+def _run_command(args: list) -> None:
+    import lib.cli
+    lib.cli.main(args)
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# main
+# =============================================================================
+def main(args: list, environment: Optional[dict] = None) -> None:
+    if environment is None:
+        environment = os.environ
+    # each step only imports its module if it has work to do,
+    # so the whole task runs in one interpreter with one import pass
+    _install_ssh_keys(environment)
+    _install_trusted_ca_certs(environment)
+    _install_consul_config(environment)
+    if args:
+        _run_command(args)
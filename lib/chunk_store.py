@@ -0,0 +1,174 @@
+# stdlib
+import collections
+import gzip
+import hashlib
+import io
+import os
+import tempfile
+from typing import Optional
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+CHUNK_STORE_DIR_VAR = "TF_ARCHIVE_CHUNK_STORE_DIR"
+CHECKSUM_ALGORITHM = "sha256"
+# members larger than this, such as provider binaries, are split into
+# chunks of this size
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+# chunks are stored in dirs named after the start of their checksum, so no
+# one dir holds every chunk
+CHUNK_DIR_NAME_LENGTH = 2
+CHUNK_FILE_SUFFIX = ".gz"
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# ChunkWriter
+# =============================================================================
+class ChunkWriter:
+    # a write only file which stores what is written to it as chunks. the
+    # caller cuts a chunk wherever the content allows, such as after each
+    # tar member, so unchanged members give the same chunks whatever comes
+    # before them, and only chunks missing from the store are written
+    def __init__(self, store_dir: str) -> None:
+        self.store_dir = store_dir
+        self.chunks: list[tuple[str, int]] = []
+        self.stored_chunks = 0
+        self.stored_bytes = 0
+        self._buffer = bytearray()
+        self._checksum = hashlib.new(CHECKSUM_ALGORITHM)
+        self._size = 0
+
+    def tell(self) -> int:
+        return self._size
+
+    def write(self, data: bytes) -> int:
+        self._size += len(data)
+        self._buffer += data
+        self._checksum.update(data)
+        while len(self._buffer) >= MAX_CHUNK_SIZE:
+            self._store_chunk(bytes(self._buffer[:MAX_CHUNK_SIZE]))
+            del self._buffer[:MAX_CHUNK_SIZE]
+        return len(data)
+
+    def cut(self) -> None:
+        if self._buffer:
+            self._store_chunk(bytes(self._buffer))
+            self._buffer.clear()
+
+    def close(self) -> None:
+        self.cut()
+
+    def checksum(self) -> str:
+        # of everything written, as if it had been written to a file
+        return self._checksum.hexdigest()
+
+    def _store_chunk(self, chunk: bytes) -> None:
+        checksum = hashlib.new(CHECKSUM_ALGORITHM, chunk).hexdigest()
+        self.chunks.append((checksum, len(chunk)))
+        chunk_file_path = get_chunk_file_path(self.store_dir, checksum)
+        if os.path.exists(chunk_file_path):
+            return
+        chunk_dir = os.path.dirname(chunk_file_path)
+        os.makedirs(chunk_dir, exist_ok=True)
+        # the store may be shared, so a chunk appears whole or not at all
+        temp_file = tempfile.NamedTemporaryFile(
+            dir=chunk_dir,
+            prefix=".tfchunk.",
+            suffix=".tmp",
+            delete=False,
+        )
+        try:
+            with temp_file:
+                temp_file.write(gzip.compress(chunk, mtime=0))
+            os.replace(temp_file.name, chunk_file_path)
+        except BaseException:
+            if os.path.exists(temp_file.name):
+                os.remove(temp_file.name)
+            raise
+        self.stored_chunks += 1
+        self.stored_bytes += len(chunk)
+
+
+# =============================================================================
+# ChunkReader
+# =============================================================================
+class ChunkReader:
+    # a read only file of chunks from the store, read one at a time and
+    # verified against their checksums
+    def __init__(self, store_dir: str, chunks: list[tuple[str, int]]) -> None:
+        self.store_dir = store_dir
+        self._chunks = collections.deque(chunks)
+        self._chunk = io.BytesIO()
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        while size != 0:
+            data = self._chunk.read(size)
+            if not data:
+                if not self._chunks:
+                    break
+                checksum, chunk_size = self._chunks.popleft()
+                self._chunk = io.BytesIO(
+                    read_chunk(self.store_dir, checksum, chunk_size)
+                )
+                continue
+            parts.append(data)
+            if size > 0:
+                size -= len(data)
+        return b"".join(parts)
+
+    def close(self) -> None:
+        self._chunks.clear()
+        self._chunk = io.BytesIO()
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# get_chunk_store_dir_from_environment
+# =============================================================================
+def get_chunk_store_dir_from_environment() -> Optional[str]:
+    return os.environ.get(CHUNK_STORE_DIR_VAR) or None
+
+
+# =============================================================================
+# get_chunk_file_path
+# =============================================================================
+def get_chunk_file_path(store_dir: str, checksum: str) -> str:
+    return os.path.join(
+        store_dir,
+        checksum[:CHUNK_DIR_NAME_LENGTH],
+        f"{checksum}{CHUNK_FILE_SUFFIX}",
+    )
+
+
+# =============================================================================
+# read_chunk
+# =============================================================================
+def read_chunk(store_dir: str, checksum: str, size: int) -> bytes:
+    chunk_file_path = get_chunk_file_path(store_dir, checksum)
+    if not os.path.isfile(chunk_file_path):
+        raise FileNotFoundError(f"chunk not found in store: {chunk_file_path}")
+    with open(chunk_file_path, "rb") as chunk_file:
+        chunk = gzip.decompress(chunk_file.read())
+    if (
+        len(chunk) != size
+        or hashlib.new(CHECKSUM_ALGORITHM, chunk).hexdigest() != checksum
+    ):
+        raise ValueError(
+            f"chunk does not match its checksum: {chunk_file_path}"
+        )
+    return chunk
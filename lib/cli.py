@@ -0,0 +1,564 @@
+# stdlib
+import datetime
+import os
+import time
+
+# local
+import lib.commands
+import lib.environment
+import lib.terraform_dir
+import lib.trace
+from lib.environment import strtobool
+
+
+# =============================================================================
+# constants
+# =============================================================================
+DEBUG = 'DEBUG'
+ERROR_ON_NO_CHANGES = 'ERROR_ON_NO_CHANGES'
+TERRAFORM_SOURCE_DIR = 'TF_WORKING_DIR'
+TERRAFORM_DIR_PATH = 'TF_DIR_PATH'
+TERRAFORM_OUTPUT_DIR = 'TF_OUTPUT_DIR'
+ARCHIVE_OUTPUT_DIR = 'ARCHIVE_OUTPUT_DIR'
+ARCHIVE_INPUT_DIR = 'ARCHIVE_INPUT_DIR'
+SOURCE_REF = 'SOURCE_REF'
+SOURCE_REF_FILE = 'SOURCE_REF_FILE'
+PLAN_FILE_PATH = 'PLAN_FILE_PATH'
+DESTROY = 'DESTROY'
+STATE_FILE_PATH = 'STATE_FILE_PATH'
+STATE_OUTPUT_DIR = 'STATE_OUTPUT_DIR'
+STATE_OUTPUT_COMPRESS = 'STATE_OUTPUT_COMPRESS'
+STATE_DIFF = 'STATE_DIFF'
+PLAN_SUMMARY = 'PLAN_SUMMARY'
+PLAN_SUMMARY_MAX_DESTROY = 'PLAN_SUMMARY_MAX_DESTROY'
+ARCHIVE_CONTENT_NAMING = 'ARCHIVE_CONTENT_NAMING'
+ARCHIVE_PIPELINE = 'ARCHIVE_PIPELINE'
+WORKSTATION_MODE = 'WORKSTATION_MODE'
+WORKSTATION_MODE_TIMEOUT = 'WORKSTATION_MODE_TIMEOUT'
+WORKSTATION_MODE_DEFAULT_TIMEOUT = 60
+WORKSTATION_MODE_WATCH = 'WORKSTATION_MODE_WATCH'
+WORKSTATION_MODE_DEBOUNCE = 'WORKSTATION_MODE_DEBOUNCE'
+DRIFT_ROOTS = 'DRIFT_ROOTS'
+DRIFT_REPORT_DIR = 'DRIFT_REPORT_DIR'
+DRIFT_CONCURRENCY = 'DRIFT_CONCURRENCY'
+DRIFT_BACKEND_RATE_LIMIT = 'DRIFT_BACKEND_RATE_LIMIT'
+RUN_HISTORY_FILE = 'RUN_HISTORY_FILE'
+RUN_HISTORY_ROOT = 'RUN_HISTORY_ROOT'
+RUN_HISTORY_REGRESSION_THRESHOLD = 'RUN_HISTORY_REGRESSION_THRESHOLD'
+METRICS_TEXTFILE_PATH = 'METRICS_TEXTFILE_PATH'
+TRACE_FILE_PATH = 'TRACE_FILE_PATH'
+TRACE_FILE_SIZE_THRESHOLD = 'TRACE_FILE_SIZE_THRESHOLD'
+PROFILE = 'PROFILE'
+PROFILE_OUTPUT_DIR = 'PROFILE_OUTPUT_DIR'
+PROFILE_TF_LOG_FILE_SIZE = 'PROFILE_TF_LOG_FILE_SIZE'
+PROFILE_TF_LOG_FILE_COUNT = 'PROFILE_TF_LOG_FILE_COUNT'
+PROVIDER_BUNDLE_ROOTS = 'PROVIDER_BUNDLE_ROOTS'
+PROVIDER_BUNDLE_OUTPUT_DIR = 'PROVIDER_BUNDLE_OUTPUT_DIR'
+
+
+# =============================================================================
+# process_args
+# =============================================================================
+def process_args(args: list) -> None:
+    command = args[0]
+    if command == lib.commands.INIT:
+        # get parameters from environment
+        terraform_source_dir = os.environ[TERRAFORM_SOURCE_DIR]
+        terraform_dir_path = os.environ.get(TERRAFORM_DIR_PATH)
+        debug = os.environ.get(DEBUG)
+        if debug:
+            # convert to bool if specified
+            debug = bool(strtobool(debug))
+        lib.commands.init(
+            terraform_source_dir,
+            terraform_dir_path=terraform_dir_path,
+            debug=debug)
+    elif command == lib.commands.PLAN:
+        # get parameters from environment
+        terraform_source_dir = os.environ[TERRAFORM_SOURCE_DIR]
+        terraform_dir_path = os.environ.get(TERRAFORM_DIR_PATH)
+        state_file_path = os.environ.get(STATE_FILE_PATH)
+        error_on_no_changes = os.environ.get(ERROR_ON_NO_CHANGES)
+        output_var_files = \
+            lib.environment.get_tf_output_var_files(os.environ)
+        if error_on_no_changes:
+            # convert to bool if specified
+            error_on_no_changes = bool(strtobool(error_on_no_changes))
+        destroy = os.environ.get(DESTROY)
+        if destroy:
+            # convert to bool if specified
+            destroy = bool(strtobool(destroy))
+        debug = os.environ.get(DEBUG)
+        if debug:
+            # convert to bool if specified
+            debug = bool(strtobool(debug))
+        lib.commands.plan(
+            terraform_source_dir,
+            terraform_dir_path=terraform_dir_path,
+            state_file_path=state_file_path,
+            output_var_files=output_var_files,
+            error_on_no_changes=error_on_no_changes,
+            destroy=destroy,
+            debug=debug)
+    elif command == lib.commands.APPLY:
+        # get parameters from environment
+        terraform_source_dir = os.environ[TERRAFORM_SOURCE_DIR]
+        terraform_dir_path = os.environ.get(TERRAFORM_DIR_PATH)
+        output_var_files = \
+            lib.environment.get_tf_output_var_files(os.environ)
+        state_file_path = os.environ.get(STATE_FILE_PATH)
+        state_output_dir = os.environ.get(STATE_OUTPUT_DIR)
+        compress_state_output = os.environ.get(STATE_OUTPUT_COMPRESS)
+        if compress_state_output:
+            # convert to bool if specified
+            compress_state_output = bool(strtobool(compress_state_output))
+        state_diff = os.environ.get(STATE_DIFF)
+        if state_diff:
+            # convert to bool if specified
+            state_diff = bool(strtobool(state_diff))
+        # optionally write outputs after the apply
+        output_dir = os.environ.get(TERRAFORM_OUTPUT_DIR)
+        output_targets = \
+            lib.environment.get_tf_output_targets(os.environ)
+        debug = os.environ.get(DEBUG)
+        if debug:
+            # convert to bool if specified
+            debug = bool(strtobool(debug))
+        lib.commands.apply(
+            terraform_source_dir,
+            terraform_dir_path=terraform_dir_path,
+            output_var_files=output_var_files,
+            state_file_path=state_file_path,
+            state_output_dir=state_output_dir,
+            compress_state_output=compress_state_output,
+            state_diff=state_diff,
+            output_dir=output_dir,
+            output_targets=output_targets,
+            debug=debug)
+    elif command == lib.commands.CREATE_PLAN:
+        # get parameters from environment
+        terraform_source_dir = os.environ[TERRAFORM_SOURCE_DIR]
+        archive_output_dir = os.environ[ARCHIVE_OUTPUT_DIR]
+        plan_file_path = os.environ.get(PLAN_FILE_PATH)
+        terraform_dir_path = os.environ.get(TERRAFORM_DIR_PATH)
+        state_file_path = os.environ.get(STATE_FILE_PATH)
+        source_ref = os.environ.get(SOURCE_REF)
+        source_ref_file = os.environ.get(SOURCE_REF_FILE)
+        error_on_no_changes = os.environ.get(ERROR_ON_NO_CHANGES)
+        output_var_files = \
+            lib.environment.get_tf_output_var_files(os.environ)
+        if error_on_no_changes:
+            # convert to bool if specified
+            error_on_no_changes = bool(strtobool(error_on_no_changes))
+        destroy = os.environ.get(DESTROY)
+        if destroy:
+            # convert to bool if specified
+            destroy = bool(strtobool(destroy))
+        plan_summary = os.environ.get(PLAN_SUMMARY)
+        if plan_summary:
+            # convert to bool if specified
+            plan_summary = bool(strtobool(plan_summary))
+        plan_summary_max_destroy = os.environ.get(PLAN_SUMMARY_MAX_DESTROY)
+        if plan_summary_max_destroy:
+            # convert to int if specified
+            plan_summary_max_destroy = int(plan_summary_max_destroy)
+        else:
+            plan_summary_max_destroy = None
+        archive_content_naming = os.environ.get(ARCHIVE_CONTENT_NAMING)
+        if archive_content_naming:
+            # convert to bool if specified
+            archive_content_naming = bool(strtobool(archive_content_naming))
+        archive_pipeline = os.environ.get(ARCHIVE_PIPELINE)
+        if archive_pipeline:
+            # convert to bool if specified
+            archive_pipeline = bool(strtobool(archive_pipeline))
+        debug = os.environ.get(DEBUG)
+        if debug:
+            # convert to bool if specified
+            debug = bool(strtobool(debug))
+        lib.commands.create_plan(
+            terraform_source_dir,
+            archive_output_dir,
+            plan_file_path=plan_file_path,
+            terraform_dir_path=terraform_dir_path,
+            state_file_path=state_file_path,
+            output_var_files=output_var_files,
+            source_ref=source_ref,
+            source_ref_file=source_ref_file,
+            error_on_no_changes=error_on_no_changes,
+            destroy=destroy,
+            plan_summary=plan_summary,
+            plan_summary_max_destroy=plan_summary_max_destroy,
+            archive_content_naming=archive_content_naming,
+            archive_pipeline=archive_pipeline,
+            debug=debug)
+    elif command == lib.commands.SHOW_PLAN:
+        # get parameters from environment
+        archive_input_dir = os.environ[ARCHIVE_INPUT_DIR]
+        plan_file_path = os.environ.get(PLAN_FILE_PATH)
+        debug = os.environ.get(DEBUG)
+        if debug:
+            # convert to bool if specified
+            debug = bool(strtobool(debug))
+        lib.commands.show_plan(
+            archive_input_dir,
+            plan_file_path=plan_file_path,
+            debug=debug)
+    elif command == lib.commands.APPLY_PLAN:
+        # get parameters from environment
+        archive_input_dir = os.environ[ARCHIVE_INPUT_DIR]
+        state_output_dir = os.environ.get(STATE_OUTPUT_DIR)
+        plan_file_path = os.environ.get(PLAN_FILE_PATH)
+        compress_state_output = os.environ.get(STATE_OUTPUT_COMPRESS)
+        if compress_state_output:
+            # convert to bool if specified
+            compress_state_output = bool(strtobool(compress_state_output))
+        state_diff = os.environ.get(STATE_DIFF)
+        if state_diff:
+            # convert to bool if specified
+            state_diff = bool(strtobool(state_diff))
+        # optionally write outputs after the apply
+        output_dir = os.environ.get(TERRAFORM_OUTPUT_DIR)
+        output_targets = \
+            lib.environment.get_tf_output_targets(os.environ)
+        debug = os.environ.get(DEBUG)
+        if debug:
+            # convert to bool if specified
+            debug = bool(strtobool(debug))
+        lib.commands.apply_plan(
+            archive_input_dir,
+            state_output_dir=state_output_dir,
+            plan_file_path=plan_file_path,
+            compress_state_output=compress_state_output,
+            state_diff=state_diff,
+            output_dir=output_dir,
+            output_targets=output_targets,
+            debug=debug)
+    elif command == lib.commands.OUTPUT:
+        # get parameters from environment
+        output_dir = os.environ[TERRAFORM_OUTPUT_DIR]
+        output_targets = \
+            lib.environment.get_tf_output_targets(os.environ)
+        state_file_path = os.environ.get(STATE_FILE_PATH)
+        debug = os.environ.get(DEBUG)
+        if debug:
+            # convert to bool if specified
+            debug = bool(strtobool(debug))
+        lib.commands.output(
+            output_dir,
+            output_targets=output_targets,
+            state_file_path=state_file_path,
+            debug=debug)
+    elif command == lib.commands.DRIFT:
+        # get parameters from environment
+        terraform_source_dir = os.environ[TERRAFORM_SOURCE_DIR]
+        # root paths within the source dir, separated by whitespace or commas
+        root_paths = os.environ[DRIFT_ROOTS].replace(',', ' ').split()
+        report_output_dir = os.environ[DRIFT_REPORT_DIR]
+        concurrency = os.environ.get(DRIFT_CONCURRENCY)
+        if concurrency:
+            # convert to int if specified
+            concurrency = int(concurrency)
+        else:
+            concurrency = None
+        backend_rate_limit = os.environ.get(DRIFT_BACKEND_RATE_LIMIT)
+        if backend_rate_limit:
+            # convert to float if specified
+            backend_rate_limit = float(backend_rate_limit)
+        else:
+            backend_rate_limit = None
+        debug = os.environ.get(DEBUG)
+        if debug:
+            # convert to bool if specified
+            debug = bool(strtobool(debug))
+        lib.commands.drift(
+            terraform_source_dir,
+            root_paths,
+            report_output_dir,
+            concurrency=concurrency,
+            backend_rate_limit=backend_rate_limit,
+            debug=debug)
+    elif command == lib.commands.HISTORY:
+        # get parameters from environment
+        history_file_path = os.environ[RUN_HISTORY_FILE]
+        root = os.environ.get(RUN_HISTORY_ROOT)
+        regression_threshold = \
+            os.environ.get(RUN_HISTORY_REGRESSION_THRESHOLD)
+        if regression_threshold:
+            # convert to float if specified
+            regression_threshold = float(regression_threshold)
+        else:
+            regression_threshold = None
+        lib.commands.history(
+            history_file_path,
+            root=root,
+            regression_threshold=regression_threshold)
+    elif command == lib.commands.BUNDLE_PROVIDERS:
+        # get parameters from environment
+        terraform_source_dir = os.environ[TERRAFORM_SOURCE_DIR]
+        bundle_output_dir = os.environ[PROVIDER_BUNDLE_OUTPUT_DIR]
+        # root paths within the source dir, separated by whitespace or commas
+        root_paths = os.environ.get(PROVIDER_BUNDLE_ROOTS)
+        if root_paths:
+            root_paths = root_paths.replace(',', ' ').split()
+        else:
+            # every root with a lock file
+            root_paths = None
+        debug = os.environ.get(DEBUG)
+        if debug:
+            # convert to bool if specified
+            debug = bool(strtobool(debug))
+        lib.commands.bundle_providers(
+            terraform_source_dir,
+            bundle_output_dir,
+            root_paths=root_paths,
+            debug=debug)
+    else:
+        print(f'command not recognized: {command}')
+        print(f"available commands: {' '.join(lib.commands.COMMANDS)}")
+        raise NotImplementedError
+
+
+def get_run_history_root() -> str:
+    root = os.environ.get(RUN_HISTORY_ROOT)
+    if root:
+        return root
+    # the source dir and the path of the root within it
+    return os.path.normpath(os.path.join(
+        os.environ.get(TERRAFORM_SOURCE_DIR, ''),
+        os.environ.get(TERRAFORM_DIR_PATH, '')))
+
+
+def record_run_history(
+        history_file_path: str,
+        command: str,
+        started_at: float,
+        duration: float,
+        success: bool) -> None:
+    # imported here so commands which keep no history do not pay for it
+    import sqlite3
+    import lib.run_history
+    import lib.run_stats
+    try:
+        lib.run_history.record_run(
+            history_file_path,
+            get_run_history_root(),
+            command,
+            started_at,
+            duration,
+            success,
+            phases=lib.run_stats.get_phases(),
+            counts=lib.run_stats.get_counts())
+    except (OSError, sqlite3.Error) as error:
+        # the history never fails the command itself
+        print(f'[warning] could not record run history: {error}')
+
+
+def process_args_and_wait(args: list) -> None:
+    try:
+        process_args(args)
+    finally:
+        # the plugin cache is exported while terraform runs, and only the
+        # end of the command waits for it
+        lib.terraform_dir.wait_for_plugin_cache_exports()
+
+
+def process_args_with_trace(args: list) -> None:
+    trace_file_path = os.environ.get(TRACE_FILE_PATH)
+    if not trace_file_path:
+        process_args_and_wait(args)
+        return
+    file_size_threshold = os.environ.get(TRACE_FILE_SIZE_THRESHOLD)
+    if file_size_threshold:
+        file_size_threshold = int(file_size_threshold)
+    else:
+        file_size_threshold = lib.trace.DEFAULT_FILE_SIZE_THRESHOLD
+    lib.trace.enable(file_size_threshold=file_size_threshold)
+    try:
+        with lib.trace.span(args[0], 'command'):
+            process_args_and_wait(args)
+    finally:
+        try:
+            lib.trace.write_trace(trace_file_path)
+        except OSError as error:
+            # the trace never fails the command itself
+            print(f'[warning] could not write trace: {error}')
+
+
+def write_run_metrics(
+        textfile_path: str,
+        command: str,
+        duration: float,
+        success: bool) -> None:
+    # imported here so commands which export no metrics do not pay for it
+    import lib.metrics
+    import lib.run_stats
+    try:
+        lib.metrics.write_metrics_textfile(
+            textfile_path,
+            lib.metrics.get_run_samples(
+                get_run_history_root(),
+                command,
+                duration,
+                success,
+                phases=lib.run_stats.get_phases(),
+                counts=lib.run_stats.get_counts(),
+                exit_codes=lib.run_stats.get_exit_codes()))
+    except OSError as error:
+        # the metrics never fail the command itself
+        print(f'[warning] could not write metrics: {error}')
+
+
+def process_args_with_history(args: list) -> None:
+    history_file_path = os.environ.get(RUN_HISTORY_FILE)
+    metrics_textfile_path = os.environ.get(METRICS_TEXTFILE_PATH)
+    if args[0] == lib.commands.HISTORY or not (
+            history_file_path or metrics_textfile_path):
+        process_args_with_trace(args)
+        return
+    started_at = time.time()
+    start_time = time.perf_counter()
+    success = False
+    try:
+        process_args_with_trace(args)
+        success = True
+    finally:
+        duration = time.perf_counter() - start_time
+        if history_file_path:
+            record_run_history(
+                history_file_path,
+                args[0],
+                started_at,
+                duration,
+                success)
+        if metrics_textfile_path:
+            write_run_metrics(
+                metrics_textfile_path,
+                args[0],
+                duration,
+                success)
+
+
+def process_args_with_profile(args: list) -> None:
+    profile = os.environ.get(PROFILE)
+    if profile:
+        # convert to bool if specified
+        profile = bool(strtobool(profile))
+    if not profile:
+        process_args_with_history(args)
+        return
+    # imported here so commands which are not profiled do not pay for it
+    import lib.profiling
+    profile_output_dir = os.environ.get(PROFILE_OUTPUT_DIR)
+    if not profile_output_dir:
+        raise ValueError(f'{PROFILE_OUTPUT_DIR} cannot be empty')
+    tf_log_file_size = os.environ.get(PROFILE_TF_LOG_FILE_SIZE)
+    if tf_log_file_size:
+        tf_log_file_size = int(tf_log_file_size)
+    else:
+        tf_log_file_size = lib.profiling.DEFAULT_TF_LOG_FILE_SIZE
+    tf_log_file_count = os.environ.get(PROFILE_TF_LOG_FILE_COUNT)
+    if tf_log_file_count:
+        tf_log_file_count = int(tf_log_file_count)
+    else:
+        tf_log_file_count = lib.profiling.DEFAULT_TF_LOG_FILE_COUNT
+    with lib.profiling.profile_run(
+            profile_output_dir,
+            args[0],
+            tf_log_file_size=tf_log_file_size,
+            tf_log_file_count=tf_log_file_count):
+        process_args_with_history(args)
+
+
+def do_workstation_session(timeout: int) -> None:
+    # imported here so commands which never watch do not pay for it
+    import lib.workstation
+    # get parameters from environment
+    terraform_source_dir = os.environ[TERRAFORM_SOURCE_DIR]
+    terraform_dir_path = os.environ.get(TERRAFORM_DIR_PATH)
+    output_var_files = \
+        lib.environment.get_tf_output_var_files(os.environ)
+    debounce_seconds = os.environ.get(WORKSTATION_MODE_DEBOUNCE)
+    if debounce_seconds:
+        debounce_seconds = float(debounce_seconds)
+    else:
+        debounce_seconds = lib.workstation.DEFAULT_DEBOUNCE_SECONDS
+    destroy = os.environ.get(DESTROY)
+    if destroy:
+        # convert to bool if specified
+        destroy = bool(strtobool(destroy))
+    debug = os.environ.get(DEBUG)
+    if debug:
+        # convert to bool if specified
+        debug = bool(strtobool(debug))
+    print('[workstation] starting warm workstation session')
+    lib.workstation.run_session(
+        terraform_source_dir,
+        timeout,
+        terraform_dir_path=terraform_dir_path,
+        output_var_files=output_var_files,
+        destroy=destroy,
+        debounce_seconds=debounce_seconds,
+        debug=debug)
+    print('[workstation] stopping workstation session')
+
+
+def do_workstation_mode(succeeded: bool = False) -> None:
+    # check for WORKSTATION_MODE
+    workstation_mode = os.environ.get(WORKSTATION_MODE)
+    if workstation_mode:
+        # convert to bool if specified
+        workstation_mode = bool(strtobool(workstation_mode))
+    workstation_mode_timeout = os.environ.get(WORKSTATION_MODE_TIMEOUT)
+    if workstation_mode_timeout:
+        workstation_mode_timeout = int(workstation_mode_timeout)
+    else:
+        workstation_mode_timeout = WORKSTATION_MODE_DEFAULT_TIMEOUT
+    # check for WORKSTATION_MODE_WATCH
+    workstation_mode_watch = os.environ.get(WORKSTATION_MODE_WATCH)
+    if workstation_mode_watch:
+        # convert to bool if specified
+        workstation_mode_watch = bool(strtobool(workstation_mode_watch))
+    # a failed command, or one without a source dir such as show-plan,
+    # only gets the plain wait
+    if workstation_mode and workstation_mode_watch and not (
+            succeeded and os.environ.get(TERRAFORM_SOURCE_DIR)):
+        print('[workstation] not watching, the command failed or has no '
+              'source dir')
+        workstation_mode_watch = False
+    # if WORKSTATION_MODE is enabled with a watch
+    if workstation_mode and workstation_mode_watch:
+        do_workstation_session(workstation_mode_timeout)
+    # if WORKSTATION_MODE is enabled
+    elif workstation_mode:
+        def _should_wait(start_time, timeout):
+            # get current time
+            current_time = datetime.datetime.utcnow()
+            # get end time
+            end_time = start_time + datetime.timedelta(minutes=timeout)
+            # get time delta between the two
+            time_remaining = end_time - current_time
+            print('[workstation] time remaining: ' +
+                  str(time_remaining).split(".")[0])
+            return current_time < end_time
+        print('[workstation] starting workstation mode')
+        print(f'[workstation] timeout: {workstation_mode_timeout} minutes')
+        # get start time
+        start_time = datetime.datetime.utcnow()
+        while _should_wait(start_time, workstation_mode_timeout):
+            sleep_time = 30
+            print(f'[workstation] sleeping for {sleep_time} seconds...')
+            time.sleep(sleep_time)
+        print('[workstation] stopping workstation mode')
+
+
+# =============================================================================
+# main
+# =============================================================================
+def main(args: list) -> None:
+    succeeded = False
+    try:
+        process_args_with_profile(args)
+        succeeded = True
+    finally:
+        do_workstation_mode(succeeded)
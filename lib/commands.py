@@ -2,6 +2,7 @@
 from typing import Any, Optional
 
 # local
+import lib.chunk_store
 import lib.terraform_dir
 
 # =============================================================================
@@ -15,7 +16,21 @@ CREATE_PLAN = "create-plan"
 SHOW_PLAN = "show-plan"
 APPLY_PLAN = "apply-plan"
 OUTPUT = "output"
-COMMANDS = [INIT, PLAN, APPLY, CREATE_PLAN, SHOW_PLAN, APPLY_PLAN, OUTPUT]
+DRIFT = "drift"
+HISTORY = "history"
+BUNDLE_PROVIDERS = "bundle-providers"
+COMMANDS = [
+    INIT,
+    PLAN,
+    APPLY,
+    CREATE_PLAN,
+    SHOW_PLAN,
+    APPLY_PLAN,
+    OUTPUT,
+    DRIFT,
+    HISTORY,
+    BUNDLE_PROVIDERS,
+]
 
 
 # =============================================================================
@@ -70,6 +85,10 @@ def apply(
     output_var_files: Optional[dict[str, Any]] = None,
     state_file_path: Optional[str] = None,
     state_output_dir: Optional[str] = None,
+    compress_state_output: Optional[bool] = None,
+    state_diff: Optional[bool] = None,
+    output_dir: Optional[str] = None,
+    output_targets: Optional[dict[str, Any]] = None,
     debug: bool = False,
 ) -> None:
     terraform_dir = lib.terraform_dir.init_terraform_dir(
@@ -83,6 +102,10 @@ def apply(
         output_var_files=output_var_files,
         state_file_path=state_file_path,
         state_output_dir=state_output_dir,
+        compress_state_output=bool(compress_state_output),
+        state_diff=bool(state_diff),
+        output_dir=output_dir or "",
+        output_targets=output_targets,
         debug=debug,
     )
 
@@ -101,6 +124,10 @@ def create_plan(
     source_ref_file: Optional[str] = None,
     error_on_no_changes: Optional[bool] = None,
     destroy: Optional[bool] = None,
+    plan_summary: Optional[bool] = None,
+    plan_summary_max_destroy: Optional[int] = None,
+    archive_content_naming: Optional[bool] = None,
+    archive_pipeline: Optional[bool] = None,
     debug: bool = False,
 ) -> None:
     terraform_dir = lib.terraform_dir.init_terraform_dir(
@@ -108,22 +135,61 @@ def create_plan(
         terraform_dir_path=terraform_dir_path,
         debug=debug,
     )
-    lib.terraform_dir.plan_terraform_dir(
-        terraform_dir,
-        terraform_dir_path=terraform_dir_path,
-        create_plan_file=True,
-        plan_file_path=plan_file_path,
-        state_file_path=state_file_path,
-        output_var_files=output_var_files,
-        error_on_no_changes=error_on_no_changes,
-        destroy=destroy,
-        debug=debug,
-    )
+    pipelined_archive = None
+    # chunked archives are always created after the plan
+    if archive_pipeline and not (
+        lib.chunk_store.get_chunk_store_dir_from_environment()
+    ):
+        # the sources, .terraform and lock file are fixed once init is done,
+        # so they are archived while the plan runs
+        pipelined_archive = lib.terraform_dir.start_terraform_dir_archive(
+            terraform_dir,
+            archive_output_dir,
+            source_ref=source_ref,
+            source_ref_file=source_ref_file,
+            debug=debug,
+        )
+    try:
+        plan_file_path = lib.terraform_dir.plan_terraform_dir(
+            terraform_dir,
+            terraform_dir_path=terraform_dir_path,
+            create_plan_file=True,
+            plan_file_path=plan_file_path,
+            state_file_path=state_file_path,
+            output_var_files=output_var_files,
+            error_on_no_changes=error_on_no_changes,
+            destroy=destroy,
+            debug=debug,
+        )
+        # a destroy threshold implies a summary
+        if plan_summary or plan_summary_max_destroy is not None:
+            # summarize before archiving, so a rejected plan is never
+            # archived
+            lib.terraform_dir.summarize_terraform_plan(
+                terraform_dir,
+                archive_output_dir,
+                plan_file_path=plan_file_path,
+                max_destroy=plan_summary_max_destroy,
+                debug=debug,
+            )
+    except BaseException:
+        if pipelined_archive:
+            pipelined_archive.abort()
+        raise
+    if pipelined_archive:
+        # adds the plan file and anything else the plan wrote
+        lib.terraform_dir.finish_terraform_dir_archive(
+            pipelined_archive,
+            content_naming=bool(archive_content_naming),
+            debug=debug,
+        )
+        return
     lib.terraform_dir.archive_terraform_dir(
         terraform_dir,
         archive_output_dir,
         source_ref=source_ref,
         source_ref_file=source_ref_file,
+        content_naming=bool(archive_content_naming),
         debug=debug,
     )
 
@@ -154,6 +220,10 @@ def apply_plan(
     archive_input_dir: str,
     state_output_dir: Optional[str] = None,
     plan_file_path: Optional[str] = None,
+    compress_state_output: Optional[bool] = None,
+    state_diff: Optional[bool] = None,
+    output_dir: Optional[str] = None,
+    output_targets: Optional[dict[str, Any]] = None,
     debug: bool = False,
 ) -> None:
     terraform_dir = lib.terraform_dir.restore_terraform_dir(
@@ -164,6 +234,10 @@ def apply_plan(
         terraform_dir,
         state_output_dir=state_output_dir,
         plan_file_path=plan_file_path,
+        compress_state_output=bool(compress_state_output),
+        state_diff=bool(state_diff),
+        output_dir=output_dir or "",
+        output_targets=output_targets,
         debug=debug,
     )
 
@@ -177,6 +251,18 @@ def output(
     state_file_path: Optional[str] = None,
     debug: bool = False,
 ) -> None:
+    # imported here, only output ever reads through the state cache
+    import lib.state_cache
+    # remote state is read through the cache, a state file never is
+    state_cache_dir = lib.state_cache.get_state_cache_dir_from_environment()
+    if state_cache_dir and not state_file_path:
+        lib.terraform_dir.output_terraform_dir_from_state_cache(
+            output_dir,
+            state_cache_dir,
+            output_targets=output_targets,
+            debug=debug,
+        )
+        return
     terraform_dir = lib.terraform_dir.init_terraform_dir(debug=debug)
     lib.terraform_dir.output_terraform_dir(
         terraform_dir,
@@ -185,3 +271,66 @@ def output(
         state_file_path=state_file_path,
         debug=debug,
     )
+
+
+# =============================================================================
+# drift
+# =============================================================================
+def drift(
+    terraform_source_dir: str,
+    root_paths: list[str],
+    report_output_dir: str,
+    concurrency: Optional[int] = None,
+    backend_rate_limit: Optional[float] = None,
+    debug: bool = False,
+) -> None:
+    lib.terraform_dir.drift_terraform_dirs(
+        terraform_source_dir,
+        root_paths,
+        report_output_dir,
+        concurrency=concurrency,
+        backend_rate_limit=backend_rate_limit,
+        debug=debug,
+    )
+
+
+# =============================================================================
+# history
+# =============================================================================
+def history(
+    history_file_path: str,
+    root: Optional[str] = None,
+    regression_threshold: Optional[float] = None,
+) -> None:
+    # imported here, the terraform commands only ever write the history
+    import lib.run_history
+    if regression_threshold is None:
+        regression_threshold = lib.run_history.DEFAULT_REGRESSION_THRESHOLD
+    stats = lib.run_history.get_duration_stats(
+        history_file_path,
+        root=root or "",
+        regression_threshold=regression_threshold,
+    )
+    print(
+        lib.run_history.format_duration_stats(
+            stats,
+            regression_threshold=regression_threshold,
+        )
+    )
+
+
+# =============================================================================
+# bundle_providers
+# =============================================================================
+def bundle_providers(
+    terraform_source_dir: str,
+    bundle_output_dir: str,
+    root_paths: Optional[list[str]] = None,
+    debug: bool = False,
+) -> None:
+    lib.terraform_dir.bundle_terraform_providers(
+        terraform_source_dir,
+        bundle_output_dir,
+        root_paths=root_paths,
+        debug=debug,
+    )
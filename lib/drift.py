@@ -0,0 +1,293 @@
+# stdlib
+import asyncio
+import collections
+import glob
+import json
+import os
+import re
+import subprocess
+import time
+from typing import Any, Optional
+
+# local
+import lib.terraform_async
+import lib.terraform_command
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+DRIFTED = "drifted"
+IN_SYNC = "in-sync"
+ERROR = "error"
+DEFAULT_CONCURRENCY = 4
+# terraform runs started per second against any one backend
+DEFAULT_BACKEND_RATE_LIMIT = 2.0
+DEFAULT_BACKEND_TYPE = "local"
+DRIFT_REPORT_FILE_NAME = "drift-report.json"
+DRIFT_REPORT_MARKDOWN_FILE_NAME = "drift-report.md"
+# lines of output kept for the report when a root fails
+ERROR_OUTPUT_LINES = 20
+BACKEND_BLOCK_REGEX = re.compile(r'^\s*backend\s+"([^"]+)"', re.MULTILINE)
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# DriftCheckError
+# =============================================================================
+class DriftCheckError(Exception):
+    pass
+
+
+# =============================================================================
+# BackendRateLimiter
+# =============================================================================
+class BackendRateLimiter:
+    # spaces out the terraform runs started against each backend, so a
+    # sweep never floods a single state backend with lock and read calls
+    def __init__(self, rate_limit: float) -> None:
+        self._interval = 1.0 / rate_limit if rate_limit > 0 else 0.0
+        self._next_start_times: dict[str, float] = {}
+        self._locks: dict[str, asyncio.Lock] = collections.defaultdict(
+            asyncio.Lock
+        )
+
+    async def wait(self, backend: str) -> None:
+        if not self._interval:
+            return
+        async with self._locks[backend]:
+            now = time.monotonic()
+            start_time = max(now, self._next_start_times.get(backend, now))
+            self._next_start_times[backend] = start_time + self._interval
+            if start_time > now:
+                await asyncio.sleep(start_time - now)
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _get_backend_type
+# =============================================================================
+def _get_backend_type(root_dir: str, default_backend_type: str = "") -> str:
+    # the backend a root declares, or the one the task configures
+    terraform_file_paths = glob.glob(os.path.join(root_dir, "*.tf"))
+    for terraform_file_path in sorted(terraform_file_paths):
+        with open(terraform_file_path, "r", encoding="utf-8") as tf_file:
+            match = BACKEND_BLOCK_REGEX.search(tf_file.read())
+        if match:
+            return match.group(1)
+    return default_backend_type or DEFAULT_BACKEND_TYPE
+
+
+# =============================================================================
+# _check_root
+# =============================================================================
+async def _check_root(
+    terraform_dir: str,
+    root_path: str,
+    plugin_cache_dir: str,
+    backend: str,
+    semaphore: asyncio.Semaphore,
+    init_lock: asyncio.Lock,
+    rate_limiter: BackendRateLimiter,
+    backend_config_vars: Optional[dict[str, Any]] = None,
+    debug: bool = False,
+) -> dict[str, Any]:
+    output: collections.deque = collections.deque(maxlen=ERROR_OUTPUT_LINES)
+    result: dict[str, Any] = {"root": root_path, "backend": backend}
+    start_time = time.monotonic()
+    try:
+        async with semaphore:
+            # terraform's plugin cache is not safe for concurrent installs,
+            # so inits take turns, and with a warm cache they are quick
+            async with init_lock:
+                await rate_limiter.wait(backend)
+                await lib.terraform_async.init(
+                    terraform_dir,
+                    terraform_dir_path=root_path,
+                    plugin_cache_dir_path=plugin_cache_dir,
+                    backend_config_vars=backend_config_vars,
+                    on_stdout_line=output.append,
+                    on_stderr_line=output.append,
+                    debug=debug,
+                )
+            await rate_limiter.wait(backend)
+            return_code = await lib.terraform_async.plan(
+                terraform_dir,
+                terraform_dir_path=root_path,
+                plugin_cache_dir_path=plugin_cache_dir,
+                error_on_no_changes=False,
+                refresh_only=True,
+                on_stdout_line=output.append,
+                on_stderr_line=output.append,
+                debug=debug,
+            )
+    except subprocess.CalledProcessError as error:
+        result["status"] = ERROR
+        result["error"] = f"terraform exited with {error.returncode}"
+        result["output"] = "".join(output)
+    else:
+        result["status"] = (
+            DRIFTED
+            if return_code == lib.terraform_command.CHANGES_RETURN_CODE
+            else IN_SYNC
+        )
+    result["duration"] = round(time.monotonic() - start_time, 3)
+    print(f"[drift] {root_path}: {result['status']}")
+    return result
+
+
+# =============================================================================
+# _check_roots
+# =============================================================================
+async def _check_roots(
+    terraform_dir: str,
+    root_paths: list[str],
+    plugin_cache_dir: str,
+    backend_config_vars: Optional[dict[str, Any]] = None,
+    default_backend_type: str = "",
+    concurrency: int = DEFAULT_CONCURRENCY,
+    backend_rate_limit: float = DEFAULT_BACKEND_RATE_LIMIT,
+    debug: bool = False,
+) -> list[dict[str, Any]]:
+    # created here, since asyncio primitives belong to the running loop
+    semaphore = asyncio.Semaphore(concurrency)
+    init_lock = asyncio.Lock()
+    rate_limiter = BackendRateLimiter(backend_rate_limit)
+    return list(
+        await asyncio.gather(*[
+            _check_root(
+                terraform_dir,
+                root_path,
+                plugin_cache_dir,
+                _get_backend_type(
+                    os.path.join(terraform_dir, root_path),
+                    default_backend_type,
+                ),
+                semaphore,
+                init_lock,
+                rate_limiter,
+                backend_config_vars=backend_config_vars,
+                debug=debug,
+            )
+            for root_path in root_paths
+        ])
+    )
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# check_drift
+# =============================================================================
+def check_drift(
+    terraform_dir: str,
+    root_paths: list[str],
+    plugin_cache_dir: str,
+    backend_config_vars: Optional[dict[str, Any]] = None,
+    default_backend_type: str = "",
+    concurrency: int = DEFAULT_CONCURRENCY,
+    backend_rate_limit: float = DEFAULT_BACKEND_RATE_LIMIT,
+    debug: bool = False,
+) -> list[dict[str, Any]]:
+    # check concurrency
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    return asyncio.run(
+        _check_roots(
+            terraform_dir,
+            root_paths,
+            plugin_cache_dir,
+            backend_config_vars=backend_config_vars,
+            default_backend_type=default_backend_type,
+            concurrency=concurrency,
+            backend_rate_limit=backend_rate_limit,
+            debug=debug,
+        )
+    )
+
+
+# =============================================================================
+# format_drift_report
+# =============================================================================
+def format_drift_report(results: list[dict[str, Any]]) -> str:
+    counts = collections.Counter(result["status"] for result in results)
+    lines = [
+        "# drift report",
+        "",
+        f"{counts[DRIFTED]} drifted, {counts[IN_SYNC]} in sync, "
+        f"{counts[ERROR]} failed, of {len(results)} roots",
+        "",
+        "| root | backend | status | duration |",
+        "| --- | --- | --- | --- |",
+    ]
+    for result in results:
+        lines.append(
+            f"| `{result['root']}` | {result['backend']} "
+            f"| {result['status']} | {result['duration']:.1f}s |"
+        )
+    for result in results:
+        if result["status"] != ERROR:
+            continue
+        lines.extend([
+            "",
+            f"## `{result['root']}`: {result['error']}",
+            "",
+            "```",
+            result["output"].rstrip("\n"),
+            "```",
+        ])
+    return "\n".join(lines) + "\n"
+
+
+# =============================================================================
+# write_drift_report
+# =============================================================================
+def write_drift_report(
+    results: list[dict[str, Any]],
+    output_dir: str,
+) -> tuple[str, str]:
+    # create output dir, if needed
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    report_file_path = os.path.join(output_dir, DRIFT_REPORT_FILE_NAME)
+    with open(report_file_path, "w", encoding="utf-8") as report_file:
+        json.dump({"roots": results}, report_file, indent=2, sort_keys=True)
+    print(f"wrote drift report to: {report_file_path}")
+    markdown_file_path = os.path.join(
+        output_dir,
+        DRIFT_REPORT_MARKDOWN_FILE_NAME,
+    )
+    with open(markdown_file_path, "w", encoding="utf-8") as markdown_file:
+        markdown_file.write(format_drift_report(results))
+    print(f"wrote drift report to: {markdown_file_path}")
+    return report_file_path, markdown_file_path
+
+
+# =============================================================================
+# check_drift_results
+# =============================================================================
+def check_drift_results(results: list[dict[str, Any]]) -> None:
+    # drift is reported, while roots which could not be checked fail
+    failed_roots = [
+        result["root"] for result in results if result["status"] == ERROR
+    ]
+    if failed_roots:
+        raise DriftCheckError(
+            f"drift check failed for: {', '.join(failed_roots)}"
+        )
@@ -10,6 +10,8 @@ from typing import Optional
 
 TERRAFORM_OUTPUT_VAR_FILE_PREFIX = 'TF_OUTPUT_VAR_FILE_'
 TERRAFORM_OUTPUT_TARGET_VAR_PREFIX = 'TF_OUTPUT_TARGET_'
+TRUE_VALUES = ('y', 'yes', 't', 'true', 'on', '1')
+FALSE_VALUES = ('n', 'no', 'f', 'false', 'off', '0')
 
 
 # =============================================================================
@@ -18,6 +20,20 @@ TERRAFORM_OUTPUT_TARGET_VAR_PREFIX = 'TF_OUTPUT_TARGET_'
 #
 # =============================================================================
 
+# =============================================================================
+# strtobool
+# =============================================================================
+def strtobool(value: str) -> int:
+    # same semantics as distutils.util.strtobool, without importing distutils
+    value = value.lower()
+    if value in TRUE_VALUES:
+        return 1
+    elif value in FALSE_VALUES:
+        return 0
+    else:
+        raise ValueError(f'invalid truth value {value!r}')
+
+
 # =============================================================================
 # get_tf_output_var_files
 # =============================================================================
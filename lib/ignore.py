@@ -0,0 +1,217 @@
+# stdlib
+import os
+import re
+from typing import Iterator, Optional
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+COPY_IGNORE_FILE_NAME = ".tfcopyignore"
+ARCHIVE_IGNORE_FILE_NAME = ".tfarchiveignore"
+COMMENT_PREFIX = "#"
+NEGATION_PREFIX = "!"
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# IgnoreMatcher
+# =============================================================================
+class IgnoreMatcher:
+    # gitignore style patterns, where the last matching pattern wins.
+    # consecutive patterns of the same kind are compiled into a single
+    # regex, so a path is tested against a handful of regexes however many
+    # patterns there are
+    def __init__(self, patterns: list[str]) -> None:
+        self._groups: list[tuple[re.Pattern, bool, bool]] = []
+        group_key: Optional[tuple[bool, bool]] = None
+        group_regexes: list[str] = []
+        for pattern in patterns:
+            parsed_pattern = _parse_pattern(pattern)
+            if not parsed_pattern:
+                continue
+            regex, negated, dir_only = parsed_pattern
+            if (negated, dir_only) != group_key:
+                self._add_group(group_regexes, group_key)
+                group_key = (negated, dir_only)
+                group_regexes = []
+            group_regexes.append(regex)
+        self._add_group(group_regexes, group_key)
+        # the last group is checked first
+        self._groups.reverse()
+
+    def _add_group(
+        self,
+        group_regexes: list[str],
+        group_key: Optional[tuple[bool, bool]],
+    ) -> None:
+        if not group_regexes or not group_key:
+            return
+        negated, dir_only = group_key
+        self._groups.append(
+            (re.compile("|".join(group_regexes)), negated, dir_only)
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self._groups)
+
+    def match(self, relative_path: str, is_dir: bool = False) -> bool:
+        for regex, negated, dir_only in self._groups:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relative_path):
+                return not negated
+        return False
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _translate_glob
+# =============================================================================
+def _translate_glob(glob: str) -> str:
+    regex = ""
+    index = 0
+    while index < len(glob):
+        char = glob[index]
+        if glob.startswith("**/", index):
+            # any number of leading directories, including none
+            regex += "(?:.*/)?"
+            index += 3
+            continue
+        if glob.startswith("**", index):
+            regex += ".*"
+            index += 2
+            continue
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[":
+            end = glob.find("]", index + 2)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                char_class = glob[index + 1:end]
+                if char_class.startswith("!"):
+                    char_class = "^" + char_class[1:]
+                char_class = char_class.replace("\\", "\\\\")
+                regex += f"[{char_class}]"
+                index = end
+        elif char == "\\" and index + 1 < len(glob):
+            index += 1
+            regex += re.escape(glob[index])
+        else:
+            regex += re.escape(char)
+        index += 1
+    return regex
+
+
+# =============================================================================
+# _parse_pattern
+# =============================================================================
+def _parse_pattern(pattern: str) -> Optional[tuple[str, bool, bool]]:
+    # returns (regex, negated, dir_only), or None for blanks and comments
+    pattern = pattern.rstrip("\n").rstrip(" ")
+    if not pattern or pattern.startswith(COMMENT_PREFIX):
+        return None
+    negated = pattern.startswith(NEGATION_PREFIX)
+    if negated:
+        pattern = pattern[len(NEGATION_PREFIX):]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return None
+    # a slash anywhere but the end anchors the pattern to the root,
+    # otherwise it matches at any depth
+    if "/" in pattern:
+        prefix = ""
+        pattern = pattern.lstrip("/")
+    else:
+        prefix = "(?:.*/)?"
+    return f"(?:{prefix}{_translate_glob(pattern)})$", negated, dir_only
+
+
+# =============================================================================
+# _get_size
+# =============================================================================
+def _get_size(path: str) -> int:
+    # files deleted while the tree is walked take up no space
+    try:
+        return os.lstat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+# =============================================================================
+# _get_tree_size
+# =============================================================================
+def _get_tree_size(path: str) -> int:
+    # symlinks are counted as themselves, never followed
+    if os.path.islink(path) or not os.path.isdir(path):
+        return _get_size(path)
+    size = 0
+    for dir_path, _, files in os.walk(path):
+        for name in files:
+            size += _get_size(os.path.join(dir_path, name))
+    return size
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# load_ignore_file
+# =============================================================================
+def load_ignore_file(ignore_file_path: str) -> Optional[IgnoreMatcher]:
+    if not os.path.isfile(ignore_file_path):
+        return None
+    with open(ignore_file_path, "r", encoding="utf-8") as ignore_file:
+        matcher = IgnoreMatcher(ignore_file.readlines())
+    return matcher or None
+
+
+# =============================================================================
+# iter_tree
+# =============================================================================
+def iter_tree(
+    root: str,
+    matcher: Optional[IgnoreMatcher] = None,
+    relative_path: str = "",
+) -> Iterator[tuple[str, str, Optional[int]]]:
+    # yields (path, relative path, skipped size) depth first in name order,
+    # starting with the root itself. ignored paths are yielded once with
+    # their size and never descended into, included paths with None
+    path = os.path.join(root, relative_path) if relative_path else root
+    is_dir = os.path.isdir(path) and not os.path.islink(path)
+    if relative_path and matcher and matcher.match(relative_path, is_dir):
+        yield path, relative_path, _get_tree_size(path)
+        return
+    yield path, relative_path, None
+    if not is_dir:
+        return
+    try:
+        names = sorted(os.listdir(path))
+    except FileNotFoundError:
+        # deleted since it was yielded
+        return
+    for name in names:
+        yield from iter_tree(
+            root,
+            matcher,
+            f"{relative_path}/{name}" if relative_path else name,
+        )
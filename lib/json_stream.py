@@ -0,0 +1,241 @@
+# stdlib
+import json
+import re
+from typing import Any, Iterable, Iterator, TextIO
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE_PATTERN = re.compile(r"[ \t\n\r]*")
+# characters which change the nesting depth, or start a string
+STRUCTURAL_PATTERN = re.compile(r'[{}\[\]"]')
+# the rest of a string, after its opening quote
+STRING_TAIL_PATTERN = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+
+_decoder = json.JSONDecoder()
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# JsonStreamError
+# =============================================================================
+class JsonStreamError(ValueError):
+    pass
+
+
+# =============================================================================
+# _Reader
+# =============================================================================
+class _Reader:
+    # a window over the stream, which only ever holds the value being read
+    def __init__(self, stream: TextIO, chunk_size: int) -> None:
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._eof = False
+        self.buffer = ""
+        self.pos = 0
+
+    def fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._stream.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # drop everything already consumed
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.pos = WHITESPACE_PATTERN.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise JsonStreamError("unexpected end of json stream")
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if char not in chars:
+            raise JsonStreamError(f"expected one of {chars!r}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def decode(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # the value may just be cut off at the end of the buffer
+                if self.fill():
+                    continue
+                raise
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def skip(self) -> None:
+        # walk past one value without decoding it, so skipping a large
+        # section costs no more memory than a chunk
+        if self.peek() not in '{["':
+            self.decode()
+            return
+        depth = 0
+        while True:
+            match = STRUCTURAL_PATTERN.search(self.buffer, self.pos)
+            if not match:
+                self.pos = len(self.buffer)
+                if not self.fill():
+                    raise JsonStreamError("unexpected end of json stream")
+                continue
+            char = match.group()
+            if char == '"':
+                tail_match = STRING_TAIL_PATTERN.match(
+                    self.buffer, match.end()
+                )
+                if not tail_match:
+                    # keep the open string in the buffer and read more
+                    self.pos = match.start()
+                    if not self.fill():
+                        raise JsonStreamError("unterminated string")
+                    continue
+                self.pos = tail_match.end()
+            else:
+                self.pos = match.end()
+                depth += 1 if char in "{[" else -1
+            if depth == 0:
+                return
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _iter_object_keys
+# =============================================================================
+def _iter_object_keys(reader: _Reader) -> Iterator[str]:
+    # yields each top level key with the reader left at its value, which the
+    # caller must consume before the next key is read
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.pos += 1
+        return
+    while True:
+        name = reader.decode()
+        if not isinstance(name, str):
+            raise JsonStreamError(f"expected an object key, found {name!r}")
+        reader.expect(":")
+        yield name
+        if reader.expect(",}") == "}":
+            return
+
+
+# =============================================================================
+# _iter_array_items
+# =============================================================================
+def _iter_array_items(reader: _Reader) -> Iterator[None]:
+    # yields once per item with the reader left at it, which the caller must
+    # consume before the next item is read
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.pos += 1
+        return
+    while True:
+        yield
+        if reader.expect(",]") == "]":
+            return
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# iter_array
+# =============================================================================
+def iter_array(
+    stream: TextIO,
+    key: str,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Any]:
+    # yields each item of the array under a top level key, one at a time,
+    # every other top level value is skipped without being decoded
+    reader = _Reader(stream, chunk_size)
+    for name in _iter_object_keys(reader):
+        if name != key or reader.peek() != "[":
+            reader.skip()
+            continue
+        for _ in _iter_array_items(reader):
+            yield reader.decode()
+
+
+# =============================================================================
+# iter_nested_array
+# =============================================================================
+def iter_nested_array(
+    stream: TextIO,
+    key: str,
+    nested_key: str,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[tuple[dict[str, Any], Any]]:
+    # yields (parent, item) for each item of the nested_key array of each
+    # object in the array under a top level key, so a single huge object is
+    # never decoded whole. parent only holds the values which come before
+    # the nested array
+    reader = _Reader(stream, chunk_size)
+    for name in _iter_object_keys(reader):
+        if name != key or reader.peek() != "[":
+            reader.skip()
+            continue
+        for _ in _iter_array_items(reader):
+            if reader.peek() != "{":
+                reader.skip()
+                continue
+            parent: dict[str, Any] = {}
+            for field in _iter_object_keys(reader):
+                if field != nested_key or reader.peek() != "[":
+                    parent[field] = reader.decode()
+                    continue
+                for _ in _iter_array_items(reader):
+                    yield parent, reader.decode()
+
+
+# =============================================================================
+# read_values
+# =============================================================================
+def read_values(
+    stream: TextIO,
+    keys: Iterable[str],
+    chunk_size: int = CHUNK_SIZE,
+) -> dict[str, Any]:
+    # decodes only the given top level values, and stops reading as soon as
+    # all of them are found
+    keys = set(keys)
+    values: dict[str, Any] = {}
+    reader = _Reader(stream, chunk_size)
+    for name in _iter_object_keys(reader):
+        if name in keys:
+            values[name] = reader.decode()
+            if len(values) == len(keys):
+                break
+        else:
+            reader.skip()
+    return values
@@ -0,0 +1,202 @@
+# stdlib
+import gzip
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Optional
+
+# local
+import lib.environment
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+COMPACT_PROGRESS_VAR = "COMPACT_PROGRESS"
+COMPACT_PROGRESS_INTERVAL_VAR = "COMPACT_PROGRESS_INTERVAL"
+RAW_LOG_OUTPUT_DIR_VAR = "RAW_LOG_OUTPUT_DIR"
+DEFAULT_SUMMARY_INTERVAL_SECONDS = 60.0
+RAW_LOG_FILE_NAME = "terraform.log.gz"
+ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-9;]*m")
+# e.g. "aws_instance.web: Still creating... [10s elapsed]"
+# or "aws_instance.web: Still destroying... [id=i-1234, 10s elapsed]"
+PROGRESS_LINE_PATTERN = re.compile(
+    r"^(?P<address>\S+): Still (?P<action>[a-z]+)\.\.\. "
+    r"\[(?:id=[^\]]*, )?(?P<elapsed>[^\],]+) elapsed\]\s*$"
+)
+# e.g. "aws_instance.web: Creation complete after 12s [id=i-1234]"
+RESOURCE_LINE_PATTERN = re.compile(r"^(?P<address>\S+): ")
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# ProgressFilter
+# =============================================================================
+class ProgressFilter:
+    # collapses "Still creating..." lines into one periodic summary of the
+    # resources still in flight, every other line passes through verbatim
+    def __init__(
+        self,
+        summary_interval: float = DEFAULT_SUMMARY_INTERVAL_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.summary_interval = summary_interval
+        self._clock = clock
+        self._last_summary_time = clock()
+        self._in_flight: dict[str, tuple[str, str]] = {}
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def _summarize(self) -> list[str]:
+        self._last_summary_time = self._clock()
+        if not self._suppressed:
+            return []
+        self._suppressed = 0
+        if not self._in_flight:
+            return []
+        resources = ", ".join(
+            f"{address} ({action}, {elapsed})"
+            for address, (action, elapsed) in sorted(self._in_flight.items())
+        )
+        in_progress = len(self._in_flight)
+        return [f"[progress] {in_progress} in progress: {resources}\n"]
+
+    def process(self, line: str) -> list[str]:
+        with self._lock:
+            plain_line = ANSI_ESCAPE_PATTERN.sub("", line)
+            progress_match = PROGRESS_LINE_PATTERN.match(plain_line)
+            if progress_match:
+                self._in_flight[progress_match.group("address")] = (
+                    progress_match.group("action"),
+                    progress_match.group("elapsed"),
+                )
+                self._suppressed += 1
+                if self._clock() - self._last_summary_time >= (
+                    self.summary_interval
+                ):
+                    return self._summarize()
+                return []
+            # any other line about a resource means it reached a final state
+            resource_match = RESOURCE_LINE_PATTERN.match(plain_line)
+            if resource_match:
+                self._in_flight.pop(resource_match.group("address"), None)
+            return [line]
+
+    def flush(self) -> list[str]:
+        with self._lock:
+            return self._summarize()
+
+    def close(self) -> None:
+        pass
+
+
+# =============================================================================
+# RawLogWriter
+# =============================================================================
+class RawLogWriter:
+    # tees every line, unfiltered, into a compressed log file
+    def __init__(self, raw_log_file_path: str) -> None:
+        self.raw_log_file_path = raw_log_file_path
+        # appending adds a new gzip member, which gzip readers concatenate
+        self._file = gzip.open(raw_log_file_path, "at", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def process(self, line: str) -> list[str]:
+        with self._lock:
+            self._file.write(line)
+        return [line]
+
+    def flush(self) -> list[str]:
+        return []
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _get_bool_from_environment
+# =============================================================================
+def _get_bool_from_environment(key: str) -> bool:
+    value = os.environ.get(key)
+    if value:
+        return bool(lib.environment.strtobool(value))
+    return False
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# apply_filters
+# =============================================================================
+def apply_filters(filters: list[Any], line: str) -> list[str]:
+    lines = [line]
+    for output_filter in filters:
+        filtered_lines: list[str] = []
+        for filtered_line in lines:
+            filtered_lines.extend(output_filter.process(filtered_line))
+        lines = filtered_lines
+    return lines
+
+
+# =============================================================================
+# flush_filters
+# =============================================================================
+def flush_filters(filters: list[Any]) -> list[str]:
+    lines: list[str] = []
+    for index, output_filter in enumerate(filters):
+        # lines flushed by one filter still pass through the filters after it
+        for flushed_line in output_filter.flush():
+            lines.extend(apply_filters(filters[index + 1:], flushed_line))
+    return lines
+
+
+# =============================================================================
+# close_filters
+# =============================================================================
+def close_filters(filters: list[Any]) -> None:
+    for output_filter in filters:
+        output_filter.close()
+
+
+# =============================================================================
+# get_raw_log_writer_from_environment
+# =============================================================================
+def get_raw_log_writer_from_environment() -> Optional[RawLogWriter]:
+    raw_log_output_dir = os.environ.get(RAW_LOG_OUTPUT_DIR_VAR)
+    if not raw_log_output_dir:
+        return None
+    # create output dir, if needed
+    if not os.path.isdir(raw_log_output_dir):
+        os.makedirs(raw_log_output_dir)
+    return RawLogWriter(os.path.join(raw_log_output_dir, RAW_LOG_FILE_NAME))
+
+
+# =============================================================================
+# get_progress_filter_from_environment
+# =============================================================================
+def get_progress_filter_from_environment() -> Optional[ProgressFilter]:
+    if not _get_bool_from_environment(COMPACT_PROGRESS_VAR):
+        return None
+    summary_interval = os.environ.get(COMPACT_PROGRESS_INTERVAL_VAR)
+    if summary_interval:
+        return ProgressFilter(summary_interval=float(summary_interval))
+    return ProgressFilter()
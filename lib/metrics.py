@@ -0,0 +1,335 @@
+# stdlib
+import fcntl
+import math
+import os
+import re
+import tempfile
+import time
+from typing import Optional
+
+# local
+import lib.run_stats
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+METRIC_PREFIX = "concourse_terraform_"
+RUNS_METRIC = f"{METRIC_PREFIX}runs_total"
+RUN_DURATION_METRIC = f"{METRIC_PREFIX}run_duration_seconds"
+PHASE_DURATION_METRIC = f"{METRIC_PREFIX}phase_duration_seconds"
+COPIED_BYTES_METRIC = f"{METRIC_PREFIX}copied_bytes_total"
+TERRAFORM_EXITS_METRIC = f"{METRIC_PREFIX}terraform_exits_total"
+ARCHIVE_BYTES_METRIC = f"{METRIC_PREFIX}archive_bytes"
+ARCHIVE_COMPRESSION_RATIO_METRIC = f"{METRIC_PREFIX}archive_compression_ratio"
+RESOURCE_CHANGES_METRIC = f"{METRIC_PREFIX}resource_changes"
+LAST_RUN_METRIC = f"{METRIC_PREFIX}last_run_timestamp_seconds"
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+# written in this order. counters and histograms add up across runs, while
+# gauges hold the value of the last run
+METRIC_FAMILIES = {
+    RUNS_METRIC: (COUNTER, "Runs of each command, by result."),
+    RUN_DURATION_METRIC: (HISTOGRAM, "Duration of each run."),
+    PHASE_DURATION_METRIC: (HISTOGRAM, "Duration of each phase of a run."),
+    COPIED_BYTES_METRIC: (COUNTER, "Bytes of files copied into work dirs."),
+    TERRAFORM_EXITS_METRIC: (COUNTER, "Terraform commands run, by exit code."),
+    ARCHIVE_BYTES_METRIC: (GAUGE, "Size of the last plan archive."),
+    ARCHIVE_COMPRESSION_RATIO_METRIC: (
+        GAUGE,
+        "Uncompressed over compressed size of the last plan archive.",
+    ),
+    RESOURCE_CHANGES_METRIC: (
+        GAUGE,
+        "Resources changed by the last plan or apply, by action.",
+    ),
+    LAST_RUN_METRIC: (GAUGE, "When the last run finished."),
+}
+HISTOGRAM_SUFFIXES = ("_bucket", "_sum", "_count")
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+SAMPLE_REGEX = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})?\s+(\S+)$")
+LOCK_FILE_SUFFIX = ".lock"
+
+# a sample is its name, its formatted labels and its value
+Sample = tuple[str, str, float]
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _escape_label_value
+# =============================================================================
+def _escape_label_value(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    )
+
+
+# =============================================================================
+# _format_labels
+# =============================================================================
+def _format_labels(labels: dict[str, str]) -> str:
+    return "{" + ",".join(
+        f'{name}="{_escape_label_value(value)}"'
+        for name, value in labels.items()
+    ) + "}"
+
+
+# =============================================================================
+# _format_value
+# =============================================================================
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# =============================================================================
+# _get_family
+# =============================================================================
+def _get_family(sample_name: str) -> Optional[str]:
+    if sample_name in METRIC_FAMILIES:
+        return sample_name
+    for suffix in HISTOGRAM_SUFFIXES:
+        family = sample_name[:-len(suffix)]
+        if (
+            sample_name.endswith(suffix)
+            and METRIC_FAMILIES.get(family, ("",))[0] == HISTOGRAM
+        ):
+            return family
+    return None
+
+
+# =============================================================================
+# _get_histogram_samples
+# =============================================================================
+def _get_histogram_samples(
+    name: str,
+    labels: dict[str, str],
+    value: float,
+    buckets: tuple[float, ...] = DURATION_BUCKETS,
+) -> list[Sample]:
+    # a single observation, which adds to the buckets it falls within
+    samples = [
+        (
+            f"{name}_bucket",
+            _format_labels({**labels, "le": _format_value(bucket)}),
+            1.0 if value <= bucket else 0.0,
+        )
+        for bucket in buckets
+    ]
+    samples.append(
+        (f"{name}_bucket", _format_labels({**labels, "le": "+Inf"}), 1.0)
+    )
+    samples.append((f"{name}_sum", _format_labels(labels), value))
+    samples.append((f"{name}_count", _format_labels(labels), 1.0))
+    return samples
+
+
+# =============================================================================
+# _parse_samples
+# =============================================================================
+def _parse_samples(text: str) -> list[Sample]:
+    # only the samples of the families written here are kept
+    samples = []
+    for line in text.splitlines():
+        match = SAMPLE_REGEX.match(line.strip())
+        if not match or not _get_family(match.group(1)):
+            continue
+        try:
+            value = float(match.group(3))
+        except ValueError:
+            continue
+        samples.append((match.group(1), match.group(2) or "", value))
+    return samples
+
+
+# =============================================================================
+# _merge_samples
+# =============================================================================
+def _merge_samples(
+    previous_samples: list[Sample],
+    samples: list[Sample],
+) -> dict[tuple[str, str], float]:
+    merged = {
+        (name, labels): value for name, labels, value in previous_samples
+    }
+    for name, labels, value in samples:
+        family = _get_family(name) or ""
+        if METRIC_FAMILIES[family][0] == GAUGE:
+            merged[(name, labels)] = value
+        else:
+            merged[(name, labels)] = merged.get((name, labels), 0.0) + value
+    return merged
+
+
+# =============================================================================
+# _format_samples
+# =============================================================================
+def _format_samples(merged: dict[tuple[str, str], float]) -> str:
+    lines = []
+    for family, (metric_type, help_text) in METRIC_FAMILIES.items():
+        family_lines = [
+            f"{name}{labels} {_format_value(value)}"
+            for (name, labels), value in merged.items()
+            if _get_family(name) == family
+        ]
+        if not family_lines:
+            continue
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {metric_type}")
+        lines.extend(family_lines)
+    return "\n".join(lines) + "\n"
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# get_run_samples
+# =============================================================================
+def get_run_samples(
+    root: str,
+    command: str,
+    duration: float,
+    success: bool,
+    phases: Optional[dict[str, float]] = None,
+    counts: Optional[dict[str, int]] = None,
+    exit_codes: Optional[list[tuple[str, int]]] = None,
+    finished_at: Optional[float] = None,
+) -> list[Sample]:
+    phases = phases or {}
+    counts = counts or {}
+    labels = {"root": root, "command": command}
+    samples: list[Sample] = [
+        (
+            RUNS_METRIC,
+            _format_labels(
+                {**labels, "result": "success" if success else "failure"}
+            ),
+            1.0,
+        ),
+    ]
+    samples.extend(
+        _get_histogram_samples(RUN_DURATION_METRIC, labels, duration)
+    )
+    for phase_name, phase_duration in sorted(phases.items()):
+        samples.extend(
+            _get_histogram_samples(
+                PHASE_DURATION_METRIC,
+                {**labels, "phase": phase_name},
+                phase_duration,
+            )
+        )
+    samples.append(
+        (
+            COPIED_BYTES_METRIC,
+            _format_labels(labels),
+            float(counts.get(lib.run_stats.COPIED_BYTES_COUNT, 0)),
+        )
+    )
+    for terraform_command, return_code in exit_codes or []:
+        samples.append(
+            (
+                TERRAFORM_EXITS_METRIC,
+                _format_labels(
+                    {
+                        **labels,
+                        "terraform_command": terraform_command,
+                        "code": str(return_code),
+                    }
+                ),
+                1.0,
+            )
+        )
+    archive_bytes = counts.get(lib.run_stats.ARCHIVE_BYTES_COUNT)
+    if archive_bytes:
+        samples.append(
+            (
+                ARCHIVE_BYTES_METRIC,
+                _format_labels(labels),
+                float(archive_bytes),
+            )
+        )
+        uncompressed_bytes = counts.get(
+            lib.run_stats.ARCHIVE_UNCOMPRESSED_BYTES_COUNT
+        )
+        if uncompressed_bytes:
+            samples.append(
+                (
+                    ARCHIVE_COMPRESSION_RATIO_METRIC,
+                    _format_labels(labels),
+                    uncompressed_bytes / archive_bytes,
+                )
+            )
+    for name, value in sorted(counts.items()):
+        if not name.startswith(lib.run_stats.RESOURCES_COUNT_PREFIX):
+            continue
+        action = name[len(lib.run_stats.RESOURCES_COUNT_PREFIX):]
+        samples.append(
+            (
+                RESOURCE_CHANGES_METRIC,
+                _format_labels({**labels, "action": action}),
+                float(value),
+            )
+        )
+    samples.append(
+        (
+            LAST_RUN_METRIC,
+            _format_labels(labels),
+            finished_at if finished_at is not None else time.time(),
+        )
+    )
+    return samples
+
+
+# =============================================================================
+# write_metrics_textfile
+# =============================================================================
+def write_metrics_textfile(textfile_path: str, samples: list[Sample]) -> None:
+    # check textfile path
+    if not textfile_path:
+        raise ValueError("textfile_path cannot be empty")
+    textfile_dir = os.path.dirname(os.path.abspath(textfile_path))
+    if not os.path.isdir(textfile_dir):
+        os.makedirs(textfile_dir)
+    # runs sharing the file take turns adding to it
+    with open(textfile_path + LOCK_FILE_SUFFIX, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        previous_samples: list[Sample] = []
+        if os.path.isfile(textfile_path):
+            with open(textfile_path, "r", encoding="utf-8") as textfile:
+                previous_samples = _parse_samples(textfile.read())
+        contents = _format_samples(_merge_samples(previous_samples, samples))
+        # the collector only reads files ending in .prom, and the file is
+        # replaced whole, so it never sees one half written
+        temp_file = tempfile.NamedTemporaryFile(
+            mode="w",
+            encoding="utf-8",
+            dir=textfile_dir,
+            prefix=".metrics.",
+            suffix=".tmp",
+            delete=False,
+        )
+        try:
+            with temp_file:
+                temp_file.write(contents)
+            os.chmod(temp_file.name, 0o644)
+            os.replace(temp_file.name, textfile_path)
+        except BaseException:
+            if os.path.exists(temp_file.name):
+                os.remove(temp_file.name)
+            raise
+    print(f"wrote metrics to: {textfile_path}")
@@ -0,0 +1,140 @@
+# stdlib
+import json
+import os
+from typing import Any, Optional, TextIO
+
+# local
+import lib.json_stream
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+PLAN_SUMMARY_FILE_NAME = "plan-summary.json"
+RESOURCE_CHANGES_KEY = "resource_changes"
+CREATE = "create"
+UPDATE = "update"
+DELETE = "delete"
+REPLACE = "replace"
+READ = "read"
+ACTIONS = (CREATE, UPDATE, DELETE, REPLACE, READ)
+# replacing a resource destroys the existing one
+DESTROY_ACTIONS = (DELETE, REPLACE)
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# PlanDestroyThresholdError
+# =============================================================================
+class PlanDestroyThresholdError(Exception):
+    pass
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _get_action
+# =============================================================================
+def _get_action(actions: list[str]) -> Optional[str]:
+    # terraform lists both halves of a replacement, in either order
+    if sorted(actions) == [CREATE, DELETE]:
+        return REPLACE
+    if len(actions) == 1 and actions[0] in ACTIONS:
+        return actions[0]
+    # "no-op" changes are left out of the summary
+    return None
+
+
+# =============================================================================
+# _new_counts
+# =============================================================================
+def _new_counts() -> dict[str, int]:
+    return {action: 0 for action in ACTIONS}
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# summarize_plan_json
+# =============================================================================
+def summarize_plan_json(plan_json: TextIO) -> dict[str, Any]:
+    totals = _new_counts()
+    by_type: dict[str, dict[str, int]] = {}
+    # only one resource change is held in memory at a time
+    for resource_change in lib.json_stream.iter_array(
+        plan_json,
+        RESOURCE_CHANGES_KEY,
+    ):
+        action = _get_action(resource_change["change"]["actions"])
+        if not action:
+            continue
+        resource_type = resource_change["type"]
+        if resource_type not in by_type:
+            by_type[resource_type] = _new_counts()
+        by_type[resource_type][action] += 1
+        totals[action] += 1
+    return {
+        "totals": totals,
+        "by_type": dict(sorted(by_type.items())),
+    }
+
+
+# =============================================================================
+# format_plan_summary
+# =============================================================================
+def format_plan_summary(summary: dict[str, Any]) -> str:
+    totals = summary["totals"]
+    return (
+        f"plan summary: {totals[CREATE]} to create, "
+        f"{totals[UPDATE]} to update, "
+        f"{totals[DELETE]} to delete, "
+        f"{totals[REPLACE]} to replace"
+    )
+
+
+# =============================================================================
+# get_destroy_count
+# =============================================================================
+def get_destroy_count(summary: dict[str, Any]) -> int:
+    return sum(summary["totals"][action] for action in DESTROY_ACTIONS)
+
+
+# =============================================================================
+# check_destroy_threshold
+# =============================================================================
+def check_destroy_threshold(summary: dict[str, Any], max_destroy: int) -> None:
+    destroy_count = get_destroy_count(summary)
+    if destroy_count > max_destroy:
+        raise PlanDestroyThresholdError(
+            f"plan destroys {destroy_count} resources, "
+            f"more than the maximum of {max_destroy}"
+        )
+
+
+# =============================================================================
+# write_plan_summary
+# =============================================================================
+def write_plan_summary(summary: dict[str, Any], output_dir: str) -> str:
+    # create output dir, if needed
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    summary_file_path = os.path.join(output_dir, PLAN_SUMMARY_FILE_NAME)
+    with open(summary_file_path, "w", encoding="utf-8") as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    print(f"wrote plan summary to: {summary_file_path}")
+    return summary_file_path
@@ -0,0 +1,328 @@
+# stdlib
+import cProfile
+import collections
+import contextlib
+import gzip
+import os
+import select
+import shutil
+import sys
+import tempfile
+import threading
+from typing import Any, Iterator, Optional
+
+# local
+import lib.terraform_command
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+# seconds between samples of every thread's stack
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# terraform's trace log is kept in files of up to this many compressed
+# bytes, and only the most recent files are kept
+DEFAULT_TF_LOG_FILE_SIZE = 64 * 1024 * 1024
+DEFAULT_TF_LOG_FILE_COUNT = 4
+TF_LOG_FILE_PREFIX = "terraform-trace"
+TF_LOG_FILE_SUFFIX = ".log.gz"
+TF_LOG_FIFO_NAME = "tf-log"
+TF_LOG_LEVEL = "trace"
+# the fastest level, so compressing never holds terraform up
+TF_LOG_COMPRESS_LEVEL = 1
+READ_SIZE = 64 * 1024
+# seconds between checks for the capture being stopped
+POLL_INTERVAL = 0.1
+PSTATS_FILE_SUFFIX = ".pstats"
+COLLAPSED_FILE_SUFFIX = ".collapsed"
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# StackSampler
+# =============================================================================
+class StackSampler:
+    # samples the stack of every thread on an interval and counts them in
+    # the collapsed stack format, one "frame;frame;frame count" line per
+    # stack, which flame graph tools and speedscope read. unlike cProfile
+    # it sees every thread, such as the archive and plugin cache export
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.stacks: collections.Counter = collections.Counter()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run,
+            name="stack-sampler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def write(self, collapsed_file_path: str) -> None:
+        with open(collapsed_file_path, "w", encoding="utf-8") as output_file:
+            for stack, count in sorted(self.stacks.items()):
+                output_file.write(f"{stack} {count}\n")
+
+    def _run(self) -> None:
+        own_thread_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(_format_frame(frame))
+                    frame = frame.f_back
+                frames.append(thread_names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(frames))] += 1
+
+
+# =============================================================================
+# RotatingLogWriter
+# =============================================================================
+class RotatingLogWriter:
+    # writes to numbered, compressed files, starting a new one when the
+    # current one reaches the file size and removing the oldest beyond the
+    # file count, so the log never takes more than their product on disk
+    def __init__(
+        self,
+        log_dir: str,
+        file_size: int = DEFAULT_TF_LOG_FILE_SIZE,
+        file_count: int = DEFAULT_TF_LOG_FILE_COUNT,
+    ) -> None:
+        # check limits
+        if file_size < 1:
+            raise ValueError("file_size must be at least 1")
+        if file_count < 1:
+            raise ValueError("file_count must be at least 1")
+        self.log_dir = log_dir
+        self.file_size = file_size
+        self.file_count = file_count
+        self.file_paths: collections.deque = collections.deque()
+        self._file_number = 0
+        self._raw_file: Any = None
+        self._file: Any = None
+
+    def write(self, data: bytes) -> None:
+        if self._file is None:
+            self._open_next_file()
+        self._file.write(data)
+        # the compressed bytes written so far, behind by what the
+        # compressor still holds
+        if self._raw_file.tell() >= self.file_size:
+            self._close_file()
+
+    def close(self) -> None:
+        self._close_file()
+
+    def _open_next_file(self) -> None:
+        file_path = os.path.join(
+            self.log_dir,
+            f"{TF_LOG_FILE_PREFIX}.{self._file_number:03d}"
+            f"{TF_LOG_FILE_SUFFIX}",
+        )
+        self._file_number += 1
+        self._raw_file = open(file_path, "wb")
+        self._file = gzip.GzipFile(
+            fileobj=self._raw_file,
+            mode="wb",
+            compresslevel=TF_LOG_COMPRESS_LEVEL,
+        )
+        self.file_paths.append(file_path)
+        while len(self.file_paths) > self.file_count:
+            os.remove(self.file_paths.popleft())
+
+    def _close_file(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        self._raw_file.close()
+        self._file = None
+        self._raw_file = None
+
+
+# =============================================================================
+# TerraformLogCapture
+# =============================================================================
+class TerraformLogCapture:
+    # points terraform's TF_LOG_PATH at a fifo, so its trace log goes
+    # through a rotating writer rather than to stderr, and is never
+    # written to disk uncompressed
+    def __init__(self, log_writer: RotatingLogWriter) -> None:
+        self.log_writer = log_writer
+        self._fifo_dir = ""
+        self._previous_env_overrides: dict[str, str] = {}
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._fifo_dir = tempfile.mkdtemp(prefix="tf-log.")
+        fifo_path = os.path.join(self._fifo_dir, TF_LOG_FIFO_NAME)
+        try:
+            os.mkfifo(fifo_path, 0o600)
+            # opened for reading and writing, so it never blocks waiting for
+            # terraform, and never sees the end of the fifo between processes
+            fifo_fd = os.open(fifo_path, os.O_RDWR)
+        except OSError:
+            shutil.rmtree(self._fifo_dir, ignore_errors=True)
+            raise
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(fifo_fd,),
+            name="tf-log-capture",
+            daemon=True,
+        )
+        self._thread.start()
+        # every terraform process started from now on gets these
+        self._previous_env_overrides = (
+            lib.terraform_command.get_process_env_overrides()
+        )
+        lib.terraform_command.set_process_env_overrides(
+            {
+                **self._previous_env_overrides,
+                "TF_LOG": TF_LOG_LEVEL,
+                "TF_LOG_PATH": fifo_path,
+            }
+        )
+
+    def stop(self) -> None:
+        lib.terraform_command.set_process_env_overrides(
+            self._previous_env_overrides
+        )
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        try:
+            self.log_writer.close()
+        except OSError as error:
+            # the log written so far is kept, the run goes on without it
+            print(f"[warning] could not close terraform log: {error}")
+        if self._fifo_dir:
+            shutil.rmtree(self._fifo_dir, ignore_errors=True)
+
+    def _run(self, fifo_fd: int) -> None:
+        write_error: Optional[OSError] = None
+        try:
+            while True:
+                readable, _, _ = select.select(
+                    [fifo_fd], [], [], POLL_INTERVAL
+                )
+                if readable:
+                    data = os.read(fifo_fd, READ_SIZE)
+                    if write_error is None:
+                        try:
+                            self.log_writer.write(data)
+                        except OSError as error:
+                            write_error = error
+                            self._stop_capturing(error)
+                # stops once stopped and drained of what terraform wrote
+                elif self._stop_event.is_set():
+                    return
+        finally:
+            os.close(fifo_fd)
+
+    def _stop_capturing(self, error: OSError) -> None:
+        # processes started from now on log as they would have without the
+        # capture, while the fifo is still drained, and what is written to
+        # it dropped, so processes already writing to it never block
+        lib.terraform_command.set_process_env_overrides(
+            self._previous_env_overrides
+        )
+        print(f"[warning] stopped capturing terraform log: {error}")
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _format_frame
+# =============================================================================
+def _format_frame(frame: Any) -> str:
+    code = frame.f_code
+    # the line the function starts on, so samples anywhere within it add up
+    file_name = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({file_name}:{code.co_firstlineno})"
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# profile_run
+# =============================================================================
+@contextlib.contextmanager
+def profile_run(
+    output_dir: str,
+    name: str,
+    sample_interval: float = DEFAULT_SAMPLE_INTERVAL,
+    tf_log_file_size: int = DEFAULT_TF_LOG_FILE_SIZE,
+    tf_log_file_count: int = DEFAULT_TF_LOG_FILE_COUNT,
+) -> Iterator[None]:
+    # check output dir
+    if not output_dir:
+        raise ValueError("output_dir cannot be empty")
+    # create output dir, if needed
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    log_capture: Optional[TerraformLogCapture] = TerraformLogCapture(
+        RotatingLogWriter(
+            output_dir,
+            file_size=tf_log_file_size,
+            file_count=tf_log_file_count,
+        )
+    )
+    try:
+        log_capture.start()
+    except OSError as error:
+        # the profile is still worth having without terraform's log
+        print(f"[warning] could not capture terraform log: {error}")
+        log_capture = None
+    sampler = StackSampler(interval=sample_interval)
+    sampler.start()
+    # cProfile sees this thread, with exact call counts and times
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        if log_capture:
+            log_capture.stop()
+            for log_file_path in log_capture.log_writer.file_paths:
+                print(f"wrote terraform log to: {log_file_path}")
+        pstats_file_path = os.path.join(
+            output_dir,
+            f"{name}{PSTATS_FILE_SUFFIX}",
+        )
+        profiler.dump_stats(pstats_file_path)
+        print(f"wrote profile to: {pstats_file_path}")
+        collapsed_file_path = os.path.join(
+            output_dir,
+            f"{name}{COLLAPSED_FILE_SUFFIX}",
+        )
+        sampler.write(collapsed_file_path)
+        print(f"wrote profile to: {collapsed_file_path}")
@@ -0,0 +1,582 @@
+# stdlib
+import base64
+import concurrent.futures
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import zlib
+from typing import Any, Optional
+
+# local
+import lib.archive
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+LOCK_FILE_NAME = ".terraform.lock.hcl"
+PROVIDER_BUNDLE_VAR = "TF_PROVIDER_BUNDLE"
+BUNDLE_FILE_NAME = "provider-bundle.tar"
+# lists every package in the bundle with its hash, stored as the first
+# member so it is read before any package
+MANIFEST_MEMBER_NAME = "provider-bundle.json"
+PACKAGE_MEMBER_SUFFIX = ".tar.gz"
+# the hash scheme terraform records for unpacked provider packages, and the
+# only one which can be checked against a plugin cache
+HASH_SCHEME = "h1:"
+PROVIDER_BLOCK_REGEX = re.compile(
+    r'^provider\s+"([^"]+)"\s*\{(.*?)^\}',
+    re.MULTILINE | re.DOTALL,
+)
+VERSION_REGEX = re.compile(r'^\s*version\s*=\s*"([^"]+)"', re.MULTILINE)
+HASHES_REGEX = re.compile(
+    r"^\s*hashes\s*=\s*\[(.*?)\]",
+    re.MULTILINE | re.DOTALL,
+)
+QUOTED_REGEX = re.compile(r'"([^"]+)"')
+# <os>_<arch>, as terraform names the platform dirs of the plugin cache
+PLATFORM_REGEX = re.compile(r"^[a-z0-9]+_[a-z0-9]+$")
+# provider binaries are large, and compressing them at the highest level
+# takes far longer for little gain
+PACKAGE_COMPRESS_LEVEL = 6
+# threads compressing or unpacking packages. zlib and hashlib release the
+# gil, so they run on separate cores
+PACKAGE_WORKERS = min(8, os.cpu_count() or 1)
+
+# a locked provider is its source address and version
+Provider = tuple[str, str]
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# ProviderBundleError
+# =============================================================================
+class ProviderBundleError(Exception):
+    pass
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _get_package_dir
+# =============================================================================
+def _get_package_dir(
+    plugin_cache_dir: str,
+    source: str,
+    version: str,
+    platform: str,
+) -> str:
+    # the plugin cache's layout, <hostname>/<namespace>/<type>/<version>/
+    # <os>_<arch>, which terraform unpacks providers into
+    return os.path.join(
+        plugin_cache_dir, *source.split("/"), version, platform
+    )
+
+
+# =============================================================================
+# _get_package_platforms
+# =============================================================================
+def _get_package_platforms(
+    plugin_cache_dir: str,
+    source: str,
+    version: str,
+) -> list[str]:
+    version_dir = os.path.join(plugin_cache_dir, *source.split("/"), version)
+    if not os.path.isdir(version_dir):
+        return []
+    return sorted(
+        entry.name
+        for entry in os.scandir(version_dir)
+        if entry.is_dir() and not entry.name.startswith(".")
+    )
+
+
+# =============================================================================
+# _get_package_member_name
+# =============================================================================
+def _get_package_member_name(source: str, version: str, platform: str) -> str:
+    return f"{source}/{version}/{platform}{PACKAGE_MEMBER_SUFFIX}"
+
+
+# =============================================================================
+# _is_safe_member_name
+# =============================================================================
+def _is_safe_member_name(member_name: str) -> bool:
+    # members never land outside the dir they are unpacked into
+    return not (
+        os.path.isabs(member_name)
+        or ".." in member_name.replace("\\", "/").split("/")
+    )
+
+
+# =============================================================================
+# _write_package
+# =============================================================================
+def _write_package(package_dir: str, package_file: Any) -> None:
+    with gzip.GzipFile(
+        filename="",
+        mode="wb",
+        fileobj=package_file,
+        mtime=0,
+        compresslevel=PACKAGE_COMPRESS_LEVEL,
+    ) as gzip_file:
+        with tarfile.open(
+            fileobj=gzip_file,
+            mode="w",
+            format=lib.archive.ARCHIVE_FORMAT,
+        ) as package_tar:
+            # normalized as in plan archives, so a bundle only depends on
+            # the packages in it
+            for dir_path, dir_names, file_names in os.walk(package_dir):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    file_path = os.path.join(dir_path, file_name)
+                    package_tar.add(
+                        file_path,
+                        arcname=os.path.relpath(file_path, package_dir),
+                        recursive=False,
+                        filter=lib.archive.normalize_tarinfo,
+                    )
+
+
+# =============================================================================
+# _extract_package
+# =============================================================================
+def _extract_package(
+    bundle_file_path: str,
+    member: tarfile.TarInfo,
+    output_dir: str,
+) -> None:
+    # every thread reads its package through its own handle on the bundle,
+    # which is uncompressed, so reading one package never reads the others
+    with tarfile.open(bundle_file_path, mode="r:") as bundle_tar:
+        package_file = bundle_tar.extractfile(member)
+        with tarfile.open(fileobj=package_file, mode="r|gz") as package_tar:
+            for tarinfo in package_tar:
+                if not _is_safe_member_name(tarinfo.name):
+                    raise ProviderBundleError(
+                        f"unsafe path in package {member.name}: {tarinfo.name}"
+                    )
+                if not (tarinfo.isreg() or tarinfo.isdir()):
+                    raise ProviderBundleError(
+                        f"unexpected member in package {member.name}: "
+                        f"{tarinfo.name}"
+                    )
+                package_tar.extract(tarinfo, path=output_dir)
+
+
+# =============================================================================
+# _unpack_package
+# =============================================================================
+def _unpack_package(
+    bundle_file_path: str,
+    member: tarfile.TarInfo,
+    package: dict[str, str],
+    plugin_cache_dir: str,
+) -> bool:
+    # the platform comes from the manifest alone, which no lock file covers
+    if not PLATFORM_REGEX.match(package["platform"]):
+        raise ProviderBundleError(
+            f"package {member.name} has an invalid platform: "
+            f"{package['platform']}"
+        )
+    package_dir = _get_package_dir(
+        plugin_cache_dir,
+        package["source"],
+        package["version"],
+        package["platform"],
+    )
+    # nothing outside the plugin cache is ever removed or replaced
+    cache_root = os.path.realpath(plugin_cache_dir)
+    if os.path.commonpath(
+        [os.path.realpath(package_dir), cache_root]
+    ) != cache_root:
+        raise ProviderBundleError(
+            f"package {member.name} is outside the plugin cache: "
+            f"{package_dir}"
+        )
+    # a cache which already holds the package is left as it is
+    if os.path.isdir(package_dir) and (
+        get_dir_hash(package_dir) == package["hash"]
+    ):
+        return False
+    parent_dir = os.path.dirname(package_dir)
+    if not os.path.isdir(parent_dir):
+        os.makedirs(parent_dir, exist_ok=True)
+    # unpacked and verified beside its destination, then moved into place,
+    # so terraform never finds a package half unpacked or unverified
+    temp_dir = tempfile.mkdtemp(
+        dir=parent_dir,
+        prefix=".tfbundle.",
+        suffix=".tmp",
+    )
+    try:
+        _extract_package(bundle_file_path, member, temp_dir)
+        package_hash = get_dir_hash(temp_dir)
+        if package_hash != package["hash"]:
+            raise ProviderBundleError(
+                f"package {member.name} failed verification: "
+                f"expected {package['hash']}, got {package_hash}"
+            )
+        if os.path.isdir(package_dir):
+            shutil.rmtree(package_dir)
+        os.replace(temp_dir, package_dir)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    return True
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# get_provider_bundle_from_environment
+# =============================================================================
+def get_provider_bundle_from_environment() -> Optional[str]:
+    return os.environ.get(PROVIDER_BUNDLE_VAR) or None
+
+
+# =============================================================================
+# get_bundle_file_path
+# =============================================================================
+def get_bundle_file_path(bundle_path: str) -> str:
+    # either the bundle itself, or the dir it was written to, such as an
+    # input holding another task's output
+    if os.path.isdir(bundle_path):
+        return os.path.join(bundle_path, BUNDLE_FILE_NAME)
+    return bundle_path
+
+
+# =============================================================================
+# read_lock_file
+# =============================================================================
+def read_lock_file(lock_file_path: str) -> list[dict[str, Any]]:
+    with open(lock_file_path, "r", encoding="utf-8") as lock_file:
+        contents = lock_file.read()
+    providers = []
+    # the lock file is hcl, but terraform writes it in a single fixed form
+    for match in PROVIDER_BLOCK_REGEX.finditer(contents):
+        source, body = match.groups()
+        version_match = VERSION_REGEX.search(body)
+        if not version_match:
+            raise ProviderBundleError(
+                f"provider {source} has no version in: {lock_file_path}"
+            )
+        hashes_match = HASHES_REGEX.search(body)
+        providers.append({
+            "source": source,
+            "version": version_match.group(1),
+            "hashes": (
+                QUOTED_REGEX.findall(hashes_match.group(1))
+                if hashes_match
+                else []
+            ),
+        })
+    return providers
+
+
+# =============================================================================
+# find_lock_files
+# =============================================================================
+def find_lock_files(
+    terraform_dir: str,
+    root_paths: Optional[list[str]] = None,
+) -> list[str]:
+    if root_paths:
+        lock_file_paths = [
+            os.path.join(terraform_dir, root_path, LOCK_FILE_NAME)
+            for root_path in root_paths
+        ]
+        missing = [
+            path for path in lock_file_paths if not os.path.isfile(path)
+        ]
+        if missing:
+            raise ProviderBundleError(
+                f"lock files not found: {', '.join(missing)}"
+            )
+        return lock_file_paths
+    # every root in the dir, skipping hidden dirs such as .terraform and the
+    # plugin cache
+    lock_file_paths = []
+    for dir_path, dir_names, file_names in os.walk(terraform_dir):
+        dir_names[:] = sorted(
+            dir_name for dir_name in dir_names if not dir_name.startswith(".")
+        )
+        if LOCK_FILE_NAME in file_names:
+            lock_file_paths.append(os.path.join(dir_path, LOCK_FILE_NAME))
+    return lock_file_paths
+
+
+# =============================================================================
+# get_locked_providers
+# =============================================================================
+def get_locked_providers(
+    lock_file_paths: list[str],
+) -> dict[Provider, set[str]]:
+    # roots locking the same version add their hashes together
+    locked_providers: dict[Provider, set[str]] = {}
+    for lock_file_path in lock_file_paths:
+        for provider in read_lock_file(lock_file_path):
+            key = (provider["source"], provider["version"])
+            locked_providers.setdefault(key, set()).update(provider["hashes"])
+    return locked_providers
+
+
+# =============================================================================
+# get_dir_hash
+# =============================================================================
+def get_dir_hash(dir_path: str) -> str:
+    # terraform's h1 hash of an unpacked package, go's dirhash: the sha256
+    # of a sorted "<sha256>  <path>" line per file
+    file_paths = []
+    for walk_dir, _, file_names in os.walk(dir_path):
+        for file_name in file_names:
+            file_path = os.path.join(walk_dir, file_name)
+            file_paths.append(
+                os.path.relpath(file_path, dir_path).replace(os.sep, "/")
+            )
+    summary = hashlib.sha256()
+    for file_path in sorted(file_paths):
+        file_checksum = lib.archive.get_file_checksum(
+            os.path.join(dir_path, file_path)
+        )
+        summary.update(f"{file_checksum}  {file_path}\n".encode("utf-8"))
+    return HASH_SCHEME + base64.b64encode(summary.digest()).decode("ascii")
+
+
+# =============================================================================
+# get_missing_providers
+# =============================================================================
+def get_missing_providers(
+    locked_providers: dict[Provider, set[str]],
+    plugin_cache_dir: str,
+) -> list[Provider]:
+    return [
+        provider
+        for provider in sorted(locked_providers)
+        if not _get_package_platforms(plugin_cache_dir, *provider)
+    ]
+
+
+# =============================================================================
+# create_provider_bundle
+# =============================================================================
+def create_provider_bundle(
+    locked_providers: dict[Provider, set[str]],
+    plugin_cache_dir: str,
+    bundle_file_path: str,
+) -> dict[str, Any]:
+    # check locked providers
+    if not locked_providers:
+        raise ValueError("locked_providers cannot be empty")
+    # only the builds whose hashes the lock files hold go in
+    packages = []
+    for source, version in sorted(locked_providers):
+        locked_hashes = locked_providers[(source, version)]
+        platforms = _get_package_platforms(plugin_cache_dir, source, version)
+        if not platforms:
+            raise ProviderBundleError(
+                f"provider {source} {version} not found in plugin cache"
+            )
+        for platform in platforms:
+            package_hash = get_dir_hash(
+                _get_package_dir(plugin_cache_dir, source, version, platform)
+            )
+            if package_hash not in locked_hashes:
+                print(
+                    f"[warning] skipping {source} {version} {platform}, "
+                    "its hash is not in the lock files"
+                )
+                continue
+            packages.append({
+                "source": source,
+                "version": version,
+                "platform": platform,
+                "hash": package_hash,
+                "member": _get_package_member_name(source, version, platform),
+            })
+        if not any(
+            package["source"] == source and package["version"] == version
+            for package in packages
+        ):
+            raise ProviderBundleError(
+                f"provider {source} {version} in plugin cache does not match "
+                "the lock files"
+            )
+    manifest = {"providers": packages}
+    bundle_dir = os.path.dirname(os.path.abspath(bundle_file_path))
+    if not os.path.isdir(bundle_dir):
+        os.makedirs(bundle_dir)
+    # written next to the destination, so a partial bundle is never read
+    temp_file = tempfile.NamedTemporaryFile(
+        dir=bundle_dir,
+        prefix=".tfbundle.",
+        suffix=".tmp",
+        delete=False,
+    )
+    package_files = [tempfile.TemporaryFile() for _ in packages]
+    try:
+        # packages are compressed at once, then stored uncompressed in the
+        # bundle, so they can be unpacked at once too
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=PACKAGE_WORKERS,
+            thread_name_prefix="bundle-compress",
+        ) as executor:
+            for future in [
+                executor.submit(
+                    _write_package,
+                    _get_package_dir(
+                        plugin_cache_dir,
+                        package["source"],
+                        package["version"],
+                        package["platform"],
+                    ),
+                    package_file,
+                )
+                for package, package_file in zip(packages, package_files)
+            ]:
+                future.result()
+        with temp_file:
+            with tarfile.open(
+                fileobj=temp_file,
+                mode="w",
+                format=lib.archive.ARCHIVE_FORMAT,
+            ) as bundle_tar:
+                contents = json.dumps(manifest, sort_keys=True).encode("utf-8")
+                tarinfo = tarfile.TarInfo(MANIFEST_MEMBER_NAME)
+                tarinfo.size = len(contents)
+                bundle_tar.addfile(
+                    lib.archive.normalize_tarinfo(tarinfo),
+                    io.BytesIO(contents),
+                )
+                for package, package_file in zip(packages, package_files):
+                    tarinfo = tarfile.TarInfo(package["member"])
+                    tarinfo.size = package_file.tell()
+                    package_file.seek(0)
+                    bundle_tar.addfile(
+                        lib.archive.normalize_tarinfo(tarinfo),
+                        package_file,
+                    )
+        os.replace(temp_file.name, bundle_file_path)
+    except BaseException:
+        if os.path.exists(temp_file.name):
+            os.remove(temp_file.name)
+        raise
+    finally:
+        for package_file in package_files:
+            package_file.close()
+    return manifest
+
+
+# =============================================================================
+# read_bundle_manifest
+# =============================================================================
+def read_bundle_manifest(bundle_file_path: str) -> dict[str, Any]:
+    with tarfile.open(bundle_file_path, mode="r:") as bundle_tar:
+        tarinfo = bundle_tar.next()
+        if tarinfo is None or tarinfo.name != MANIFEST_MEMBER_NAME:
+            raise ProviderBundleError(
+                f"not a provider bundle: {bundle_file_path}"
+            )
+        return json.load(bundle_tar.extractfile(tarinfo))
+
+
+# =============================================================================
+# unpack_provider_bundle
+# =============================================================================
+def unpack_provider_bundle(
+    bundle_file_path: str,
+    plugin_cache_dir: str,
+    locked_providers: dict[Provider, set[str]],
+) -> int:
+    # check plugin cache dir
+    if not plugin_cache_dir:
+        raise ValueError("plugin_cache_dir cannot be empty")
+    try:
+        manifest = read_bundle_manifest(bundle_file_path)
+        # only the headers are read, skipping over the packages
+        with tarfile.open(bundle_file_path, mode="r:") as bundle_tar:
+            members = {tarinfo.name: tarinfo for tarinfo in bundle_tar}
+    except (tarfile.TarError, ValueError) as error:
+        raise ProviderBundleError(
+            f"provider bundle is corrupt: {bundle_file_path}: {error}"
+        ) from error
+    # the manifest only says what the bundle holds, so a package is only
+    # installed when the lock files of the roots using it hold its hash
+    packages = []
+    for package in manifest.get("providers", []):
+        locked_hashes = locked_providers.get(
+            (package["source"], package["version"]),
+            set(),
+        )
+        if package["hash"] not in locked_hashes:
+            print(
+                f"[warning] skipping {package['source']} "
+                f"{package['version']} {package['platform']}, "
+                "its hash is not in the lock files"
+            )
+            continue
+        packages.append(package)
+    missing = [
+        package["member"]
+        for package in packages
+        if package["member"] not in members
+    ]
+    if missing:
+        raise ProviderBundleError(
+            f"provider bundle is missing packages: {', '.join(missing)}"
+        )
+    failures = []
+    unpacked_count = 0
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=PACKAGE_WORKERS,
+        thread_name_prefix="bundle-unpack",
+    ) as executor:
+        futures = {
+            package["member"]: executor.submit(
+                _unpack_package,
+                bundle_file_path,
+                members[package["member"]],
+                package,
+                plugin_cache_dir,
+            )
+            for package in packages
+        }
+        for member_name, future in futures.items():
+            try:
+                unpacked_count += int(future.result())
+            except ProviderBundleError as error:
+                failures.append(str(error))
+            except (
+                tarfile.TarError,
+                EOFError,
+                gzip.BadGzipFile,
+                zlib.error,
+            ) as error:
+                failures.append(f"package {member_name} is corrupt: {error}")
+    if failures:
+        raise ProviderBundleError(
+            "provider bundle failed verification: " + "; ".join(failures)
+        )
+    return unpacked_count
@@ -0,0 +1,222 @@
+# stdlib
+import json
+import os
+import re
+from typing import Any, Iterable, Optional
+
+# local
+import lib.environment
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+REDACT_SECRETS_VAR = "REDACT_SECRETS"
+BACKEND_CONFIG_VAR_PREFIX = "TF_BACKEND_CONFIG_"
+SSH_KEY_VALUE_VAR = "CT_GIT_IDENTITY_VALUE"
+REDACTION_MASK = "***"
+# shorter values (e.g. "true", "1") would mask ordinary words
+MIN_SECRET_LENGTH = 4
+TRIE_END_KEY = ""
+
+# the filter built for the current environment, see
+# get_redaction_filter_from_environment
+_cached_redaction_filter: Optional[tuple[Any, Any]] = None
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# RedactionFilter
+# =============================================================================
+class RedactionFilter:
+    # masks every occurrence of a known secret value in each line
+    def __init__(self, secrets: Iterable[str]) -> None:
+        self.pattern = compile_secrets_pattern(secrets)
+
+    def redact(self, text: str) -> str:
+        if not self.pattern:
+            return text
+        return self.pattern.sub(REDACTION_MASK, text)
+
+    def process(self, line: str) -> list[str]:
+        return [self.redact(line)]
+
+    def flush(self) -> list[str]:
+        return []
+
+    def close(self) -> None:
+        pass
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _split_secret
+# =============================================================================
+def _split_secret(secret: str) -> list[str]:
+    # output is filtered line by line, so multi-line secrets (e.g. ssh keys)
+    # are matched one line at a time
+    return [
+        line.strip()
+        for line in secret.splitlines()
+        if len(line.strip()) >= MIN_SECRET_LENGTH
+    ]
+
+
+# =============================================================================
+# _build_trie
+# =============================================================================
+def _build_trie(secrets: Iterable[str]) -> dict[str, Any]:
+    trie: dict[str, Any] = {}
+    for secret in secrets:
+        node = trie
+        for char in secret:
+            node = node.setdefault(char, {})
+        node[TRIE_END_KEY] = {}
+    return trie
+
+
+# =============================================================================
+# _trie_to_pattern
+# =============================================================================
+def _trie_to_pattern(node: dict[str, Any]) -> str:
+    # each node becomes one alternation keyed on a single character, so the
+    # regex engine walks the trie like an aho-corasick goto function instead
+    # of retrying every secret at every position
+    prefix = ""
+    while True:
+        is_end = TRIE_END_KEY in node
+        children = [
+            (char, child)
+            for char, child in sorted(node.items())
+            if char != TRIE_END_KEY
+        ]
+        if len(children) != 1 or is_end:
+            break
+        # follow single-child chains without recursing, secrets can be long
+        prefix += re.escape(children[0][0])
+        node = children[0][1]
+    if not children:
+        return prefix
+    branches = [
+        re.escape(char) + _trie_to_pattern(child)
+        for char, child in children
+    ]
+    pattern = "(?:" + "|".join(branches) + ")"
+    # greedy, so the longest secret sharing this prefix wins
+    return prefix + (pattern + "?" if is_end else pattern)
+
+
+# =============================================================================
+# _get_sensitive_values
+# =============================================================================
+def _get_sensitive_values(value: Any) -> list[str]:
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        return [
+            leaf for item in value.values()
+            for leaf in _get_sensitive_values(item)
+        ]
+    if isinstance(value, list):
+        return [leaf for item in value for leaf in _get_sensitive_values(item)]
+    if value is None or isinstance(value, bool):
+        return []
+    return [json.dumps(value)]
+
+
+# =============================================================================
+# _get_secrets_from_output_var_file
+# =============================================================================
+def _get_secrets_from_output_var_file(output_var_file_path: str) -> list[str]:
+    try:
+        with open(output_var_file_path, "r", encoding="utf-8") as output_file:
+            output_contents = json.load(output_file)
+    except (OSError, ValueError):
+        # a missing or invalid file is reported later by the command itself
+        return []
+    if not isinstance(output_contents, dict):
+        return []
+    # a single output, or a map of outputs, see environment var files docs
+    outputs = (
+        [output_contents]
+        if "value" in output_contents
+        else list(output_contents.values())
+    )
+    secrets: list[str] = []
+    for output in outputs:
+        if isinstance(output, dict) and output.get("sensitive"):
+            secrets.extend(_get_sensitive_values(output.get("value")))
+    return secrets
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# compile_secrets_pattern
+# =============================================================================
+def compile_secrets_pattern(secrets: Iterable[str]) -> Optional[re.Pattern]:
+    split_secrets = {
+        line for secret in secrets if secret for line in _split_secret(secret)
+    }
+    if not split_secrets:
+        return None
+    return re.compile(_trie_to_pattern(_build_trie(split_secrets)))
+
+
+# =============================================================================
+# get_secrets_from_environment
+# =============================================================================
+def get_secrets_from_environment(environment: dict) -> list[str]:
+    secrets: list[str] = []
+    for key, value in environment.items():
+        if key.startswith(BACKEND_CONFIG_VAR_PREFIX):
+            secrets.append(value)
+    if environment.get(SSH_KEY_VALUE_VAR):
+        secrets.append(environment[SSH_KEY_VALUE_VAR])
+    output_var_files = lib.environment.get_tf_output_var_files(environment)
+    for output_var_file_path in (output_var_files or {}).values():
+        secrets.extend(_get_secrets_from_output_var_file(output_var_file_path))
+    return secrets
+
+
+# =============================================================================
+# get_redaction_filter_from_environment
+# =============================================================================
+def get_redaction_filter_from_environment() -> Optional[RedactionFilter]:
+    global _cached_redaction_filter
+    value = os.environ.get(REDACT_SECRETS_VAR)
+    if not (value and lib.environment.strtobool(value)):
+        return None
+    # build the matcher once per run, not once per terraform invocation
+    cache_key = tuple(
+        sorted(
+            (key, value)
+            for key, value in os.environ.items()
+            if key.startswith(BACKEND_CONFIG_VAR_PREFIX)
+            or key.startswith(lib.environment.TERRAFORM_OUTPUT_VAR_FILE_PREFIX)
+            or key == SSH_KEY_VALUE_VAR
+        )
+    )
+    if _cached_redaction_filter and _cached_redaction_filter[0] == cache_key:
+        return _cached_redaction_filter[1]
+    redaction_filter = RedactionFilter(
+        get_secrets_from_environment(os.environ)
+    )
+    _cached_redaction_filter = (cache_key, redaction_filter)
+    return redaction_filter
@@ -0,0 +1,343 @@
+# stdlib
+import base64
+import hashlib
+import json
+import os
+import re
+import stat
+import subprocess
+import sys
+import tempfile
+from typing import Any, Optional
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+REPLAY_MODE_VAR = "TF_REPLAY_MODE"
+REPLAY_FIXTURE_DIR_VAR = "TF_REPLAY_FIXTURE_DIR"
+REPLAY_TERRAFORM_BIN_VAR = "TF_REPLAY_TERRAFORM_BIN_FILE_PATH"
+RECORD = "record"
+REPLAY = "replay"
+REPLAY_MODES = (RECORD, REPLAY)
+DEFAULT_FIXTURE_DIR = "/app/testdata/terraform-replay"
+DEFAULT_TERRAFORM_BIN_FILE_PATH = "terraform"
+# only these parts of the environment change what terraform does. the
+# logging vars are left out so recordings replay with any log level
+RECORDED_ENV_PREFIX = "TF_"
+IGNORED_ENV_VARS = ("TF_LOG", "TF_LOG_PATH")
+REPLAY_ENV_PREFIX = "TF_REPLAY_"
+# files written larger than this, such as provider binaries, are replayed as
+# empty files, which is all the wrapper itself looks at
+MAX_RECORDED_FILE_SIZE = 1024 * 1024
+# args whose values are files terraform writes next to
+PATH_ARG_PREFIXES = ("-chdir=", "-state=", "-out=", "-state-out=", "-backup=")
+# returned when a replay has no recording, like a shell's command not found
+NOT_RECORDED_RETURN_CODE = 127
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# PathNormalizer
+# =============================================================================
+class PathNormalizer:
+    # temp dirs are named differently on every run, so they are replaced by
+    # placeholders numbered in order of appearance. the same calls made in a
+    # later run then normalize to the same values, and the placeholders map
+    # back to that run's dirs
+    def __init__(self, cwd: str) -> None:
+        self.placeholders: dict[str, str] = {"{cwd}": cwd}
+        self._temp_dir_regex = re.compile(
+            re.escape(tempfile.gettempdir().rstrip("/")) + r"/[^/=:\s]+"
+        )
+
+    def _replace_temp_dir(self, match: "re.Match") -> str:
+        temp_dir = match.group(0)
+        for placeholder, path in self.placeholders.items():
+            if path == temp_dir:
+                return placeholder
+        placeholder = f"{{tmp{len(self.placeholders) - 1}}}"
+        self.placeholders[placeholder] = temp_dir
+        return placeholder
+
+    def normalize(self, value: str) -> str:
+        cwd = self.placeholders["{cwd}"]
+        if value == cwd or value.startswith(cwd + "/"):
+            value = "{cwd}" + value[len(cwd):]
+        return self._temp_dir_regex.sub(self._replace_temp_dir, value)
+
+    def normalize_output(self, output: bytes) -> bytes:
+        # only the paths already seen are replaced, since a placeholder
+        # first seen in the output would have nothing to expand to
+        text = output.decode("utf-8", errors="surrogateescape")
+        for placeholder, path in sorted(
+            self.placeholders.items(),
+            key=lambda item: len(item[1]),
+            reverse=True,
+        ):
+            text = text.replace(path, placeholder)
+        return text.encode("utf-8", errors="surrogateescape")
+
+    def expand_output(self, output: bytes) -> bytes:
+        text = output.decode("utf-8", errors="surrogateescape")
+        return self.expand(text).encode("utf-8", errors="surrogateescape")
+
+    def expand(self, value: str) -> str:
+        for placeholder, path in self.placeholders.items():
+            value = value.replace(placeholder, path)
+        return value
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _get_recorded_env
+# =============================================================================
+def _get_recorded_env(normalizer: PathNormalizer) -> dict[str, str]:
+    return {
+        key: normalizer.normalize(value)
+        for key, value in sorted(os.environ.items())
+        if key.startswith(RECORDED_ENV_PREFIX)
+        and key not in IGNORED_ENV_VARS
+        and not key.startswith(REPLAY_ENV_PREFIX)
+    }
+
+
+# =============================================================================
+# _get_fixture_key
+# =============================================================================
+def _get_fixture_key(args: list[str], env: dict[str, str]) -> str:
+    contents = json.dumps({"args": args, "env": env}, sort_keys=True)
+    return hashlib.sha256(contents.encode("utf-8")).hexdigest()
+
+
+# =============================================================================
+# _get_watched_dirs
+# =============================================================================
+def _get_watched_dirs(args: list[str]) -> list[str]:
+    # the dirs terraform can write to: the working dir, the config dir and
+    # the dirs of the state and plan files
+    dirs = [os.getcwd()]
+    # paths are kept as given, rather than resolved, so they normalize the
+    # same way as the args
+    for arg in args:
+        for prefix in PATH_ARG_PREFIXES:
+            if not arg.startswith(prefix):
+                continue
+            path = os.path.abspath(arg[len(prefix):])
+            if prefix != "-chdir=" or not os.path.isdir(path):
+                path = os.path.dirname(path)
+            dirs.append(path)
+    watched_dirs: list[str] = []
+    # nested dirs are covered by their parents
+    for path in sorted(set(dirs)):
+        if not any(
+            os.path.commonpath([path, watched_dir]) == watched_dir
+            for watched_dir in watched_dirs
+        ):
+            watched_dirs.append(path)
+    return watched_dirs
+
+
+# =============================================================================
+# _snapshot
+# =============================================================================
+def _snapshot(dirs: list[str]) -> dict[str, tuple[int, int, int]]:
+    # (mode, size, mtime) of every file and link, keyed by path
+    snapshot = {}
+    for watched_dir in dirs:
+        for dir_path, dir_names, file_names in os.walk(watched_dir):
+            for name in dir_names + file_names:
+                path = os.path.join(dir_path, name)
+                path_stat = os.lstat(path)
+                if stat.S_ISDIR(path_stat.st_mode):
+                    continue
+                snapshot[path] = (
+                    path_stat.st_mode,
+                    path_stat.st_size,
+                    path_stat.st_mtime_ns,
+                )
+    return snapshot
+
+
+# =============================================================================
+# _get_file_effects
+# =============================================================================
+def _get_file_effects(
+    before: dict[str, tuple[int, int, int]],
+    after: dict[str, tuple[int, int, int]],
+    normalizer: PathNormalizer,
+) -> list[dict[str, Any]]:
+    effects: list[dict[str, Any]] = []
+    for path in sorted(before.keys() - after.keys()):
+        effects.append({"path": normalizer.normalize(path), "deleted": True})
+    for path, path_stat in sorted(after.items()):
+        if before.get(path) == path_stat:
+            continue
+        mode, size, _ = path_stat
+        effect: dict[str, Any] = {
+            "path": normalizer.normalize(path),
+            "mode": stat.S_IMODE(mode),
+        }
+        if stat.S_ISLNK(mode):
+            effect["link"] = normalizer.normalize(os.readlink(path))
+        elif size > MAX_RECORDED_FILE_SIZE:
+            effect["size"] = size
+        else:
+            with open(path, "rb") as effect_file:
+                effect["contents"] = base64.b64encode(
+                    effect_file.read()
+                ).decode("ascii")
+        effects.append(effect)
+    return effects
+
+
+# =============================================================================
+# _apply_file_effects
+# =============================================================================
+def _apply_file_effects(
+    effects: list[dict[str, Any]],
+    normalizer: PathNormalizer,
+) -> None:
+    for effect in effects:
+        path = normalizer.expand(effect["path"])
+        if os.path.lexists(path) and not os.path.isdir(path):
+            os.remove(path)
+        if effect.get("deleted"):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if "link" in effect:
+            os.symlink(normalizer.expand(effect["link"]), path)
+            continue
+        with open(path, "wb") as effect_file:
+            effect_file.write(base64.b64decode(effect.get("contents", "")))
+        os.chmod(path, effect["mode"])
+
+
+# =============================================================================
+# _write_output
+# =============================================================================
+def _write_output(stdout: bytes, stderr: bytes) -> None:
+    sys.stdout.buffer.write(stdout)
+    sys.stdout.buffer.flush()
+    sys.stderr.buffer.write(stderr)
+    sys.stderr.buffer.flush()
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# get_replay_mode_from_environment
+# =============================================================================
+def get_replay_mode_from_environment() -> str:
+    replay_mode = os.environ.get(REPLAY_MODE_VAR) or REPLAY
+    if replay_mode not in REPLAY_MODES:
+        raise ValueError(
+            f"invalid {REPLAY_MODE_VAR}: {replay_mode}, "
+            f"expected one of: {', '.join(REPLAY_MODES)}"
+        )
+    return replay_mode
+
+
+# =============================================================================
+# get_fixture_file_path
+# =============================================================================
+def get_fixture_file_path(
+    args: list[str],
+    fixture_dir: str,
+    normalizer: Optional[PathNormalizer] = None,
+) -> str:
+    normalizer = normalizer or PathNormalizer(os.getcwd())
+    normalized_args = [normalizer.normalize(arg) for arg in args]
+    key = _get_fixture_key(normalized_args, _get_recorded_env(normalizer))
+    return os.path.join(fixture_dir, f"{key}.json")
+
+
+# =============================================================================
+# record
+# =============================================================================
+def record(
+    args: list[str],
+    fixture_dir: str,
+    terraform_bin_file_path: str,
+) -> int:
+    normalizer = PathNormalizer(os.getcwd())
+    fixture_file_path = get_fixture_file_path(args, fixture_dir, normalizer)
+    watched_dirs = _get_watched_dirs(args)
+    before = _snapshot(watched_dirs)
+    process = subprocess.run(
+        [terraform_bin_file_path, *args],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    effects = _get_file_effects(before, _snapshot(watched_dirs), normalizer)
+    fixture = {
+        "args": [normalizer.normalize(arg) for arg in args],
+        "env": _get_recorded_env(normalizer),
+        "return_code": process.returncode,
+        "stdout": base64.b64encode(
+            normalizer.normalize_output(process.stdout)
+        ).decode("ascii"),
+        "stderr": base64.b64encode(
+            normalizer.normalize_output(process.stderr)
+        ).decode("ascii"),
+        "files": effects,
+    }
+    os.makedirs(fixture_dir, exist_ok=True)
+    with open(fixture_file_path, "w", encoding="utf-8") as fixture_file:
+        json.dump(fixture, fixture_file, indent=2, sort_keys=True)
+    _write_output(process.stdout, process.stderr)
+    return process.returncode
+
+
+# =============================================================================
+# replay
+# =============================================================================
+def replay(args: list[str], fixture_dir: str) -> int:
+    normalizer = PathNormalizer(os.getcwd())
+    fixture_file_path = get_fixture_file_path(args, fixture_dir, normalizer)
+    if not os.path.isfile(fixture_file_path):
+        print(
+            f"no recording of: terraform {' '.join(args)}, "
+            f"expected: {fixture_file_path}",
+            file=sys.stderr,
+        )
+        return NOT_RECORDED_RETURN_CODE
+    with open(fixture_file_path, "r", encoding="utf-8") as fixture_file:
+        fixture = json.load(fixture_file)
+    _apply_file_effects(fixture["files"], normalizer)
+    _write_output(
+        normalizer.expand_output(base64.b64decode(fixture["stdout"])),
+        normalizer.expand_output(base64.b64decode(fixture["stderr"])),
+    )
+    return fixture["return_code"]
+
+
+# =============================================================================
+# main
+# =============================================================================
+def main(args: list[str]) -> None:
+    fixture_dir = os.environ.get(REPLAY_FIXTURE_DIR_VAR) or DEFAULT_FIXTURE_DIR
+    if get_replay_mode_from_environment() == RECORD:
+        terraform_bin_file_path = (
+            os.environ.get(REPLAY_TERRAFORM_BIN_VAR)
+            or DEFAULT_TERRAFORM_BIN_FILE_PATH
+        )
+        sys.exit(record(args, fixture_dir, terraform_bin_file_path))
+    sys.exit(replay(args, fixture_dir))
@@ -0,0 +1,213 @@
+# stdlib
+import math
+import os
+import sqlite3
+from typing import Any, Optional
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+TERRAFORM_VERSION_VAR = "TERRAFORM_VERSION"
+DEFAULT_REGRESSION_THRESHOLD = 1.5
+# the number of most recent runs of a root and command the stats cover
+DEFAULT_WINDOW = 100
+# seconds to wait for another writer, when the file is shared
+BUSY_TIMEOUT = 30.0
+# rows are only ever inserted, never updated or deleted
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    root TEXT NOT NULL,
+    command TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    terraform_version TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_root_command
+    ON runs (root, command, started_at);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counts (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL
+);
+"""
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _connect
+# =============================================================================
+def _connect(history_file_path: str) -> sqlite3.Connection:
+    history_dir = os.path.dirname(os.path.abspath(history_file_path))
+    if not os.path.isdir(history_dir):
+        os.makedirs(history_dir)
+    connection = sqlite3.connect(history_file_path, timeout=BUSY_TIMEOUT)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    return connection
+
+
+# =============================================================================
+# _get_percentile
+# =============================================================================
+def _get_percentile(sorted_values: list[float], percentile: float) -> float:
+    # nearest rank, so the value is always one which was measured
+    rank = math.ceil(percentile / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# record_run
+# =============================================================================
+def record_run(
+    history_file_path: str,
+    root: str,
+    command: str,
+    started_at: float,
+    duration: float,
+    success: bool,
+    phases: Optional[dict[str, float]] = None,
+    counts: Optional[dict[str, int]] = None,
+    terraform_version: str = "",
+) -> int:
+    # check history file path
+    if not history_file_path:
+        raise ValueError("history_file_path cannot be empty")
+    if not terraform_version:
+        terraform_version = os.environ.get(TERRAFORM_VERSION_VAR, "")
+    phases = phases or {}
+    counts = counts or {}
+    connection = _connect(history_file_path)
+    try:
+        # the run, its phases and counts are written together or not at all
+        with connection:
+            cursor = connection.execute(
+                "INSERT INTO runs (started_at, root, command, success,"
+                " duration, terraform_version) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    started_at,
+                    root,
+                    command,
+                    int(success),
+                    duration,
+                    terraform_version,
+                ),
+            )
+            run_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO phases (run_id, name, duration) VALUES (?, ?, ?)",
+                [(run_id, name, value) for name, value in phases.items()],
+            )
+            connection.executemany(
+                "INSERT INTO counts (run_id, name, value) VALUES (?, ?, ?)",
+                [(run_id, name, value) for name, value in counts.items()],
+            )
+    finally:
+        connection.close()
+    print(f"recorded run {run_id} to: {history_file_path}")
+    return run_id
+
+
+# =============================================================================
+# get_duration_stats
+# =============================================================================
+def get_duration_stats(
+    history_file_path: str,
+    root: str = "",
+    regression_threshold: float = DEFAULT_REGRESSION_THRESHOLD,
+    window: int = DEFAULT_WINDOW,
+) -> list[dict[str, Any]]:
+    # p50 and p95 of the successful runs of each root and command, and the
+    # runs which took longer than the threshold times the p50
+    if not os.path.isfile(history_file_path):
+        return []
+    connection = _connect(history_file_path)
+    try:
+        query = "SELECT DISTINCT root, command FROM runs"
+        params: tuple[str, ...] = ()
+        if root:
+            query += " WHERE root = ?"
+            params = (root,)
+        groups = connection.execute(
+            query + " ORDER BY root, command",
+            params,
+        ).fetchall()
+        stats = []
+        for group in groups:
+            runs = connection.execute(
+                "SELECT id, started_at, duration, terraform_version FROM runs"
+                " WHERE root = ? AND command = ? AND success = 1"
+                " ORDER BY started_at DESC LIMIT ?",
+                (group["root"], group["command"], window),
+            ).fetchall()
+            if not runs:
+                continue
+            durations = sorted(run["duration"] for run in runs)
+            p50 = _get_percentile(durations, 50)
+            stats.append({
+                "root": group["root"],
+                "command": group["command"],
+                "runs": len(runs),
+                "p50": p50,
+                "p95": _get_percentile(durations, 95),
+                "regressions": [
+                    {
+                        "id": run["id"],
+                        "started_at": run["started_at"],
+                        "duration": run["duration"],
+                        "terraform_version": run["terraform_version"],
+                    }
+                    for run in reversed(runs)
+                    if run["duration"] > p50 * regression_threshold
+                ],
+            })
+        return stats
+    finally:
+        connection.close()
+
+
+# =============================================================================
+# format_duration_stats
+# =============================================================================
+def format_duration_stats(
+    stats: list[dict[str, Any]],
+    regression_threshold: float = DEFAULT_REGRESSION_THRESHOLD,
+) -> str:
+    if not stats:
+        return "no runs recorded"
+    lines = []
+    for group_stats in stats:
+        lines.append(
+            f"{group_stats['root']} {group_stats['command']}:"
+            f" runs={group_stats['runs']}"
+            f" p50={group_stats['p50']:.1f}s"
+            f" p95={group_stats['p95']:.1f}s"
+        )
+        for regression in group_stats["regressions"]:
+            lines.append(
+                f"  regression: run {regression['id']} took"
+                f" {regression['duration']:.1f}s,"
+                f" over {regression_threshold}x the p50"
+                f" (terraform {regression['terraform_version'] or 'unknown'})"
+            )
+    return "\n".join(lines)
@@ -0,0 +1,95 @@
+# stdlib
+import contextlib
+import time
+from typing import Iterator
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+# counts of the resources changed, prefixed to the plan or state diff action
+RESOURCES_COUNT_PREFIX = "resources_"
+ARCHIVE_BYTES_COUNT = "archive_bytes"
+ARCHIVE_UNCOMPRESSED_BYTES_COUNT = "archive_uncompressed_bytes"
+COPIED_BYTES_COUNT = "copied_bytes"
+
+# phase timings and counts for this process, which runs a single command
+_phases: dict[str, float] = {}
+_counts: dict[str, int] = {}
+# the terraform commands run, with what they exited with
+_exit_codes: list[tuple[str, int]] = []
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# phase
+# =============================================================================
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    # phases which run more than once, such as show, add up
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases[name] = (
+            _phases.get(name, 0.0) + time.perf_counter() - start_time
+        )
+
+
+# =============================================================================
+# add_count
+# =============================================================================
+def add_count(name: str, value: int) -> None:
+    _counts[name] = _counts.get(name, 0) + value
+
+
+# =============================================================================
+# add_resource_counts
+# =============================================================================
+def add_resource_counts(counts: dict[str, int]) -> None:
+    for action, value in counts.items():
+        add_count(f"{RESOURCES_COUNT_PREFIX}{action}", value)
+
+
+# =============================================================================
+# add_exit_code
+# =============================================================================
+def add_exit_code(command: str, return_code: int) -> None:
+    _exit_codes.append((command, return_code))
+
+
+# =============================================================================
+# get_phases
+# =============================================================================
+def get_phases() -> dict[str, float]:
+    return dict(_phases)
+
+
+# =============================================================================
+# get_counts
+# =============================================================================
+def get_counts() -> dict[str, int]:
+    return dict(_counts)
+
+
+# =============================================================================
+# get_exit_codes
+# =============================================================================
+def get_exit_codes() -> list[tuple[str, int]]:
+    return list(_exit_codes)
+
+
+# =============================================================================
+# reset
+# =============================================================================
+def reset() -> None:
+    _phases.clear()
+    _counts.clear()
+    _exit_codes.clear()
@@ -0,0 +1,174 @@
+# stdlib
+import errno
+import fcntl
+import os
+import shutil
+from typing import Optional
+
+# local
+import lib.ignore
+import lib.run_stats
+import lib.trace
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+STAGING_MODE_VAR = "TF_STAGING_MODE"
+COPY = "copy"
+SYMLINK = "symlink"
+REFLINK = "reflink"
+STAGING_MODES = (COPY, SYMLINK, REFLINK)
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+# errors meaning the filesystem, or the pair of filesystems, cannot clone
+REFLINK_UNSUPPORTED_ERRNOS = (
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.EBADF,
+)
+# paths written by the wrapper or by terraform, which must never be links
+# back into the inputs. they are staged as real copies
+REAL_COPY_PATTERNS = [
+    "backend.tf",
+    "*.tfvars.json",
+    "terraform.tfstate*",
+    ".terraform.lock.hcl",
+    ".terraform/",
+    ".tfplan",
+    "tf-output.json",
+]
+
+_real_copy_matcher = lib.ignore.IgnoreMatcher(REAL_COPY_PATTERNS)
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _clone_file
+# =============================================================================
+def _clone_file(source: str, destination: str) -> bool:
+    # shares the source's blocks until either file is written, where the
+    # filesystem supports it. returns False when it does not
+    with open(source, "rb") as source_file:
+        with open(destination, "wb") as destination_file:
+            try:
+                fcntl.ioctl(
+                    destination_file.fileno(),
+                    FICLONE,
+                    source_file.fileno(),
+                )
+            except OSError as error:
+                if error.errno in REFLINK_UNSUPPORTED_ERRNOS:
+                    return False
+                raise
+    shutil.copystat(source, destination)
+    return True
+
+
+# =============================================================================
+# _copy_file
+# =============================================================================
+def _copy_file(source: str, destination: str) -> str:
+    size = os.path.getsize(source)
+    lib.run_stats.add_count(lib.run_stats.COPIED_BYTES_COUNT, size)
+    with lib.trace.file_span("copy", "file", source, size):
+        return shutil.copy2(source, destination)
+
+
+# =============================================================================
+# _remove_existing
+# =============================================================================
+def _remove_existing(path: str) -> None:
+    # inputs are layered onto each other, later ones replacing files
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# get_staging_mode_from_environment
+# =============================================================================
+def get_staging_mode_from_environment() -> str:
+    staging_mode = os.environ.get(STAGING_MODE_VAR) or COPY
+    if staging_mode not in STAGING_MODES:
+        raise ValueError(
+            f"invalid {STAGING_MODE_VAR}: {staging_mode}, "
+            f"expected one of: {', '.join(STAGING_MODES)}"
+        )
+    return staging_mode
+
+
+# =============================================================================
+# stage_tree
+# =============================================================================
+def stage_tree(
+    source: str,
+    destination: str,
+    staging_mode: str = COPY,
+    ignore_matcher: Optional[lib.ignore.IgnoreMatcher] = None,
+) -> int:
+    # builds destination from source, as real directories holding copies,
+    # clones or links of the files, and returns the bytes ignored
+    skipped_bytes = 0
+    # cleared for the rest of the tree on the first failed clone
+    reflink_supported = staging_mode == REFLINK
+    real_copy_dir_prefix = ""
+    for path, relative_path, skipped_size in lib.ignore.iter_tree(
+        source,
+        ignore_matcher,
+    ):
+        if skipped_size is not None:
+            skipped_bytes += skipped_size
+            continue
+        if real_copy_dir_prefix and relative_path.startswith(
+            real_copy_dir_prefix
+        ):
+            continue
+        destination_path = os.path.join(destination, relative_path)
+        if os.path.islink(path):
+            # preserving symlinks since terraform plan archives contain them
+            _remove_existing(destination_path)
+            os.symlink(os.readlink(path), destination_path)
+        elif os.path.isdir(path):
+            if staging_mode == SYMLINK and _real_copy_matcher.match(
+                relative_path,
+                is_dir=True,
+            ):
+                shutil.copytree(
+                    path,
+                    destination_path,
+                    symlinks=True,
+                    copy_function=_copy_file,
+                    dirs_exist_ok=True,
+                )
+                real_copy_dir_prefix = relative_path + "/"
+                continue
+            os.makedirs(destination_path, exist_ok=True)
+        elif staging_mode == SYMLINK and not _real_copy_matcher.match(
+            relative_path
+        ):
+            # terraform only reads these, straight from the input
+            _remove_existing(destination_path)
+            os.symlink(os.path.abspath(path), destination_path)
+        else:
+            _remove_existing(destination_path)
+            if reflink_supported:
+                reflink_supported = _clone_file(path, destination_path)
+                if reflink_supported:
+                    continue
+            _copy_file(path, destination_path)
+    return skipped_bytes
@@ -0,0 +1,413 @@
+# stdlib
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import ssl
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Optional
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+STATE_CACHE_DIR_VAR = "TF_STATE_CACHE_DIR"
+HTTP_BACKEND = "http"
+CONSUL_BACKEND = "consul"
+S3_BACKEND = "s3"
+DEFAULT_WORKSPACE = "default"
+CONSUL_ADDRESS_VAR = "CONSUL_HTTP_ADDR"
+CONSUL_TOKEN_VAR = "CONSUL_HTTP_TOKEN"
+DEFAULT_CONSUL_ADDRESS = "127.0.0.1:8500"
+DEFAULT_CONSUL_SCHEME = "http"
+# the consul backend keeps other workspaces at the path with this suffix
+CONSUL_WORKSPACE_SEPARATOR = "-env:"
+CONSUL_INDEX_HEADER = "X-Consul-Index"
+CONSUL_TOKEN_HEADER = "X-Consul-Token"
+ETAG_HEADER = "ETag"
+# the s3 backend keeps other workspaces under this prefix, unless configured
+DEFAULT_S3_WORKSPACE_KEY_PREFIX = "env:"
+AWS_ACCESS_KEY_ID_VAR = "AWS_ACCESS_KEY_ID"
+AWS_SECRET_ACCESS_KEY_VAR = "AWS_SECRET_ACCESS_KEY"
+AWS_SESSION_TOKEN_VAR = "AWS_SESSION_TOKEN"
+AWS_REGION_VARS = ("AWS_REGION", "AWS_DEFAULT_REGION")
+AWS_SIGNING_ALGORITHM = "AWS4-HMAC-SHA256"
+AWS_DATE_FORMAT = "%Y%m%dT%H%M%SZ"
+# sha256 of the empty body of a HEAD request
+EMPTY_PAYLOAD_HASH = hashlib.sha256(b"").hexdigest()
+# seconds to wait on a metadata check before giving up on it
+METADATA_CHECK_TIMEOUT = 10.0
+CACHE_ENTRY_FILE_SUFFIX = ".json"
+# entries hold output values, which may be sensitive
+CACHE_ENTRY_FILE_MODE = 0o600
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _get_ssl_context
+# =============================================================================
+def _get_ssl_context(
+    backend_config: dict[str, Any],
+) -> Optional[ssl.SSLContext]:
+    ca_file = backend_config.get("ca_file")
+    if not ca_file:
+        return None
+    return ssl.create_default_context(cafile=ca_file)
+
+
+# =============================================================================
+# _get_response_header
+# =============================================================================
+def _get_response_header(
+    request: urllib.request.Request,
+    header: str,
+    ssl_context: Optional[ssl.SSLContext] = None,
+) -> Optional[str]:
+    try:
+        with urllib.request.urlopen(
+            request,
+            timeout=METADATA_CHECK_TIMEOUT,
+            context=ssl_context,
+        ) as response:
+            return response.headers.get(header)
+    except (OSError, ValueError) as error:
+        # no metadata check, so the state is read the usual way
+        print(f"[warning] could not check state metadata: {error}")
+        return None
+
+
+# =============================================================================
+# _get_http_validator
+# =============================================================================
+def _get_http_validator(backend_config: dict[str, Any]) -> Optional[str]:
+    address = backend_config.get("address")
+    if not address:
+        return None
+    # the state's etag, without reading the state itself
+    request = urllib.request.Request(address, method="HEAD")
+    username = backend_config.get("username")
+    if username:
+        credentials = f"{username}:{backend_config.get('password', '')}"
+        request.add_header(
+            "Authorization",
+            "Basic " + base64.b64encode(credentials.encode()).decode(),
+        )
+    etag = _get_response_header(
+        request,
+        ETAG_HEADER,
+        ssl_context=_get_ssl_context(backend_config),
+    )
+    return f"etag:{etag}" if etag else None
+
+
+# =============================================================================
+# _get_consul_validator
+# =============================================================================
+def _get_consul_validator(
+    backend_config: dict[str, Any],
+    workspace: str = "",
+) -> Optional[str]:
+    path = backend_config.get("path")
+    if not path:
+        return None
+    if workspace and workspace != DEFAULT_WORKSPACE:
+        path = f"{path}{CONSUL_WORKSPACE_SEPARATOR}{workspace}"
+    address = (
+        backend_config.get("address")
+        or os.environ.get(CONSUL_ADDRESS_VAR)
+        or DEFAULT_CONSUL_ADDRESS
+    )
+    scheme = backend_config.get("scheme") or DEFAULT_CONSUL_SCHEME
+    if "://" not in address:
+        address = f"{scheme}://{address}"
+    # only the key names are listed, and the index of the listing is the
+    # highest modify index beneath the path, which covers a state split
+    # into chunks too
+    request = urllib.request.Request(
+        f"{address.rstrip('/')}/v1/kv/{urllib.parse.quote(path)}?keys"
+    )
+    token = backend_config.get("access_token") or os.environ.get(
+        CONSUL_TOKEN_VAR
+    )
+    if token:
+        request.add_header(CONSUL_TOKEN_HEADER, token)
+    modify_index = _get_response_header(
+        request,
+        CONSUL_INDEX_HEADER,
+        ssl_context=_get_ssl_context(backend_config),
+    )
+    return f"modify_index:{modify_index}" if modify_index else None
+
+
+# =============================================================================
+# _get_aws_authorization
+# =============================================================================
+def _get_aws_authorization(
+    method: str,
+    url: str,
+    headers: dict[str, str],
+    region: str,
+    service: str,
+    access_key: str,
+    secret_key: str,
+) -> str:
+    # signature version 4, for a request without a body. headers must hold
+    # x-amz-date, and every header given is signed along with the host
+    parsed_url = urllib.parse.urlsplit(url)
+    signed_headers = {"host": parsed_url.netloc}
+    signed_headers.update(
+        {name.lower(): value.strip() for name, value in headers.items()}
+    )
+    signed_header_names = ";".join(sorted(signed_headers))
+    canonical_request = "\n".join([
+        method,
+        parsed_url.path or "/",
+        "&".join(sorted(parsed_url.query.split("&")))
+        if parsed_url.query else "",
+        "".join(
+            f"{name}:{signed_headers[name]}\n"
+            for name in sorted(signed_headers)
+        ),
+        signed_header_names,
+        EMPTY_PAYLOAD_HASH,
+    ])
+    amz_date = signed_headers["x-amz-date"]
+    scope = f"{amz_date[:8]}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join([
+        AWS_SIGNING_ALGORITHM,
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+    ])
+    signing_key = f"AWS4{secret_key}".encode("utf-8")
+    for value in (amz_date[:8], region, service, "aws4_request"):
+        signing_key = hmac.new(
+            signing_key,
+            value.encode("utf-8"),
+            hashlib.sha256,
+        ).digest()
+    signature = hmac.new(
+        signing_key,
+        string_to_sign.encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+    return (
+        f"{AWS_SIGNING_ALGORITHM} Credential={access_key}/{scope}, "
+        f"SignedHeaders={signed_header_names}, Signature={signature}"
+    )
+
+
+# =============================================================================
+# _get_s3_validator
+# =============================================================================
+def _get_s3_validator(
+    backend_config: dict[str, Any],
+    workspace: str = "",
+) -> Optional[str]:
+    bucket = backend_config.get("bucket")
+    key = backend_config.get("key")
+    if not bucket or not key:
+        return None
+    # only static credentials can be signed with here. profiles, assumed
+    # roles and instance credentials are left to terraform
+    access_key = backend_config.get("access_key") or os.environ.get(
+        AWS_ACCESS_KEY_ID_VAR
+    )
+    secret_key = backend_config.get("secret_key") or os.environ.get(
+        AWS_SECRET_ACCESS_KEY_VAR
+    )
+    region = backend_config.get("region") or next(
+        (os.environ[var] for var in AWS_REGION_VARS if os.environ.get(var)),
+        None,
+    )
+    if not access_key or not secret_key or not region:
+        return None
+    if workspace and workspace != DEFAULT_WORKSPACE:
+        workspace_key_prefix = backend_config.get(
+            "workspace_key_prefix",
+            DEFAULT_S3_WORKSPACE_KEY_PREFIX,
+        )
+        key = f"{workspace_key_prefix}/{workspace}/{key}"
+    path = urllib.parse.quote(key.lstrip("/"), safe="/")
+    endpoint = backend_config.get("endpoint")
+    if endpoint:
+        if "://" not in endpoint:
+            endpoint = f"https://{endpoint}"
+        url = f"{endpoint.rstrip('/')}/{bucket}/{path}"
+    elif str(
+        backend_config.get("use_path_style")
+        or backend_config.get("force_path_style")
+    ).lower() == "true":
+        url = f"https://s3.{region}.amazonaws.com/{bucket}/{path}"
+    else:
+        url = f"https://{bucket}.s3.{region}.amazonaws.com/{path}"
+    # the object's etag, without reading the state itself
+    headers = {
+        "x-amz-content-sha256": EMPTY_PAYLOAD_HASH,
+        "x-amz-date": datetime.datetime.now(
+            datetime.timezone.utc
+        ).strftime(AWS_DATE_FORMAT),
+    }
+    token = backend_config.get("token") or os.environ.get(
+        AWS_SESSION_TOKEN_VAR
+    )
+    if token:
+        headers["x-amz-security-token"] = token
+    request = urllib.request.Request(url, headers=headers, method="HEAD")
+    request.add_header(
+        "Authorization",
+        _get_aws_authorization(
+            "HEAD",
+            url,
+            headers,
+            region,
+            S3_BACKEND,
+            access_key,
+            secret_key,
+        ),
+    )
+    etag = _get_response_header(
+        request,
+        ETAG_HEADER,
+        ssl_context=_get_ssl_context(backend_config),
+    )
+    return f"etag:{etag}" if etag else None
+
+
+# =============================================================================
+# _get_cache_entry_file_path
+# =============================================================================
+def _get_cache_entry_file_path(cache_dir: str, cache_key: str) -> str:
+    return os.path.join(cache_dir, f"{cache_key}{CACHE_ENTRY_FILE_SUFFIX}")
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# get_state_cache_dir_from_environment
+# =============================================================================
+def get_state_cache_dir_from_environment() -> Optional[str]:
+    return os.environ.get(STATE_CACHE_DIR_VAR) or None
+
+
+# =============================================================================
+# get_cache_key
+# =============================================================================
+def get_cache_key(
+    backend_type: str,
+    backend_config: Optional[dict[str, Any]] = None,
+    workspace: str = "",
+) -> str:
+    # hashed, so credentials in the config never appear in the cache dir
+    key = json.dumps(
+        {
+            "backend_type": backend_type,
+            "backend_config": backend_config or {},
+            "workspace": workspace or DEFAULT_WORKSPACE,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+# =============================================================================
+# get_backend_validator
+# =============================================================================
+def get_backend_validator(
+    backend_type: str,
+    backend_config: Optional[dict[str, Any]] = None,
+    workspace: str = "",
+) -> Optional[str]:
+    # a value which changes whenever the state does, read without reading
+    # the state, or None where the backend has no such check
+    backend_config = backend_config or {}
+    if backend_type == HTTP_BACKEND:
+        return _get_http_validator(backend_config)
+    if backend_type == CONSUL_BACKEND:
+        return _get_consul_validator(backend_config, workspace=workspace)
+    if backend_type == S3_BACKEND:
+        return _get_s3_validator(backend_config, workspace=workspace)
+    return None
+
+
+# =============================================================================
+# get_state_outputs
+# =============================================================================
+def get_state_outputs(state: dict[str, Any]) -> dict[str, Any]:
+    # as terraform output -json prints them
+    return {
+        name: {
+            "sensitive": bool(state_output.get("sensitive", False)),
+            "type": state_output.get("type"),
+            "value": state_output.get("value"),
+        }
+        for name, state_output in state.get("outputs", {}).items()
+    }
+
+
+# =============================================================================
+# read_cache_entry
+# =============================================================================
+def read_cache_entry(
+    cache_dir: str,
+    cache_key: str,
+) -> Optional[dict[str, Any]]:
+    cache_entry_file_path = _get_cache_entry_file_path(cache_dir, cache_key)
+    try:
+        with open(cache_entry_file_path, "r", encoding="utf-8") as entry_file:
+            return json.load(entry_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as error:
+        # a damaged entry is a miss, and is replaced
+        print(f"[warning] could not read state cache entry: {error}")
+        return None
+
+
+# =============================================================================
+# write_cache_entry
+# =============================================================================
+def write_cache_entry(
+    cache_dir: str,
+    cache_key: str,
+    cache_entry: dict[str, Any],
+) -> str:
+    # create cache dir, if needed
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    cache_entry_file_path = _get_cache_entry_file_path(cache_dir, cache_key)
+    # jobs sharing the cache never see an entry half written
+    temp_file = tempfile.NamedTemporaryFile(
+        mode="w",
+        encoding="utf-8",
+        dir=cache_dir,
+        prefix=".tfstatecache.",
+        suffix=".tmp",
+        delete=False,
+    )
+    try:
+        with temp_file:
+            json.dump(cache_entry, temp_file, sort_keys=True)
+        os.chmod(temp_file.name, CACHE_ENTRY_FILE_MODE)
+        os.replace(temp_file.name, cache_entry_file_path)
+    except BaseException:
+        if os.path.exists(temp_file.name):
+            os.remove(temp_file.name)
+        raise
+    return cache_entry_file_path
@@ -0,0 +1,257 @@
+# stdlib
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+from typing import Any, Iterator
+
+# local
+import lib.json_stream
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+STATE_DIFF_FILE_NAME = "state-diff.json"
+RESOURCES_KEY = "resources"
+INSTANCES_KEY = "instances"
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+CHANGE_TYPES = (ADDED, REMOVED, CHANGED)
+# records sorted in memory at once, which bounds memory use regardless of
+# the number of resource instances
+DEFAULT_RUN_SIZE = 10000
+DIGEST_SIZE = 16
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _format_index_key
+# =============================================================================
+def _format_index_key(index_key: Any) -> str:
+    if index_key is None:
+        return ""
+    # count uses numbers, for_each uses strings, as in terraform addresses
+    return f"[{json.dumps(index_key)}]"
+
+
+# =============================================================================
+# _get_resource_address
+# =============================================================================
+def _get_resource_address(resource: dict[str, Any]) -> str:
+    address = f"{resource['type']}.{resource['name']}"
+    if resource.get("mode") == "data":
+        address = f"data.{address}"
+    if resource.get("module"):
+        address = f"{resource['module']}.{address}"
+    return address
+
+
+# =============================================================================
+# _get_instance_digest
+# =============================================================================
+def _get_instance_digest(instance: dict[str, Any]) -> str:
+    attributes = instance.get("attributes", instance.get("attributes_flat"))
+    encoded_attributes = json.dumps(
+        attributes,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.blake2b(
+        encoded_attributes.encode("utf-8"),
+        digest_size=DIGEST_SIZE,
+    ).hexdigest()
+
+
+# =============================================================================
+# _iter_instance_records
+# =============================================================================
+def _iter_instance_records(state_file_path: str) -> Iterator[tuple[str, str]]:
+    # a missing state, e.g. no backup before the first apply, is empty
+    if not os.path.isfile(state_file_path):
+        return
+    with open(state_file_path, "r", encoding="utf-8") as state_file:
+        # instances are streamed one by one, a single resource using count
+        # or for_each can hold most of the state
+        for resource, instance in lib.json_stream.iter_nested_array(
+            state_file,
+            RESOURCES_KEY,
+            INSTANCES_KEY,
+        ):
+            yield (
+                _get_resource_address(resource)
+                + _format_index_key(instance.get("index_key")),
+                _get_instance_digest(instance),
+            )
+
+
+# =============================================================================
+# _write_run
+# =============================================================================
+def _write_run(records: list[tuple[str, str]], scratch_dir: str) -> str:
+    records.sort()
+    with tempfile.NamedTemporaryFile(
+        "w",
+        encoding="utf-8",
+        dir=scratch_dir,
+        suffix=".run",
+        delete=False,
+    ) as run_file:
+        for record in records:
+            # json lines, since addresses may contain any character
+            run_file.write(json.dumps(record) + "\n")
+    return run_file.name
+
+
+# =============================================================================
+# _iter_run
+# =============================================================================
+def _iter_run(run_file_path: str) -> Iterator[tuple[str, str]]:
+    with open(run_file_path, "r", encoding="utf-8") as run_file:
+        for line in run_file:
+            address, digest = json.loads(line)
+            yield address, digest
+
+
+# =============================================================================
+# _iter_sorted_records
+# =============================================================================
+def _iter_sorted_records(
+    state_file_path: str,
+    scratch_dir: str,
+    run_size: int,
+) -> Iterator[tuple[str, str]]:
+    # first pass: sorted runs of at most run_size records on disk
+    run_file_paths: list[str] = []
+    records: list[tuple[str, str]] = []
+    for record in _iter_instance_records(state_file_path):
+        records.append(record)
+        if len(records) >= run_size:
+            run_file_paths.append(_write_run(records, scratch_dir))
+            records = []
+    if records:
+        run_file_paths.append(_write_run(records, scratch_dir))
+    # second pass: merge the runs into one sorted stream
+    return heapq.merge(*[_iter_run(path) for path in run_file_paths])
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# iter_state_diff
+# =============================================================================
+def iter_state_diff(
+    before_state_file_path: str,
+    after_state_file_path: str,
+    run_size: int = DEFAULT_RUN_SIZE,
+) -> Iterator[tuple[str, str]]:
+    # yields (change type, address) in address order, by walking both
+    # address sorted streams side by side
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        before_records = _iter_sorted_records(
+            before_state_file_path,
+            scratch_dir,
+            run_size,
+        )
+        after_records = _iter_sorted_records(
+            after_state_file_path,
+            scratch_dir,
+            run_size,
+        )
+        before = next(before_records, None)
+        after = next(after_records, None)
+        while before or after:
+            if after is None or (before and before[0] < after[0]):
+                yield REMOVED, before[0]
+                before = next(before_records, None)
+            elif before is None or after[0] < before[0]:
+                yield ADDED, after[0]
+                after = next(after_records, None)
+            else:
+                if before[1] != after[1]:
+                    yield CHANGED, after[0]
+                before = next(before_records, None)
+                after = next(after_records, None)
+
+
+# =============================================================================
+# format_state_diff_counts
+# =============================================================================
+def format_state_diff_counts(counts: dict[str, int]) -> str:
+    return (
+        f"state diff: {counts[ADDED]} added, "
+        f"{counts[REMOVED]} removed, "
+        f"{counts[CHANGED]} changed"
+    )
+
+
+# =============================================================================
+# write_state_diff
+# =============================================================================
+def write_state_diff(
+    before_state_file_path: str,
+    after_state_file_path: str,
+    output_dir: str,
+    run_size: int = DEFAULT_RUN_SIZE,
+) -> dict[str, int]:
+    # create output dir, if needed
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    counts = {change_type: 0 for change_type in CHANGE_TYPES}
+    state_diff_file_path = os.path.join(output_dir, STATE_DIFF_FILE_NAME)
+    addresses_file_paths: dict[str, str] = {}
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        # addresses are spooled per change type, then written out as lists
+        address_files: dict[str, Any] = {}
+        for change_type in CHANGE_TYPES:
+            addresses_file_paths[change_type] = os.path.join(
+                scratch_dir,
+                change_type,
+            )
+            address_files[change_type] = open(
+                addresses_file_paths[change_type],
+                "w",
+                encoding="utf-8",
+            )
+        try:
+            for change_type, address in iter_state_diff(
+                before_state_file_path,
+                after_state_file_path,
+                run_size=run_size,
+            ):
+                address_files[change_type].write(json.dumps(address) + "\n")
+                counts[change_type] += 1
+        finally:
+            for address_file in address_files.values():
+                address_file.close()
+        with open(state_diff_file_path, "w", encoding="utf-8") as diff_file:
+            diff_file.write(f'{{"counts": {json.dumps(counts)}')
+            for change_type in CHANGE_TYPES:
+                diff_file.write(f', "{change_type}": [')
+                with open(
+                    addresses_file_paths[change_type],
+                    "r",
+                    encoding="utf-8",
+                ) as address_file:
+                    for index, line in enumerate(address_file):
+                        if index:
+                            diff_file.write(", ")
+                        diff_file.write(line.rstrip("\n"))
+                diff_file.write("]")
+            diff_file.write("}\n")
+    print(format_state_diff_counts(counts))
+    print(f"wrote state diff to: {state_diff_file_path}")
+    return counts
@@ -0,0 +1,308 @@
+# stdlib
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Any, Optional
+
+# local
+import lib.json_stream
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+TERRAFORM_STATE_FILE_NAME = "terraform.tfstate"
+TERRAFORM_BACKUP_STATE_FILE_NAME = f"{TERRAFORM_STATE_FILE_NAME}.backup"
+STATE_MANIFEST_FILE_NAME = f"{TERRAFORM_STATE_FILE_NAME}.manifest.json"
+COMPRESSED_FILE_SUFFIX = ".gz"
+CHECKSUM_ALGORITHM = "blake2b"
+COPY_BUFFER_SIZE = 1024 * 1024
+# temporary files are created private, exported files keep the permissions
+# shutil.copyfile gave them before
+EXPORTED_FILE_MODE = 0o644
+# the state keys recorded in the manifest
+STATE_METADATA_KEYS = ("serial", "lineage")
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# StateIntegrityError
+# =============================================================================
+class StateIntegrityError(Exception):
+    pass
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _get_file_checksum
+# =============================================================================
+def _get_file_checksum(file_path: str) -> str:
+    checksum = hashlib.blake2b()
+    with open(file_path, "rb") as checksum_file:
+        for chunk in iter(lambda: checksum_file.read(COPY_BUFFER_SIZE), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+# =============================================================================
+# _get_state_metadata
+# =============================================================================
+def _get_state_metadata(state_file_path: str) -> dict[str, Any]:
+    # serial and lineage come first in a state file, so this stops reading
+    # long before the resources
+    try:
+        with open(state_file_path, "r", encoding="utf-8") as state_file:
+            return lib.json_stream.read_values(state_file, STATE_METADATA_KEYS)
+    except ValueError:
+        return {}
+
+
+# =============================================================================
+# _fsync_dir
+# =============================================================================
+def _fsync_dir(directory: str) -> None:
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+# =============================================================================
+# _write_file_atomically
+# =============================================================================
+def _write_file_atomically(
+    source_file_path: str,
+    destination_file_path: str,
+    compress: bool = False,
+) -> str:
+    destination_dir = os.path.dirname(destination_file_path)
+    # the temporary file sits next to the destination, so the rename is
+    # atomic and a killed container never leaves a torn file behind
+    temp_file = tempfile.NamedTemporaryFile(
+        dir=destination_dir,
+        prefix=f".{os.path.basename(destination_file_path)}.",
+        delete=False,
+    )
+    try:
+        with temp_file:
+            with open(source_file_path, "rb") as source_file:
+                if compress:
+                    # no name or timestamp, so equal states compress equally
+                    with gzip.GzipFile(
+                        filename="",
+                        mode="wb",
+                        fileobj=temp_file,
+                        mtime=0,
+                    ) as gzip_file:
+                        shutil.copyfileobj(
+                            source_file,
+                            gzip_file,
+                            COPY_BUFFER_SIZE,
+                        )
+                else:
+                    shutil.copyfileobj(
+                        source_file, temp_file, COPY_BUFFER_SIZE
+                    )
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.chmod(temp_file.name, EXPORTED_FILE_MODE)
+        checksum = _get_file_checksum(temp_file.name)
+        os.replace(temp_file.name, destination_file_path)
+    except BaseException:
+        if os.path.exists(temp_file.name):
+            os.remove(temp_file.name)
+        raise
+    _fsync_dir(destination_dir)
+    return checksum
+
+
+# =============================================================================
+# _write_manifest_atomically
+# =============================================================================
+def _write_manifest_atomically(
+    manifest: dict[str, Any],
+    manifest_file_path: str,
+) -> None:
+    manifest_dir = os.path.dirname(manifest_file_path)
+    with tempfile.NamedTemporaryFile(
+        "w",
+        encoding="utf-8",
+        dir=manifest_dir,
+        prefix=f".{STATE_MANIFEST_FILE_NAME}.",
+        delete=False,
+    ) as temp_file:
+        json.dump(manifest, temp_file, indent=2, sort_keys=True)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.chmod(temp_file.name, EXPORTED_FILE_MODE)
+    os.replace(temp_file.name, manifest_file_path)
+    _fsync_dir(manifest_dir)
+
+
+# =============================================================================
+# _get_exported_file_name
+# =============================================================================
+def _get_exported_file_name(file_name: str, compress: bool) -> str:
+    if compress:
+        return file_name + COMPRESSED_FILE_SUFFIX
+    return file_name
+
+
+# =============================================================================
+# _is_already_exported
+# =============================================================================
+def _is_already_exported(
+    previous_entry: Optional[dict[str, Any]],
+    source_checksum: str,
+    destination_file_path: str,
+    compress: bool,
+) -> bool:
+    if not previous_entry or not os.path.isfile(destination_file_path):
+        return False
+    if previous_entry.get("source_checksum") != source_checksum:
+        return False
+    if previous_entry.get("compressed", False) != compress:
+        return False
+    # trust the manifest only while the exported file still matches it
+    return _get_file_checksum(destination_file_path) == (
+        previous_entry.get("checksum")
+    )
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# read_state_manifest
+# =============================================================================
+def read_state_manifest(state_dir: str) -> Optional[dict[str, Any]]:
+    manifest_file_path = os.path.join(state_dir, STATE_MANIFEST_FILE_NAME)
+    if not os.path.isfile(manifest_file_path):
+        return None
+    with open(manifest_file_path, "r", encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+
+# =============================================================================
+# export_state_files
+# =============================================================================
+def export_state_files(
+    terraform_dir: str,
+    state_output_dir: str,
+    compress: bool = False,
+) -> dict[str, Any]:
+    # create output dir, if needed
+    if not os.path.isdir(state_output_dir):
+        os.makedirs(state_output_dir)
+    previous_manifest = read_state_manifest(state_output_dir) or {}
+    previous_files = previous_manifest.get("files", {})
+    manifest: dict[str, Any] = {"algorithm": CHECKSUM_ALGORITHM, "files": {}}
+    source_checksums: dict[str, str] = {}
+    for file_name in (
+        TERRAFORM_STATE_FILE_NAME,
+        TERRAFORM_BACKUP_STATE_FILE_NAME,
+    ):
+        source_file_path = os.path.join(terraform_dir, file_name)
+        if not os.path.isfile(source_file_path):
+            continue
+        source_checksum = _get_file_checksum(source_file_path)
+        exported_file_name = _get_exported_file_name(file_name, compress)
+        destination_file_path = os.path.join(
+            state_output_dir,
+            exported_file_name,
+        )
+        # a backup identical to the state it backs up adds nothing
+        identical_file_names = [
+            name
+            for name, checksum in source_checksums.items()
+            if checksum == source_checksum
+        ]
+        if identical_file_names:
+            manifest["files"][file_name] = {"same_as": identical_file_names[0]}
+            # do not leave a stale copy from an earlier export behind
+            if os.path.isfile(destination_file_path):
+                os.remove(destination_file_path)
+            print(
+                f"skipped exporting {file_name}, "
+                f"identical to {identical_file_names[0]}"
+            )
+            continue
+        source_checksums[file_name] = source_checksum
+        previous_entry = previous_files.get(file_name)
+        if _is_already_exported(
+            previous_entry,
+            source_checksum,
+            destination_file_path,
+            compress,
+        ):
+            manifest["files"][file_name] = previous_entry
+            print(f"skipped exporting {file_name}, already up to date")
+            continue
+        checksum = _write_file_atomically(
+            source_file_path,
+            destination_file_path,
+            compress=compress,
+        )
+        manifest["files"][file_name] = {
+            "path": exported_file_name,
+            "checksum": checksum,
+            "source_checksum": source_checksum,
+            "size": os.path.getsize(destination_file_path),
+            "compressed": compress,
+            **_get_state_metadata(source_file_path),
+        }
+        print(f"exported {file_name} to: {destination_file_path}")
+    # the manifest is written last, so it only ever lists complete files
+    _write_manifest_atomically(
+        manifest,
+        os.path.join(state_output_dir, STATE_MANIFEST_FILE_NAME),
+    )
+    return manifest
+
+
+# =============================================================================
+# verify_state_file
+# =============================================================================
+def verify_state_file(state_file_path: str) -> None:
+    manifest = read_state_manifest(os.path.dirname(state_file_path))
+    if not manifest:
+        return
+    exported_file_name = os.path.basename(state_file_path)
+    for entry in manifest.get("files", {}).values():
+        if entry.get("path") != exported_file_name:
+            continue
+        checksum = _get_file_checksum(state_file_path)
+        if checksum != entry["checksum"]:
+            raise StateIntegrityError(
+                f"checksum mismatch for state file {state_file_path}: "
+                f"expected {entry['checksum']}, found {checksum}"
+            )
+        return
+
+
+# =============================================================================
+# open_state_file
+# =============================================================================
+def open_state_file(state_file_path: str) -> Any:
+    if state_file_path.endswith(COMPRESSED_FILE_SUFFIX):
+        return gzip.open(state_file_path, "rb")
+    return open(state_file_path, "rb")
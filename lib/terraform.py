@@ -1,16 +1,29 @@
 # stdlib
 import os
+import shutil
 import subprocess
 import sys
+import threading
 from typing import Any, Optional
 
+# local
+import lib.log_filter
+import lib.redact
+import lib.run_stats
+import lib.terraform_command
+import lib.trace
+
 # =============================================================================
 #
 # constants
 #
 # =============================================================================
 
-TERRAFORM_BIN_FILE_PATH = "terraform"
+TERRAFORM_BIN_FILE_PATH_VAR = "TERRAFORM_BIN_FILE_PATH"
+# overridable so tests can run against a stand-in such as bin/terraform-replay
+TERRAFORM_BIN_FILE_PATH = (
+    os.environ.get(TERRAFORM_BIN_FILE_PATH_VAR) or "terraform"
+)
 
 
 # =============================================================================
@@ -22,8 +35,7 @@ TERRAFORM_BIN_FILE_PATH = "terraform"
 # =============================================================================
 # TerraformNoChangesError
 # =============================================================================
-class TerraformNoChangesError(subprocess.CalledProcessError):
-    pass
+TerraformNoChangesError = lib.terraform_command.TerraformNoChangesError
 
 
 # =============================================================================
@@ -43,9 +55,46 @@ def _dump_plugin_cache(plugin_cache_dir: str) -> None:
 
 
 # =============================================================================
-# _terraform
+# _get_output_filters
+# =============================================================================
+def _get_output_filters() -> tuple[list[Any], list[Any]]:
+    stdout_filters: list[Any] = []
+    stderr_filters: list[Any] = []
+    # secrets are masked before a line reaches any log, raw or not
+    redaction_filter = lib.redact.get_redaction_filter_from_environment()
+    if redaction_filter:
+        stdout_filters.append(redaction_filter)
+        stderr_filters.append(redaction_filter)
+    # the raw log sees every line before anything is collapsed
+    raw_log_writer = lib.log_filter.get_raw_log_writer_from_environment()
+    if raw_log_writer:
+        stdout_filters.append(raw_log_writer)
+        stderr_filters.append(raw_log_writer)
+    # progress lines are only ever written to stdout
+    progress_filter = lib.log_filter.get_progress_filter_from_environment()
+    if progress_filter:
+        stdout_filters.append(progress_filter)
+    return stdout_filters, stderr_filters
+
+
+# =============================================================================
+# _stream_lines
 # =============================================================================
-def _terraform(
+def _stream_lines(stream: Any, filters: list[Any], output: Any) -> None:
+    if not stream:
+        return
+    for line in stream:
+        # log the output as it arrives
+        for filtered_line in lib.log_filter.apply_filters(filters, line):
+            print(filtered_line, end="", file=output)
+    for filtered_line in lib.log_filter.flush_filters(filters):
+        print(filtered_line, end="", file=output)
+
+
+# =============================================================================
+# _run_terraform
+# =============================================================================
+def _run_terraform(
     *args: str,
     terraform_dir: str = ".",
     input_arg: Any = None,
@@ -55,86 +104,106 @@ def _terraform(
     output_file: str = "",
     debug: bool = False,
 ) -> None:
-
-    if not terraform_dir:
-        terraform_dir = "."
-
-    process_args = [TERRAFORM_BIN_FILE_PATH, f"-chdir={terraform_dir}", *args]
-    # force 'TF_IN_AUTOMATION'
-    os.environ["TF_IN_AUTOMATION"] = "1"
+    process_args = lib.terraform_command.get_process_args(
+        TERRAFORM_BIN_FILE_PATH,
+        args,
+        terraform_dir=terraform_dir,
+    )
+    process_env = lib.terraform_command.get_process_env(plugin_cache_dir)
+    redaction_filter = lib.redact.get_redaction_filter_from_environment()
     if debug:
         print(f'[debug] HOME is {os.environ["HOME"]}')
-        print(f'[debug] executing: {" ".join(process_args)}')
-    if plugin_cache_dir:
-        os.environ["TF_PLUGIN_CACHE_DIR"] = plugin_cache_dir
-        if debug:
-            print(f"[debug] set TF_PLUGIN_CACHE_DIR to {plugin_cache_dir}")
-            _dump_plugin_cache(plugin_cache_dir)
+        debug_process_args = " ".join(process_args)
+        if redaction_filter:
+            debug_process_args = redaction_filter.redact(debug_process_args)
+        print(f"[debug] executing: {debug_process_args}")
+    if plugin_cache_dir and debug:
+        print(f"[debug] set TF_PLUGIN_CACHE_DIR to {plugin_cache_dir}")
+        _dump_plugin_cache(plugin_cache_dir)
+    stdout_filters, stderr_filters = _get_output_filters()
     try:
-        # use Popen so we can read lines as they come
-        with subprocess.Popen(
-            process_args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,  # redirect stderr to stdout
-            bufsize=1,
-            universal_newlines=True,
-            stdin=input_arg,
-            cwd=working_dir,
-        ) as pipe:
-            if pipe.stdout:
-                if output_file:
-                    with open(
-                        output_file,
-                        "w",
-                        encoding="utf-8",
-                    ) as output_file_obj:
-                        for line in pipe.stdout.read():
-                            output_file_obj.write(line)
-                            if debug:
-                                # log the output as it arrives
-                                print(line, end="")
-                    if debug:
-                        print(f"[debug] wrote output to {output_file}")
-                else:
-                    for line in pipe.stdout.read():
-                        # log the output as it arrives
-                        print(line, end="")
-            if pipe.stderr:
-                for line in pipe.stderr:
-                    print(line, end="", file=sys.stderr)
-        # mask args if we're not in debug
-        masked_args = pipe.args if debug else [TERRAFORM_BIN_FILE_PATH]
-        # check if we're using detailed exit codes
-        if "-detailed-exitcode" in [arg.lower() for arg in args]:
-            # 2 == success, with changes
-            if pipe.returncode != 2:
-                # 0 == success, no changes
-                if pipe.returncode == 0:
-                    if error_on_no_changes:
-                        # raise a custom exception
-                        raise TerraformNoChangesError(
-                            pipe.returncode,
-                            masked_args,
-                        )
-                else:
-                    # raise a standard exception
-                    raise subprocess.CalledProcessError(
-                        pipe.returncode,
-                        masked_args,
-                    )
-        else:
-            if pipe.returncode != 0:
-                # raise a standard exception
-                raise subprocess.CalledProcessError(
-                    pipe.returncode,
-                    masked_args,
+        # the process's lifetime, from start to exit, is a span of its own
+        with lib.trace.span(
+            os.path.basename(process_args[0]),
+            "subprocess",
+            command=args[0].lstrip("-"),
+        ) as span_args:
+            # use Popen so we can read lines as they come
+            with subprocess.Popen(
+                process_args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=1,
+                universal_newlines=True,
+                stdin=input_arg,
+                cwd=working_dir,
+                env=process_env,
+            ) as pipe:
+                span_args["pid"] = pipe.pid
+                # drain stderr alongside stdout so neither pipe can fill and
+                # block
+                stderr_thread = threading.Thread(
+                    target=_stream_lines,
+                    args=(pipe.stderr, stderr_filters, sys.stderr),
+                    daemon=True,
                 )
+                stderr_thread.start()
+                if pipe.stdout:
+                    if output_file:
+                        with open(
+                            output_file,
+                            "w",
+                            encoding="utf-8",
+                        ) as output_file_obj:
+                            if debug:
+                                for line in pipe.stdout:
+                                    output_file_obj.write(line)
+                                    # log the output as it arrives, the file
+                                    # itself keeps the values downstream needs
+                                    if redaction_filter:
+                                        line = redaction_filter.redact(line)
+                                    print(line, end="")
+                            else:
+                                # copy in chunks, json output is a single line
+                                # which can be tens of megabytes long
+                                shutil.copyfileobj(
+                                    pipe.stdout,
+                                    output_file_obj,
+                                )
+                        if debug:
+                            print(f"[debug] wrote output to {output_file}")
+                    else:
+                        _stream_lines(pipe.stdout, stdout_filters, sys.stdout)
+                stderr_thread.join()
+            span_args["exit_code"] = pipe.returncode
+        lib.run_stats.add_exit_code(args[0].lstrip("-"), pipe.returncode)
+        lib.terraform_command.check_return_code(
+            pipe.returncode,
+            args,
+            lib.terraform_command.get_masked_args(
+                process_args,
+                redaction_filter=redaction_filter,
+                debug=debug,
+            ),
+            error_on_no_changes=error_on_no_changes,
+        )
     finally:
+        lib.log_filter.close_filters(stdout_filters + stderr_filters)
         if plugin_cache_dir and debug:
             print("[debug] dumping updated plugin cache")
             _dump_plugin_cache(plugin_cache_dir)
 
 
+# =============================================================================
+# _terraform
+# =============================================================================
+def _terraform(*args: str, **kwargs: Any) -> None:
+    # each terraform command is timed as a phase of the run
+    command = args[0].lstrip("-")
+    with lib.run_stats.phase(command), lib.trace.span(command, "terraform"):
+        _run_terraform(*args, **kwargs)
+
+
 # =============================================================================
 #
 # public terraform functions
@@ -157,18 +226,15 @@ def init(
     terraform_dir_path: str = ".",
     plugin_cache_dir_path: str = "",
     backend_config_vars: Optional[dict[str, Any]] = None,
+    backend: bool = True,
     debug: bool = False,
 ) -> None:
-    terraform_command_args = []
-    # set backend config values
-    if backend_config_vars:
-        for key, val in backend_config_vars.items():
-            terraform_command_args.append(f"-backend-config={key}={val}")
     # execute
     _terraform(
-        "init",
-        "-input=false",
-        *terraform_command_args,
+        *lib.terraform_command.get_init_args(
+            backend_config_vars,
+            backend=backend,
+        ),
         terraform_dir=terraform_dir_path,
         working_dir=working_dir_path,
         plugin_cache_dir=plugin_cache_dir_path,
@@ -191,24 +257,15 @@ def plan(
     var_file_paths: Optional[list[str]] = None,
     debug: bool = False,
 ) -> None:
-    terraform_command_args = []
-    if state_file_path:
-        # specify state file
-        terraform_command_args.append(f"-state={state_file_path}")
-    if create_plan_file:
-        # creating a plan file
-        terraform_command_args.append(f"-out={plan_file_path}")
-    for var_file_path in var_file_paths or []:
-        terraform_command_args.append(f"-var-file={var_file_path}")
-    if destroy:
-        # creating a destroy plan
-        terraform_command_args.append("-destroy")
     # execute
     _terraform(
-        "plan",
-        "-input=false",
-        "-detailed-exitcode",
-        *terraform_command_args,
+        *lib.terraform_command.get_plan_args(
+            state_file_path=state_file_path,
+            create_plan_file=create_plan_file,
+            plan_file_path=plan_file_path,
+            destroy=destroy,
+            var_file_paths=var_file_paths,
+        ),
         terraform_dir=terraform_dir_path,
         working_dir=working_dir_path,
         plugin_cache_dir=plugin_cache_dir_path,
@@ -229,22 +286,16 @@ def apply(
     var_file_paths: Optional[list[str]] = None,
     debug: bool = False,
 ) -> None:
-    terraform_command_args = []
-    if plan_file_path:
-        # target plan file if using a plan file
-        terraform_dir_path = plan_file_path
-    else:
-        # auto approve if not using a plan file
-        terraform_command_args.append("-auto-approve")
-    if state_file_path:
-        # specify state file
-        terraform_command_args.append(f"-state={state_file_path}")
-    for var_file_path in var_file_paths or []:
-        terraform_command_args.append(f"-var-file={var_file_path}")
+    terraform_command_args, terraform_dir_path = (
+        lib.terraform_command.get_apply_args(
+            terraform_dir_path=terraform_dir_path,
+            state_file_path=state_file_path,
+            plan_file_path=plan_file_path,
+            var_file_paths=var_file_paths,
+        )
+    )
     # execute
     _terraform(
-        "apply",
-        "-input=false",
         *terraform_command_args,
         terraform_dir=terraform_dir_path,
         working_dir=working_dir_path,
@@ -259,13 +310,17 @@ def apply(
 def show(
     working_dir_path: str,
     plan_file_path: str,
+    output_file_path: str = "",
     debug: bool = False,
 ) -> None:
-    # execute
+    # execute, with machine readable output when writing to a file
     _terraform(
-        "show",
-        plan_file_path,
+        *lib.terraform_command.get_show_args(
+            plan_file_path,
+            json_output=bool(output_file_path),
+        ),
         working_dir=working_dir_path,
+        output_file=output_file_path,
         debug=debug,
     )
 
@@ -276,22 +331,35 @@ def show(
 def output(
     working_dir_path: str,
     output_file_path: str,
+    terraform_dir_path: str = ".",
     state_file_path: str = "",
     target_name: str = "",
     debug: bool = False,
 ) -> None:
-    terraform_command_args = []
-    if state_file_path:
-        # specify state file
-        terraform_command_args.append(f"-state={state_file_path}")
-    if target_name:
-        # specify target
-        terraform_command_args.append(target_name)
     # execute
     _terraform(
-        "output",
-        "-json",
-        *terraform_command_args,
+        *lib.terraform_command.get_output_args(
+            state_file_path=state_file_path,
+            target_name=target_name,
+        ),
+        terraform_dir=terraform_dir_path,
+        working_dir=working_dir_path,
+        output_file=output_file_path,
+        debug=debug,
+    )
+
+
+# =============================================================================
+# state_pull
+# =============================================================================
+def state_pull(
+    working_dir_path: str,
+    output_file_path: str,
+    debug: bool = False,
+) -> None:
+    # execute
+    _terraform(
+        *lib.terraform_command.get_state_pull_args(),
         working_dir=working_dir_path,
         output_file=output_file_path,
         debug=debug,
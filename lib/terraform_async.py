@@ -0,0 +1,359 @@
+# stdlib
+import asyncio
+import codecs
+import os
+import signal
+import sys
+from typing import Any, Callable, Optional
+
+# local
+import lib.redact
+import lib.run_stats
+import lib.terraform
+import lib.terraform_command
+import lib.trace
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+CHUNK_SIZE = 64 * 1024
+# seconds terraform gets to release its locks and exit after an interrupt,
+# before it is killed
+CANCEL_GRACE_SECONDS = 30.0
+
+LineCallback = Callable[[str], None]
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _print_stdout_line
+# =============================================================================
+def _print_stdout_line(line: str) -> None:
+    print(line, end="")
+
+
+# =============================================================================
+# _print_stderr_line
+# =============================================================================
+def _print_stderr_line(line: str) -> None:
+    print(line, end="", file=sys.stderr)
+
+
+# =============================================================================
+# _read_lines
+# =============================================================================
+async def _read_lines(
+    stream: asyncio.StreamReader,
+    callback: LineCallback,
+    redaction_filter: Any = None,
+) -> None:
+    # read in chunks rather than with readline, which fails on lines longer
+    # than the stream limit, such as json output
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    while True:
+        chunk = await stream.read(CHUNK_SIZE)
+        pending += decoder.decode(chunk, final=not chunk)
+        *lines, pending = pending.split("\n")
+        lines = [f"{line}\n" for line in lines]
+        if not chunk and pending:
+            # the last line, without a newline
+            lines.append(pending)
+        for line in lines:
+            if redaction_filter:
+                line = redaction_filter.redact(line)
+            callback(line)
+        if not chunk:
+            return
+
+
+# =============================================================================
+# _copy_to_file
+# =============================================================================
+async def _copy_to_file(stream: asyncio.StreamReader, file_path: str) -> None:
+    with open(file_path, "wb") as output_file:
+        while True:
+            chunk = await stream.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            output_file.write(chunk)
+
+
+# =============================================================================
+# _interrupt
+# =============================================================================
+async def _interrupt(process: asyncio.subprocess.Process) -> None:
+    if process.returncode is not None:
+        return
+    # terraform stops gracefully on SIGINT, as on ctrl+c, releasing state
+    # locks, where killing it would leave them behind
+    process.send_signal(signal.SIGINT)
+    try:
+        # keep draining its output, so it never blocks on a full pipe
+        await asyncio.wait_for(process.communicate(), CANCEL_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+# =============================================================================
+# _run_terraform
+# =============================================================================
+async def _run_terraform(
+    *args: str,
+    terraform_dir: str = ".",
+    working_dir: str = "",
+    plugin_cache_dir: str = "",
+    error_on_no_changes: bool = True,
+    output_file: str = "",
+    on_stdout_line: Optional[LineCallback] = None,
+    on_stderr_line: Optional[LineCallback] = None,
+    debug: bool = False,
+) -> int:
+    process_args = lib.terraform_command.get_process_args(
+        lib.terraform.TERRAFORM_BIN_FILE_PATH,
+        args,
+        terraform_dir=terraform_dir,
+    )
+    redaction_filter = lib.redact.get_redaction_filter_from_environment()
+    if debug:
+        debug_process_args = " ".join(process_args)
+        if redaction_filter:
+            debug_process_args = redaction_filter.redact(debug_process_args)
+        print(f"[debug] executing: {debug_process_args}")
+    # processes run concurrently on the event loop's thread, so each
+    # terraform dir gets its own track in the trace
+    with lib.trace.span(
+        os.path.basename(process_args[0]),
+        "subprocess",
+        track=f"terraform {terraform_dir}",
+        command=args[0].lstrip("-"),
+    ) as span_args:
+        process = await asyncio.create_subprocess_exec(
+            *process_args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=working_dir or None,
+            # the environment is per process, os.environ is never changed
+            env=lib.terraform_command.get_process_env(plugin_cache_dir),
+        )
+        span_args["pid"] = process.pid
+        if output_file:
+            stdout_reader = _copy_to_file(process.stdout, output_file)
+        else:
+            stdout_reader = _read_lines(
+                process.stdout,
+                on_stdout_line or _print_stdout_line,
+                redaction_filter=redaction_filter,
+            )
+        stderr_reader = _read_lines(
+            process.stderr,
+            on_stderr_line or _print_stderr_line,
+            redaction_filter=redaction_filter,
+        )
+        try:
+            await asyncio.gather(stdout_reader, stderr_reader)
+            return_code = await process.wait()
+        except asyncio.CancelledError:
+            await _interrupt(process)
+            raise
+        span_args["exit_code"] = return_code
+    lib.run_stats.add_exit_code(args[0].lstrip("-"), return_code)
+    lib.terraform_command.check_return_code(
+        return_code,
+        args,
+        lib.terraform_command.get_masked_args(
+            process_args,
+            redaction_filter=redaction_filter,
+            debug=debug,
+        ),
+        error_on_no_changes=error_on_no_changes,
+    )
+    return return_code
+
+
+# =============================================================================
+# _terraform
+# =============================================================================
+async def _terraform(
+    *args: str,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    **kwargs: Any,
+) -> int:
+    # the semaphore caps the number of terraform processes running at once
+    if semaphore is None:
+        return await _run_terraform(*args, **kwargs)
+    async with semaphore:
+        return await _run_terraform(*args, **kwargs)
+
+
+# =============================================================================
+#
+# public terraform functions
+#
+# =============================================================================
+
+# =============================================================================
+# init
+# =============================================================================
+async def init(
+    working_dir_path: str,
+    terraform_dir_path: str = ".",
+    plugin_cache_dir_path: str = "",
+    backend_config_vars: Optional[dict[str, Any]] = None,
+    on_stdout_line: Optional[LineCallback] = None,
+    on_stderr_line: Optional[LineCallback] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    debug: bool = False,
+) -> int:
+    # execute
+    return await _terraform(
+        *lib.terraform_command.get_init_args(backend_config_vars),
+        terraform_dir=terraform_dir_path,
+        working_dir=working_dir_path,
+        plugin_cache_dir=plugin_cache_dir_path,
+        on_stdout_line=on_stdout_line,
+        on_stderr_line=on_stderr_line,
+        semaphore=semaphore,
+        debug=debug,
+    )
+
+
+# =============================================================================
+# plan
+# =============================================================================
+async def plan(
+    working_dir_path: str,
+    terraform_dir_path: str = ".",
+    plugin_cache_dir_path: str = "",
+    state_file_path: str = "",
+    create_plan_file: bool = False,
+    plan_file_path: str = "",
+    error_on_no_changes: bool = True,
+    destroy: bool = False,
+    var_file_paths: Optional[list[str]] = None,
+    refresh_only: bool = False,
+    on_stdout_line: Optional[LineCallback] = None,
+    on_stderr_line: Optional[LineCallback] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    debug: bool = False,
+) -> int:
+    # execute, returning 2 when there are changes and 0 when there are none
+    return await _terraform(
+        *lib.terraform_command.get_plan_args(
+            state_file_path=state_file_path,
+            create_plan_file=create_plan_file,
+            plan_file_path=plan_file_path,
+            destroy=destroy,
+            var_file_paths=var_file_paths,
+            refresh_only=refresh_only,
+        ),
+        terraform_dir=terraform_dir_path,
+        working_dir=working_dir_path,
+        plugin_cache_dir=plugin_cache_dir_path,
+        error_on_no_changes=error_on_no_changes,
+        on_stdout_line=on_stdout_line,
+        on_stderr_line=on_stderr_line,
+        semaphore=semaphore,
+        debug=debug,
+    )
+
+
+# =============================================================================
+# apply
+# =============================================================================
+async def apply(
+    working_dir_path: str,
+    terraform_dir_path: str = ".",
+    plugin_cache_dir_path: str = "",
+    state_file_path: str = "",
+    plan_file_path: str = "",
+    var_file_paths: Optional[list[str]] = None,
+    on_stdout_line: Optional[LineCallback] = None,
+    on_stderr_line: Optional[LineCallback] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    debug: bool = False,
+) -> int:
+    terraform_command_args, terraform_dir_path = (
+        lib.terraform_command.get_apply_args(
+            terraform_dir_path=terraform_dir_path,
+            state_file_path=state_file_path,
+            plan_file_path=plan_file_path,
+            var_file_paths=var_file_paths,
+        )
+    )
+    # execute
+    return await _terraform(
+        *terraform_command_args,
+        terraform_dir=terraform_dir_path,
+        working_dir=working_dir_path,
+        plugin_cache_dir=plugin_cache_dir_path,
+        on_stdout_line=on_stdout_line,
+        on_stderr_line=on_stderr_line,
+        semaphore=semaphore,
+        debug=debug,
+    )
+
+
+# =============================================================================
+# show
+# =============================================================================
+async def show(
+    working_dir_path: str,
+    plan_file_path: str,
+    output_file_path: str = "",
+    on_stdout_line: Optional[LineCallback] = None,
+    on_stderr_line: Optional[LineCallback] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    debug: bool = False,
+) -> int:
+    # execute, with machine readable output when writing to a file
+    return await _terraform(
+        *lib.terraform_command.get_show_args(
+            plan_file_path,
+            json_output=bool(output_file_path),
+        ),
+        working_dir=working_dir_path,
+        output_file=output_file_path,
+        on_stdout_line=on_stdout_line,
+        on_stderr_line=on_stderr_line,
+        semaphore=semaphore,
+        debug=debug,
+    )
+
+
+# =============================================================================
+# output
+# =============================================================================
+async def output(
+    working_dir_path: str,
+    output_file_path: str,
+    terraform_dir_path: str = ".",
+    state_file_path: str = "",
+    target_name: str = "",
+    on_stderr_line: Optional[LineCallback] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    debug: bool = False,
+) -> int:
+    # execute
+    return await _terraform(
+        *lib.terraform_command.get_output_args(
+            state_file_path=state_file_path,
+            target_name=target_name,
+        ),
+        terraform_dir=terraform_dir_path,
+        working_dir=working_dir_path,
+        output_file=output_file_path,
+        on_stderr_line=on_stderr_line,
+        semaphore=semaphore,
+        debug=debug,
+    )
@@ -0,0 +1,235 @@
+# stdlib
+import os
+import subprocess
+from typing import Any, Optional
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+DETAILED_EXITCODE_ARG = "-detailed-exitcode"
+# return codes of commands run with -detailed-exitcode
+NO_CHANGES_RETURN_CODE = 0
+CHANGES_RETURN_CODE = 2
+
+# env vars every terraform process gets on top of this process's own, such
+# as the profiler's log capture, kept out of os.environ so nothing else in
+# this process sees them
+_process_env_overrides: dict[str, str] = {}
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# TerraformNoChangesError
+# =============================================================================
+class TerraformNoChangesError(subprocess.CalledProcessError):
+    pass
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# get_process_args
+# =============================================================================
+def get_process_args(
+    terraform_bin_file_path: str,
+    args: tuple[str, ...],
+    terraform_dir: str = ".",
+) -> list[str]:
+    if not terraform_dir:
+        terraform_dir = "."
+    return [terraform_bin_file_path, f"-chdir={terraform_dir}", *args]
+
+
+# =============================================================================
+# get_process_env
+# =============================================================================
+def get_process_env(plugin_cache_dir: str = "") -> dict[str, str]:
+    # each process gets its own environment, so runs in one process never
+    # see each other's plugin cache
+    env = dict(os.environ)
+    env.update(_process_env_overrides)
+    # force 'TF_IN_AUTOMATION'
+    env["TF_IN_AUTOMATION"] = "1"
+    if plugin_cache_dir:
+        env["TF_PLUGIN_CACHE_DIR"] = plugin_cache_dir
+    return env
+
+
+# =============================================================================
+# get_process_env_overrides
+# =============================================================================
+def get_process_env_overrides() -> dict[str, str]:
+    return dict(_process_env_overrides)
+
+
+# =============================================================================
+# set_process_env_overrides
+# =============================================================================
+def set_process_env_overrides(overrides: dict[str, str]) -> None:
+    global _process_env_overrides
+    # replaced rather than changed, so a process started on another thread
+    # gets either the old overrides or the new ones
+    _process_env_overrides = dict(overrides)
+
+
+# =============================================================================
+# get_masked_args
+# =============================================================================
+def get_masked_args(
+    process_args: list[str],
+    redaction_filter: Any = None,
+    debug: bool = False,
+) -> list[str]:
+    # mask args if we're not in debug
+    if not debug:
+        return process_args[:1]
+    if redaction_filter:
+        return [redaction_filter.redact(arg) for arg in process_args]
+    return process_args
+
+
+# =============================================================================
+# check_return_code
+# =============================================================================
+def check_return_code(
+    return_code: int,
+    args: tuple[str, ...],
+    masked_args: list[str],
+    error_on_no_changes: bool = True,
+) -> None:
+    # check if we're using detailed exit codes
+    if DETAILED_EXITCODE_ARG in [arg.lower() for arg in args]:
+        # 2 == success, with changes
+        if return_code == CHANGES_RETURN_CODE:
+            return
+        # 0 == success, no changes
+        if return_code == NO_CHANGES_RETURN_CODE:
+            if error_on_no_changes:
+                # raise a custom exception
+                raise TerraformNoChangesError(return_code, masked_args)
+            return
+    elif return_code == 0:
+        return
+    # raise a standard exception
+    raise subprocess.CalledProcessError(return_code, masked_args)
+
+
+# =============================================================================
+# get_init_args
+# =============================================================================
+def get_init_args(
+    backend_config_vars: Optional[dict[str, Any]] = None,
+    backend: bool = True,
+) -> list[str]:
+    terraform_command_args = ["init", "-input=false"]
+    if not backend:
+        # only install providers and modules
+        terraform_command_args.append("-backend=false")
+    # set backend config values
+    if backend_config_vars:
+        for key, val in backend_config_vars.items():
+            terraform_command_args.append(f"-backend-config={key}={val}")
+    return terraform_command_args
+
+
+# =============================================================================
+# get_plan_args
+# =============================================================================
+def get_plan_args(
+    state_file_path: str = "",
+    create_plan_file: bool = False,
+    plan_file_path: str = "",
+    destroy: bool = False,
+    var_file_paths: Optional[list[str]] = None,
+    refresh_only: bool = False,
+) -> list[str]:
+    terraform_command_args = ["plan", "-input=false", DETAILED_EXITCODE_ARG]
+    if state_file_path:
+        # specify state file
+        terraform_command_args.append(f"-state={state_file_path}")
+    if create_plan_file:
+        # creating a plan file
+        terraform_command_args.append(f"-out={plan_file_path}")
+    for var_file_path in var_file_paths or []:
+        terraform_command_args.append(f"-var-file={var_file_path}")
+    if destroy:
+        # creating a destroy plan
+        terraform_command_args.append("-destroy")
+    if refresh_only:
+        # only compare the state with the real infrastructure
+        terraform_command_args.append("-refresh-only")
+    return terraform_command_args
+
+
+# =============================================================================
+# get_apply_args
+# =============================================================================
+def get_apply_args(
+    terraform_dir_path: str = ".",
+    state_file_path: str = "",
+    plan_file_path: str = "",
+    var_file_paths: Optional[list[str]] = None,
+) -> tuple[list[str], str]:
+    # returns the args, and the terraform dir to run them against
+    terraform_command_args = ["apply", "-input=false"]
+    if plan_file_path:
+        # target plan file if using a plan file
+        terraform_dir_path = plan_file_path
+    else:
+        # auto approve if not using a plan file
+        terraform_command_args.append("-auto-approve")
+    if state_file_path:
+        # specify state file
+        terraform_command_args.append(f"-state={state_file_path}")
+    for var_file_path in var_file_paths or []:
+        terraform_command_args.append(f"-var-file={var_file_path}")
+    return terraform_command_args, terraform_dir_path
+
+
+# =============================================================================
+# get_show_args
+# =============================================================================
+def get_show_args(plan_file_path: str, json_output: bool = False) -> list[str]:
+    terraform_command_args = ["show"]
+    if json_output:
+        # machine readable output
+        terraform_command_args.append("-json")
+    terraform_command_args.append(plan_file_path)
+    return terraform_command_args
+
+
+# =============================================================================
+# get_output_args
+# =============================================================================
+def get_output_args(
+    state_file_path: str = "",
+    target_name: str = "",
+) -> list[str]:
+    terraform_command_args = ["output", "-json"]
+    if state_file_path:
+        # specify state file
+        terraform_command_args.append(f"-state={state_file_path}")
+    if target_name:
+        # specify target
+        terraform_command_args.append(target_name)
+    return terraform_command_args
+
+
+# =============================================================================
+# get_state_pull_args
+# =============================================================================
+def get_state_pull_args() -> list[str]:
+    # the latest state, as json, from whichever backend is configured
+    return ["state", "pull"]
@@ -1,5 +1,6 @@
 # stdlib
-import distutils.dir_util
+import atexit
+import concurrent.futures
 import json
 import os
 import shutil
@@ -9,7 +10,17 @@ import time
 from typing import Any, Optional
 
 # local
+import lib.archive
+import lib.chunk_store
+import lib.ignore
+import lib.plan_summary
+import lib.run_stats
+import lib.staging
+import lib.state_diff
+import lib.state_export
 import lib.terraform
+import lib.trace
+import lib.work_dir
 
 # =============================================================================
 #
@@ -23,7 +34,9 @@ AUX_INPUT_PATH_KEY = "PATH"
 AUX_INPUT_NAME_KEY = "NAME"
 BACKEND_FILE_NAME = "backend.tf"
 BACKEND_TYPE_VAR = "TF_BACKEND_TYPE"
+LOCAL_BACKEND_TYPE = "local"
 BACKEND_CONFIG_VAR_PREFIX = "TF_BACKEND_CONFIG_"
+WORKSPACE_VAR = "TF_WORKSPACE"
 TERRAFORM_WORK_DIR = "/tmp/tfwork"
 TERRAFORM_DIR_NAME = "terraform"
 TERRAFORM_PLUGIN_CACHE_DIR_NAME = ".tfcache"
@@ -32,7 +45,24 @@ TERRAFORM_PLAN_FILE_NAME = ".tfplan"
 TERRAFORM_STATE_FILE_NAME = "terraform.tfstate"
 TERRAFORM_OUTPUT_FILE_NAME = "tf-output.json"
 TERRAFORM_OUTPUT_FILE_SUFFIX = ".json"
-TERRAFORM_BACKUP_STATE_FILE_NAME = f"{TERRAFORM_STATE_FILE_NAME}.backup"
+# terraform backs up a state file beside it, with this suffix
+TERRAFORM_BACKUP_FILE_SUFFIX = ".backup"
+TERRAFORM_BACKUP_STATE_FILE_NAME = (
+    f"{TERRAFORM_STATE_FILE_NAME}{TERRAFORM_BACKUP_FILE_SUFFIX}"
+)
+ARCHIVE_FILE_SUFFIX = ".tar.gz"
+# plan files only work from the absolute path they were created in, so
+# archives created outside of TERRAFORM_WORK_DIR record it
+ARCHIVE_WORK_DIR_KEY = "work_dir"
+# where archives written before archives were reproducible recorded it
+ARCHIVE_WORK_DIR_PAX_HEADER = "CONCOURSE_TERRAFORM.work_dir"
+
+# plugin cache exports run alongside terraform, on a single worker so they
+# never overlap, and are waited on at exit
+_plugin_cache_export_executor: Optional[
+    concurrent.futures.ThreadPoolExecutor
+] = None
+_plugin_cache_exports: list[concurrent.futures.Future] = []
 
 
 # =============================================================================
@@ -77,23 +107,86 @@ def _prep_terraform_dir_path(
 # =============================================================================
 # _copy_terraform_dir
 # =============================================================================
-def _copy_terraform_dir(source: str, destination: str) -> None:
-    distutils.dir_util._path_created = {}
-    # preserving symlinks since terraform plan archives contain them
-    distutils.dir_util.copy_tree(source, destination, preserve_symlinks=1)
+def _copy_terraform_dir(
+    source: str,
+    destination: str,
+    ignore_file_name: str = "",
+    staging_mode: str = lib.staging.COPY,
+) -> None:
+    with lib.trace.span(
+        "_copy_terraform_dir",
+        "terraform_dir",
+        source=source,
+        destination=destination,
+    ):
+        ignore_matcher = None
+        if ignore_file_name:
+            ignore_matcher = lib.ignore.load_ignore_file(
+                os.path.join(source, ignore_file_name)
+            )
+        # traced copies go file by file, so large files show up in the trace
+        if (
+            not ignore_matcher
+            and staging_mode == lib.staging.COPY
+            and not lib.trace.is_enabled()
+        ):
+            copied_bytes = 0
+
+            def copy_file(source_path: str, destination_path: str) -> str:
+                nonlocal copied_bytes
+                copied_bytes += os.path.getsize(source_path)
+                return shutil.copy2(source_path, destination_path)
+
+            # preserving symlinks since terraform plan archives contain them
+            shutil.copytree(
+                source,
+                destination,
+                symlinks=True,
+                copy_function=copy_file,
+                dirs_exist_ok=True,
+            )
+            lib.run_stats.add_count(
+                lib.run_stats.COPIED_BYTES_COUNT,
+                copied_bytes,
+            )
+            return
+        skipped_bytes = lib.staging.stage_tree(
+            source,
+            destination,
+            staging_mode=staging_mode,
+            ignore_matcher=ignore_matcher,
+        )
+        if ignore_matcher:
+            print(
+                f"skipped {skipped_bytes} bytes of ignored files in: {source}"
+            )
+
+
+# =============================================================================
+# _get_state_dir
+# =============================================================================
+def _get_state_dir(terraform_dir: str, terraform_dir_path: str = "") -> str:
+    # terraform keeps local state, and resolves -state, in the dir it runs in
+    return os.path.join(terraform_dir, terraform_dir_path)
 
 
 # =============================================================================
 # _import_state_file_to_terraform_dir
 # =============================================================================
 def _import_state_file_to_terraform_dir(
-    state_file_path: str, terraform_dir: str
+    state_file_path: str,
+    terraform_dir: str,
+    terraform_dir_path: str = "",
 ) -> str:
     destination_file_path = os.path.join(
-        terraform_dir,
+        _get_state_dir(terraform_dir, terraform_dir_path),
         TERRAFORM_STATE_FILE_NAME,
     )
-    shutil.copyfile(state_file_path, destination_file_path)
+    # check the file against its export manifest, if it has one
+    lib.state_export.verify_state_file(state_file_path)
+    with lib.state_export.open_state_file(state_file_path) as state_file:
+        with open(destination_file_path, "wb") as destination_file:
+            shutil.copyfileobj(state_file, destination_file)
     print(f"imported state file {state_file_path} to: {destination_file_path}")
     return TERRAFORM_STATE_FILE_NAME
 
@@ -101,42 +194,58 @@ def _import_state_file_to_terraform_dir(
 # =============================================================================
 # _export_state_files_from_terraform_dir
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def _export_state_files_from_terraform_dir(
     terraform_dir: str,
     state_output_dir: str,
+    terraform_dir_path: str = "",
+    compress: bool = False,
 ) -> None:
-    # create output dir, if needed
-    if not os.path.isdir(state_output_dir):
-        os.makedirs(state_output_dir)
-    # format paths to state files
-    source_state_file_path = os.path.join(
-        terraform_dir,
-        TERRAFORM_STATE_FILE_NAME,
-    )
-    source_backup_state_file_path = os.path.join(
-        terraform_dir,
-        TERRAFORM_BACKUP_STATE_FILE_NAME,
-    )
-    destination_state_file_path = os.path.join(
-        state_output_dir,
-        TERRAFORM_STATE_FILE_NAME,
-    )
-    destination_backup_state_file_path = os.path.join(
-        state_output_dir,
-        TERRAFORM_BACKUP_STATE_FILE_NAME,
+    with lib.run_stats.phase("state_export"):
+        lib.state_export.export_state_files(
+            _get_state_dir(terraform_dir, terraform_dir_path),
+            state_output_dir,
+            compress=compress,
+        )
+
+
+# =============================================================================
+# _diff_state_files_in_terraform_dir
+# =============================================================================
+@lib.trace.traced("terraform_dir")
+def _diff_state_files_in_terraform_dir(
+    terraform_dir: str,
+    state_output_dir: str,
+    terraform_dir_path: str = "",
+    state_file_path: str = "",
+) -> bool:
+    # the state applied, and exported, from the dir terraform runs in
+    state_file_path = os.path.join(
+        _get_state_dir(terraform_dir, terraform_dir_path),
+        state_file_path or TERRAFORM_STATE_FILE_NAME,
     )
-    # copy state files, if found
-    if os.path.isfile(source_state_file_path):
-        shutil.copyfile(source_state_file_path, destination_state_file_path)
-        print(f"exported state file to: {destination_state_file_path}")
-    if os.path.isfile(source_backup_state_file_path):
-        shutil.copyfile(
-            source_backup_state_file_path,
-            destination_backup_state_file_path,
+    # a remote backend leaves no local state, which would diff as no changes
+    backend_type = _get_backend_type_from_environment()
+    if backend_type and backend_type != LOCAL_BACKEND_TYPE:
+        print(
+            "[warning] skipping state diff, the state is kept by the "
+            f"{backend_type} backend"
         )
+        return False
+    if not os.path.isfile(state_file_path):
         print(
-            f"exported backup state file {destination_backup_state_file_path}",
+            f"[warning] skipping state diff, no local state: {state_file_path}"
         )
+        return False
+    # the backup holds the state from before the apply
+    with lib.run_stats.phase("state_diff"):
+        counts = lib.state_diff.write_state_diff(
+            f"{state_file_path}{TERRAFORM_BACKUP_FILE_SUFFIX}",
+            state_file_path,
+            state_output_dir,
+        )
+    lib.run_stats.add_resource_counts(counts)
+    return True
 
 
 # =============================================================================
@@ -204,27 +313,138 @@ def _get_archive_version(
 
 
 # =============================================================================
-# _create_terraform_dir_archive
+# _get_terraform_dir_archive_file_path
 # =============================================================================
-def _create_terraform_dir_archive(
-    terraform_dir: str, output_dir: str, version: str, debug: bool = False
+def _get_terraform_dir_archive_file_path(
+    output_dir: str,
+    version: str,
+    suffix: str = ARCHIVE_FILE_SUFFIX,
 ) -> str:
-    archive_file_name = f"terraform-{version}.tar.gz"
+    archive_file_name = f"terraform-{version}{suffix}"
     archive_file_path = os.path.join(output_dir, archive_file_name)
-    with tarfile.open(archive_file_path, "x:gz") as archive_file:
-        if debug:
-            archive_file.debug = 3
-            print(f"[debug] creating terraform archive: {archive_file_path}")
-        archive_file.add(terraform_dir, TERRAFORM_DIR_NAME)
-    if debug:
+    # never overwrite an existing archive
+    if os.path.exists(archive_file_path):
+        raise FileExistsError(f"archive already exists: {archive_file_path}")
+    return archive_file_path
+
+
+# =============================================================================
+# _get_terraform_dir_archive_metadata
+# =============================================================================
+def _get_terraform_dir_archive_metadata(terraform_dir: str) -> dict[str, Any]:
+    metadata = {}
+    terraform_work_dir = os.path.dirname(os.path.abspath(terraform_dir))
+    if terraform_work_dir != TERRAFORM_WORK_DIR:
+        metadata[ARCHIVE_WORK_DIR_KEY] = terraform_work_dir
+    return metadata
+
+
+# =============================================================================
+# _get_terraform_dir_archive_ignore_matcher
+# =============================================================================
+def _get_terraform_dir_archive_ignore_matcher(
+    terraform_dir: str,
+) -> Optional[lib.ignore.IgnoreMatcher]:
+    return lib.ignore.load_ignore_file(
+        os.path.join(terraform_dir, lib.ignore.ARCHIVE_IGNORE_FILE_NAME)
+    )
+
+
+# =============================================================================
+# _finish_terraform_dir_archive
+# =============================================================================
+def _finish_terraform_dir_archive(
+    archive_file_path: str,
+    checksum: str,
+    content_naming: bool = False,
+    debug: bool = False,
+) -> str:
+    lib.run_stats.add_count(
+        lib.run_stats.ARCHIVE_BYTES_COUNT,
+        os.path.getsize(archive_file_path),
+    )
+    chunked = archive_file_path.endswith(lib.archive.CHUNK_MANIFEST_SUFFIX)
+    if not chunked:
+        lib.run_stats.add_count(
+            lib.run_stats.ARCHIVE_UNCOMPRESSED_BYTES_COUNT,
+            lib.archive.get_uncompressed_size(archive_file_path),
+        )
+    if content_naming:
+        # identical plans get identical names, as well as identical bytes
+        suffix = (
+            lib.archive.CHUNK_MANIFEST_SUFFIX
+            if chunked
+            else ARCHIVE_FILE_SUFFIX
+        )
+        content_file_path = os.path.join(
+            os.path.dirname(archive_file_path),
+            f"terraform-{checksum}{suffix}",
+        )
+        os.replace(archive_file_path, content_file_path)
+        archive_file_path = content_file_path
+    if debug and not chunked:
         with tarfile.open(archive_file_path, "r:gz") as archive_file:
             archive_file.debug = 3
             print(f"[debug] terraform archive contents: {archive_file_path}")
             archive_file.list()
     print(f"wrote archive to: {archive_file_path}")
+    lib.archive.write_archive_manifest(archive_file_path, checksum)
     return archive_file_path
 
 
+# =============================================================================
+# _create_terraform_dir_archive
+# =============================================================================
+@lib.trace.traced("terraform_dir")
+def _create_terraform_dir_archive(
+    terraform_dir: str,
+    output_dir: str,
+    version: str,
+    content_naming: bool = False,
+    debug: bool = False,
+) -> str:
+    chunk_store_dir = lib.chunk_store.get_chunk_store_dir_from_environment()
+    archive_file_path = _get_terraform_dir_archive_file_path(
+        output_dir,
+        version,
+        suffix=(
+            lib.archive.CHUNK_MANIFEST_SUFFIX
+            if chunk_store_dir
+            else ARCHIVE_FILE_SUFFIX
+        ),
+    )
+    if debug:
+        print(f"[debug] creating terraform archive: {archive_file_path}")
+    metadata = _get_terraform_dir_archive_metadata(terraform_dir)
+    ignore_matcher = _get_terraform_dir_archive_ignore_matcher(terraform_dir)
+    with lib.run_stats.phase("archive"):
+        if chunk_store_dir:
+            # only the chunks missing from the store are written, and the
+            # output only holds the manifest listing them
+            checksum = lib.archive.create_chunked_archive(
+                terraform_dir,
+                archive_file_path,
+                TERRAFORM_DIR_NAME,
+                chunk_store_dir,
+                metadata=metadata,
+                ignore_matcher=ignore_matcher,
+            )
+        else:
+            checksum = lib.archive.create_archive(
+                terraform_dir,
+                archive_file_path,
+                TERRAFORM_DIR_NAME,
+                metadata=metadata,
+                ignore_matcher=ignore_matcher,
+            )
+    return _finish_terraform_dir_archive(
+        archive_file_path,
+        checksum,
+        content_naming=content_naming,
+        debug=debug,
+    )
+
+
 # =============================================================================
 # _get_archive_file_name
 # =============================================================================
@@ -232,7 +452,8 @@ def _get_archive_file_name(archive_input_dir: str) -> str:
     archive_files = [
         archive_file
         for archive_file in os.listdir(archive_input_dir)
-        if archive_file.endswith(".tar.gz")
+        if archive_file.endswith(ARCHIVE_FILE_SUFFIX)
+        or archive_file.endswith(lib.archive.CHUNK_MANIFEST_SUFFIX)
     ]
     if len(archive_files) == 0:
         raise FileNotFoundError(f"no archive file found at path: {archive_input_dir}")
@@ -245,6 +466,19 @@ def _get_archive_file_name(archive_input_dir: str) -> str:
         return str(archive_files[0])
 
 
+# =============================================================================
+# _get_archive_work_dir
+# =============================================================================
+def _get_archive_work_dir(archive_file_path: str) -> Optional[str]:
+    metadata = lib.archive.read_archive_metadata(archive_file_path)
+    if ARCHIVE_WORK_DIR_KEY in metadata:
+        return metadata[ARCHIVE_WORK_DIR_KEY]
+    if archive_file_path.endswith(lib.archive.CHUNK_MANIFEST_SUFFIX):
+        return None
+    with tarfile.open(archive_file_path, "r:gz") as archive_file:
+        return archive_file.pax_headers.get(ARCHIVE_WORK_DIR_PAX_HEADER)
+
+
 # =============================================================================
 # _print_directory_contents
 # =============================================================================
@@ -257,6 +491,7 @@ def _print_directory_contents(directory: str) -> None:
 # =============================================================================
 # _restore_terraform_dir_archive
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def _restore_terraform_dir_archive(
     terraform_dir: str, input_dir: str, debug: bool = False
 ) -> None:
@@ -264,24 +499,54 @@ def _restore_terraform_dir_archive(
     archive_file_name = _get_archive_file_name(input_dir)
     # get the archive file path
     archive_file_path = os.path.join(input_dir, archive_file_name)
-    # get a temporary directory to extract to
-    with tempfile.TemporaryDirectory() as extract_scratch_dir:
-        # extract to the temporary directory
-        with tarfile.open(archive_file_path, "r:gz") as archive_file:
-            if debug:
-                archive_file.debug = 3
-                print(f"[debug] extracting terraform archive: {archive_file_path}")
-            archive_file.extractall(path=extract_scratch_dir)
-        # get the extracted terraform dir path
-        extracted_terraform_dir = _get_terraform_dir(extract_scratch_dir)
-        # copy the extracted terraform dir to the terraform dir
-        _copy_terraform_dir(extracted_terraform_dir, terraform_dir)
+    with lib.run_stats.phase("restore"):
+        # get a temporary directory to extract to
+        with tempfile.TemporaryDirectory() as extract_scratch_dir:
+            # extract to the temporary directory
+            if archive_file_path.endswith(lib.archive.CHUNK_MANIFEST_SUFFIX):
+                if debug:
+                    print(
+                        "[debug] reassembling terraform archive: "
+                        f"{archive_file_path}"
+                    )
+                lib.archive.extract_chunked_archive(
+                    archive_file_path,
+                    extract_scratch_dir,
+                    store_dir=(
+                        lib.chunk_store.get_chunk_store_dir_from_environment()
+                        or ""
+                    ),
+                )
+            else:
+                if debug:
+                    print(
+                        "[debug] extracting terraform archive: "
+                        f"{archive_file_path}"
+                    )
+                lib.archive.extract_archive(
+                    archive_file_path,
+                    extract_scratch_dir,
+                    debug=debug,
+                )
+            # get the extracted terraform dir path
+            extracted_terraform_dir = _get_terraform_dir(extract_scratch_dir)
+            # copy the extracted terraform dir to the terraform dir
+            _copy_terraform_dir(extracted_terraform_dir, terraform_dir)
     if debug:
         print("[debug] extracted archive contents: ")
         _print_directory_contents(terraform_dir)
     print(f"restored archive {archive_file_path} to: {terraform_dir}")
 
 
+# =============================================================================
+# _get_terraform_work_dir_from_environment
+# =============================================================================
+def _get_terraform_work_dir_from_environment(size_paths: list[str]) -> str:
+    if lib.work_dir.is_isolated_from_environment():
+        return lib.work_dir.create_work_dir_from_environment(size_paths)
+    return TERRAFORM_WORK_DIR
+
+
 # =============================================================================
 # _get_backend_type_from_environment
 # =============================================================================
@@ -328,9 +593,11 @@ def _get_aux_inputs_from_environment() -> list[dict[str, Any]]:
 # =============================================================================
 # _copy_aux_inputs_to_terraform_dir
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def _copy_aux_inputs_to_terraform_dir(
     aux_inputs: list[dict[str, Any]],
     terraform_dir: str,
+    staging_mode: str = lib.staging.COPY,
 ) -> None:
     for aux_input in aux_inputs:
         aux_input_source_path: str = aux_input[AUX_INPUT_PATH_KEY]
@@ -341,7 +608,12 @@ def _copy_aux_inputs_to_terraform_dir(
             aux_input_dest_path = os.path.join(terraform_dir, aux_input_name)
         else:
             aux_input_dest_path = terraform_dir
-        _copy_terraform_dir(aux_input_source_path, aux_input_dest_path)
+        _copy_terraform_dir(
+            aux_input_source_path,
+            aux_input_dest_path,
+            ignore_file_name=lib.ignore.COPY_IGNORE_FILE_NAME,
+            staging_mode=staging_mode,
+        )
 
 
 # =============================================================================
@@ -361,21 +633,103 @@ def _get_plugin_cache_dir_from_environment() -> str:
 # =============================================================================
 # _import_plugin_cache_dir
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def _import_plugin_cache_dir(
     input_plugin_cache_dir: str,
     plugin_cache_dir: str,
 ) -> None:
-    _copy_terraform_dir(input_plugin_cache_dir, plugin_cache_dir)
+    # an earlier run's export may still be writing to the input
+    wait_for_plugin_cache_exports()
+    with lib.run_stats.phase("plugin_cache_import"):
+        _copy_terraform_dir(input_plugin_cache_dir, plugin_cache_dir)
+
+
+# =============================================================================
+# _get_provider_bundle_from_environment
+# =============================================================================
+def _get_provider_bundle_from_environment() -> Optional[str]:
+    # imported here, so runs without a bundle never load the bundle code
+    import lib.provider_bundle
+    return lib.provider_bundle.get_provider_bundle_from_environment()
+
+
+# =============================================================================
+# _unpack_provider_bundle
+# =============================================================================
+@lib.trace.traced("terraform_dir")
+def _unpack_provider_bundle(
+    provider_bundle_path: str,
+    plugin_cache_dir: str,
+    terraform_dir: str,
+    root_paths: list[str],
+) -> None:
+    # imported here, only runs given a bundle ever unpack one
+    import lib.provider_bundle
+    bundle_file_path = lib.provider_bundle.get_bundle_file_path(
+        provider_bundle_path
+    )
+    # packages are only trusted as far as the roots using them lock them
+    lock_file_paths = [
+        lock_file_path
+        for lock_file_path in (
+            os.path.join(
+                terraform_dir,
+                root_path,
+                lib.provider_bundle.LOCK_FILE_NAME,
+            )
+            for root_path in root_paths
+        )
+        if os.path.isfile(lock_file_path)
+    ]
+    if not lock_file_paths:
+        print(
+            "[warning] skipping provider bundle, no lock files in: "
+            f"{', '.join(root_paths)}"
+        )
+        return
+    with lib.run_stats.phase("provider_bundle_unpack"):
+        unpacked_count = lib.provider_bundle.unpack_provider_bundle(
+            bundle_file_path,
+            plugin_cache_dir,
+            lib.provider_bundle.get_locked_providers(lock_file_paths),
+        )
+    print(f"unpacked {unpacked_count} providers from: {bundle_file_path}")
 
 
 # =============================================================================
 # _export_plugin_cache_dir
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def _export_plugin_cache_dir(
     plugin_cache_dir: str,
     output_plugin_cache_dir: str,
 ) -> None:
-    _copy_terraform_dir(plugin_cache_dir, output_plugin_cache_dir)
+    with lib.run_stats.phase("plugin_cache_export"):
+        _copy_terraform_dir(plugin_cache_dir, output_plugin_cache_dir)
+
+
+# =============================================================================
+# _start_plugin_cache_export
+# =============================================================================
+def _start_plugin_cache_export(
+    plugin_cache_dir: str,
+    output_plugin_cache_dir: str,
+) -> None:
+    global _plugin_cache_export_executor
+    if _plugin_cache_export_executor is None:
+        _plugin_cache_export_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="plugin-cache-export",
+        )
+        # registered after the work dir's cleanup, so it runs before it
+        atexit.register(wait_for_plugin_cache_exports)
+    _plugin_cache_exports.append(
+        _plugin_cache_export_executor.submit(
+            _export_plugin_cache_dir,
+            plugin_cache_dir,
+            output_plugin_cache_dir,
+        )
+    )
 
 
 # =============================================================================
@@ -394,6 +748,103 @@ def _export_output_file(output_file_path: str, output_dir: str) -> None:
     print(f"exported output to: {dst_output_file_path}")
 
 
+# =============================================================================
+# _write_outputs_from_terraform_dir
+# =============================================================================
+@lib.trace.traced("terraform_dir")
+def _write_outputs_from_terraform_dir(
+    terraform_dir: str,
+    output_dir: str,
+    output_targets: Optional[dict[str, Any]] = None,
+    terraform_dir_path: str = "",
+    state_file_path: str = "",
+    debug: bool = False,
+) -> None:
+    # outputs are read in the root the state was written from
+    if output_targets:
+        # get a temporary file to write to
+        with tempfile.NamedTemporaryFile() as tf_output_temp_file:
+            # dump output(s) to temporary file
+            lib.terraform.output(
+                terraform_dir,
+                tf_output_temp_file.name,
+                terraform_dir_path=terraform_dir_path,
+                state_file_path=state_file_path,
+                debug=debug,
+            )
+            # read contents from temporary file
+            tf_output_file_contents = json.load(tf_output_temp_file)
+        # each to a file named after itself
+        for target_file, target_name in output_targets.items():
+            output_file_path = os.path.join(
+                terraform_dir,
+                target_file + TERRAFORM_OUTPUT_FILE_SUFFIX,
+            )
+            output_target_value = tf_output_file_contents[target_name]
+            # never write through a staged link into an input
+            if os.path.islink(output_file_path):
+                os.remove(output_file_path)
+            with open(output_file_path, "w", encoding="utf-8") as output_file:
+                json.dump(output_target_value, output_file)
+            _export_output_file(output_file_path, output_dir)
+    else:
+        # dump output(s) to default name
+        output_file_path = os.path.join(
+            terraform_dir,
+            TERRAFORM_OUTPUT_FILE_NAME,
+        )
+        lib.terraform.output(
+            terraform_dir,
+            output_file_path,
+            terraform_dir_path=terraform_dir_path,
+            state_file_path=state_file_path,
+            debug=debug,
+        )
+        _export_output_file(output_file_path, output_dir)
+
+
+# =============================================================================
+# _write_output_values
+# =============================================================================
+def _write_output_values(
+    output_values: dict[str, Any],
+    output_dir: str,
+    output_targets: Optional[dict[str, Any]] = None,
+) -> None:
+    # the files terraform output would have given, from values already read
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    if output_targets:
+        # each to a file named after itself
+        output_files = {
+            f"{target_file}{TERRAFORM_OUTPUT_FILE_SUFFIX}": (
+                output_values[target_name]
+            )
+            for target_file, target_name in output_targets.items()
+        }
+    else:
+        output_files = {TERRAFORM_OUTPUT_FILE_NAME: output_values}
+    for output_file_name, output_value in output_files.items():
+        output_file_path = os.path.join(output_dir, output_file_name)
+        with open(output_file_path, "w", encoding="utf-8") as output_file:
+            json.dump(output_value, output_file)
+        print(f"exported output to: {output_file_path}")
+
+
+# =============================================================================
+# _pull_terraform_state
+# =============================================================================
+def _pull_terraform_state(debug: bool = False) -> dict[str, Any]:
+    terraform_dir = init_terraform_dir(debug=debug)
+    with tempfile.NamedTemporaryFile() as state_temp_file:
+        lib.terraform.state_pull(
+            terraform_dir,
+            state_temp_file.name,
+            debug=debug,
+        )
+        return json.load(state_temp_file)
+
+
 # =============================================================================
 # _convert_output_var_file_into_var_file
 # =============================================================================
@@ -419,6 +870,7 @@ def _convert_output_var_file_into_var_file(
 # =============================================================================
 # _convert_and_import_output_var_files_to_terraform_dir
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def _convert_and_import_output_var_files_to_terraform_dir(
     output_var_files: dict[str, Any],
     terraform_dir: str,
@@ -440,35 +892,58 @@ def _convert_and_import_output_var_files_to_terraform_dir(
 
 
 # =============================================================================
-#
-# public functions
-#
-# =============================================================================
-
+# _stage_terraform_dir
 # =============================================================================
-# init_terraform_dir
-# =============================================================================
-def init_terraform_dir(
+@lib.trace.traced("terraform_dir")
+def _stage_terraform_dir(
     terraform_source_dir: str = "",
-    terraform_dir_path: str = "",
+    input_plugin_cache_dir: str = "",
     terraform_work_dir: str = "",
-    debug: bool = False,
 ) -> str:
+    # get aux inputs from environment
+    aux_inputs = _get_aux_inputs_from_environment()
     # default the work dir
     if not terraform_work_dir:
-        terraform_work_dir = TERRAFORM_WORK_DIR
+        terraform_work_dir = _get_terraform_work_dir_from_environment(
+            [
+                terraform_source_dir,
+                input_plugin_cache_dir,
+                *[aux_input[AUX_INPUT_PATH_KEY] for aux_input in aux_inputs],
+            ]
+        )
     # get path to terraform dir
     terraform_dir = _get_terraform_dir(terraform_work_dir)
     # prep the terraform dir
     _prep_terraform_dir(terraform_dir)
-    # optionally copy the terraform source dir into terraform dir
-    if terraform_source_dir:
-        _copy_terraform_dir(terraform_source_dir, terraform_dir)
-    # get aux inputs from environment
-    aux_inputs = _get_aux_inputs_from_environment()
-    # optionally copy aux inputs to terraform dir
-    if aux_inputs:
-        _copy_aux_inputs_to_terraform_dir(aux_inputs, terraform_dir)
+    # get the staging mode from environment
+    staging_mode = lib.staging.get_staging_mode_from_environment()
+    with lib.run_stats.phase("stage"):
+        # optionally copy the terraform source dir into terraform dir
+        if terraform_source_dir:
+            _copy_terraform_dir(
+                terraform_source_dir,
+                terraform_dir,
+                ignore_file_name=lib.ignore.COPY_IGNORE_FILE_NAME,
+                staging_mode=staging_mode,
+            )
+        # optionally copy aux inputs to terraform dir
+        if aux_inputs:
+            _copy_aux_inputs_to_terraform_dir(
+                aux_inputs,
+                terraform_dir,
+                staging_mode=staging_mode,
+            )
+    return terraform_dir
+
+
+# =============================================================================
+# _create_backend_file_from_environment
+# =============================================================================
+def _create_backend_file_from_environment(
+    terraform_dir: str,
+    terraform_dir_path: str = "",
+    debug: bool = False,
+) -> None:
     # get backend type from environment
     backend_type = _get_backend_type_from_environment()
     # optionally create a backend configuration
@@ -481,15 +956,81 @@ def init_terraform_dir(
         else:
             backend_file_dir = terraform_dir
         _create_backend_file(backend_type, backend_file_dir, debug=debug)
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# get_terraform_dir
+# =============================================================================
+def get_terraform_dir(terraform_work_dir: str = "") -> str:
+    # default the work dir, to the one created for this run if any
+    if not terraform_work_dir:
+        terraform_work_dir = (
+            lib.work_dir.get_current_work_dir() or TERRAFORM_WORK_DIR
+        )
+    return _get_terraform_dir(terraform_work_dir)
+
+
+# =============================================================================
+# wait_for_plugin_cache_exports
+# =============================================================================
+def wait_for_plugin_cache_exports() -> bool:
+    # the cache only speeds up later runs, so a failed export is reported
+    # rather than failing the command
+    exported = True
+    while _plugin_cache_exports:
+        try:
+            _plugin_cache_exports.pop(0).result()
+        except Exception as error:
+            print(f"[warning] could not export plugin cache: {error}")
+            exported = False
+    return exported
+
+
+# =============================================================================
+# init_terraform_dir
+# =============================================================================
+@lib.trace.traced("terraform_dir")
+def init_terraform_dir(
+    terraform_source_dir: str = "",
+    terraform_dir_path: str = "",
+    terraform_work_dir: str = "",
+    debug: bool = False,
+) -> str:
+    # check for input plugin cache dir
+    input_plugin_cache_dir = _get_plugin_cache_dir_from_environment()
+    terraform_dir = _stage_terraform_dir(
+        terraform_source_dir,
+        input_plugin_cache_dir=input_plugin_cache_dir,
+        terraform_work_dir=terraform_work_dir,
+    )
+    _create_backend_file_from_environment(
+        terraform_dir,
+        terraform_dir_path=terraform_dir_path,
+        debug=debug,
+    )
     # get any backend config values from environment
     backend_config_vars = _get_backend_config_from_environment()
     # get the plugin cache dir path
     plugin_cache_dir = _get_plugin_cache_dir(terraform_dir)
-    # check for input plugin cache dir
-    input_plugin_cache_dir = _get_plugin_cache_dir_from_environment()
     # optionally import the plugin cache dir into terraform plugin cache dir
     if input_plugin_cache_dir:
         _import_plugin_cache_dir(input_plugin_cache_dir, plugin_cache_dir)
+    # optionally unpack a provider bundle into the plugin cache dir, so
+    # terraform finds the locked providers there rather than downloading them
+    provider_bundle_path = _get_provider_bundle_from_environment()
+    if provider_bundle_path:
+        _unpack_provider_bundle(
+            provider_bundle_path,
+            plugin_cache_dir,
+            terraform_dir,
+            [terraform_dir_path or "."],
+        )
     # terraform init
     lib.terraform.init(
         terraform_dir,
@@ -498,20 +1039,23 @@ def init_terraform_dir(
         backend_config_vars=backend_config_vars,
         debug=debug,
     )
-    # optionally export the terraform plugin cache dir back to the input
+    # optionally export the terraform plugin cache dir back to the input,
+    # which only later runs need, so it is copied while terraform runs
     if input_plugin_cache_dir:
-        _export_plugin_cache_dir(plugin_cache_dir, input_plugin_cache_dir)
+        _start_plugin_cache_export(plugin_cache_dir, input_plugin_cache_dir)
     return terraform_dir
 
 
 # =============================================================================
 # archive_terraform_dir
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def archive_terraform_dir(
     terraform_dir: str,
     archive_output_dir: str,
     source_ref: Optional[str] = None,
     source_ref_file: Optional[str] = None,
+    content_naming: bool = False,
     debug: bool = False,
 ) -> str:
     # check terraform dir
@@ -529,14 +1073,76 @@ def archive_terraform_dir(
         terraform_dir,
         archive_output_dir,
         archive_version,
+        content_naming=content_naming,
         debug=debug,
     )
     return archive_file_path
 
 
+# =============================================================================
+# start_terraform_dir_archive
+# =============================================================================
+@lib.trace.traced("terraform_dir")
+def start_terraform_dir_archive(
+    terraform_dir: str,
+    archive_output_dir: str,
+    source_ref: Optional[str] = None,
+    source_ref_file: Optional[str] = None,
+    debug: bool = False,
+) -> lib.archive.PipelinedArchive:
+    # check terraform dir
+    if not terraform_dir:
+        raise ValueError("terraform_dir cannot be empty")
+    # check archive output dir
+    if not archive_output_dir:
+        raise ValueError("archive_output_dir cannot be empty")
+    archive_file_path = _get_terraform_dir_archive_file_path(
+        archive_output_dir,
+        _get_archive_version(
+            source_ref=source_ref,
+            source_ref_file=source_ref_file,
+        ),
+    )
+    if debug:
+        print(f"[debug] starting terraform archive: {archive_file_path}")
+    pipelined_archive = lib.archive.PipelinedArchive(
+        terraform_dir,
+        archive_file_path,
+        TERRAFORM_DIR_NAME,
+        metadata=_get_terraform_dir_archive_metadata(terraform_dir),
+        ignore_matcher=_get_terraform_dir_archive_ignore_matcher(
+            terraform_dir
+        ),
+    )
+    pipelined_archive.start()
+    return pipelined_archive
+
+
+# =============================================================================
+# finish_terraform_dir_archive
+# =============================================================================
+@lib.trace.traced("terraform_dir")
+def finish_terraform_dir_archive(
+    pipelined_archive: lib.archive.PipelinedArchive,
+    content_naming: bool = False,
+    debug: bool = False,
+) -> str:
+    # only the time spent waiting on the archive counts, the rest of it was
+    # created alongside terraform
+    with lib.run_stats.phase("archive"):
+        checksum = pipelined_archive.finish()
+    return _finish_terraform_dir_archive(
+        pipelined_archive.archive_file_path,
+        checksum,
+        content_naming=content_naming,
+        debug=debug,
+    )
+
+
 # =============================================================================
 # restore_terraform_dir
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def restore_terraform_dir(
     archive_input_dir: str,
     terraform_work_dir: Optional[str] = None,
@@ -545,9 +1151,30 @@ def restore_terraform_dir(
     # check archive input dir
     if not archive_input_dir:
         raise ValueError("archive_input_dir cannot be empty")
-    # default the work dir
+    # default the work dir, to the one the plan was created in
     if not terraform_work_dir:
-        terraform_work_dir = TERRAFORM_WORK_DIR
+        archive_work_dir = _get_archive_work_dir(
+            os.path.join(
+                archive_input_dir,
+                _get_archive_file_name(archive_input_dir),
+            )
+        )
+        if archive_work_dir:
+            # the path is read from the archive, so only a work dir within
+            # a configured work dir root is used, never any other dir
+            if not lib.work_dir.is_work_dir_path(
+                archive_work_dir,
+                lib.work_dir.get_work_dir_roots_from_environment(),
+            ):
+                raise ValueError(
+                    f"archive work dir is not a work dir: {archive_work_dir}"
+                )
+            terraform_work_dir = lib.work_dir.create_work_dir(
+                os.path.dirname(archive_work_dir),
+                work_dir=archive_work_dir,
+            )
+        else:
+            terraform_work_dir = TERRAFORM_WORK_DIR
     # get path to terraform dir
     terraform_dir = _get_terraform_dir(terraform_work_dir)
     # prep the terraform dir
@@ -564,6 +1191,7 @@ def restore_terraform_dir(
 # =============================================================================
 # plan_terraform_dir
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def plan_terraform_dir(
     terraform_dir: str,
     terraform_dir_path: str = "",
@@ -585,6 +1213,7 @@ def plan_terraform_dir(
         state_file_path = _import_state_file_to_terraform_dir(
             state_file_path,
             terraform_dir,
+            terraform_dir_path=terraform_dir_path,
         )
     # get the plugin cache path
     plugin_cache_dir = _get_plugin_cache_dir(terraform_dir)
@@ -623,12 +1252,17 @@ def plan_terraform_dir(
 # =============================================================================
 # apply_terraform_dir
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def apply_terraform_dir(
     terraform_dir: str,
     terraform_dir_path: str = "",
     output_var_files: Optional[dict[str, Any]] = None,
     state_file_path: str = "",
     state_output_dir: str = "",
+    compress_state_output: bool = False,
+    state_diff: bool = False,
+    output_dir: str = "",
+    output_targets: Optional[dict[str, Any]] = None,
     debug: bool = False,
 ) -> None:
     # check terraform dir
@@ -639,6 +1273,7 @@ def apply_terraform_dir(
         state_file_path = _import_state_file_to_terraform_dir(
             state_file_path,
             terraform_dir,
+            terraform_dir_path=terraform_dir_path,
         )
     # get the plugin cache path
     plugin_cache_dir = _get_plugin_cache_dir(terraform_dir)
@@ -664,21 +1299,46 @@ def apply_terraform_dir(
             state_file_path=state_file_path,
             debug=debug,
         )
+        if state_diff and state_output_dir:
+            _diff_state_files_in_terraform_dir(
+                terraform_dir,
+                state_output_dir,
+                terraform_dir_path=terraform_dir_path,
+                state_file_path=state_file_path,
+            )
+        if output_dir:
+            # read the outputs from the state just written, rather than
+            # initializing again in a separate output task
+            _write_outputs_from_terraform_dir(
+                terraform_dir,
+                output_dir,
+                output_targets=output_targets,
+                terraform_dir_path=terraform_dir_path,
+                state_file_path=state_file_path,
+                debug=debug,
+            )
     finally:
         if state_output_dir:
             _export_state_files_from_terraform_dir(
                 terraform_dir,
                 state_output_dir,
+                terraform_dir_path=terraform_dir_path,
+                compress=compress_state_output,
             )
 
 
 # =============================================================================
 # apply_terraform_plan
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def apply_terraform_plan(
     terraform_dir: str,
     state_output_dir: Optional[str] = None,
     plan_file_path: Optional[str] = None,
+    compress_state_output: bool = False,
+    state_diff: bool = False,
+    output_dir: str = "",
+    output_targets: Optional[dict[str, Any]] = None,
     debug: bool = False,
 ) -> None:
     # check terraform dir
@@ -696,17 +1356,30 @@ def apply_terraform_plan(
             plan_file_path=plan_file_path,
             debug=debug,
         )
+        if state_diff and state_output_dir:
+            _diff_state_files_in_terraform_dir(terraform_dir, state_output_dir)
+        if output_dir:
+            # read the outputs from the state just written, rather than
+            # initializing again in a separate output task
+            _write_outputs_from_terraform_dir(
+                terraform_dir,
+                output_dir,
+                output_targets=output_targets,
+                debug=debug,
+            )
     finally:
         if state_output_dir:
             _export_state_files_from_terraform_dir(
                 terraform_dir,
                 state_output_dir,
+                compress=compress_state_output,
             )
 
 
 # =============================================================================
 # show_terraform_plan
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def show_terraform_plan(
     terraform_dir: str,
     plan_file_path: Optional[str] = None,
@@ -721,9 +1394,199 @@ def show_terraform_plan(
     lib.terraform.show(terraform_dir, plan_file_path, debug=debug)
 
 
+# =============================================================================
+# summarize_terraform_plan
+# =============================================================================
+@lib.trace.traced("terraform_dir")
+def summarize_terraform_plan(
+    terraform_dir: str,
+    summary_output_dir: str,
+    plan_file_path: Optional[str] = None,
+    max_destroy: Optional[int] = None,
+    debug: bool = False,
+) -> dict[str, Any]:
+    # check terraform dir
+    if not terraform_dir:
+        raise ValueError("terraform_dir cannot be empty")
+    # check summary output dir
+    if not summary_output_dir:
+        raise ValueError("summary_output_dir cannot be empty")
+    # check plan file path
+    if not plan_file_path:
+        plan_file_path = TERRAFORM_PLAN_FILE_NAME
+    # get a temporary file to write to, the plan json is never held in memory
+    with tempfile.NamedTemporaryFile(suffix=".json") as plan_json_temp_file:
+        lib.terraform.show(
+            terraform_dir,
+            plan_file_path,
+            output_file_path=plan_json_temp_file.name,
+            debug=debug,
+        )
+        with open(
+            plan_json_temp_file.name,
+            "r",
+            encoding="utf-8",
+        ) as plan_json_file:
+            summary = lib.plan_summary.summarize_plan_json(plan_json_file)
+    lib.run_stats.add_resource_counts(summary["totals"])
+    print(lib.plan_summary.format_plan_summary(summary))
+    lib.plan_summary.write_plan_summary(summary, summary_output_dir)
+    if max_destroy is not None:
+        lib.plan_summary.check_destroy_threshold(summary, max_destroy)
+    return summary
+
+
+# =============================================================================
+# drift_terraform_dirs
+# =============================================================================
+@lib.trace.traced("terraform_dir")
+def drift_terraform_dirs(
+    terraform_source_dir: str,
+    root_paths: list[str],
+    report_output_dir: str,
+    concurrency: Optional[int] = None,
+    backend_rate_limit: Optional[float] = None,
+    debug: bool = False,
+) -> list[dict[str, Any]]:
+    # imported here, asyncio is only needed to check drift
+    import lib.drift
+    if concurrency is None:
+        concurrency = lib.drift.DEFAULT_CONCURRENCY
+    if backend_rate_limit is None:
+        backend_rate_limit = lib.drift.DEFAULT_BACKEND_RATE_LIMIT
+    # check root paths
+    if not root_paths:
+        raise ValueError("root_paths cannot be empty")
+    # check report output dir
+    if not report_output_dir:
+        raise ValueError("report_output_dir cannot be empty")
+    # check for input plugin cache dir
+    input_plugin_cache_dir = _get_plugin_cache_dir_from_environment()
+    # the source is staged once, and every root is checked within it
+    terraform_dir = _stage_terraform_dir(
+        terraform_source_dir,
+        input_plugin_cache_dir=input_plugin_cache_dir,
+    )
+    for root_path in root_paths:
+        _create_backend_file_from_environment(
+            terraform_dir,
+            terraform_dir_path=root_path,
+            debug=debug,
+        )
+    # get the plugin cache dir path, shared by every root
+    plugin_cache_dir = _get_plugin_cache_dir(terraform_dir)
+    # optionally import the plugin cache dir into terraform plugin cache dir
+    if input_plugin_cache_dir:
+        _import_plugin_cache_dir(input_plugin_cache_dir, plugin_cache_dir)
+    # optionally unpack a provider bundle into the plugin cache dir, so
+    # terraform finds the locked providers there rather than downloading them
+    provider_bundle_path = _get_provider_bundle_from_environment()
+    if provider_bundle_path:
+        _unpack_provider_bundle(
+            provider_bundle_path,
+            plugin_cache_dir,
+            terraform_dir,
+            root_paths,
+        )
+    with lib.run_stats.phase("drift"):
+        results = lib.drift.check_drift(
+            terraform_dir,
+            root_paths,
+            plugin_cache_dir,
+            backend_config_vars=_get_backend_config_from_environment(),
+            default_backend_type=_get_backend_type_from_environment() or "",
+            concurrency=concurrency,
+            backend_rate_limit=backend_rate_limit,
+            debug=debug,
+        )
+    # optionally export the terraform plugin cache dir back to the input
+    if input_plugin_cache_dir:
+        _export_plugin_cache_dir(plugin_cache_dir, input_plugin_cache_dir)
+    print(lib.drift.format_drift_report(results))
+    lib.drift.write_drift_report(results, report_output_dir)
+    lib.drift.check_drift_results(results)
+    return results
+
+
+# =============================================================================
+# bundle_terraform_providers
+# =============================================================================
+@lib.trace.traced("terraform_dir")
+def bundle_terraform_providers(
+    terraform_source_dir: str,
+    bundle_output_dir: str,
+    root_paths: Optional[list[str]] = None,
+    debug: bool = False,
+) -> str:
+    # imported here, only the bundle-providers command packs a bundle
+    import lib.provider_bundle
+    # check bundle output dir
+    if not bundle_output_dir:
+        raise ValueError("bundle_output_dir cannot be empty")
+    # check for input plugin cache dir
+    input_plugin_cache_dir = _get_plugin_cache_dir_from_environment()
+    # staged, so terraform init never writes to the source dir
+    terraform_dir = _stage_terraform_dir(
+        terraform_source_dir,
+        input_plugin_cache_dir=input_plugin_cache_dir,
+    )
+    lock_file_paths = lib.provider_bundle.find_lock_files(
+        terraform_dir,
+        root_paths=root_paths,
+    )
+    if not lock_file_paths:
+        raise ValueError(f"no lock files found in: {terraform_source_dir}")
+    # get the plugin cache dir path, shared by every root
+    plugin_cache_dir = _get_plugin_cache_dir(terraform_dir)
+    # optionally import the plugin cache dir into terraform plugin cache dir
+    if input_plugin_cache_dir:
+        _import_plugin_cache_dir(input_plugin_cache_dir, plugin_cache_dir)
+    with lib.run_stats.phase("provider_install"):
+        # roots locking providers the cache lacks install them into it,
+        # without touching their backends
+        for lock_file_path in lock_file_paths:
+            missing_providers = lib.provider_bundle.get_missing_providers(
+                lib.provider_bundle.get_locked_providers([lock_file_path]),
+                plugin_cache_dir,
+            )
+            if not missing_providers:
+                continue
+            lib.terraform.init(
+                terraform_dir,
+                terraform_dir_path=os.path.relpath(
+                    os.path.dirname(lock_file_path),
+                    terraform_dir,
+                ),
+                plugin_cache_dir_path=plugin_cache_dir,
+                backend=False,
+                debug=debug,
+            )
+    bundle_file_path = os.path.join(
+        bundle_output_dir,
+        lib.provider_bundle.BUNDLE_FILE_NAME,
+    )
+    with lib.run_stats.phase("provider_bundle"):
+        manifest = lib.provider_bundle.create_provider_bundle(
+            lib.provider_bundle.get_locked_providers(lock_file_paths),
+            plugin_cache_dir,
+            bundle_file_path,
+        )
+    for package in manifest["providers"]:
+        print(
+            f"bundled {package['source']} {package['version']} "
+            f"{package['platform']}: {package['hash']}"
+        )
+    print(f"wrote provider bundle to: {bundle_file_path}")
+    # optionally export the terraform plugin cache dir back to the input
+    if input_plugin_cache_dir:
+        _export_plugin_cache_dir(plugin_cache_dir, input_plugin_cache_dir)
+    return bundle_file_path
+
+
 # =============================================================================
 # output_terraform_dir
 # =============================================================================
+@lib.trace.traced("terraform_dir")
 def output_terraform_dir(
     terraform_dir: str,
     output_dir: str,
@@ -743,38 +1606,80 @@ def output_terraform_dir(
             state_file_path,
             terraform_dir,
         )
-    if output_targets:
-        # get a temporary file to write to
-        with tempfile.NamedTemporaryFile() as tf_output_temp_file:
-            # dump output(s) to temporary file
-            lib.terraform.output(
-                terraform_dir,
-                tf_output_temp_file.name,
-                state_file_path=state_file_path,
-                debug=debug,
-            )
-            # read contents from temporary file
-            tf_output_file_contents = json.load(tf_output_temp_file)
-        # each to a file named after itself
-        for target_file, target_name in output_targets.items():
-            output_file_path = os.path.join(
-                terraform_dir,
-                target_file + TERRAFORM_OUTPUT_FILE_SUFFIX,
-            )
-            output_target_value = tf_output_file_contents[target_name]
-            with open(output_file_path, "w", encoding="utf-8") as output_file:
-                json.dump(output_target_value, output_file)
-            _export_output_file(output_file_path, output_dir)
-    else:
-        # dump output(s) to default name
-        output_file_path = os.path.join(
-            terraform_dir,
-            TERRAFORM_OUTPUT_FILE_NAME,
+    _write_outputs_from_terraform_dir(
+        terraform_dir,
+        output_dir,
+        output_targets=output_targets,
+        state_file_path=state_file_path,
+        debug=debug,
+    )
+
+
+# =============================================================================
+# output_terraform_dir_from_state_cache
+# =============================================================================
+@lib.trace.traced("terraform_dir")
+def output_terraform_dir_from_state_cache(
+    output_dir: str,
+    state_cache_dir: str,
+    output_targets: Optional[dict[str, Any]] = None,
+    debug: bool = False,
+) -> None:
+    # imported here, only output ever reads through the state cache
+    import lib.state_cache
+    # check output_dir
+    if not output_dir:
+        raise ValueError("output_dir cannot be empty")
+    # check state cache dir
+    if not state_cache_dir:
+        raise ValueError("state_cache_dir cannot be empty")
+    # the cache is keyed by the backend the task configures
+    backend_type = _get_backend_type_from_environment()
+    if not backend_type:
+        raise ValueError(f"{BACKEND_TYPE_VAR} cannot be empty")
+    backend_config = _get_backend_config_from_environment()
+    workspace = os.environ.get(WORKSPACE_VAR, "")
+    cache_key = lib.state_cache.get_cache_key(
+        backend_type,
+        backend_config,
+        workspace=workspace,
+    )
+    cache_entry = lib.state_cache.read_cache_entry(state_cache_dir, cache_key)
+    # checked before the state is read, so a state written in between is
+    # only ever read again, never missed
+    with lib.run_stats.phase("state_cache_check"):
+        validator = lib.state_cache.get_backend_validator(
+            backend_type,
+            backend_config,
+            workspace=workspace,
         )
-        lib.terraform.output(
-            terraform_dir,
-            output_file_path,
-            state_file_path=state_file_path,
-            debug=debug,
+    if cache_entry and validator and cache_entry["validator"] == validator:
+        print(
+            f"state cache hit, serial {cache_entry['serial']}: "
+            f"{cache_entry['lineage']}"
         )
-        _export_output_file(output_file_path, output_dir)
+        _write_output_values(
+            cache_entry["outputs"],
+            output_dir,
+            output_targets=output_targets,
+        )
+        return
+    # backends without a validator, or whose check failed, are always read
+    state = _pull_terraform_state(debug=debug)
+    output_values = lib.state_cache.get_state_outputs(state)
+    lib.state_cache.write_cache_entry(
+        state_cache_dir,
+        cache_key,
+        {
+            "backend_type": backend_type,
+            "lineage": state.get("lineage"),
+            "serial": state.get("serial"),
+            "validator": validator,
+            "outputs": output_values,
+        },
+    )
+    _write_output_values(
+        output_values,
+        output_dir,
+        output_targets=output_targets,
+    )
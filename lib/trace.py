@@ -0,0 +1,202 @@
+# stdlib
+import contextlib
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Iterator, TypeVar, cast
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+# files copied or archived are traced from this size up, so a tree of many
+# small files does not bury the rest of the trace
+DEFAULT_FILE_SIZE_THRESHOLD = 1024 * 1024
+# named tracks, such as concurrent terraform processes, get their own thread
+# ids, well clear of real ones
+TRACK_THREAD_ID_START = 1 << 32
+COMPLETE_EVENT = "X"
+METADATA_EVENT = "M"
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# the events of this process, which runs a single command
+_enabled = False
+_file_size_threshold = DEFAULT_FILE_SIZE_THRESHOLD
+_events: list[dict[str, Any]] = []
+_thread_ids: dict[Any, int] = {}
+_track_thread_ids = itertools.count(TRACK_THREAD_ID_START)
+_lock = threading.Lock()
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _now
+# =============================================================================
+def _now() -> float:
+    # trace event timestamps are in microseconds
+    return time.perf_counter() * 1_000_000
+
+
+# =============================================================================
+# _get_thread_id
+# =============================================================================
+def _get_thread_id(track: str) -> int:
+    key = track or threading.get_ident()
+    with _lock:
+        if key in _thread_ids:
+            return _thread_ids[key]
+        if track:
+            thread_id = next(_track_thread_ids)
+            thread_name = track
+        else:
+            thread_id = threading.get_native_id()
+            thread_name = threading.current_thread().name
+        _thread_ids[key] = thread_id
+        # names the thread's track in the viewer
+        _events.append({
+            "name": "thread_name",
+            "ph": METADATA_EVENT,
+            "pid": os.getpid(),
+            "tid": thread_id,
+            "args": {"name": thread_name},
+        })
+        return thread_id
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# enable
+# =============================================================================
+def enable(file_size_threshold: int = DEFAULT_FILE_SIZE_THRESHOLD) -> None:
+    global _enabled, _file_size_threshold
+    _enabled = True
+    _file_size_threshold = file_size_threshold
+
+
+# =============================================================================
+# is_enabled
+# =============================================================================
+def is_enabled() -> bool:
+    return _enabled
+
+
+# =============================================================================
+# span
+# =============================================================================
+@contextlib.contextmanager
+def span(
+    name: str,
+    category: str,
+    track: str = "",
+    **args: Any,
+) -> Iterator[dict[str, Any]]:
+    # yields the span's args, so the caller can add what it only learns
+    # along the way, such as a process id or exit code
+    if not _enabled:
+        yield args
+        return
+    thread_id = _get_thread_id(track)
+    start_time = _now()
+    try:
+        yield args
+    finally:
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": COMPLETE_EVENT,
+            "ts": start_time,
+            "dur": _now() - start_time,
+            "pid": os.getpid(),
+            "tid": thread_id,
+            "args": args,
+        }
+        with _lock:
+            _events.append(event)
+
+
+# =============================================================================
+# file_span
+# =============================================================================
+@contextlib.contextmanager
+def file_span(
+    name: str,
+    category: str,
+    path: str,
+    size: int,
+) -> Iterator[None]:
+    if not _enabled or size < _file_size_threshold:
+        yield
+        return
+    with span(name, category, path=path, size=size):
+        yield
+
+
+# =============================================================================
+# traced
+# =============================================================================
+def traced(category: str) -> Callable[[F], F]:
+    # spans every call of the decorated function, named after it
+    def decorator(function: F) -> F:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _enabled:
+                return function(*args, **kwargs)
+            with span(function.__name__, category):
+                return function(*args, **kwargs)
+        return cast(F, wrapper)
+    return decorator
+
+
+# =============================================================================
+# get_events
+# =============================================================================
+def get_events() -> list[dict[str, Any]]:
+    with _lock:
+        return list(_events)
+
+
+# =============================================================================
+# write_trace
+# =============================================================================
+def write_trace(trace_file_path: str) -> None:
+    # check trace file path
+    if not trace_file_path:
+        raise ValueError("trace_file_path cannot be empty")
+    trace_dir = os.path.dirname(os.path.abspath(trace_file_path))
+    if not os.path.isdir(trace_dir):
+        os.makedirs(trace_dir)
+    # the json object format, which chrome://tracing and perfetto both load
+    with open(trace_file_path, "w", encoding="utf-8") as trace_file:
+        json.dump(
+            {"traceEvents": get_events(), "displayTimeUnit": "ms"},
+            trace_file,
+        )
+    print(f"wrote trace to: {trace_file_path}")
+
+
+# =============================================================================
+# reset
+# =============================================================================
+def reset() -> None:
+    global _enabled, _file_size_threshold
+    _enabled = False
+    _file_size_threshold = DEFAULT_FILE_SIZE_THRESHOLD
+    with _lock:
+        _events.clear()
+        _thread_ids.clear()
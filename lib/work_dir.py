@@ -0,0 +1,264 @@
+# stdlib
+import atexit
+import fcntl
+import os
+import re
+import shutil
+import tempfile
+from typing import Any, Iterable, Optional
+
+# local
+import lib.environment
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+WORK_DIR_ISOLATED_VAR = "TF_WORK_DIR_ISOLATED"
+WORK_DIR_MEMORY_BUDGET_VAR = "TF_WORK_DIR_MEMORY_BUDGET"
+WORK_DIR_TMPFS_ROOT_VAR = "TF_WORK_DIR_TMPFS_ROOT"
+WORK_DIR_DISK_ROOT_VAR = "TF_WORK_DIR_DISK_ROOT"
+DEFAULT_TMPFS_ROOT = "/dev/shm"
+DEFAULT_DISK_ROOT = "/tmp"
+WORK_DIR_PREFIX = "tfwork-"
+# the names mkdtemp gives work dirs, the only ones ever locked or removed
+WORK_DIR_NAME_PATTERN = re.compile(
+    rf"^{re.escape(WORK_DIR_PREFIX)}[a-z0-9_]+$"
+)
+LOCK_FILE_NAME = ".tfwork.lock"
+# room for .terraform modules, the plan file and state written during a run
+SIZE_ESTIMATE_HEADROOM = 1.5
+SIZE_SUFFIXES = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+SIZE_PATTERN = re.compile(r"^\s*(\d+)\s*([KMG]?)i?B?\s*$", re.IGNORECASE)
+
+# the work dir of this run, and its lock, held until exit. the dir is only
+# removed at exit when this run created it
+_current_work_dir: Optional[str] = None
+_current_work_dir_created = False
+_current_lock_file: Optional[Any] = None
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _get_tree_size
+# =============================================================================
+def _get_tree_size(path: str) -> int:
+    # symlinks are not followed, they cost nothing to copy
+    if os.path.islink(path):
+        return 0
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for dir_path, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(dir_path, name)
+            if not os.path.islink(file_path):
+                size += os.path.getsize(file_path)
+    return size
+
+
+# =============================================================================
+# _get_free_bytes
+# =============================================================================
+def _get_free_bytes(path: str) -> int:
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+# =============================================================================
+# _lock_work_dir
+# =============================================================================
+def _lock_work_dir(work_dir: str, blocking: bool = True) -> Optional[Any]:
+    lock_file = open(os.path.join(work_dir, LOCK_FILE_NAME), "a")
+    flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+    try:
+        fcntl.flock(lock_file.fileno(), flags)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    # the lock is released by the kernel when the process exits, however it
+    # exits, which is what marks a work dir as stale
+    return lock_file
+
+
+# =============================================================================
+# _remove_current_work_dir
+# =============================================================================
+def _remove_current_work_dir() -> None:
+    global _current_work_dir, _current_work_dir_created, _current_lock_file
+    if _current_work_dir and _current_work_dir_created:
+        shutil.rmtree(_current_work_dir, ignore_errors=True)
+    if _current_lock_file:
+        _current_lock_file.close()
+    _current_work_dir = None
+    _current_work_dir_created = False
+    _current_lock_file = None
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# parse_size
+# =============================================================================
+def parse_size(value: str) -> int:
+    size_match = SIZE_PATTERN.match(value)
+    if not size_match:
+        raise ValueError(f"invalid size: {value!r}")
+    number, suffix = size_match.groups()
+    return int(number) * SIZE_SUFFIXES[suffix.upper()]
+
+
+# =============================================================================
+# estimate_work_dir_size
+# =============================================================================
+def estimate_work_dir_size(paths: Iterable[str]) -> int:
+    size = sum(_get_tree_size(path) for path in paths if path)
+    return int(size * SIZE_ESTIMATE_HEADROOM)
+
+
+# =============================================================================
+# choose_work_dir_root
+# =============================================================================
+def choose_work_dir_root(
+    estimated_size: int,
+    memory_budget: Optional[int],
+    tmpfs_root: str = DEFAULT_TMPFS_ROOT,
+    disk_root: str = DEFAULT_DISK_ROOT,
+) -> str:
+    # memory is only used when the tree fits both the budget and the tmpfs
+    if memory_budget is not None and os.path.isdir(tmpfs_root):
+        if estimated_size <= min(memory_budget, _get_free_bytes(tmpfs_root)):
+            return tmpfs_root
+    return disk_root
+
+
+# =============================================================================
+# cleanup_stale_work_dirs
+# =============================================================================
+def cleanup_stale_work_dirs(root: str) -> list[str]:
+    removed_work_dirs: list[str] = []
+    if not os.path.isdir(root):
+        return removed_work_dirs
+    for name in sorted(os.listdir(root)):
+        work_dir = os.path.join(root, name)
+        if not name.startswith(WORK_DIR_PREFIX) or work_dir == (
+            _current_work_dir
+        ):
+            continue
+        if not os.path.isdir(work_dir) or os.path.islink(work_dir):
+            continue
+        # without a lock file the dir is still being created
+        if not os.path.isfile(os.path.join(work_dir, LOCK_FILE_NAME)):
+            continue
+        # a lock nobody holds means the run which owned it has ended
+        lock_file = _lock_work_dir(work_dir, blocking=False)
+        if not lock_file:
+            continue
+        try:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        finally:
+            lock_file.close()
+        removed_work_dirs.append(work_dir)
+        print(f"removed stale work dir: {work_dir}")
+    return removed_work_dirs
+
+
+# =============================================================================
+# create_work_dir
+# =============================================================================
+def create_work_dir(root: str, work_dir: str = "") -> str:
+    global _current_work_dir, _current_work_dir_created, _current_lock_file
+    if _current_work_dir:
+        # one work dir per run, shared by every step of the run
+        return _current_work_dir
+    if work_dir and not is_work_dir_path(work_dir, [root]):
+        raise ValueError(f"not a work dir in {root}: {work_dir}")
+    cleanup_stale_work_dirs(root)
+    if work_dir:
+        # e.g. restoring a plan archive, which must use its original path
+        created = not os.path.isdir(work_dir)
+        os.makedirs(work_dir, exist_ok=True)
+        # another run may still be using it, rather than wait on that run
+        lock_file = _lock_work_dir(work_dir, blocking=False)
+        if not lock_file:
+            raise ValueError(f"work dir is in use by another run: {work_dir}")
+        _current_work_dir_created = created
+        _current_lock_file = lock_file
+    else:
+        os.makedirs(root, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix=WORK_DIR_PREFIX, dir=root)
+        _current_work_dir_created = True
+        _current_lock_file = _lock_work_dir(work_dir)
+    _current_work_dir = work_dir
+    atexit.register(_remove_current_work_dir)
+    print(f"using work dir: {work_dir}")
+    return work_dir
+
+
+# =============================================================================
+# is_work_dir_path
+# =============================================================================
+def is_work_dir_path(work_dir: str, roots: Iterable[str]) -> bool:
+    # a dir named as create_work_dir names them, directly within a root
+    work_dir = os.path.abspath(work_dir)
+    if not WORK_DIR_NAME_PATTERN.match(os.path.basename(work_dir)):
+        return False
+    if os.path.islink(work_dir):
+        return False
+    return any(
+        os.path.dirname(work_dir) == os.path.abspath(root)
+        for root in roots
+        if root
+    )
+
+
+# =============================================================================
+# get_work_dir_roots_from_environment
+# =============================================================================
+def get_work_dir_roots_from_environment() -> list[str]:
+    return [
+        os.environ.get(WORK_DIR_TMPFS_ROOT_VAR, DEFAULT_TMPFS_ROOT),
+        os.environ.get(WORK_DIR_DISK_ROOT_VAR, DEFAULT_DISK_ROOT),
+    ]
+
+
+# =============================================================================
+# get_current_work_dir
+# =============================================================================
+def get_current_work_dir() -> Optional[str]:
+    return _current_work_dir
+
+
+# =============================================================================
+# is_isolated_from_environment
+# =============================================================================
+def is_isolated_from_environment() -> bool:
+    value = os.environ.get(WORK_DIR_ISOLATED_VAR)
+    if value:
+        return bool(lib.environment.strtobool(value))
+    return False
+
+
+# =============================================================================
+# create_work_dir_from_environment
+# =============================================================================
+def create_work_dir_from_environment(size_paths: Iterable[str]) -> str:
+    memory_budget = os.environ.get(WORK_DIR_MEMORY_BUDGET_VAR)
+    root = choose_work_dir_root(
+        estimate_work_dir_size(size_paths),
+        parse_size(memory_budget) if memory_budget else None,
+        tmpfs_root=os.environ.get(WORK_DIR_TMPFS_ROOT_VAR, DEFAULT_TMPFS_ROOT),
+        disk_root=os.environ.get(WORK_DIR_DISK_ROOT_VAR, DEFAULT_DISK_ROOT),
+    )
+    return create_work_dir(root)
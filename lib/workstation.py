@@ -0,0 +1,355 @@
+# stdlib
+import ctypes
+import os
+import select
+import shutil
+import struct
+import subprocess
+import time
+from typing import Any, Optional
+
+# local
+import lib.terraform_dir
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+DEFAULT_DEBOUNCE_SECONDS = 2.0
+STATUS_INTERVAL_SECONDS = 30
+POLL_INTERVAL_SECONDS = 1.0
+IGNORED_DIR_NAMES = (".git", ".terraform")
+# inotify flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+)
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+# =============================================================================
+#
+# classes
+#
+# =============================================================================
+
+# =============================================================================
+# PollingWatcher
+# =============================================================================
+class PollingWatcher:
+    # portable fallback which diffs (mtime, size) snapshots of the tree
+    def __init__(self, watch_dir: str) -> None:
+        self.watch_dir = watch_dir
+        self._snapshot = _snapshot_dir(watch_dir)
+
+    def wait_for_changes(self, timeout: float) -> set[str]:
+        deadline = time.monotonic() + timeout
+        while True:
+            snapshot = _snapshot_dir(self.watch_dir)
+            changes = {
+                path
+                for path in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(path) != self._snapshot.get(path)
+            }
+            self._snapshot = snapshot
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                return changes
+            time.sleep(min(POLL_INTERVAL_SECONDS, remaining))
+
+    def close(self) -> None:
+        pass
+
+
+# =============================================================================
+# InotifyWatcher
+# =============================================================================
+class InotifyWatcher:
+    # recursive inotify watch, so an idle session costs no cpu
+    def __init__(self, watch_dir: str) -> None:
+        self.watch_dir = watch_dir
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._watch_paths: dict[int, str] = {}
+        self._add_watches("")
+
+    def _add_watch(self, relative_path: str) -> None:
+        path = os.path.join(self.watch_dir, relative_path)
+        wd = self._libc.inotify_add_watch(
+            self._fd,
+            os.fsencode(path),
+            INOTIFY_WATCH_MASK,
+        )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self._watch_paths[wd] = relative_path
+
+    def _add_watches(self, relative_path: str) -> None:
+        root = os.path.join(self.watch_dir, relative_path)
+        for path, dirs, _ in os.walk(root):
+            dirs[:] = [name for name in dirs if name not in IGNORED_DIR_NAMES]
+            self._add_watch(os.path.relpath(path, self.watch_dir))
+
+    def _read_events(self) -> set[str]:
+        changes: set[str] = set()
+        try:
+            data = os.read(self._fd, INOTIFY_READ_SIZE)
+        except BlockingIOError:
+            return changes
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(
+                data,
+                offset,
+            )
+            offset += INOTIFY_EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+            if mask & IN_IGNORED:
+                self._watch_paths.pop(wd, None)
+                continue
+            if wd not in self._watch_paths or name in IGNORED_DIR_NAMES:
+                continue
+            relative_path = os.path.normpath(
+                os.path.join(self._watch_paths[wd], name)
+            )
+            if (mask & IN_ISDIR) and (mask & (IN_CREATE | IN_MOVED_TO)):
+                # watch new directories, their contents are synced as a whole
+                self._add_watches(relative_path)
+            changes.add(relative_path)
+        return changes
+
+    def wait_for_changes(self, timeout: float) -> set[str]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        return self._read_events()
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+# =============================================================================
+#
+# private functions
+#
+# =============================================================================
+
+# =============================================================================
+# _snapshot_dir
+# =============================================================================
+def _snapshot_dir(directory: str) -> dict[str, tuple[int, int]]:
+    snapshot: dict[str, tuple[int, int]] = {}
+    for path, dirs, files in os.walk(directory):
+        dirs[:] = [name for name in dirs if name not in IGNORED_DIR_NAMES]
+        for name in files:
+            file_path = os.path.join(path, name)
+            try:
+                file_stat = os.lstat(file_path)
+            except FileNotFoundError:
+                continue
+            snapshot[os.path.relpath(file_path, directory)] = (
+                file_stat.st_mtime_ns,
+                file_stat.st_size,
+            )
+    return snapshot
+
+
+# =============================================================================
+# _create_watcher
+# =============================================================================
+def _create_watcher(watch_dir: str) -> Any:
+    try:
+        return InotifyWatcher(watch_dir)
+    except (AttributeError, OSError) as error:
+        print(f"[workstation] inotify unavailable, polling instead: {error}")
+        return PollingWatcher(watch_dir)
+
+
+# =============================================================================
+# _wait_for_quiet_period
+# =============================================================================
+def _wait_for_quiet_period(watcher: Any, debounce_seconds: float) -> set[str]:
+    # keep collecting until no event arrives for a full debounce period,
+    # so an editor saving several files only triggers one plan
+    changes: set[str] = set()
+    while True:
+        new_changes = watcher.wait_for_changes(debounce_seconds)
+        if not new_changes:
+            return changes
+        changes.update(new_changes)
+
+
+# =============================================================================
+# _sync_file
+# =============================================================================
+def _sync_file(source_path: str, destination_path: str) -> str:
+    if os.path.islink(destination_path):
+        # staged as a link back to the source, which is already up to date
+        if os.path.realpath(destination_path) == os.path.realpath(
+            source_path
+        ):
+            return destination_path
+        os.remove(destination_path)
+    return shutil.copy2(source_path, destination_path)
+
+
+# =============================================================================
+# _sync_path
+# =============================================================================
+def _sync_path(source_path: str, destination_path: str) -> None:
+    if os.path.islink(source_path):
+        if os.path.isdir(destination_path) and not os.path.islink(
+            destination_path
+        ):
+            shutil.rmtree(destination_path)
+        elif os.path.lexists(destination_path):
+            os.remove(destination_path)
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        os.symlink(os.readlink(source_path), destination_path)
+    elif os.path.isdir(source_path):
+        shutil.copytree(
+            source_path,
+            destination_path,
+            symlinks=True,
+            copy_function=_sync_file,
+            dirs_exist_ok=True,
+        )
+    elif os.path.isfile(source_path):
+        if os.path.isdir(destination_path) and not os.path.islink(
+            destination_path
+        ):
+            shutil.rmtree(destination_path)
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        _sync_file(source_path, destination_path)
+    elif os.path.isdir(destination_path) and not os.path.islink(
+        destination_path
+    ):
+        shutil.rmtree(destination_path)
+    elif os.path.lexists(destination_path):
+        os.remove(destination_path)
+
+
+# =============================================================================
+# _sync_changes
+# =============================================================================
+def _sync_changes(
+    source_dir: str,
+    destination_dir: str,
+    relative_paths: set[str],
+) -> None:
+    for relative_path in sorted(relative_paths):
+        _sync_path(
+            os.path.join(source_dir, relative_path),
+            os.path.join(destination_dir, relative_path),
+        )
+        print(f"[workstation] synced: {relative_path}")
+
+
+# =============================================================================
+# _plan
+# =============================================================================
+def _plan(
+    terraform_dir: str,
+    terraform_dir_path: str = "",
+    output_var_files: Optional[dict[str, Any]] = None,
+    destroy: bool = False,
+    debug: bool = False,
+) -> None:
+    try:
+        lib.terraform_dir.plan_terraform_dir(
+            terraform_dir,
+            terraform_dir_path=terraform_dir_path,
+            output_var_files=output_var_files,
+            error_on_no_changes=False,
+            destroy=destroy,
+            debug=debug,
+        )
+    except subprocess.CalledProcessError as error:
+        # a failed plan is expected while iterating, keep the session alive
+        print(f"[workstation] plan failed with exit code {error.returncode}")
+
+
+# =============================================================================
+#
+# public functions
+#
+# =============================================================================
+
+# =============================================================================
+# run_session
+# =============================================================================
+def run_session(
+    terraform_source_dir: str,
+    timeout: float,
+    terraform_dir: str = "",
+    terraform_dir_path: str = "",
+    output_var_files: Optional[dict[str, Any]] = None,
+    destroy: bool = False,
+    debounce_seconds: float = DEFAULT_DEBOUNCE_SECONDS,
+    debug: bool = False,
+) -> None:
+    # check terraform source dir
+    if not terraform_source_dir:
+        raise ValueError("terraform_source_dir cannot be empty")
+    # reuse the initialized terraform dir, only init if it is missing
+    if not terraform_dir:
+        terraform_dir = lib.terraform_dir.get_terraform_dir()
+    if not os.path.isdir(terraform_dir):
+        terraform_dir = lib.terraform_dir.init_terraform_dir(
+            terraform_source_dir,
+            terraform_dir_path=terraform_dir_path,
+            debug=debug,
+        )
+    print(f"[workstation] watching {terraform_source_dir} for changes")
+    print(f"[workstation] timeout: {timeout} minutes")
+    end_time = time.monotonic() + (timeout * 60)
+    watcher = _create_watcher(terraform_source_dir)
+    try:
+        while True:
+            remaining = end_time - time.monotonic()
+            if remaining <= 0:
+                break
+            changes = watcher.wait_for_changes(
+                min(remaining, STATUS_INTERVAL_SECONDS)
+            )
+            if not changes:
+                print(
+                    f"[workstation] time remaining: {int(remaining)} seconds"
+                )
+                continue
+            changes.update(_wait_for_quiet_period(watcher, debounce_seconds))
+            _sync_changes(terraform_source_dir, terraform_dir, changes)
+            print("[workstation] re-running plan")
+            _plan(
+                terraform_dir,
+                terraform_dir_path=terraform_dir_path,
+                output_var_files=output_var_files,
+                destroy=destroy,
+                debug=debug,
+            )
+    finally:
+        watcher.close()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+# stdlib
+import gzip
+import io
+import json
+import os
+import tarfile
+import tempfile
+import unittest
+import unittest.mock
+
+# local
+import lib.archive
+import lib.chunk_store
+import lib.ignore
+import lib.terraform_dir
+import tests.common as common
+
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+TEST_TREE_FILES = {
+    'main.tf': '# main',
+    'b.tf': '# b',
+    '.terraform/plugins/terraform-provider-null': 'binary',
+}
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+def create_test_tree(root: str) -> str:
+    source_dir = common.create_test_tree(root, TEST_TREE_FILES)
+    provider_file_path = os.path.join(
+        source_dir, '.terraform', 'plugins', 'terraform-provider-null')
+    os.chmod(provider_file_path, 0o700)
+    os.symlink(
+        provider_file_path,
+        os.path.join(source_dir, '.terraform', 'provider-link'))
+    return source_dir
+
+
+def delete_during_walk(relative_path: str):
+    # deletes the path after it is listed, before it is archived, as
+    # terraform does with its lock info during a plan
+    iter_tree = lib.ignore.iter_tree
+
+    def iter_tree_deleting(*args, **kwargs):
+        for path, tree_relative_path, skipped_size in iter_tree(
+                *args, **kwargs):
+            if tree_relative_path == relative_path and os.path.exists(path):
+                os.remove(path)
+            yield path, tree_relative_path, skipped_size
+    return unittest.mock.patch('lib.ignore.iter_tree', iter_tree_deleting)
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_creating_archives(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.source_dir = create_test_tree(self.root.name)
+
+    def create_archive(self, name, metadata=None):
+        archive_file_path = os.path.join(self.root.name, name)
+        checksum = lib.archive.create_archive(
+            self.source_dir,
+            archive_file_path,
+            'terraform',
+            metadata=metadata)
+        return archive_file_path, checksum
+
+    def test_identical_trees_give_identical_bytes(self):
+        first_path, first_checksum = self.create_archive('first.tar.gz')
+        # touch every file, as a fresh checkout would
+        for name in ('main.tf', 'b.tf'):
+            os.utime(os.path.join(self.source_dir, name), (12345, 12345))
+        os.chmod(os.path.join(self.source_dir, 'main.tf'), 0o600)
+        second_path, second_checksum = self.create_archive('second.tar.gz')
+        self.assertEqual(first_checksum, second_checksum)
+        with open(first_path, 'rb') as first, \
+                open(second_path, 'rb') as second:
+            self.assertEqual(first.read(), second.read())
+        self.assertEqual(
+            first_checksum, lib.archive.get_file_checksum(first_path))
+
+    def test_changed_contents_change_the_checksum(self):
+        _, first_checksum = self.create_archive('first.tar.gz')
+        with open(os.path.join(self.source_dir, 'main.tf'), 'w') as f:
+            f.write('# changed')
+        _, second_checksum = self.create_archive('second.tar.gz')
+        self.assertNotEqual(first_checksum, second_checksum)
+
+    def test_gzip_header_has_no_name_or_timestamp(self):
+        archive_file_path, _ = self.create_archive('archive.tar.gz')
+        with open(archive_file_path, 'rb') as f:
+            header = f.read(10)
+        # FNAME flag
+        self.assertEqual(0, header[3] & 0x08)
+        self.assertEqual(b'\0\0\0\0', header[4:8])
+
+    def test_members_are_sorted_and_normalized(self):
+        archive_file_path, _ = self.create_archive('archive.tar.gz')
+        with tarfile.open(archive_file_path, 'r:gz') as archive_file:
+            members = archive_file.getmembers()
+        self.assertEqual(
+            [
+                'terraform',
+                'terraform/.terraform',
+                'terraform/.terraform/plugins',
+                'terraform/.terraform/plugins/terraform-provider-null',
+                'terraform/.terraform/provider-link',
+                'terraform/b.tf',
+                'terraform/main.tf',
+                lib.archive.CHECKSUMS_MEMBER_NAME,
+            ],
+            [member.name for member in members])
+        modes = {member.name: member.mode for member in members}
+        self.assertEqual(0o755, modes['terraform'])
+        self.assertEqual(0o644, modes['terraform/main.tf'])
+        self.assertEqual(
+            0o755,
+            modes['terraform/.terraform/plugins/terraform-provider-null'])
+        for member in members:
+            self.assertEqual(0, member.mtime)
+            self.assertEqual(0, member.uid)
+            self.assertEqual('', member.uname)
+        links = [member for member in members if member.issym()]
+        self.assertEqual(1, len(links))
+
+    def test_metadata_is_the_first_member(self):
+        archive_file_path, _ = self.create_archive(
+            'archive.tar.gz', metadata={'work_dir': '/tmp/tfwork-test'})
+        self.assertEqual(
+            {'work_dir': '/tmp/tfwork-test'},
+            lib.archive.read_archive_metadata(archive_file_path))
+        without_metadata_path, _ = self.create_archive('plain.tar.gz')
+        self.assertEqual(
+            {}, lib.archive.read_archive_metadata(without_metadata_path))
+
+    def test_files_deleted_during_the_walk_are_skipped(self):
+        with delete_during_walk('b.tf'):
+            self.create_archive('archive.tar.gz')
+        with tarfile.open(
+                os.path.join(self.root.name, 'archive.tar.gz'),
+                'r:gz') as archive_file:
+            self.assertNotIn('terraform/b.tf', archive_file.getnames())
+            self.assertIn('terraform/main.tf', archive_file.getnames())
+
+    def test_it_writes_a_manifest(self):
+        archive_file_path, checksum = self.create_archive('archive.tar.gz')
+        manifest_file_path = lib.archive.write_archive_manifest(
+            archive_file_path, checksum)
+        with open(manifest_file_path) as f:
+            manifest = json.load(f)
+        self.assertEqual('archive.tar.gz', manifest['file'])
+        self.assertEqual('sha256', manifest['algorithm'])
+        self.assertEqual(checksum, manifest['checksum'])
+        self.assertEqual(os.path.getsize(archive_file_path), manifest['size'])
+
+
+class when_pipelining_archives(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.source_dir = create_test_tree(self.root.name)
+        self.archive_file_path = os.path.join(self.root.name, 'archive.tar.gz')
+        self.pipelined_archive = lib.archive.PipelinedArchive(
+            self.source_dir,
+            self.archive_file_path,
+            'terraform',
+            metadata={'work_dir': '/tmp/tfwork-test'})
+
+    def test_an_unchanged_tree_gives_the_same_bytes(self):
+        self.pipelined_archive.start()
+        checksum = self.pipelined_archive.finish()
+        expected_checksum = lib.archive.create_archive(
+            self.source_dir,
+            os.path.join(self.root.name, 'expected.tar.gz'),
+            'terraform',
+            metadata={'work_dir': '/tmp/tfwork-test'})
+        self.assertEqual(expected_checksum, checksum)
+
+    def test_files_written_after_starting_are_added(self):
+        self.pipelined_archive.start()
+        with open(os.path.join(self.source_dir, '.tfplan'), 'w') as f:
+            f.write('plan')
+        with open(os.path.join(self.source_dir, 'main.tf'), 'w') as f:
+            f.write('# changed during the plan')
+        checksum = self.pipelined_archive.finish()
+        self.assertEqual(
+            checksum, lib.archive.get_file_checksum(self.archive_file_path))
+        extract_dir = os.path.join(self.root.name, 'extract')
+        with tarfile.open(self.archive_file_path, 'r:gz') as archive_file:
+            self.assertEqual(
+                lib.archive.METADATA_MEMBER_NAME, archive_file.next().name)
+            archive_file.extractall(extract_dir)
+        with open(os.path.join(extract_dir, 'terraform', '.tfplan')) as f:
+            self.assertEqual('plan', f.read())
+        with open(os.path.join(extract_dir, 'terraform', 'main.tf')) as f:
+            self.assertEqual('# changed during the plan', f.read())
+
+    def test_files_deleted_during_the_walk_are_skipped(self):
+        lock_info_path = os.path.join(
+            self.source_dir, '.terraform.tfstate.lock.info')
+        with open(lock_info_path, 'w') as f:
+            f.write('{}')
+        with delete_during_walk('.terraform.tfstate.lock.info'):
+            self.pipelined_archive.start()
+            self.pipelined_archive.finish()
+        with tarfile.open(self.archive_file_path, 'r:gz') as archive_file:
+            self.assertNotIn(
+                'terraform/.terraform.tfstate.lock.info',
+                archive_file.getnames())
+
+    def test_files_deleted_after_being_added_are_not_extracted(self):
+        lock_info_path = os.path.join(
+            self.source_dir, '.terraform.tfstate.lock.info')
+        with open(lock_info_path, 'w') as f:
+            f.write('{}')
+        self.pipelined_archive.start()
+        # wait for the walk which adds it
+        self.pipelined_archive._thread.join()
+        with delete_during_walk('.terraform.tfstate.lock.info'):
+            self.pipelined_archive.finish()
+        extract_dir = os.path.join(self.root.name, 'extract')
+        lib.archive.extract_archive(self.archive_file_path, extract_dir)
+        self.assertEqual(
+            ['.terraform', 'b.tf', 'main.tf'],
+            sorted(os.listdir(os.path.join(extract_dir, 'terraform'))))
+
+    def test_aborting_leaves_no_files(self):
+        self.pipelined_archive.start()
+        self.pipelined_archive.abort()
+        self.assertEqual(
+            ['source'], sorted(os.listdir(self.root.name)))
+
+
+class when_chunking_archives(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.source_dir = create_test_tree(self.root.name)
+        self.store_dir = os.path.join(self.root.name, 'store')
+
+    def create_chunked_archive(self, name):
+        manifest_file_path = os.path.join(
+            self.root.name, name + lib.archive.CHUNK_MANIFEST_SUFFIX)
+        checksum = lib.archive.create_chunked_archive(
+            self.source_dir,
+            manifest_file_path,
+            'terraform',
+            self.store_dir,
+            metadata={'work_dir': '/tmp/tfwork-test'})
+        return manifest_file_path, checksum
+
+    def test_it_stores_the_uncompressed_archive(self):
+        manifest_file_path, checksum = self.create_chunked_archive('first')
+        self.assertEqual(
+            checksum, lib.archive.get_file_checksum(manifest_file_path))
+        archive_file_path = os.path.join(self.root.name, 'archive.tar.gz')
+        lib.archive.create_archive(
+            self.source_dir,
+            archive_file_path,
+            'terraform',
+            metadata={'work_dir': '/tmp/tfwork-test'})
+        with gzip.open(archive_file_path, 'rb') as f:
+            expected_contents = f.read()
+        manifest = lib.archive.read_chunk_manifest(manifest_file_path)
+        chunk_reader = lib.chunk_store.ChunkReader(
+            self.store_dir, manifest['chunks'])
+        self.assertEqual(expected_contents, chunk_reader.read())
+        self.assertEqual(
+            {'work_dir': '/tmp/tfwork-test'},
+            lib.archive.read_archive_metadata(manifest_file_path))
+
+    def test_repeat_archives_only_store_changed_members(self):
+        self.create_chunked_archive('first')
+        with open(os.path.join(self.source_dir, 'b.tf'), 'w') as f:
+            f.write('# changed')
+        with unittest.mock.patch('builtins.print') as mocked_print:
+            manifest_file_path, _ = self.create_chunked_archive('second')
+        # only the changed member and the checksums, the rest are already
+        # stored
+        self.assertTrue(
+            mocked_print.call_args_list[0][0][0].startswith('stored 2 of '))
+        extract_dir = os.path.join(self.root.name, 'extract')
+        lib.archive.extract_chunked_archive(manifest_file_path, extract_dir)
+        with open(os.path.join(extract_dir, 'terraform', 'b.tf')) as f:
+            self.assertEqual('# changed', f.read())
+        self.assertTrue(os.path.islink(
+            os.path.join(extract_dir, 'terraform', '.terraform',
+                         'provider-link')))
+
+
+class when_verifying_archives(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.source_dir = create_test_tree(self.root.name)
+        self.archive_file_path = os.path.join(self.root.name, 'archive.tar.gz')
+        lib.archive.create_archive(
+            self.source_dir, self.archive_file_path, 'terraform')
+        self.extract_dir = os.path.join(self.root.name, 'extract')
+
+    def test_intact_archives_are_extracted(self):
+        lib.archive.extract_archive(self.archive_file_path, self.extract_dir)
+        with open(os.path.join(self.extract_dir, 'terraform', 'main.tf')) as f:
+            self.assertEqual('# main', f.read())
+
+    def test_it_lists_the_corrupt_members(self):
+        # swap the contents of two members, keeping their checksums
+        tampered_file_path = os.path.join(self.root.name, 'tampered.tar.gz')
+        with tarfile.open(self.archive_file_path, 'r:gz') as archive_file, \
+                tarfile.open(tampered_file_path, 'w:gz') as tampered_file:
+            for tarinfo in archive_file:
+                if not tarinfo.isreg():
+                    tampered_file.addfile(tarinfo)
+                    continue
+                contents = archive_file.extractfile(tarinfo).read()
+                if tarinfo.name == 'terraform/main.tf':
+                    contents = b'# b'
+                elif tarinfo.name == 'terraform/b.tf':
+                    contents = b'# main'
+                tarinfo.size = len(contents)
+                tampered_file.addfile(tarinfo, io.BytesIO(contents))
+        with self.assertRaises(lib.archive.ArchiveIntegrityError) as context:
+            lib.archive.extract_archive(tampered_file_path, self.extract_dir)
+        self.assertIn(
+            'terraform/b.tf, terraform/main.tf', str(context.exception))
+
+    def test_truncated_archives_are_rejected(self):
+        with open(self.archive_file_path, 'rb') as f:
+            contents = f.read()
+        with open(self.archive_file_path, 'wb') as f:
+            f.write(contents[:len(contents) // 2])
+        with self.assertRaises(lib.archive.ArchiveIntegrityError) as context:
+            lib.archive.extract_archive(
+                self.archive_file_path, self.extract_dir)
+        self.assertIn('truncated', str(context.exception))
+
+
+class when_archiving_terraform_dirs_by_content(unittest.TestCase):
+    def test_identical_plans_get_identical_names(self):
+        with tempfile.TemporaryDirectory() as root:
+            source_dir = create_test_tree(root)
+            archive_file_names = []
+            for name in ('first', 'second'):
+                archive_output_dir = os.path.join(root, name)
+                os.makedirs(archive_output_dir)
+                archive_file_path = lib.terraform_dir.archive_terraform_dir(
+                    source_dir,
+                    archive_output_dir,
+                    source_ref=name,
+                    content_naming=True)
+                archive_file_names.append(os.path.basename(archive_file_path))
+                self.assertEqual(
+                    ['archive-manifest.json', archive_file_names[-1]],
+                    sorted(os.listdir(archive_output_dir)))
+            self.assertEqual(archive_file_names[0], archive_file_names[1])
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# stdlib
+import os
+import subprocess
+import sys
+import unittest
+import unittest.mock
+
+# local
+import lib
+import lib.bootstrap
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+LIB_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(lib.__file__)))
+# generous ceilings, these catch accidental eager imports
+# rather than small fluctuations between machines
+BOOTSTRAP_IMPORT_BUDGET_US = 100000
+CLI_IMPORT_BUDGET_US = 250000
+BOOTSTRAP_LAZY_MODULES = [
+    'lib.cli',
+    'lib.commands',
+    'lib.terraform_dir',
+    'lib.terraform',
+    'lib.trusted_ca_certs',
+    'lib.consul_config',
+    'tarfile',
+    'distutils',
+]
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+# =============================================================================
+# get_import_times
+# =============================================================================
+def get_import_times(module_name: str) -> dict:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = LIB_ROOT_DIR
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        cwd=LIB_ROOT_DIR,
+        env=env,
+        check=True)
+    # lines look like:
+    # import time: self [us] | cumulative | imported package
+    import_times: dict = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        import_times[fields[2].strip()] = int(fields[1].strip())
+    return import_times
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_importing_bootstrap(unittest.TestCase):
+    def test_it_stays_within_the_import_time_budget(self):
+        import_times = get_import_times('lib.bootstrap')
+        self.assertLess(
+            import_times['lib.bootstrap'],
+            BOOTSTRAP_IMPORT_BUDGET_US)
+
+    def test_it_does_not_import_step_modules_eagerly(self):
+        import_times = get_import_times('lib.bootstrap')
+        for module_name in BOOTSTRAP_LAZY_MODULES:
+            self.assertNotIn(module_name, import_times)
+
+
+class when_importing_cli(unittest.TestCase):
+    def test_it_stays_within_the_import_time_budget(self):
+        import_times = get_import_times('lib.cli')
+        self.assertLess(import_times['lib.cli'], CLI_IMPORT_BUDGET_US)
+
+    def test_it_does_not_import_distutils_util(self):
+        import_times = get_import_times('lib.cli')
+        self.assertNotIn('distutils.util', import_times)
+
+
+class when_bootstrapping_without_optional_steps(unittest.TestCase):
+    def test_it_only_installs_ssh_keys(self):
+        with unittest.mock.patch('lib.ssh_keys.main') as ssh_keys_main, \
+                unittest.mock.patch('lib.trusted_ca_certs.main') as ca_main, \
+                unittest.mock.patch('lib.consul_config.main') as consul_main:
+            lib.bootstrap.main([], environment={})
+            ssh_keys_main.assert_called_once_with({})
+            ca_main.assert_not_called()
+            consul_main.assert_not_called()
+
+
+class when_bootstrapping_with_all_steps(unittest.TestCase):
+    def test_it_runs_each_step_and_the_command(self):
+        environment = {
+            lib.bootstrap.TRUSTED_CA_CERTS_VAR_PREFIX + 'foo': 'foo.pem',
+            lib.bootstrap.CONSUL_CONFIG_VAR_PREFIX + 'foo': 'foo.json',
+        }
+        with unittest.mock.patch('lib.ssh_keys.main') as ssh_keys_main, \
+                unittest.mock.patch('lib.trusted_ca_certs.main') as ca_main, \
+                unittest.mock.patch('lib.consul_config.main') as consul_main, \
+                unittest.mock.patch('lib.cli.main') as cli_main:
+            lib.bootstrap.main(['plan'], environment=environment)
+            ssh_keys_main.assert_called_once_with(environment)
+            ca_main.assert_called_once_with(environment)
+            consul_main.assert_called_once_with(environment)
+            cli_main.assert_called_once_with(['plan'])
+
+    def test_it_skips_consul_config_if_already_installed(self):
+        environment = {
+            lib.bootstrap.CONSUL_CONFIG_VAR_PREFIX + 'foo': 'foo.json',
+            lib.bootstrap.CONSUL_CONFIG_INSTALLED_VAR: '1',
+        }
+        with unittest.mock.patch('lib.ssh_keys.main'), \
+                unittest.mock.patch('lib.consul_config.main') as consul_main:
+            lib.bootstrap.main([], environment=environment)
+            consul_main.assert_not_called()
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()
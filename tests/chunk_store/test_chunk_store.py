@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# stdlib
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+# local
+import lib.chunk_store
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_storing_chunks(unittest.TestCase):
+    def setUp(self):
+        self.store = tempfile.TemporaryDirectory()
+        self.addCleanup(self.store.cleanup)
+        patcher = unittest.mock.patch.object(
+            lib.chunk_store, 'MAX_CHUNK_SIZE', 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, *parts):
+        chunk_writer = lib.chunk_store.ChunkWriter(self.store.name)
+        for part in parts:
+            chunk_writer.write(part)
+            chunk_writer.cut()
+        chunk_writer.close()
+        return chunk_writer
+
+    def test_it_splits_large_writes_and_cuts_where_asked(self):
+        chunk_writer = self.write(b'abcdefghij', b'xy')
+        self.assertEqual(
+            [4, 4, 2, 2], [size for _, size in chunk_writer.chunks])
+        self.assertEqual(12, chunk_writer.tell())
+
+    def test_it_only_stores_missing_chunks(self):
+        first = self.write(b'abcd', b'efgh')
+        self.assertEqual(2, first.stored_chunks)
+        second = self.write(b'abcd', b'efgX')
+        self.assertEqual(1, second.stored_chunks)
+        self.assertEqual(4, second.stored_bytes)
+        self.assertEqual(first.chunks[0], second.chunks[0])
+
+    def test_it_reads_chunks_back_in_order(self):
+        chunk_writer = self.write(b'abcdefghij', b'xy')
+        chunk_reader = lib.chunk_store.ChunkReader(
+            self.store.name, chunk_writer.chunks)
+        self.assertEqual(b'abc', chunk_reader.read(3))
+        self.assertEqual(b'defghijxy', chunk_reader.read())
+        self.assertEqual(b'', chunk_reader.read(1))
+
+    def test_it_rejects_corrupt_chunks(self):
+        chunk_writer = self.write(b'abcd')
+        checksum, size = chunk_writer.chunks[0]
+        chunk_file_path = lib.chunk_store.get_chunk_file_path(
+            self.store.name, checksum)
+        os.replace(
+            lib.chunk_store.get_chunk_file_path(
+                self.store.name, self.write(b'dcba').chunks[0][0]),
+            chunk_file_path)
+        with self.assertRaises(ValueError):
+            lib.chunk_store.read_chunk(self.store.name, checksum, size)
+        os.remove(chunk_file_path)
+        with self.assertRaises(FileNotFoundError):
+            lib.chunk_store.read_chunk(self.store.name, checksum, size)
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+# stdlib
+import os
+import stat
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+# =============================================================================
+# write_file
+# =============================================================================
+def write_file(path: str, contents: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(contents)
+
+
+# =============================================================================
+# read_file
+# =============================================================================
+def read_file(path: str) -> str:
+    with open(path, 'r') as file:
+        return file.read()
+
+
+# =============================================================================
+# create_test_tree
+# =============================================================================
+def create_test_tree(root: str, files: dict) -> str:
+    # a source dir holding each relative path with its contents
+    source_dir = os.path.join(root, 'source')
+    for relative_path, contents in files.items():
+        write_file(os.path.join(source_dir, relative_path), contents)
+    return source_dir
+
+
+# =============================================================================
+# create_fake_terraform
+# =============================================================================
+def create_fake_terraform(directory: str, script: str) -> str:
+    # an executable script standing in for the terraform binary
+    fake_terraform_path = os.path.join(directory, 'terraform')
+    with open(fake_terraform_path, 'w') as fake_terraform:
+        fake_terraform.write(script)
+    os.chmod(fake_terraform_path, stat.S_IRWXU)
+    return fake_terraform_path
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# stdlib
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+# local
+import lib.drift
+import lib.terraform
+import tests.common as common
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+# the first arg is -chdir, the second the terraform command. plans exit with
+# the code in the root's exit_code file, and only run one at a time
+FAKE_TERRAFORM_SCRIPT = """#!/bin/sh
+root="${1#-chdir=}"
+case "$2" in
+    init)
+        echo "initialized $root"
+        ;;
+    plan)
+        case "$*" in
+            *-refresh-only*) ;;
+            *) echo 'not a refresh-only plan' 1>&2; exit 1 ;;
+        esac
+        mkdir "$FAKE_LOCK_DIR" || exit 1
+        sleep 0.05
+        rmdir "$FAKE_LOCK_DIR"
+        echo "planned $root"
+        exit "$(cat "$root/exit_code")"
+        ;;
+esac
+"""
+TEST_ROOT_EXIT_CODES = {
+    'network': 2,
+    'dns': 0,
+    'broken': 1,
+}
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+# =============================================================================
+# create_test_roots
+# =============================================================================
+def create_test_roots(terraform_dir: str) -> None:
+    for root_path, exit_code in TEST_ROOT_EXIT_CODES.items():
+        root_dir = os.path.join(terraform_dir, root_path)
+        os.makedirs(root_dir)
+        with open(os.path.join(root_dir, 'exit_code'), 'w') as exit_file:
+            exit_file.write(str(exit_code))
+    with open(os.path.join(terraform_dir, 'network', 'main.tf'), 'w') as tf:
+        tf.write('terraform {\n  backend "s3" {}\n}\n')
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_checking_roots_for_drift(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.terraform_dir = os.path.join(temp_dir.name, 'work')
+        create_test_roots(self.terraform_dir)
+        patcher = unittest.mock.patch.object(
+            lib.terraform,
+            'TERRAFORM_BIN_FILE_PATH',
+            common.create_fake_terraform(
+                temp_dir.name, FAKE_TERRAFORM_SCRIPT),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        env_patcher = unittest.mock.patch.dict(
+            os.environ,
+            {'FAKE_LOCK_DIR': os.path.join(temp_dir.name, 'lock')},
+        )
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+        self.report_dir = os.path.join(temp_dir.name, 'report')
+
+    def check_drift(self, concurrency: int = 1) -> list:
+        return lib.drift.check_drift(
+            self.terraform_dir,
+            list(TEST_ROOT_EXIT_CODES),
+            os.path.join(self.terraform_dir, '.tfcache'),
+            concurrency=concurrency,
+            backend_rate_limit=0)
+
+    def test_it_reports_the_status_of_each_root(self):
+        results = self.check_drift()
+        self.assertEqual(
+            [(result['root'], result['status']) for result in results],
+            [
+                ('network', lib.drift.DRIFTED),
+                ('dns', lib.drift.IN_SYNC),
+                ('broken', lib.drift.ERROR),
+            ])
+        self.assertIn('planned broken', results[2]['output'])
+
+    def test_it_reads_the_backend_of_each_root(self):
+        results = self.check_drift()
+        self.assertEqual(
+            [result['backend'] for result in results],
+            ['s3', 'local', 'local'])
+
+    def test_it_writes_json_and_markdown_reports(self):
+        results = self.check_drift()
+        report_file_path, markdown_file_path = \
+            lib.drift.write_drift_report(results, self.report_dir)
+        with open(report_file_path) as report_file:
+            self.assertEqual(len(json.load(report_file)['roots']), 3)
+        with open(markdown_file_path) as markdown_file:
+            markdown = markdown_file.read()
+        self.assertIn('1 drifted, 1 in sync, 1 failed, of 3 roots', markdown)
+        self.assertIn('## `broken`: terraform exited with 1', markdown)
+
+    def test_it_fails_for_roots_which_could_not_be_checked(self):
+        results = self.check_drift()
+        with self.assertRaisesRegex(lib.drift.DriftCheckError, 'broken'):
+            lib.drift.check_drift_results(results)
+
+    def test_it_rejects_a_concurrency_below_one(self):
+        with self.assertRaises(ValueError):
+            self.check_drift(concurrency=0)
+
+
+class when_rate_limiting_backends(unittest.TestCase):
+    def test_it_spaces_out_starts_against_the_same_backend(self):
+        async def wait_all(backends):
+            rate_limiter = lib.drift.BackendRateLimiter(20.0)
+            start_time = time.monotonic()
+            await asyncio.gather(*[
+                rate_limiter.wait(backend) for backend in backends
+            ])
+            return time.monotonic() - start_time
+
+        self.assertGreaterEqual(asyncio.run(wait_all(['s3'] * 3)), 0.09)
+        self.assertLess(asyncio.run(wait_all(['s3', 'consul', 'gcs'])), 0.05)
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# stdlib
+import os
+import tarfile
+import tempfile
+import unittest
+
+# local
+import lib.archive
+import lib.ignore
+import lib.terraform_dir
+import tests.common as common
+
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+TEST_TREE_FILES = {
+    'main.tf': '# main',
+    '.git/objects/pack': 'x' * 100,
+    'docs/readme.md': 'x' * 10,
+    'modules/a/main.tf': '# a',
+    'modules/a/notes.md': 'x',
+    lib.ignore.COPY_IGNORE_FILE_NAME: '# junk\n.git/\n/docs\n*.md\n',
+}
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+def get_relative_paths(root: str) -> list:
+    return sorted(
+        relative_path
+        for _, relative_path, skipped_size in lib.ignore.iter_tree(root)
+        if relative_path)
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_matching_ignore_patterns(unittest.TestCase):
+    def test_unanchored_patterns_match_at_any_depth(self):
+        matcher = lib.ignore.IgnoreMatcher(['*.md', 'fixtures'])
+        self.assertTrue(matcher.match('README.md'))
+        self.assertTrue(matcher.match('modules/a/notes.md'))
+        self.assertTrue(matcher.match('test/fixtures', is_dir=True))
+        self.assertFalse(matcher.match('main.tf'))
+        self.assertFalse(matcher.match('md'))
+
+    def test_slashes_anchor_patterns_to_the_root(self):
+        matcher = lib.ignore.IgnoreMatcher(['/docs', 'test/fixtures'])
+        self.assertTrue(matcher.match('docs', is_dir=True))
+        self.assertFalse(matcher.match('modules/docs', is_dir=True))
+        self.assertTrue(matcher.match('test/fixtures', is_dir=True))
+        self.assertFalse(matcher.match('a/test/fixtures', is_dir=True))
+
+    def test_trailing_slashes_only_match_dirs(self):
+        matcher = lib.ignore.IgnoreMatcher(['.git/'])
+        self.assertTrue(matcher.match('.git', is_dir=True))
+        self.assertFalse(matcher.match('.git'))
+
+    def test_double_stars_match_any_number_of_dirs(self):
+        matcher = lib.ignore.IgnoreMatcher(['**/testdata', 'build/**'])
+        self.assertTrue(matcher.match('testdata', is_dir=True))
+        self.assertTrue(matcher.match('a/b/testdata', is_dir=True))
+        self.assertTrue(matcher.match('build/a/b.txt'))
+        self.assertFalse(matcher.match('build'))
+
+    def test_the_last_matching_pattern_wins(self):
+        matcher = lib.ignore.IgnoreMatcher(
+            ['*.json', '!keep.json', 'keep.json.bak', '*.tf?', '[!m]*.tf'])
+        self.assertTrue(matcher.match('plan.json'))
+        self.assertFalse(matcher.match('keep.json'))
+        self.assertTrue(matcher.match('keep.json.bak'))
+        self.assertTrue(matcher.match('a.tfx'))
+        self.assertTrue(matcher.match('other.tf'))
+        self.assertFalse(matcher.match('main.tf'))
+
+    def test_blank_and_comment_lines_are_skipped(self):
+        self.assertFalse(lib.ignore.IgnoreMatcher(['', '# comment', '  ']))
+
+
+class when_walking_trees(unittest.TestCase):
+    def test_ignored_paths_are_skipped_with_their_size(self):
+        with tempfile.TemporaryDirectory() as root:
+            source_dir = common.create_test_tree(root, TEST_TREE_FILES)
+            matcher = lib.ignore.load_ignore_file(
+                os.path.join(source_dir, lib.ignore.COPY_IGNORE_FILE_NAME))
+            walked = list(lib.ignore.iter_tree(source_dir, matcher))
+        skipped = {
+            relative_path: skipped_size
+            for _, relative_path, skipped_size in walked
+            if skipped_size is not None}
+        self.assertEqual(
+            {'.git': 100, 'docs': 10, 'modules/a/notes.md': 1}, skipped)
+        included = [
+            relative_path
+            for _, relative_path, skipped_size in walked
+            if skipped_size is None]
+        self.assertEqual(
+            ['', lib.ignore.COPY_IGNORE_FILE_NAME, 'main.tf', 'modules',
+             'modules/a', 'modules/a/main.tf'],
+            included)
+
+
+class when_copying_and_archiving_with_ignore_files(unittest.TestCase):
+    def test_copies_skip_ignored_paths(self):
+        with tempfile.TemporaryDirectory() as root:
+            source_dir = common.create_test_tree(root, TEST_TREE_FILES)
+            destination_dir = os.path.join(root, 'destination')
+            lib.terraform_dir._copy_terraform_dir(
+                source_dir,
+                destination_dir,
+                ignore_file_name=lib.ignore.COPY_IGNORE_FILE_NAME)
+            self.assertEqual(
+                [lib.ignore.COPY_IGNORE_FILE_NAME, 'main.tf', 'modules',
+                 'modules/a', 'modules/a/main.tf'],
+                get_relative_paths(destination_dir))
+
+    def test_copies_without_an_ignore_file_copy_everything(self):
+        with tempfile.TemporaryDirectory() as root:
+            source_dir = common.create_test_tree(root, TEST_TREE_FILES)
+            destination_dir = os.path.join(root, 'destination')
+            lib.terraform_dir._copy_terraform_dir(
+                source_dir,
+                destination_dir,
+                ignore_file_name=lib.ignore.ARCHIVE_IGNORE_FILE_NAME)
+            self.assertEqual(
+                get_relative_paths(source_dir),
+                get_relative_paths(destination_dir))
+
+    def test_archives_skip_ignored_paths(self):
+        with tempfile.TemporaryDirectory() as root:
+            source_dir = common.create_test_tree(root, TEST_TREE_FILES)
+            matcher = lib.ignore.IgnoreMatcher(['.git/', 'modules/'])
+            archive_file_path = os.path.join(root, 'archive.tar.gz')
+            lib.archive.create_archive(
+                source_dir,
+                archive_file_path,
+                'terraform',
+                ignore_matcher=matcher)
+            with tarfile.open(archive_file_path, 'r:gz') as archive_file:
+                names = archive_file.getnames()
+        self.assertEqual(
+            ['terraform', 'terraform/' + lib.ignore.COPY_IGNORE_FILE_NAME,
+             'terraform/docs', 'terraform/docs/readme.md',
+             'terraform/main.tf', lib.archive.CHECKSUMS_MEMBER_NAME],
+            names)
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()
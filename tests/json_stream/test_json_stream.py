@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# stdlib
+import io
+import json
+import unittest
+
+# local
+import lib.json_stream
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+TEST_DOCUMENT = {
+    'format_version': '1.0',
+    'planned_values': {
+        'root_module': {
+            'resources': [{'address': 'a', 'values': {'tags': ['x', 'y']}}],
+        },
+    },
+    'escaped': 'a "quoted" \\ {value} [with] brackets',
+    'number': 12345,
+    'items': [{'name': 'first'}, 2, 'three', None, [4.5e3]],
+    'after': True,
+}
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_iterating_a_json_array(unittest.TestCase):
+    def test_it_yields_each_item(self):
+        stream = io.StringIO(json.dumps(TEST_DOCUMENT))
+        self.assertEqual(
+            TEST_DOCUMENT['items'],
+            list(lib.json_stream.iter_array(stream, 'items')))
+
+    def test_it_handles_every_chunk_boundary(self):
+        document = json.dumps(TEST_DOCUMENT, indent=2)
+        for chunk_size in range(1, 16):
+            with self.subTest(chunk_size=chunk_size):
+                items = lib.json_stream.iter_array(
+                    io.StringIO(document),
+                    'items',
+                    chunk_size=chunk_size)
+                self.assertEqual(TEST_DOCUMENT['items'], list(items))
+
+    def test_it_yields_nothing_for_a_missing_or_empty_key(self):
+        self.assertEqual([], list(lib.json_stream.iter_array(
+            io.StringIO(json.dumps(TEST_DOCUMENT)), 'missing')))
+        self.assertEqual([], list(lib.json_stream.iter_array(
+            io.StringIO('{"items": []}'), 'items')))
+        self.assertEqual([], list(lib.json_stream.iter_array(
+            io.StringIO('{}'), 'items')))
+
+    def test_it_rejects_truncated_documents(self):
+        document = json.dumps(TEST_DOCUMENT)
+        with self.assertRaises(ValueError):
+            list(lib.json_stream.iter_array(
+                io.StringIO(document[:40]), 'items', chunk_size=8))
+
+
+class when_iterating_a_nested_json_array(unittest.TestCase):
+    def test_it_yields_each_nested_item_with_its_parent(self):
+        document = json.dumps({
+            'resources': [
+                {'name': 'a', 'instances': [1, 2], 'after': 'ignored'},
+                'not an object',
+                {'name': 'b', 'instances': []},
+                {'name': 'c', 'instances': [{'id': 3}]},
+            ],
+        })
+        self.assertEqual(
+            [({'name': 'a'}, 1), ({'name': 'a'}, 2),
+             ({'name': 'c'}, {'id': 3})],
+            [(dict(parent), item) for parent, item in
+             lib.json_stream.iter_nested_array(
+                 io.StringIO(document), 'resources', 'instances',
+                 chunk_size=5)])
+
+    def test_it_skips_empty_objects(self):
+        document = '{"resources":[{},{"a":1,"instances":[3]}],"after":{}}'
+        self.assertEqual(
+            [({'a': 1}, 3)],
+            [(dict(parent), item) for parent, item in
+             lib.json_stream.iter_nested_array(
+                 io.StringIO(document), 'resources', 'instances')])
+        self.assertEqual(
+            {'after': {}},
+            lib.json_stream.read_values(io.StringIO('{"x":{},"after":{}}'),
+                                        ['after']))
+
+
+class when_reading_json_values(unittest.TestCase):
+    def test_it_reads_only_the_given_keys(self):
+        stream = io.StringIO(json.dumps(TEST_DOCUMENT))
+        self.assertEqual(
+            {'number': 12345, 'escaped': TEST_DOCUMENT['escaped']},
+            lib.json_stream.read_values(
+                stream, ['number', 'escaped'], chunk_size=7))
+
+    def test_it_stops_once_every_key_is_found(self):
+        # anything after the value is never parsed
+        stream = io.StringIO('{"serial": 3, "resources": [not json')
+        self.assertEqual(
+            {'serial': 3},
+            lib.json_stream.read_values(stream, ['serial']))
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# stdlib
+import gzip
+import io
+import os
+import tempfile
+import unittest
+import unittest.mock
+from contextlib import redirect_stdout
+
+# local
+import lib.log_filter
+import lib.terraform
+import tests.common as common
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+TEST_PROGRESS_OUTPUT = [
+    'aws_instance.a: Creating...\n',
+    'aws_instance.b: Destroying... [id=i-b]\n',
+    'aws_instance.a: Still creating... [10s elapsed]\n',
+    'aws_instance.b: Still destroying... [id=i-b, 10s elapsed]\n',
+    'aws_instance.a: Still creating... [20s elapsed]\n',
+    'aws_instance.b: Destruction complete after 25s\n',
+    'aws_instance.a: Still creating... [30s elapsed]\n',
+    'Error: creating instance: quota exceeded\n',
+]
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+# =============================================================================
+# FakeClock
+# =============================================================================
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+# =============================================================================
+# create_fake_terraform
+# =============================================================================
+def create_fake_terraform(directory: str, lines: list) -> str:
+    script = '#!/bin/sh\n' + ''.join(
+        f"printf '%s\\n' '{line.rstrip()}'\n" for line in lines)
+    script += "echo 'warning on stderr' 1>&2\n"
+    return common.create_fake_terraform(directory, script)
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_filtering_progress_lines(unittest.TestCase):
+    def test_it_drops_progress_lines_between_summaries(self):
+        progress_filter = lib.log_filter.ProgressFilter(clock=FakeClock())
+        output = []
+        for line in TEST_PROGRESS_OUTPUT:
+            output.extend(progress_filter.process(line))
+        self.assertFalse(any('Still' in line for line in output))
+
+    def test_it_keeps_final_states_and_errors_verbatim(self):
+        progress_filter = lib.log_filter.ProgressFilter(clock=FakeClock())
+        output = []
+        for line in TEST_PROGRESS_OUTPUT:
+            output.extend(progress_filter.process(line))
+        self.assertIn(
+            'aws_instance.b: Destruction complete after 25s\n',
+            output)
+        self.assertIn('Error: creating instance: quota exceeded\n', output)
+
+    def test_it_emits_periodic_summaries(self):
+        clock = FakeClock()
+        progress_filter = lib.log_filter.ProgressFilter(
+            summary_interval=18,
+            clock=clock)
+        output = []
+        for line in TEST_PROGRESS_OUTPUT:
+            clock.now += 5
+            output.extend(progress_filter.process(line))
+        summaries = [line for line in output if line.startswith('[progress]')]
+        self.assertEqual(1, len(summaries))
+        self.assertIn('aws_instance.a (creating, 10s)', summaries[0])
+        self.assertIn('aws_instance.b (destroying, 10s)', summaries[0])
+
+    def test_it_forgets_resources_which_completed(self):
+        progress_filter = lib.log_filter.ProgressFilter(clock=FakeClock())
+        for line in TEST_PROGRESS_OUTPUT:
+            progress_filter.process(line)
+        summary = progress_filter.flush()
+        self.assertEqual(1, len(summary))
+        self.assertIn('aws_instance.a (creating, 30s)', summary[0])
+        self.assertNotIn('aws_instance.b', summary[0])
+
+    def test_it_matches_colored_output(self):
+        progress_filter = lib.log_filter.ProgressFilter(clock=FakeClock())
+        self.assertEqual(
+            [],
+            progress_filter.process(
+                '\x1b[0m\x1b[1maws_instance.a: Still creating... '
+                '[10s elapsed]\x1b[0m\x1b[0m\n'))
+
+
+class when_writing_a_raw_log(unittest.TestCase):
+    def test_it_compresses_every_line(self):
+        with tempfile.TemporaryDirectory() as raw_log_dir:
+            raw_log_file_path = os.path.join(raw_log_dir, 'raw.log.gz')
+            filters = [
+                lib.log_filter.RawLogWriter(raw_log_file_path),
+                lib.log_filter.ProgressFilter(clock=FakeClock()),
+            ]
+            for line in TEST_PROGRESS_OUTPUT:
+                lib.log_filter.apply_filters(filters, line)
+            lib.log_filter.close_filters(filters)
+            with gzip.open(raw_log_file_path, 'rt') as raw_log_file:
+                self.assertEqual(
+                    ''.join(TEST_PROGRESS_OUTPUT),
+                    raw_log_file.read())
+
+
+class when_streaming_terraform_output(unittest.TestCase):
+    def test_it_applies_the_filters_from_the_environment(self):
+        with tempfile.TemporaryDirectory() as test_dir:
+            fake_terraform_path = create_fake_terraform(
+                test_dir,
+                TEST_PROGRESS_OUTPUT)
+            raw_log_dir = os.path.join(test_dir, 'logs')
+            env_vars = {
+                lib.log_filter.COMPACT_PROGRESS_VAR: 'true',
+                lib.log_filter.RAW_LOG_OUTPUT_DIR_VAR: raw_log_dir,
+            }
+            stdout = io.StringIO()
+            with unittest.mock.patch.dict('os.environ', env_vars), \
+                    unittest.mock.patch(
+                        'lib.terraform.TERRAFORM_BIN_FILE_PATH',
+                        fake_terraform_path), \
+                    redirect_stdout(stdout):
+                lib.terraform._terraform('apply', working_dir=test_dir)
+            self.assertNotIn('Still creating', stdout.getvalue())
+            self.assertIn('quota exceeded', stdout.getvalue())
+            raw_log_file_path = os.path.join(
+                raw_log_dir,
+                lib.log_filter.RAW_LOG_FILE_NAME)
+            with gzip.open(raw_log_file_path, 'rt') as raw_log_file:
+                raw_log = raw_log_file.read()
+            self.assertIn('Still creating', raw_log)
+            self.assertIn('warning on stderr', raw_log)
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# stdlib
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+# local
+import lib.metrics
+import lib.run_stats
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+def get_samples(duration, success=True, archive_bytes=100):
+    return lib.metrics.get_run_samples(
+        'network',
+        'create-plan',
+        duration,
+        success,
+        phases={'plan': 2.5},
+        counts={
+            lib.run_stats.ARCHIVE_BYTES_COUNT: archive_bytes,
+            lib.run_stats.ARCHIVE_UNCOMPRESSED_BYTES_COUNT: 400,
+            lib.run_stats.COPIED_BYTES_COUNT: 1024,
+            'resources_create': 3,
+        },
+        exit_codes=[('init', 0), ('plan', 2)],
+        finished_at=1700000000)
+
+
+def read_metrics(textfile_path):
+    with open(textfile_path) as f:
+        lines = f.read().splitlines()
+    return {
+        line.rsplit(' ', 1)[0]: line.rsplit(' ', 1)[1]
+        for line in lines
+        if not line.startswith('#')
+    }
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_writing_metrics_textfiles(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.textfile_path = os.path.join(self.root.name, 'tf.prom')
+        patcher = unittest.mock.patch('builtins.print')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_it_labels_samples_by_root_and_command(self):
+        lib.metrics.write_metrics_textfile(self.textfile_path, get_samples(7))
+        metrics = read_metrics(self.textfile_path)
+        labels = 'root="network",command="create-plan"'
+        self.assertEqual(
+            '1',
+            metrics['concourse_terraform_runs_total{'
+                    + labels + ',result="success"}'])
+        self.assertEqual(
+            '0',
+            metrics['concourse_terraform_run_duration_seconds_bucket{'
+                    + labels + ',le="5"}'])
+        self.assertEqual(
+            '1',
+            metrics['concourse_terraform_run_duration_seconds_bucket{'
+                    + labels + ',le="10"}'])
+        self.assertEqual(
+            '2.5',
+            metrics['concourse_terraform_phase_duration_seconds_sum{'
+                    + labels + ',phase="plan"}'])
+        self.assertEqual(
+            '1',
+            metrics['concourse_terraform_terraform_exits_total{'
+                    + labels + ',terraform_command="plan",code="2"}'])
+        self.assertEqual(
+            '4',
+            metrics['concourse_terraform_archive_compression_ratio{'
+                    + labels + '}'])
+        self.assertEqual(
+            '3',
+            metrics['concourse_terraform_resource_changes{'
+                    + labels + ',action="create"}'])
+
+    def test_counters_add_up_and_gauges_are_replaced(self):
+        lib.metrics.write_metrics_textfile(self.textfile_path, get_samples(7))
+        lib.metrics.write_metrics_textfile(
+            self.textfile_path, get_samples(70, archive_bytes=200))
+        metrics = read_metrics(self.textfile_path)
+        labels = 'root="network",command="create-plan"'
+        self.assertEqual(
+            '2',
+            metrics['concourse_terraform_run_duration_seconds_count{'
+                    + labels + '}'])
+        self.assertEqual(
+            '77',
+            metrics['concourse_terraform_run_duration_seconds_sum{'
+                    + labels + '}'])
+        self.assertEqual(
+            '2048',
+            metrics['concourse_terraform_copied_bytes_total{'
+                    + labels + '}'])
+        self.assertEqual(
+            '200',
+            metrics['concourse_terraform_archive_bytes{' + labels + '}'])
+        self.assertEqual(
+            ['tf.prom', 'tf.prom.lock'], sorted(os.listdir(self.root.name)))
+
+    def test_it_writes_one_help_and_type_line_per_family(self):
+        lib.metrics.write_metrics_textfile(self.textfile_path, get_samples(7))
+        with open(self.textfile_path) as f:
+            lines = f.read().splitlines()
+        self.assertIn(
+            '# TYPE concourse_terraform_run_duration_seconds histogram', lines)
+        type_lines = [line for line in lines if line.startswith('# TYPE')]
+        self.assertEqual(len(type_lines), len(set(type_lines)))
+
+    def test_label_values_are_escaped(self):
+        samples = lib.metrics.get_run_samples(
+            'say "hi"\\', 'plan', 1, False, finished_at=0)
+        lib.metrics.write_metrics_textfile(self.textfile_path, samples)
+        with open(self.textfile_path) as f:
+            self.assertIn(
+                'concourse_terraform_runs_total{root="say \\"hi\\"\\\\",'
+                'command="plan",result="failure"} 1',
+                f.read())
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()
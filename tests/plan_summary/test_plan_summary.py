@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# stdlib
+import io
+import json
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+# local
+import lib.plan_summary
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+TEST_RESOURCE_CHANGES = [
+    ('aws_instance', ['create']),
+    ('aws_instance', ['create']),
+    ('aws_instance', ['update']),
+    ('aws_s3_bucket', ['delete']),
+    ('aws_s3_bucket', ['delete', 'create']),
+    ('aws_iam_role', ['create', 'delete']),
+    ('aws_iam_role', ['no-op']),
+    ('aws_ami', ['read']),
+]
+LARGE_PLAN_RESOURCE_COUNT = 20000
+# well under the size of the plan file itself
+LARGE_PLAN_MAX_PEAK_MEMORY = 2 * 1024 * 1024
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+# =============================================================================
+# resource_change
+# =============================================================================
+def resource_change(index: int, resource_type: str, actions: list) -> dict:
+    return {
+        'address': f'{resource_type}.r{index}',
+        'type': resource_type,
+        'name': f'r{index}',
+        'change': {
+            'actions': actions,
+            'before': {'id': f'id-{index}', 'tags': {'index': index}},
+            'after': {'id': f'id-{index}', 'tags': {'index': index}},
+        },
+    }
+
+
+# =============================================================================
+# write_large_plan
+# =============================================================================
+def write_large_plan(plan_file) -> None:
+    # written piece by piece, so only the parser is measured
+    plan_file.write('{"format_version": "1.0", "planned_values": {"r": [')
+    for index in range(LARGE_PLAN_RESOURCE_COUNT):
+        if index:
+            plan_file.write(',')
+        json.dump({'values': {'index': index, 'data': 'x' * 200}}, plan_file)
+    plan_file.write(']}, "resource_changes": [')
+    for index in range(LARGE_PLAN_RESOURCE_COUNT):
+        if index:
+            plan_file.write(',')
+        actions = ['delete'] if index % 10 == 0 else ['create']
+        json.dump(resource_change(index, 'aws_instance', actions), plan_file)
+    plan_file.write(']}')
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_summarizing_a_plan(unittest.TestCase):
+    def setUp(self):
+        plan = {
+            'format_version': '1.0',
+            'resource_changes': [
+                resource_change(index, resource_type, actions)
+                for index, (resource_type, actions)
+                in enumerate(TEST_RESOURCE_CHANGES)
+            ],
+        }
+        self.summary = lib.plan_summary.summarize_plan_json(
+            io.StringIO(json.dumps(plan)))
+
+    def test_it_counts_actions_per_type(self):
+        self.assertEqual(
+            {'create': 2, 'update': 1, 'delete': 0, 'replace': 0, 'read': 0},
+            self.summary['by_type']['aws_instance'])
+        self.assertEqual(
+            {'create': 0, 'update': 0, 'delete': 0, 'replace': 1, 'read': 0},
+            self.summary['by_type']['aws_iam_role'])
+
+    def test_it_counts_totals(self):
+        self.assertEqual(
+            {'create': 2, 'update': 1, 'delete': 1, 'replace': 2, 'read': 1},
+            self.summary['totals'])
+
+    def test_it_counts_replacements_as_destroys(self):
+        self.assertEqual(3, lib.plan_summary.get_destroy_count(self.summary))
+        lib.plan_summary.check_destroy_threshold(self.summary, 3)
+        with self.assertRaises(lib.plan_summary.PlanDestroyThresholdError):
+            lib.plan_summary.check_destroy_threshold(self.summary, 2)
+
+    def test_it_writes_the_summary_file(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            summary_file_path = lib.plan_summary.write_plan_summary(
+                self.summary,
+                output_dir)
+            self.assertEqual(
+                os.path.join(output_dir, 'plan-summary.json'),
+                summary_file_path)
+            with open(summary_file_path) as summary_file:
+                self.assertEqual(self.summary, json.load(summary_file))
+
+
+class when_summarizing_a_large_plan(unittest.TestCase):
+    def test_memory_stays_flat(self):
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as plan_file:
+            write_large_plan(plan_file)
+            plan_file_size = plan_file.tell()
+            plan_file.seek(0)
+            tracemalloc.start()
+            try:
+                summary = lib.plan_summary.summarize_plan_json(plan_file)
+                _, peak_memory = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        self.assertGreater(plan_file_size, 4 * LARGE_PLAN_MAX_PEAK_MEMORY)
+        self.assertLess(peak_memory, LARGE_PLAN_MAX_PEAK_MEMORY)
+        self.assertEqual(
+            LARGE_PLAN_RESOURCE_COUNT // 10,
+            summary['totals']['delete'])
+        self.assertEqual(
+            LARGE_PLAN_RESOURCE_COUNT - LARGE_PLAN_RESOURCE_COUNT // 10,
+            summary['totals']['create'])
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+# stdlib
+import errno
+import gzip
+import os
+import pstats
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+# local
+import lib.profiling
+import lib.terraform_command
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+def busy_wait(seconds: float) -> None:
+    end_time = time.monotonic() + seconds
+    while time.monotonic() < end_time:
+        pass
+
+
+def write_log_line(env: dict, line: str) -> None:
+    subprocess.run(
+        ['sh', '-c', f'echo {line} >> "$TF_LOG_PATH"'],
+        env=env,
+        check=True,
+        # a fifo with no reader would block the write forever
+        timeout=5)
+
+
+def read_log_files(file_paths) -> bytes:
+    data = b''
+    for file_path in file_paths:
+        with gzip.open(file_path, 'rb') as log_file:
+            data += log_file.read()
+    return data
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_rotating_logs(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def test_it_keeps_only_the_most_recent_files(self):
+        log_writer = lib.profiling.RotatingLogWriter(
+            self.temp_dir.name, file_size=1, file_count=2)
+        for index in range(5):
+            log_writer.write(f'line {index}\n'.encode())
+        log_writer.close()
+        self.assertEqual(
+            sorted(os.listdir(self.temp_dir.name)),
+            ['terraform-trace.003.log.gz', 'terraform-trace.004.log.gz'])
+        self.assertEqual(
+            read_log_files(log_writer.file_paths), b'line 3\nline 4\n')
+
+    def test_it_fills_a_file_up_to_its_size(self):
+        log_writer = lib.profiling.RotatingLogWriter(self.temp_dir.name)
+        for index in range(100):
+            log_writer.write(f'line {index}\n'.encode())
+        log_writer.close()
+        self.assertEqual(len(log_writer.file_paths), 1)
+
+    def test_it_rejects_empty_limits(self):
+        with self.assertRaises(ValueError):
+            lib.profiling.RotatingLogWriter(self.temp_dir.name, file_count=0)
+
+
+class when_capturing_terraform_logs(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def test_processes_write_their_log_through_the_fifo(self):
+        log_capture = lib.profiling.TerraformLogCapture(
+            lib.profiling.RotatingLogWriter(self.temp_dir.name))
+        with unittest.mock.patch.dict(os.environ, {'TF_LOG': 'info'}):
+            log_capture.start()
+            try:
+                process_env = lib.terraform_command.get_process_env()
+                self.assertEqual(process_env['TF_LOG'], 'trace')
+                # only terraform processes see the capture
+                self.assertEqual(os.environ['TF_LOG'], 'info')
+                self.assertNotIn('TF_LOG_PATH', os.environ)
+                # terraform appends to TF_LOG_PATH, once per process
+                for index in range(2):
+                    write_log_line(process_env, str(index))
+            finally:
+                log_capture.stop()
+            process_env = lib.terraform_command.get_process_env()
+            self.assertEqual(process_env['TF_LOG'], 'info')
+            self.assertNotIn('TF_LOG_PATH', process_env)
+        self.assertEqual(
+            read_log_files(log_capture.log_writer.file_paths), b'0\n1\n')
+
+    def test_it_stops_capturing_when_the_log_cannot_be_written(self):
+        log_writer = lib.profiling.RotatingLogWriter(self.temp_dir.name)
+        log_capture = lib.profiling.TerraformLogCapture(log_writer)
+        write_error = OSError(errno.ENOSPC, 'No space left on device')
+        with unittest.mock.patch.object(
+                log_writer, 'write', side_effect=write_error), \
+                unittest.mock.patch('builtins.print') as print_mock:
+            log_capture.start()
+            try:
+                write_log_line(
+                    lib.terraform_command.get_process_env(), 'first')
+                deadline = time.monotonic() + 5
+                while 'TF_LOG_PATH' in lib.terraform_command.get_process_env():
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.01)
+                # processes already writing to the fifo are still drained
+                fifo_path = os.path.join(
+                    log_capture._fifo_dir, lib.profiling.TF_LOG_FIFO_NAME)
+                write_log_line(
+                    {**os.environ, 'TF_LOG_PATH': fifo_path}, 'second')
+            finally:
+                log_capture.stop()
+        print_mock.assert_called_once_with(
+            '[warning] stopped capturing terraform log: '
+            '[Errno 28] No space left on device')
+
+
+class when_profiling_runs(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        patcher = unittest.mock.patch('builtins.print')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_the_sampler_sees_every_thread(self):
+        sampler = lib.profiling.StackSampler(interval=0.001)
+        thread = threading.Thread(
+            target=busy_wait, args=(0.1,), name='archive')
+        sampler.start()
+        thread.start()
+        thread.join()
+        sampler.stop()
+        self.assertTrue(any(
+            stack.startswith('archive;') and 'busy_wait' in stack
+            for stack in sampler.stacks))
+
+    def test_it_writes_pstats_and_collapsed_stacks(self):
+        output_dir = os.path.join(self.temp_dir.name, 'profile')
+        with lib.profiling.profile_run(
+                output_dir, 'plan', sample_interval=0.001):
+            busy_wait(0.05)
+        stats = pstats.Stats(os.path.join(output_dir, 'plan.pstats'))
+        self.assertTrue(any(
+            function_name == 'busy_wait'
+            for _, _, function_name in stats.stats))
+        with open(os.path.join(output_dir, 'plan.collapsed')) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(
+            line.rsplit(' ', 1)[1].isdigit() for line in lines))
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == '__main__':
+    unittest.main()
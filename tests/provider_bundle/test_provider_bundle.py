@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+
+# stdlib
+import base64
+import hashlib
+import io
+import json
+import os
+import stat
+import tarfile
+import tempfile
+import unittest
+import unittest.mock
+
+# local
+import lib.provider_bundle
+import lib.terraform
+import lib.terraform_dir
+import tests.common as common
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+TEST_SOURCE = 'registry.terraform.io/hashicorp/null'
+TEST_VERSION = '3.2.1'
+TEST_PLATFORM = 'linux_amd64'
+TEST_BINARY_NAME = 'terraform-provider-null_v3.2.1_x5'
+TEST_BINARY_CONTENTS = 'null provider'
+# installs the provider into the plugin cache, as terraform init does, and
+# fails an init which does not find it there
+FAKE_TERRAFORM_SCRIPT = f"""#!/bin/sh
+package_dir="$TF_PLUGIN_CACHE_DIR/{TEST_SOURCE}/{TEST_VERSION}/{TEST_PLATFORM}"
+case "$*" in
+    *-backend=false*)
+        mkdir -p "$package_dir"
+        printf '{TEST_BINARY_CONTENTS}' > "$package_dir/{TEST_BINARY_NAME}"
+        chmod 755 "$package_dir/{TEST_BINARY_NAME}"
+        printf 'license' > "$package_dir/LICENSE"
+        ;;
+    *init*)
+        test -x "$package_dir/{TEST_BINARY_NAME}" || exit 1
+        ;;
+esac
+"""
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+# =============================================================================
+# create_package
+# =============================================================================
+def create_package(
+    plugin_cache_dir: str,
+    platform: str = TEST_PLATFORM,
+    contents: str = TEST_BINARY_CONTENTS,
+) -> str:
+    package_dir = os.path.join(
+        plugin_cache_dir, TEST_SOURCE, TEST_VERSION, platform)
+    os.makedirs(package_dir)
+    binary_path = os.path.join(package_dir, TEST_BINARY_NAME)
+    with open(binary_path, 'w') as binary_file:
+        binary_file.write(contents)
+    os.chmod(binary_path, 0o755)
+    with open(os.path.join(package_dir, 'LICENSE'), 'w') as license_file:
+        license_file.write('license')
+    return package_dir
+
+
+# =============================================================================
+# write_lock_file
+# =============================================================================
+def write_lock_file(root_dir: str, hashes: list) -> str:
+    os.makedirs(root_dir, exist_ok=True)
+    lock_file_path = os.path.join(
+        root_dir, lib.provider_bundle.LOCK_FILE_NAME)
+    hash_lines = ''.join(f'    "{value}",\n' for value in hashes)
+    with open(lock_file_path, 'w') as lock_file:
+        lock_file.write(
+            '# This file is maintained automatically by "terraform init".\n'
+            '# Manual edits may be lost in future updates.\n'
+            '\n'
+            f'provider "{TEST_SOURCE}" {{\n'
+            f'  version     = "{TEST_VERSION}"\n'
+            '  constraints = "~> 3.2"\n'
+            '  hashes = [\n'
+            f'{hash_lines}'
+            '  ]\n'
+            '}\n')
+    return lock_file_path
+
+
+# =============================================================================
+# get_package_hash
+# =============================================================================
+def get_package_hash(contents: str = TEST_BINARY_CONTENTS) -> str:
+    with tempfile.TemporaryDirectory() as plugin_cache_dir:
+        return lib.provider_bundle.get_dir_hash(
+            create_package(plugin_cache_dir, contents=contents))
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_reading_lock_files(unittest.TestCase):
+    def test_it_reads_the_version_and_hashes_of_each_provider(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            lock_file_path = write_lock_file(
+                temp_dir, ['h1:abc=', 'zh:0123'])
+            with open(lock_file_path, 'a') as lock_file:
+                lock_file.write(
+                    '\n'
+                    'provider "registry.terraform.io/hashicorp/aws" {\n'
+                    '  version = "5.31.0"\n'
+                    '  hashes = [\n'
+                    '    "h1:def=",\n'
+                    '  ]\n'
+                    '}\n')
+            self.assertEqual(
+                lib.provider_bundle.read_lock_file(lock_file_path),
+                [
+                    {
+                        'source': TEST_SOURCE,
+                        'version': TEST_VERSION,
+                        'hashes': ['h1:abc=', 'zh:0123'],
+                    },
+                    {
+                        'source': 'registry.terraform.io/hashicorp/aws',
+                        'version': '5.31.0',
+                        'hashes': ['h1:def='],
+                    },
+                ])
+
+    def test_it_finds_lock_files_outside_hidden_dirs(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            network_lock = write_lock_file(
+                os.path.join(temp_dir, 'network'), [])
+            dns_lock = write_lock_file(os.path.join(temp_dir, 'dns'), [])
+            write_lock_file(
+                os.path.join(temp_dir, 'dns', '.terraform', 'modules'), [])
+            self.assertEqual(
+                lib.provider_bundle.find_lock_files(temp_dir),
+                [dns_lock, network_lock])
+
+
+class when_hashing_packages(unittest.TestCase):
+    def test_it_hashes_like_terraform(self):
+        # go's dirhash, over the sorted files of the package
+        lines = ''.join(
+            f'{hashlib.sha256(contents.encode()).hexdigest()}  {name}\n'
+            for name, contents in sorted([
+                ('LICENSE', 'license'),
+                (TEST_BINARY_NAME, TEST_BINARY_CONTENTS),
+            ]))
+        expected_hash = 'h1:' + base64.b64encode(
+            hashlib.sha256(lines.encode()).digest()).decode()
+        self.assertEqual(get_package_hash(), expected_hash)
+
+
+class when_bundling_providers(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.plugin_cache_dir = os.path.join(self.temp_dir, 'cache')
+        self.bundle_file_path = os.path.join(
+            self.temp_dir, 'bundle', lib.provider_bundle.BUNDLE_FILE_NAME)
+        self.locked_providers = {
+            (TEST_SOURCE, TEST_VERSION): {get_package_hash(), 'zh:0123'},
+        }
+        print_patcher = unittest.mock.patch('builtins.print')
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def create_bundle(self) -> dict:
+        return lib.provider_bundle.create_provider_bundle(
+            self.locked_providers,
+            self.plugin_cache_dir,
+            self.bundle_file_path)
+
+    def test_it_unpacks_the_locked_packages_into_a_plugin_cache(self):
+        package_dir = create_package(self.plugin_cache_dir)
+        self.create_bundle()
+        output_cache_dir = os.path.join(self.temp_dir, 'output-cache')
+        self.assertEqual(
+            lib.provider_bundle.unpack_provider_bundle(
+                self.bundle_file_path,
+                output_cache_dir,
+                self.locked_providers),
+            1)
+        unpacked_dir = os.path.join(
+            output_cache_dir, TEST_SOURCE, TEST_VERSION, TEST_PLATFORM)
+        self.assertEqual(
+            lib.provider_bundle.get_dir_hash(unpacked_dir),
+            lib.provider_bundle.get_dir_hash(package_dir))
+        self.assertTrue(
+            os.stat(os.path.join(unpacked_dir, TEST_BINARY_NAME)).st_mode
+            & stat.S_IXUSR)
+        # a package the cache already holds is left alone
+        self.assertEqual(
+            lib.provider_bundle.unpack_provider_bundle(
+                self.bundle_file_path,
+                output_cache_dir,
+                self.locked_providers),
+            0)
+
+    def test_it_only_unpacks_packages_locked_by_the_consuming_root(self):
+        create_package(self.plugin_cache_dir)
+        self.create_bundle()
+        output_cache_dir = os.path.join(self.temp_dir, 'output-cache')
+        # a root locking another build of the same version
+        self.assertEqual(
+            lib.provider_bundle.unpack_provider_bundle(
+                self.bundle_file_path,
+                output_cache_dir,
+                {(TEST_SOURCE, TEST_VERSION): {'h1:other'}}),
+            0)
+        self.assertFalse(os.path.exists(output_cache_dir))
+
+    def test_it_creates_the_same_bundle_every_time(self):
+        create_package(self.plugin_cache_dir)
+        self.create_bundle()
+        with open(self.bundle_file_path, 'rb') as bundle_file:
+            first_bundle = bundle_file.read()
+        self.create_bundle()
+        with open(self.bundle_file_path, 'rb') as bundle_file:
+            self.assertEqual(bundle_file.read(), first_bundle)
+
+    def test_it_skips_builds_not_in_the_lock_files(self):
+        create_package(self.plugin_cache_dir)
+        create_package(
+            self.plugin_cache_dir, platform='darwin_arm64', contents='other')
+        manifest = self.create_bundle()
+        self.assertEqual(
+            [package['platform'] for package in manifest['providers']],
+            [TEST_PLATFORM])
+
+    def test_it_fails_on_a_provider_not_matching_the_lock_files(self):
+        create_package(self.plugin_cache_dir, contents='tampered')
+        with self.assertRaises(lib.provider_bundle.ProviderBundleError):
+            self.create_bundle()
+
+    def test_it_fails_on_a_provider_missing_from_the_cache(self):
+        with self.assertRaises(lib.provider_bundle.ProviderBundleError):
+            self.create_bundle()
+
+    def test_it_fails_on_a_package_not_matching_the_manifest(self):
+        create_package(self.plugin_cache_dir)
+        manifest = self.create_bundle()
+        # a bundle whose package was swapped for another
+        tampered_cache_dir = os.path.join(self.temp_dir, 'tampered-cache')
+        tampered_dir = create_package(tampered_cache_dir, contents='evil')
+        package_file_path = os.path.join(self.temp_dir, 'package.tar.gz')
+        with open(package_file_path, 'wb') as package_file:
+            lib.provider_bundle._write_package(tampered_dir, package_file)
+        with tarfile.open(self.bundle_file_path, 'r:') as bundle_tar:
+            manifest_member = bundle_tar.next()
+            manifest_contents = bundle_tar.extractfile(manifest_member).read()
+        with tarfile.open(self.bundle_file_path, 'w:') as bundle_tar:
+            manifest_file_path = os.path.join(self.temp_dir, 'manifest.json')
+            with open(manifest_file_path, 'wb') as manifest_file:
+                manifest_file.write(manifest_contents)
+            bundle_tar.add(manifest_file_path, arcname=manifest_member.name)
+            bundle_tar.add(
+                package_file_path,
+                arcname=manifest['providers'][0]['member'])
+        output_cache_dir = os.path.join(self.temp_dir, 'output-cache')
+        with self.assertRaises(lib.provider_bundle.ProviderBundleError):
+            lib.provider_bundle.unpack_provider_bundle(
+                self.bundle_file_path,
+                output_cache_dir,
+                self.locked_providers)
+        # nothing unverified is left in the cache
+        self.assertEqual(
+            os.listdir(os.path.join(output_cache_dir, TEST_SOURCE)),
+            [TEST_VERSION])
+        self.assertEqual(
+            os.listdir(
+                os.path.join(output_cache_dir, TEST_SOURCE, TEST_VERSION)),
+            [])
+
+    def test_it_rejects_platforms_outside_the_plugin_cache(self):
+        create_package(self.plugin_cache_dir)
+        manifest = self.create_bundle()
+        with tarfile.open(self.bundle_file_path, 'r:') as bundle_tar:
+            members = [
+                (tarinfo, bundle_tar.extractfile(tarinfo).read())
+                for tarinfo in bundle_tar]
+        # a manifest naming a platform dir outside the cache, for a package
+        # which matches its locked hash
+        manifest['providers'][0]['platform'] = '../../../../../victim'
+        manifest_contents = json.dumps(manifest).encode()
+        members[0][0].size = len(manifest_contents)
+        members[0] = (members[0][0], manifest_contents)
+        with tarfile.open(self.bundle_file_path, 'w:') as bundle_tar:
+            for tarinfo, contents in members:
+                bundle_tar.addfile(tarinfo, io.BytesIO(contents))
+        victim_dir = os.path.join(self.temp_dir, 'victim')
+        os.makedirs(victim_dir)
+        with open(os.path.join(victim_dir, 'keep'), 'w') as f:
+            f.write('keep')
+        output_cache_dir = os.path.join(self.temp_dir, 'output-cache')
+        with self.assertRaises(lib.provider_bundle.ProviderBundleError):
+            lib.provider_bundle.unpack_provider_bundle(
+                self.bundle_file_path,
+                output_cache_dir,
+                self.locked_providers)
+        self.assertEqual(['keep'], os.listdir(victim_dir))
+
+
+class when_bundling_and_initializing_terraform_dirs(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.source_dir = os.path.join(self.temp_dir, 'source')
+        write_lock_file(
+            os.path.join(self.source_dir, 'network'), [get_package_hash()])
+        fake_terraform_path = common.create_fake_terraform(
+            self.temp_dir, FAKE_TERRAFORM_SCRIPT)
+        for patcher in [
+            unittest.mock.patch.object(
+                lib.terraform,
+                'TERRAFORM_BIN_FILE_PATH',
+                fake_terraform_path,
+            ),
+            unittest.mock.patch.object(
+                lib.terraform_dir,
+                'TERRAFORM_WORK_DIR',
+                os.path.join(self.temp_dir, 'bundle-work'),
+            ),
+            unittest.mock.patch.dict(os.environ),
+            unittest.mock.patch('builtins.print'),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        os.environ.pop(lib.terraform_dir.TERRAFORM_PLUGIN_CACHE_VAR_NAME, None)
+
+    def test_init_starts_with_the_bundled_providers(self):
+        bundle_output_dir = os.path.join(self.temp_dir, 'provider-bundle')
+        lib.terraform_dir.bundle_terraform_providers(
+            self.source_dir,
+            bundle_output_dir,
+            root_paths=['network'])
+        os.environ[lib.provider_bundle.PROVIDER_BUNDLE_VAR] = \
+            bundle_output_dir
+        work_dir = os.path.join(self.temp_dir, 'init-work')
+        # fails unless the provider is in the plugin cache before init
+        terraform_dir = lib.terraform_dir.init_terraform_dir(
+            terraform_source_dir=self.source_dir,
+            terraform_dir_path='network',
+            terraform_work_dir=work_dir)
+        self.assertTrue(
+            os.path.isfile(
+                os.path.join(
+                    terraform_dir,
+                    lib.terraform_dir.TERRAFORM_PLUGIN_CACHE_DIR_NAME,
+                    TEST_SOURCE,
+                    TEST_VERSION,
+                    TEST_PLATFORM,
+                    TEST_BINARY_NAME,
+                )))
+
+    def test_init_skips_providers_its_root_does_not_lock(self):
+        bundle_output_dir = os.path.join(self.temp_dir, 'provider-bundle')
+        lib.terraform_dir.bundle_terraform_providers(
+            self.source_dir,
+            bundle_output_dir,
+            root_paths=['network'])
+        # a root locking other builds, and a root locking nothing
+        write_lock_file(os.path.join(self.source_dir, 'dns'), ['h1:other'])
+        os.makedirs(os.path.join(self.source_dir, 'cdn'))
+        plugin_cache_dir = os.path.join(self.temp_dir, 'init-cache')
+        for root_path in ('dns', 'cdn'):
+            lib.terraform_dir._unpack_provider_bundle(
+                bundle_output_dir,
+                plugin_cache_dir,
+                self.source_dir,
+                [root_path])
+        self.assertFalse(os.path.exists(
+            os.path.join(plugin_cache_dir, TEST_SOURCE)))
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == '__main__':
+    unittest.main()
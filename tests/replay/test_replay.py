@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# stdlib
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# local
+import lib.replay
+import tests.common as common
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+ROOT_DIR = \
+    os.path.dirname(os.path.dirname(os.path.abspath(lib.replay.__file__)))
+REPLAY_BIN_FILE_PATH = os.path.join(ROOT_DIR, 'bin', 'terraform-replay')
+# writes a plan file, a large file and output, and deletes a file
+FAKE_TERRAFORM_SCRIPT = """#!/bin/sh
+echo "plan for: $*"
+echo 'a warning' 1>&2
+echo 'plan' > "${4#-out=}"
+head -c 2000000 /dev/zero > large.bin
+rm -f stale.txt
+exit 2
+"""
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+# =============================================================================
+# run_replay_bin
+# =============================================================================
+def run_replay_bin(
+        working_dir: str,
+        args: list,
+        env: dict) -> subprocess.CompletedProcess:
+    process_env = dict(os.environ)
+    process_env.update(env)
+    process_env['PYTHONPATH'] = ROOT_DIR
+    return subprocess.run(
+        [sys.executable, REPLAY_BIN_FILE_PATH, *args],
+        cwd=working_dir,
+        env=process_env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True)
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_recording_and_replaying_terraform(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.fixture_dir = os.path.join(temp_dir.name, 'fixtures')
+        self.env = {
+            lib.replay.REPLAY_FIXTURE_DIR_VAR: self.fixture_dir,
+            lib.replay.REPLAY_TERRAFORM_BIN_VAR:
+                common.create_fake_terraform(
+                    temp_dir.name, FAKE_TERRAFORM_SCRIPT),
+            'TF_IN_AUTOMATION': '1',
+        }
+        self.recorded = self.run_in_new_working_dir(lib.replay.RECORD)
+
+    def run_in_new_working_dir(self, replay_mode: str, env: dict = None):
+        working_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(working_dir.cleanup)
+        with open(os.path.join(working_dir.name, 'stale.txt'), 'w'):
+            pass
+        plan_file_path = os.path.join(working_dir.name, '.tfplan')
+        process = run_replay_bin(
+            working_dir.name,
+            [
+                '-chdir=.',
+                'plan',
+                '-detailed-exitcode',
+                f'-out={plan_file_path}',
+            ],
+            {
+                **self.env,
+                lib.replay.REPLAY_MODE_VAR: replay_mode,
+                **(env or {}),
+            })
+        return working_dir.name, process
+
+    def test_it_passes_through_the_recorded_run(self):
+        _, process = self.recorded
+        self.assertEqual(process.returncode, 2)
+        self.assertIn('plan for:', process.stdout)
+        self.assertEqual(process.stderr, 'a warning\n')
+        self.assertEqual(len(os.listdir(self.fixture_dir)), 1)
+
+    def test_it_replays_output_and_exit_code_in_another_working_dir(self):
+        working_dir, process = self.run_in_new_working_dir(lib.replay.REPLAY)
+        self.assertEqual(process.returncode, 2)
+        self.assertEqual(process.stdout, self.recorded[1].stdout.replace(
+            self.recorded[0], working_dir))
+        self.assertEqual(process.stderr, 'a warning\n')
+
+    def test_it_replays_file_side_effects(self):
+        working_dir, _ = self.run_in_new_working_dir(lib.replay.REPLAY)
+        with open(os.path.join(working_dir, '.tfplan')) as plan_file:
+            self.assertEqual(plan_file.read(), 'plan\n')
+        self.assertFalse(
+            os.path.exists(os.path.join(working_dir, 'stale.txt')))
+
+    def test_it_replays_large_files_as_empty_files(self):
+        working_dir, _ = self.run_in_new_working_dir(lib.replay.REPLAY)
+        self.assertEqual(
+            os.path.getsize(os.path.join(working_dir, 'large.bin')), 0)
+
+    def test_it_fails_for_runs_with_a_different_environment(self):
+        _, process = self.run_in_new_working_dir(
+            lib.replay.REPLAY,
+            {'TF_VAR_name': 'other'})
+        self.assertEqual(
+            process.returncode,
+            lib.replay.NOT_RECORDED_RETURN_CODE)
+        self.assertIn('no recording of:', process.stderr)
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# stdlib
+import os
+import sqlite3
+import tempfile
+import unittest
+
+# local
+import lib.run_history
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+TEST_ROOT = 'terraform-source-dir/network'
+TEST_OTHER_ROOT = 'terraform-source-dir/dns'
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+# =============================================================================
+# record_test_runs
+# =============================================================================
+def record_test_runs(
+        history_file_path: str,
+        durations: list,
+        root: str = TEST_ROOT,
+        command: str = 'apply',
+        success: bool = True) -> None:
+    for index, duration in enumerate(durations):
+        lib.run_history.record_run(
+            history_file_path,
+            root,
+            command,
+            started_at=1000.0 + index,
+            duration=duration,
+            success=success,
+            phases={'init': 1.0, 'apply': duration - 1.0},
+            counts={'resources_create': 2},
+            terraform_version='1.5.7')
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_recording_runs(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.history_file_path = \
+            os.path.join(temp_dir.name, 'cache', 'history.sqlite')
+
+    def test_it_creates_the_file_and_appends_runs(self):
+        record_test_runs(self.history_file_path, [10.0, 11.0])
+        connection = sqlite3.connect(self.history_file_path)
+        try:
+            runs = connection.execute(
+                'SELECT id, root, command, terraform_version FROM runs'
+            ).fetchall()
+            phases = connection.execute(
+                'SELECT COUNT(*) FROM phases').fetchone()[0]
+            counts = connection.execute(
+                'SELECT name, value FROM counts').fetchall()
+        finally:
+            connection.close()
+        self.assertEqual(runs, [
+            (1, TEST_ROOT, 'apply', '1.5.7'),
+            (2, TEST_ROOT, 'apply', '1.5.7'),
+        ])
+        self.assertEqual(phases, 4)
+        self.assertEqual(counts, [('resources_create', 2)] * 2)
+
+    def test_it_rejects_an_empty_file_path(self):
+        with self.assertRaises(ValueError):
+            lib.run_history.record_run('', TEST_ROOT, 'apply', 0.0, 1.0, True)
+
+
+class when_getting_duration_stats(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.history_file_path = \
+            os.path.join(temp_dir.name, 'history.sqlite')
+        record_test_runs(
+            self.history_file_path,
+            [10.0, 12.0, 11.0, 13.0, 10.0, 12.0, 11.0, 10.0, 12.0, 30.0])
+        record_test_runs(
+            self.history_file_path,
+            [100.0],
+            success=False)
+        record_test_runs(
+            self.history_file_path,
+            [5.0],
+            root=TEST_OTHER_ROOT,
+            command='plan')
+
+    def test_it_reports_p50_and_p95_per_root_and_command(self):
+        stats = lib.run_history.get_duration_stats(self.history_file_path)
+        self.assertEqual(
+            [(s['root'], s['command'], s['runs']) for s in stats],
+            [(TEST_OTHER_ROOT, 'plan', 1), (TEST_ROOT, 'apply', 10)])
+        self.assertEqual(stats[1]['p50'], 11.0)
+        self.assertEqual(stats[1]['p95'], 30.0)
+
+    def test_it_flags_runs_beyond_the_regression_threshold(self):
+        stats = lib.run_history.get_duration_stats(
+            self.history_file_path,
+            root=TEST_ROOT)
+        self.assertEqual(
+            [regression['duration'] for regression in stats[0]['regressions']],
+            [30.0])
+        stats = lib.run_history.get_duration_stats(
+            self.history_file_path,
+            root=TEST_ROOT,
+            regression_threshold=1.1)
+        self.assertEqual(
+            [regression['duration'] for regression in stats[0]['regressions']],
+            [13.0, 30.0])
+
+    def test_it_formats_the_report(self):
+        stats = lib.run_history.get_duration_stats(
+            self.history_file_path,
+            root=TEST_ROOT)
+        report = lib.run_history.format_duration_stats(stats)
+        self.assertIn(
+            f"{TEST_ROOT} apply: runs=10 p50=11.0s p95=30.0s", report)
+        self.assertIn('regression: run 10 took 30.0s', report)
+
+    def test_it_reports_nothing_without_a_history_file(self):
+        self.assertEqual(
+            lib.run_history.get_duration_stats('/nonexistent/history.sqlite'),
+            [])
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+# stdlib
+import unittest
+
+# local
+import lib.run_stats
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_collecting_run_stats(unittest.TestCase):
+    def setUp(self):
+        lib.run_stats.reset()
+        self.addCleanup(lib.run_stats.reset)
+
+    def test_it_adds_up_phases_which_run_more_than_once(self):
+        with lib.run_stats.phase('show'):
+            pass
+        first_duration = lib.run_stats.get_phases()['show']
+        with lib.run_stats.phase('show'):
+            pass
+        self.assertGreater(lib.run_stats.get_phases()['show'], first_duration)
+
+    def test_it_times_phases_which_raise(self):
+        with self.assertRaises(RuntimeError):
+            with lib.run_stats.phase('apply'):
+                raise RuntimeError()
+        self.assertIn('apply', lib.run_stats.get_phases())
+
+    def test_it_prefixes_resource_counts(self):
+        lib.run_stats.add_resource_counts({'create': 2, 'delete': 1})
+        lib.run_stats.add_resource_counts({'create': 1})
+        self.assertEqual(lib.run_stats.get_counts(), {
+            'resources_create': 3,
+            'resources_delete': 1,
+        })
+
+    def test_it_records_exit_codes(self):
+        lib.run_stats.add_exit_code('init', 0)
+        lib.run_stats.add_exit_code('plan', 2)
+        self.assertEqual(
+            lib.run_stats.get_exit_codes(), [('init', 0), ('plan', 2)])
+        lib.run_stats.reset()
+        self.assertEqual(lib.run_stats.get_exit_codes(), [])
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == '__main__':
+    unittest.main()
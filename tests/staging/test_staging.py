@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# stdlib
+import os
+import tarfile
+import tempfile
+import unittest
+import unittest.mock
+
+# local
+import lib.archive
+import lib.staging
+import tests.common as common
+
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+TEST_TREE_FILES = {
+    'main.tf': '# main',
+    'modules/a/main.tf': '# a',
+    'backend.tf': '# backend',
+    'env.tfvars.json': '{}',
+    'terraform.tfstate': '{}',
+    '.terraform/modules/m': 'm',
+}
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_staging_with_symlinks(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.source_dir = common.create_test_tree(
+            self.root.name, TEST_TREE_FILES)
+        self.destination_dir = os.path.join(self.root.name, 'destination')
+        lib.staging.stage_tree(
+            self.source_dir,
+            self.destination_dir,
+            staging_mode=lib.staging.SYMLINK)
+
+    def test_read_only_files_link_to_the_input(self):
+        for relative_path in ('main.tf', 'modules/a/main.tf'):
+            destination_path = os.path.join(
+                self.destination_dir, relative_path)
+            self.assertTrue(os.path.islink(destination_path))
+            self.assertEqual(
+                os.path.join(self.source_dir, relative_path),
+                os.readlink(destination_path))
+        # directories are real, so new files never land in the input
+        self.assertFalse(
+            os.path.islink(os.path.join(self.destination_dir, 'modules')))
+
+    def test_written_files_are_real_copies(self):
+        for relative_path in (
+                'backend.tf',
+                'env.tfvars.json',
+                'terraform.tfstate',
+                '.terraform',
+                '.terraform/modules/m'):
+            self.assertFalse(os.path.islink(
+                os.path.join(self.destination_dir, relative_path)))
+        common.write_file(
+            os.path.join(self.destination_dir, 'backend.tf'), 'new')
+        self.assertEqual(
+            '# backend',
+            common.read_file(os.path.join(self.source_dir, 'backend.tf')))
+
+    def test_archives_store_linked_files_as_files(self):
+        copied_dir = os.path.join(self.root.name, 'copied')
+        lib.staging.stage_tree(self.source_dir, copied_dir)
+        checksums = []
+        for name, source_dir in (
+                ('staged', self.destination_dir),
+                ('copied', copied_dir)):
+            archive_file_path = os.path.join(
+                self.root.name, f'{name}.tar.gz')
+            checksums.append(lib.archive.create_archive(
+                source_dir, archive_file_path, 'terraform'))
+            with tarfile.open(archive_file_path, 'r:gz') as archive_file:
+                member = archive_file.getmember('terraform/main.tf')
+                self.assertTrue(member.isreg())
+        # a staged tree archives exactly as a copied one
+        self.assertEqual(checksums[0], checksums[1])
+
+
+class when_staging_with_reflinks(unittest.TestCase):
+    def test_files_are_independent_copies(self):
+        with tempfile.TemporaryDirectory() as root:
+            source_dir = common.create_test_tree(root, TEST_TREE_FILES)
+            destination_dir = os.path.join(root, 'destination')
+            lib.staging.stage_tree(
+                source_dir,
+                destination_dir,
+                staging_mode=lib.staging.REFLINK)
+            destination_path = os.path.join(destination_dir, 'main.tf')
+            self.assertFalse(os.path.islink(destination_path))
+            self.assertEqual('# main', common.read_file(destination_path))
+            common.write_file(destination_path, 'changed')
+            self.assertEqual(
+                '# main', common.read_file(
+                    os.path.join(source_dir, 'main.tf')))
+
+    def test_unsupported_filesystems_fall_back_to_copies(self):
+        with tempfile.TemporaryDirectory() as root:
+            source_dir = common.create_test_tree(root, TEST_TREE_FILES)
+            destination_dir = os.path.join(root, 'destination')
+            with unittest.mock.patch(
+                    'fcntl.ioctl',
+                    side_effect=OSError(95, 'not supported')) as ioctl:
+                lib.staging.stage_tree(
+                    source_dir,
+                    destination_dir,
+                    staging_mode=lib.staging.REFLINK)
+            # only tried once per tree
+            self.assertEqual(1, ioctl.call_count)
+            self.assertEqual(
+                '# a',
+                common.read_file(os.path.join(
+                    destination_dir, 'modules', 'a', 'main.tf')))
+
+
+class when_getting_the_staging_mode(unittest.TestCase):
+    def test_it_defaults_to_copy(self):
+        with unittest.mock.patch.dict(os.environ, clear=True):
+            self.assertEqual(
+                lib.staging.COPY,
+                lib.staging.get_staging_mode_from_environment())
+
+    def test_it_rejects_unknown_modes(self):
+        with unittest.mock.patch.dict(
+                os.environ, {lib.staging.STAGING_MODE_VAR: 'hardlink'}):
+            with self.assertRaises(ValueError):
+                lib.staging.get_staging_mode_from_environment()
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+# stdlib
+import hashlib
+import http.server
+import json
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+import urllib.request
+
+# local
+import lib.state_cache
+import lib.terraform
+import lib.terraform_dir
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+def get_state(serial: int, value: str) -> dict:
+    return {
+        'version': 4,
+        'serial': serial,
+        'lineage': 'lineage-1',
+        'outputs': {
+            'name': {'value': value, 'type': 'string'},
+            'secret': {
+                'value': 'hunter2', 'type': 'string', 'sensitive': True},
+        },
+        'resources': [],
+    }
+
+
+class StubBackendHandler(http.server.BaseHTTPRequestHandler):
+    # a stand-in for an http state backend and consul's kv api
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body):
+        backend = self.server.backend
+        backend.requests.append((self.command, self.path, dict(self.headers)))
+        if self.path.startswith('/v1/kv/'):
+            body = json.dumps([self.path[len('/v1/kv/'):]]).encode()
+            self.send_response(200)
+            self.send_header('X-Consul-Index', str(backend.modify_index))
+        else:
+            body = json.dumps(backend.state).encode()
+            self.send_response(200)
+            if backend.send_etag:
+                self.send_header('ETag', hashlib.md5(body).hexdigest())
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubBackend:
+    def __init__(self):
+        self.state = get_state(1, 'first')
+        self.modify_index = 7
+        self.send_etag = True
+        self.requests = []
+        self.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), StubBackendHandler)
+        self.server.backend = self
+        self.address = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,))
+        self.thread.start()
+
+    def stop(self):
+        if not self.thread.is_alive():
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_checking_backend_metadata(unittest.TestCase):
+    def setUp(self):
+        self.backend = StubBackend()
+        self.addCleanup(self.backend.stop)
+        patcher = unittest.mock.patch('builtins.print')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_http_backends_are_checked_by_etag(self):
+        config = {'address': f'{self.backend.address}/state'}
+        validator = lib.state_cache.get_backend_validator('http', config)
+        self.assertTrue(validator.startswith('etag:'))
+        self.assertEqual(
+            validator, lib.state_cache.get_backend_validator('http', config))
+        self.backend.state = get_state(2, 'second')
+        self.assertNotEqual(
+            validator, lib.state_cache.get_backend_validator('http', config))
+        self.assertEqual(
+            {command for command, _, _ in self.backend.requests}, {'HEAD'})
+
+    def test_http_backends_without_etags_have_no_check(self):
+        self.backend.send_etag = False
+        self.assertIsNone(lib.state_cache.get_backend_validator(
+            'http', {'address': f'{self.backend.address}/state'}))
+
+    def test_consul_backends_are_checked_by_modify_index(self):
+        validator = lib.state_cache.get_backend_validator(
+            'consul',
+            {
+                'address': self.backend.address,
+                'path': 'tf/network',
+                'access_token': 'token',
+            },
+            workspace='staging',
+        )
+        self.assertEqual(validator, 'modify_index:7')
+        _, path, headers = self.backend.requests[0]
+        self.assertEqual(path, '/v1/kv/tf/network-env%3Astaging?keys')
+        self.assertEqual(headers['X-Consul-Token'], 'token')
+
+    def test_unreachable_backends_have_no_check(self):
+        address = self.backend.address
+        self.backend.stop()
+        self.assertIsNone(lib.state_cache.get_backend_validator(
+            'http', {'address': f'{address}/state'}))
+
+    def test_s3_backends_are_checked_by_a_signed_head(self):
+        config = {
+            'bucket': 'tfstate',
+            'key': 'network/terraform.tfstate',
+            'region': 'eu-west-1',
+            'endpoint': self.backend.address,
+            'access_key': 'AKIDEXAMPLE',
+            'secret_key': 'secret',
+        }
+        validator = lib.state_cache.get_backend_validator(
+            's3', config, workspace='staging')
+        self.assertTrue(validator.startswith('etag:'))
+        command, path, headers = self.backend.requests[0]
+        self.assertEqual('HEAD', command)
+        self.assertEqual(
+            '/tfstate/env%3A/staging/network/terraform.tfstate', path)
+        self.assertTrue(headers['Authorization'].startswith(
+            'AWS4-HMAC-SHA256 Credential=AKIDEXAMPLE/'))
+        self.assertIn('/eu-west-1/s3/aws4_request', headers['Authorization'])
+
+    def test_s3_backends_without_static_credentials_have_no_check(self):
+        with unittest.mock.patch.dict(os.environ, clear=True):
+            self.assertIsNone(lib.state_cache.get_backend_validator(
+                's3', {'bucket': 'b', 'key': 'k', 'region': 'eu-west-1'}))
+        self.assertEqual([], self.backend.requests)
+
+    def test_requests_are_signed_with_signature_version_4(self):
+        # the get-vanilla case of the aws signature version 4 test suite
+        self.assertEqual(
+            lib.state_cache._get_aws_authorization(
+                'GET',
+                'https://example.amazonaws.com/',
+                {'X-Amz-Date': '20150830T123600Z'},
+                'us-east-1',
+                'service',
+                'AKIDEXAMPLE',
+                'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY'),
+            'AWS4-HMAC-SHA256 '
+            'Credential=AKIDEXAMPLE/20150830/us-east-1/service/aws4_request, '
+            'SignedHeaders=host;x-amz-date, '
+            'Signature='
+            '5fa00fa31553b73ebf1942676e86291e8372ff2a2260956d9b8aae1d763fbf31')
+
+    def test_other_backends_have_no_check(self):
+        self.assertIsNone(lib.state_cache.get_backend_validator(
+            'gcs', {'bucket': 'b', 'prefix': 'p'}))
+
+    def test_outputs_are_read_as_terraform_prints_them(self):
+        self.assertEqual(
+            lib.state_cache.get_state_outputs(get_state(1, 'first')),
+            {
+                'name': {
+                    'sensitive': False, 'type': 'string', 'value': 'first'},
+                'secret': {
+                    'sensitive': True, 'type': 'string', 'value': 'hunter2'},
+            })
+
+    def test_keys_ignore_the_order_of_the_config(self):
+        self.assertEqual(
+            lib.state_cache.get_cache_key('consul', {'a': '1', 'b': '2'}),
+            lib.state_cache.get_cache_key('consul', {'b': '2', 'a': '1'}))
+        self.assertNotEqual(
+            lib.state_cache.get_cache_key('consul', {'a': '1'}),
+            lib.state_cache.get_cache_key('consul', {'a': '1'}, 'staging'))
+
+
+class when_reading_outputs_through_the_state_cache(unittest.TestCase):
+    def setUp(self):
+        self.backend = StubBackend()
+        self.addCleanup(self.backend.stop)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.cache_dir = os.path.join(self.temp_dir.name, 'cache')
+        self.output_dir = os.path.join(self.temp_dir.name, 'output')
+        self.init_count = 0
+        for patcher in [
+            unittest.mock.patch.dict(os.environ, {
+                'TF_BACKEND_TYPE': 'http',
+                'TF_BACKEND_CONFIG_address': f'{self.backend.address}/state',
+            }),
+            unittest.mock.patch.object(
+                lib.terraform_dir, 'init_terraform_dir', self.fake_init),
+            unittest.mock.patch.object(
+                lib.terraform, 'state_pull', self.fake_state_pull),
+            unittest.mock.patch('builtins.print'),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_init(self, debug=False):
+        self.init_count += 1
+        return self.temp_dir.name
+
+    def fake_state_pull(self, working_dir_path, output_file_path, debug=False):
+        # reads the state from the backend, as terraform would
+        address = os.environ['TF_BACKEND_CONFIG_address']
+        with urllib.request.urlopen(address) as response:
+            with open(output_file_path, 'wb') as output_file:
+                output_file.write(response.read())
+
+    def read_output(self, file_name='tf-output.json'):
+        with open(os.path.join(self.output_dir, file_name)) as f:
+            return json.load(f)
+
+    def output(self, output_targets=None):
+        lib.terraform_dir.output_terraform_dir_from_state_cache(
+            self.output_dir,
+            self.cache_dir,
+            output_targets=output_targets,
+        )
+
+    def test_an_unchanged_state_is_served_from_the_cache(self):
+        self.output()
+        self.assertEqual(self.init_count, 1)
+        self.assertEqual(self.read_output()['name']['value'], 'first')
+        os.remove(os.path.join(self.output_dir, 'tf-output.json'))
+        self.output()
+        self.assertEqual(self.init_count, 1)
+        self.assertEqual(self.read_output()['name']['value'], 'first')
+
+    def test_a_changed_state_is_read_again(self):
+        self.output()
+        self.backend.state = get_state(2, 'second')
+        self.output()
+        self.assertEqual(self.init_count, 2)
+        self.assertEqual(self.read_output()['name']['value'], 'second')
+
+    def test_targets_are_written_to_their_own_files(self):
+        self.output()
+        self.output(output_targets={'network_name': 'name'})
+        self.assertEqual(self.init_count, 1)
+        self.assertEqual(
+            self.read_output('network_name.json'),
+            {'sensitive': False, 'type': 'string', 'value': 'first'})
+
+    def test_entries_are_private(self):
+        self.output()
+        entry_file_name, = os.listdir(self.cache_dir)
+        entry_file_path = os.path.join(self.cache_dir, entry_file_name)
+        self.assertEqual(os.stat(entry_file_path).st_mode & 0o777, 0o600)
+        with open(entry_file_path) as f:
+            entry = json.load(f)
+        self.assertEqual(entry['lineage'], 'lineage-1')
+        self.assertEqual(entry['serial'], 1)
+        self.assertNotIn(self.backend.address, json.dumps(entry))
+
+    def test_a_backend_type_is_required(self):
+        del os.environ['TF_BACKEND_TYPE']
+        with self.assertRaises(ValueError):
+            self.output()
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == '__main__':
+    unittest.main()
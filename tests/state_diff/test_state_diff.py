@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+# stdlib
+import json
+import os
+import tempfile
+import tracemalloc
+import unittest
+import unittest.mock
+
+# local
+import lib.state_diff
+import lib.terraform_dir
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+LARGE_STATE_INSTANCE_COUNT = 10000
+# small runs, so the merge of many runs on disk is exercised
+LARGE_STATE_RUN_SIZE = 1000
+LARGE_STATE_MAX_PEAK_MEMORY = 2 * 1024 * 1024
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+# =============================================================================
+# write_state_file
+# =============================================================================
+def write_state_file(file_path: str, resources: list) -> None:
+    with open(file_path, 'w') as state_file:
+        json.dump({
+            'version': 4,
+            'serial': 1,
+            'lineage': 'test',
+            'outputs': {'value': {'value': 'x', 'type': 'string'}},
+            'resources': resources,
+        }, state_file)
+
+
+# =============================================================================
+# resource
+# =============================================================================
+def resource(
+    name: str,
+    instances: list,
+    module: str = '',
+    mode: str = 'managed',
+) -> dict:
+    # same key order as terraform, with the instances last
+    test_resource = {'module': module} if module else {}
+    test_resource.update({
+        'mode': mode,
+        'type': 'null_resource',
+        'name': name,
+        'provider': 'provider["registry.terraform.io/hashicorp/null"]',
+        'instances': instances,
+    })
+    return test_resource
+
+
+# =============================================================================
+# instance
+# =============================================================================
+def instance(value: str, **kwargs) -> dict:
+    return {
+        'schema_version': 0,
+        'attributes': {'id': value, 'triggers': {'value': value}},
+        **kwargs,
+    }
+
+
+# =============================================================================
+# write_large_state_file
+# =============================================================================
+def write_large_state_file(file_path: str, changed_every: int) -> None:
+    # written piece by piece, so only the diff is measured
+    with open(file_path, 'w') as state_file:
+        state_file.write('{"version": 4, "resources": [')
+        state_file.write(json.dumps(resource('many', [
+            instance(
+                f'{index // changed_every}-{index}',
+                index_key=f'key-{index:06d}')
+            for index in range(LARGE_STATE_INSTANCE_COUNT)
+        ])))
+        state_file.write(']}')
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_diffing_state_files(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.before_file_path = os.path.join(
+            self.state_dir.name, 'terraform.tfstate.backup')
+        self.after_file_path = os.path.join(
+            self.state_dir.name, 'terraform.tfstate')
+        write_state_file(self.before_file_path, [
+            resource('kept', [instance('a')]),
+            resource('changed', [instance('before')]),
+            resource('removed', [instance('a')]),
+            resource('counted', [
+                instance('a', index_key=0),
+                instance('b', index_key=1),
+            ]),
+        ])
+        write_state_file(self.after_file_path, [
+            resource('counted', [instance('a', index_key=0)]),
+            resource('kept', [instance('a')]),
+            resource('changed', [instance('after')]),
+            resource('added', [instance('a')], module='module.child'),
+            resource('keyed', [instance('a', index_key='x')], mode='data'),
+        ])
+
+    def tearDown(self):
+        self.state_dir.cleanup()
+
+    def test_it_reports_changes_by_address(self):
+        self.assertEqual(
+            {
+                ('removed', 'null_resource.counted[1]'),
+                ('changed', 'null_resource.changed'),
+                ('added', 'data.null_resource.keyed["x"]'),
+                ('added', 'module.child.null_resource.added'),
+                ('removed', 'null_resource.removed'),
+            },
+            set(lib.state_diff.iter_state_diff(
+                self.before_file_path,
+                self.after_file_path,
+                run_size=2)))
+
+    def test_a_missing_before_state_adds_everything(self):
+        changes = list(lib.state_diff.iter_state_diff(
+            os.path.join(self.state_dir.name, 'missing'),
+            self.after_file_path))
+        self.assertEqual(5, len(changes))
+        self.assertEqual({'added'}, {change for change, _ in changes})
+
+    def test_it_writes_the_diff_file(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            counts = lib.state_diff.write_state_diff(
+                self.before_file_path,
+                self.after_file_path,
+                output_dir)
+            with open(os.path.join(output_dir, 'state-diff.json')) as diff:
+                state_diff = json.load(diff)
+        self.assertEqual({'added': 2, 'removed': 2, 'changed': 1}, counts)
+        self.assertEqual(counts, state_diff['counts'])
+        self.assertEqual(['null_resource.changed'], state_diff['changed'])
+        self.assertEqual(
+            ['null_resource.counted[1]', 'null_resource.removed'],
+            state_diff['removed'])
+
+
+class when_diffing_state_in_terraform_dirs(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.terraform_dir = temp_dir.name
+        self.state_output_dir = os.path.join(temp_dir.name, 'state-output')
+        self.diff_file_path = os.path.join(
+            self.state_output_dir, 'state-diff.json')
+        for patcher in [
+            unittest.mock.patch.dict(os.environ),
+            unittest.mock.patch('builtins.print'),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        os.environ.pop(lib.terraform_dir.BACKEND_TYPE_VAR, None)
+
+    def diff_state_files(self, terraform_dir_path: str = '') -> bool:
+        return lib.terraform_dir._diff_state_files_in_terraform_dir(
+            self.terraform_dir,
+            self.state_output_dir,
+            terraform_dir_path=terraform_dir_path)
+
+    def test_it_diffs_the_state_of_the_terraform_dir_path(self):
+        root_dir = os.path.join(self.terraform_dir, 'network')
+        os.makedirs(root_dir)
+        write_state_file(
+            os.path.join(root_dir, 'terraform.tfstate'),
+            [resource('added', [instance('a')])])
+        self.assertTrue(self.diff_state_files(terraform_dir_path='network'))
+        with open(self.diff_file_path) as diff:
+            self.assertEqual(
+                ['null_resource.added'], json.load(diff)['added'])
+
+    def test_it_skips_a_remote_backend(self):
+        # a stale local state file is not the state of a remote backend
+        write_state_file(
+            os.path.join(self.terraform_dir, 'terraform.tfstate'), [])
+        os.environ[lib.terraform_dir.BACKEND_TYPE_VAR] = 's3'
+        self.assertFalse(self.diff_state_files())
+        self.assertFalse(os.path.exists(self.diff_file_path))
+
+    def test_it_skips_a_dir_without_local_state(self):
+        self.assertFalse(self.diff_state_files())
+        self.assertFalse(os.path.exists(self.diff_file_path))
+
+    def test_it_diffs_and_exports_the_state_file_applied(self):
+        input_state_file_path = os.path.join(
+            self.terraform_dir, 'input.tfstate')
+        write_state_file(input_state_file_path, [])
+        os.makedirs(os.path.join(self.terraform_dir, 'network'))
+
+        def apply(working_dir, terraform_dir_path='.', state_file_path='',
+                  **kwargs):
+            # as terraform does, relative to the dir it runs in
+            applied_file_path = os.path.join(
+                working_dir, terraform_dir_path, state_file_path)
+            os.replace(applied_file_path, applied_file_path + '.backup')
+            write_state_file(
+                applied_file_path, [resource('added', [instance('a')])])
+
+        with unittest.mock.patch('lib.terraform.apply', side_effect=apply):
+            lib.terraform_dir.apply_terraform_dir(
+                self.terraform_dir,
+                terraform_dir_path='network',
+                state_file_path=input_state_file_path,
+                state_output_dir=self.state_output_dir,
+                state_diff=True)
+        with open(self.diff_file_path) as diff:
+            self.assertEqual(
+                ['null_resource.added'], json.load(diff)['added'])
+        with open(os.path.join(
+                self.state_output_dir, 'terraform.tfstate')) as state_file:
+            self.assertEqual(1, len(json.load(state_file)['resources']))
+
+
+class when_diffing_large_state_files(unittest.TestCase):
+    def test_memory_stays_bounded(self):
+        with tempfile.TemporaryDirectory() as state_dir:
+            before_file_path = os.path.join(state_dir, 'before')
+            after_file_path = os.path.join(state_dir, 'after')
+            write_large_state_file(before_file_path, changed_every=1)
+            write_large_state_file(after_file_path, changed_every=2)
+            tracemalloc.start()
+            try:
+                changes = [
+                    change for change, _ in lib.state_diff.iter_state_diff(
+                        before_file_path,
+                        after_file_path,
+                        run_size=LARGE_STATE_RUN_SIZE)
+                ]
+                _, peak_memory = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        # every instance but the first has a new value
+        self.assertEqual(
+            ['changed'] * (LARGE_STATE_INSTANCE_COUNT - 1),
+            changes)
+        self.assertLess(peak_memory, LARGE_STATE_MAX_PEAK_MEMORY)
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()
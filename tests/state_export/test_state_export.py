@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# stdlib
+import gzip
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+# local
+import lib.state_export
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+TEST_LINEAGE = '5e4b1f0c-0000-4000-8000-000000000000'
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+# =============================================================================
+# write_state_file
+# =============================================================================
+def write_state_file(file_path: str, serial: int) -> None:
+    with open(file_path, 'w') as state_file:
+        json.dump({
+            'version': 4,
+            'terraform_version': '0.14.0',
+            'serial': serial,
+            'lineage': TEST_LINEAGE,
+            'outputs': {},
+            'resources': [{'type': 'null_resource', 'name': f'r{serial}'}],
+        }, state_file)
+
+
+# =============================================================================
+# read_file
+# =============================================================================
+def read_file(file_path: str) -> bytes:
+    with open(file_path, 'rb') as state_file:
+        return state_file.read()
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_exporting_state_files(unittest.TestCase):
+    def setUp(self):
+        self.terraform_dir = tempfile.TemporaryDirectory()
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.state_file_path = os.path.join(
+            self.terraform_dir.name, 'terraform.tfstate')
+        self.backup_file_path = os.path.join(
+            self.terraform_dir.name, 'terraform.tfstate.backup')
+        write_state_file(self.state_file_path, 2)
+        write_state_file(self.backup_file_path, 1)
+
+    def tearDown(self):
+        self.terraform_dir.cleanup()
+        self.output_dir.cleanup()
+
+    def export(self, compress: bool = False) -> dict:
+        return lib.state_export.export_state_files(
+            self.terraform_dir.name,
+            self.output_dir.name,
+            compress=compress)
+
+    def test_it_copies_the_files_and_writes_a_manifest(self):
+        manifest = self.export()
+        self.assertEqual(
+            sorted([
+                'terraform.tfstate',
+                'terraform.tfstate.backup',
+                'terraform.tfstate.manifest.json',
+            ]),
+            sorted(os.listdir(self.output_dir.name)))
+        self.assertEqual(
+            read_file(self.state_file_path),
+            read_file(os.path.join(self.output_dir.name, 'terraform.tfstate')))
+        state_entry = manifest['files']['terraform.tfstate']
+        self.assertEqual(2, state_entry['serial'])
+        self.assertEqual(TEST_LINEAGE, state_entry['lineage'])
+        self.assertEqual('blake2b', manifest['algorithm'])
+        self.assertEqual(
+            manifest,
+            lib.state_export.read_state_manifest(self.output_dir.name))
+
+    def test_it_skips_a_backup_identical_to_the_state(self):
+        write_state_file(self.backup_file_path, 2)
+        manifest = self.export()
+        self.assertEqual(
+            {'same_as': 'terraform.tfstate'},
+            manifest['files']['terraform.tfstate.backup'])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.output_dir.name, 'terraform.tfstate.backup')))
+
+    def test_it_skips_files_already_exported(self):
+        self.export()
+        with unittest.mock.patch(
+                'lib.state_export._write_file_atomically') as mock_write:
+            self.export()
+        mock_write.assert_not_called()
+
+    def test_it_keeps_the_previous_file_when_a_write_fails(self):
+        self.export()
+        exported_file_path = os.path.join(
+            self.output_dir.name, 'terraform.tfstate')
+        previous_contents = read_file(exported_file_path)
+        write_state_file(self.state_file_path, 3)
+        with unittest.mock.patch('os.replace', side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.export()
+        self.assertEqual(previous_contents, read_file(exported_file_path))
+        # no temporary files are left behind
+        self.assertEqual(
+            [],
+            [name for name in os.listdir(self.output_dir.name)
+             if name.startswith('.')])
+
+    def test_it_compresses_deterministically(self):
+        manifest = self.export(compress=True)
+        exported_file_path = os.path.join(
+            self.output_dir.name, 'terraform.tfstate.gz')
+        with gzip.open(exported_file_path, 'rb') as exported_file:
+            self.assertEqual(
+                read_file(self.state_file_path), exported_file.read())
+        checksum = manifest['files']['terraform.tfstate']['checksum']
+        os.remove(exported_file_path)
+        manifest = self.export(compress=True)
+        self.assertEqual(
+            checksum, manifest['files']['terraform.tfstate']['checksum'])
+
+    def test_it_detects_corrupted_files(self):
+        self.export()
+        exported_file_path = os.path.join(
+            self.output_dir.name, 'terraform.tfstate')
+        lib.state_export.verify_state_file(exported_file_path)
+        with open(exported_file_path, 'a') as exported_file:
+            exported_file.write(' ')
+        with self.assertRaises(lib.state_export.StateIntegrityError):
+            lib.state_export.verify_state_file(exported_file_path)
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# stdlib
+import asyncio
+import os
+import subprocess
+import tempfile
+import unittest
+import unittest.mock
+
+# local
+import lib.terraform
+import lib.terraform_async
+import tests.common as common
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+# the first arg is -chdir, the second the terraform command
+FAKE_TERRAFORM_SCRIPT = """#!/bin/sh
+case "$2" in
+    init)
+        echo "plugin cache: $TF_PLUGIN_CACHE_DIR"
+        echo "in automation: $TF_IN_AUTOMATION"
+        printf 'no trailing newline' 1>&2
+        ;;
+    plan)
+        echo 'Plan: 1 to add, 0 to change, 0 to destroy.'
+        exit "${FAKE_PLAN_EXIT_CODE:-2}"
+        ;;
+    apply)
+        # fails if another apply is running
+        mkdir "$FAKE_LOCK_DIR" || exit 1
+        sleep 0.1
+        rmdir "$FAKE_LOCK_DIR"
+        ;;
+    show)
+        trap 'echo interrupted > "$FAKE_SIGNAL_FILE"; exit 130' INT
+        echo 'started'
+        while true; do sleep 0.05; done
+        ;;
+    output)
+        echo '{"name": {"value": "test"}}'
+        ;;
+esac
+"""
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_running_terraform_asynchronously(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        patcher = unittest.mock.patch.object(
+            lib.terraform,
+            'TERRAFORM_BIN_FILE_PATH',
+            common.create_fake_terraform(
+                self.temp_dir.name, FAKE_TERRAFORM_SCRIPT),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_it_passes_lines_to_the_callbacks(self):
+        stdout_lines = []
+        stderr_lines = []
+        return_code = asyncio.run(lib.terraform_async.init(
+            self.temp_dir.name,
+            plugin_cache_dir_path='/tmp/plugin-cache',
+            on_stdout_line=stdout_lines.append,
+            on_stderr_line=stderr_lines.append,
+        ))
+        self.assertEqual(return_code, 0)
+        self.assertEqual(stdout_lines, [
+            'plugin cache: /tmp/plugin-cache\n',
+            'in automation: 1\n',
+        ])
+        self.assertEqual(stderr_lines, ['no trailing newline'])
+
+    def test_it_never_changes_the_environment_of_this_process(self):
+        with unittest.mock.patch.dict(os.environ, clear=False):
+            os.environ.pop('TF_PLUGIN_CACHE_DIR', None)
+            asyncio.run(lib.terraform_async.init(
+                self.temp_dir.name,
+                plugin_cache_dir_path='/tmp/plugin-cache',
+                on_stdout_line=lambda line: None,
+                on_stderr_line=lambda line: None,
+            ))
+            self.assertNotIn('TF_PLUGIN_CACHE_DIR', os.environ)
+
+    def test_it_returns_the_detailed_exit_code_of_a_plan(self):
+        return_code = asyncio.run(lib.terraform_async.plan(
+            self.temp_dir.name,
+            on_stdout_line=lambda line: None,
+        ))
+        self.assertEqual(return_code, 2)
+
+    def test_it_raises_when_a_plan_has_no_changes(self):
+        with unittest.mock.patch.dict(
+                os.environ, {'FAKE_PLAN_EXIT_CODE': '0'}):
+            with self.assertRaises(lib.terraform.TerraformNoChangesError):
+                asyncio.run(lib.terraform_async.plan(
+                    self.temp_dir.name,
+                    on_stdout_line=lambda line: None,
+                ))
+            return_code = asyncio.run(lib.terraform_async.plan(
+                self.temp_dir.name,
+                error_on_no_changes=False,
+                on_stdout_line=lambda line: None,
+            ))
+        self.assertEqual(return_code, 0)
+
+    def test_it_raises_when_terraform_fails(self):
+        with unittest.mock.patch.dict(
+                os.environ, {'FAKE_PLAN_EXIT_CODE': '1'}):
+            with self.assertRaises(subprocess.CalledProcessError):
+                asyncio.run(lib.terraform_async.plan(
+                    self.temp_dir.name,
+                    on_stdout_line=lambda line: None,
+                ))
+
+    def test_it_writes_output_to_a_file(self):
+        output_file_path = os.path.join(self.temp_dir.name, 'output.json')
+        asyncio.run(lib.terraform_async.output(
+            self.temp_dir.name,
+            output_file_path,
+        ))
+        with open(output_file_path) as output_file:
+            self.assertEqual(
+                output_file.read(), '{"name": {"value": "test"}}\n')
+
+    def test_it_limits_concurrent_processes_with_a_semaphore(self):
+        lock_dir = os.path.join(self.temp_dir.name, 'lock')
+
+        async def apply_all():
+            semaphore = asyncio.Semaphore(1)
+            return await asyncio.gather(*[
+                lib.terraform_async.apply(
+                    self.temp_dir.name,
+                    semaphore=semaphore,
+                )
+                for _ in range(3)
+            ])
+
+        with unittest.mock.patch.dict(os.environ, {'FAKE_LOCK_DIR': lock_dir}):
+            self.assertEqual(asyncio.run(apply_all()), [0, 0, 0])
+
+    def test_it_interrupts_terraform_when_cancelled(self):
+        signal_file_path = os.path.join(self.temp_dir.name, 'signal')
+
+        async def show_and_cancel():
+            started = asyncio.Event()
+            task = asyncio.ensure_future(lib.terraform_async.show(
+                self.temp_dir.name,
+                'plan.tfplan',
+                on_stdout_line=lambda line: started.set(),
+            ))
+            await asyncio.wait_for(started.wait(), 10)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with unittest.mock.patch.dict(
+            os.environ,
+            {'FAKE_SIGNAL_FILE': signal_file_path},
+        ):
+            asyncio.run(show_and_cancel())
+        with open(signal_file_path) as signal_file:
+            self.assertEqual(signal_file.read(), 'interrupted\n')
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == '__main__':
+    unittest.main()
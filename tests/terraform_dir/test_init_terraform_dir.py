@@ -3,6 +3,7 @@
 # stdlib
 import os
 import unittest
+import unittest.mock
 
 # local
 import lib.terraform_dir
@@ -227,10 +228,40 @@ class TestInitTerraformDir(unittest.TestCase):
                         terraform_work_dir=test_working_dir,
                         debug=True
                     )
+                    # the export runs in the background until waited on
+                    self.assertTrue(
+                        lib.terraform_dir.wait_for_plugin_cache_exports())
                     # assert the dir was created
                     self.assertTrue(os.path.exists(cached_plugin_arch_dir))
 
 
+class TestPluginCacheExport(unittest.TestCase):
+    def test_exports_in_the_background(self):
+        with common.create_test_working_dir() as test_working_dir:
+            plugin_cache_dir = os.path.join(test_working_dir, 'plugins')
+            os.makedirs(os.path.join(plugin_cache_dir, 'linux_amd64'))
+            output_plugin_cache_dir = os.path.join(test_working_dir, 'cache')
+            lib.terraform_dir._start_plugin_cache_export(
+                plugin_cache_dir, output_plugin_cache_dir)
+            self.assertTrue(lib.terraform_dir.wait_for_plugin_cache_exports())
+            self.assertTrue(os.path.isdir(
+                os.path.join(output_plugin_cache_dir, 'linux_amd64')))
+
+    def test_export_failures_are_only_reported(self):
+        with common.create_test_working_dir() as test_working_dir:
+            lib.terraform_dir._start_plugin_cache_export(
+                os.path.join(test_working_dir, 'missing'),
+                os.path.join(test_working_dir, 'cache'))
+            with unittest.mock.patch('builtins.print') as mocked_print:
+                self.assertFalse(
+                    lib.terraform_dir.wait_for_plugin_cache_exports())
+            self.assertIn(
+                '[warning] could not export plugin cache',
+                mocked_print.call_args[0][0])
+            # nothing is left to wait on
+            self.assertTrue(lib.terraform_dir.wait_for_plugin_cache_exports())
+
+
 # =============================================================================
 #
 # main
@@ -3,13 +3,32 @@
 # stdlib
 import json
 import os
+import tempfile
 import unittest
+import unittest.mock
 
 # local
+import lib.terraform
 import lib.terraform_dir
+import tests.common
 import tests.terraform_dir.common as common
 
 
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+# outputs only exist in the root given by -chdir, as with real state
+FAKE_TERRAFORM_SCRIPT = """#!/bin/sh
+cd "${1#-chdir=}" || exit 1
+if [ "$2" = "output" ]; then
+    cat outputs.json
+fi
+"""
+
+
 # =============================================================================
 #
 # test classes
@@ -87,6 +106,101 @@ class TestOutputTerraformDir(unittest.TestCase):
                                  'hello world')
 
 
+class TestApplyWritesOutputs(unittest.TestCase):
+    # terraform itself is stubbed out, only the wiring is under test
+    def setUp(self):
+        self.terraform_dir = tempfile.TemporaryDirectory()
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.terraform_dir.cleanup)
+        self.addCleanup(self.output_dir.cleanup)
+        self.calls = []
+        apply_patcher = unittest.mock.patch(
+            'lib.terraform.apply',
+            side_effect=lambda *args, **kwargs: self.calls.append('apply'))
+        output_patcher = unittest.mock.patch(
+            'lib.terraform.output',
+            side_effect=self.write_output)
+        apply_patcher.start()
+        output_patcher.start()
+        self.addCleanup(apply_patcher.stop)
+        self.addCleanup(output_patcher.stop)
+
+    def write_output(self, working_dir, output_file_path, **kwargs):
+        self.calls.append('output')
+        with open(output_file_path, 'w') as output_file:
+            json.dump({'example': {'value': 'hello world'}}, output_file)
+
+    def test_apply_writes_outputs_after_applying(self):
+        lib.terraform_dir.apply_terraform_dir(
+            self.terraform_dir.name,
+            output_dir=self.output_dir.name,
+            debug=True)
+        self.assertEqual(['apply', 'output'], self.calls)
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.output_dir.name,
+            lib.terraform_dir.TERRAFORM_OUTPUT_FILE_NAME)))
+
+    def test_apply_plan_writes_output_targets(self):
+        lib.terraform_dir.apply_terraform_plan(
+            self.terraform_dir.name,
+            output_dir=self.output_dir.name,
+            output_targets={'test': 'example'},
+            debug=True)
+        self.assertEqual(['apply', 'output'], self.calls)
+        with open(os.path.join(self.output_dir.name, 'test.json')) as f:
+            self.assertEqual({'value': 'hello world'}, json.load(f))
+
+    def test_apply_without_output_dir_does_not_output(self):
+        lib.terraform_dir.apply_terraform_plan(
+            self.terraform_dir.name,
+            debug=True)
+        self.assertEqual(['apply'], self.calls)
+
+
+class when_applying_with_a_terraform_dir_path(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.terraform_dir = os.path.join(temp_dir.name, 'work')
+        self.output_dir = os.path.join(temp_dir.name, 'output')
+        os.makedirs(os.path.join(self.terraform_dir, 'network'))
+        with open(os.path.join(
+                self.terraform_dir, 'network', 'outputs.json'), 'w') as f:
+            json.dump({'example': {'value': 'hello world'}}, f)
+        fake_terraform_path = tests.common.create_fake_terraform(
+            temp_dir.name, FAKE_TERRAFORM_SCRIPT)
+        for patcher in [
+            unittest.mock.patch.object(
+                lib.terraform,
+                'TERRAFORM_BIN_FILE_PATH',
+                fake_terraform_path,
+            ),
+            unittest.mock.patch('builtins.print'),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_it_reads_outputs_in_the_terraform_dir_path(self):
+        lib.terraform_dir.apply_terraform_dir(
+            self.terraform_dir,
+            terraform_dir_path='network',
+            output_dir=self.output_dir)
+        with open(os.path.join(
+                self.output_dir,
+                lib.terraform_dir.TERRAFORM_OUTPUT_FILE_NAME)) as f:
+            self.assertEqual(
+                {'example': {'value': 'hello world'}}, json.load(f))
+
+    def test_it_reads_output_targets_in_the_terraform_dir_path(self):
+        lib.terraform_dir.apply_terraform_dir(
+            self.terraform_dir,
+            terraform_dir_path='network',
+            output_dir=self.output_dir,
+            output_targets={'test': 'example'})
+        with open(os.path.join(self.output_dir, 'test.json')) as f:
+            self.assertEqual({'value': 'hello world'}, json.load(f))
+
+
 # =============================================================================
 #
 # main
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# stdlib
+import json
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+# local
+import lib.staging
+import lib.terraform
+import lib.trace
+import tests.common as common
+
+# =============================================================================
+#
+# constants
+#
+# =============================================================================
+
+FAKE_TERRAFORM_SCRIPT = """#!/bin/sh
+echo 'Terraform v0.0.0'
+"""
+
+
+# =============================================================================
+#
+# test helpers
+#
+# =============================================================================
+
+def get_spans(name=None):
+    return [
+        event for event in lib.trace.get_events()
+        if event['ph'] == lib.trace.COMPLETE_EVENT
+        and (name is None or event['name'] == name)
+    ]
+
+
+def write_file(path: str, size: int) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_tracing(unittest.TestCase):
+    def setUp(self):
+        lib.trace.reset()
+        self.addCleanup(lib.trace.reset)
+
+    def test_nothing_is_recorded_unless_enabled(self):
+        with lib.trace.span('plan', 'terraform') as span_args:
+            span_args['pid'] = 1
+        self.assertEqual(lib.trace.get_events(), [])
+
+    def test_spans_nest_within_each_other(self):
+        lib.trace.enable()
+        with lib.trace.span('outer', 'test'):
+            with lib.trace.span('inner', 'test', path='a') as span_args:
+                span_args['size'] = 1
+        inner, outer = get_spans()
+        self.assertEqual(inner['args'], {'path': 'a', 'size': 1})
+        self.assertEqual(inner['tid'], outer['tid'])
+        self.assertGreaterEqual(inner['ts'], outer['ts'])
+        self.assertLessEqual(
+            inner['ts'] + inner['dur'], outer['ts'] + outer['dur'])
+
+    def test_threads_and_tracks_are_named(self):
+        lib.trace.enable()
+
+        def archive():
+            with lib.trace.span('a', 'test'):
+                pass
+
+        thread = threading.Thread(target=archive, name='archive')
+        with lib.trace.span('b', 'test', track='terraform network'):
+            thread.start()
+            thread.join()
+        names = {
+            event['args']['name']: event['tid']
+            for event in lib.trace.get_events()
+            if event['ph'] == lib.trace.METADATA_EVENT
+        }
+        self.assertEqual(
+            names['terraform network'], get_spans('b')[0]['tid'])
+        self.assertIn('archive', names)
+        self.assertNotEqual(names['archive'], names['terraform network'])
+
+    def test_traced_functions_are_named_after_the_function(self):
+        lib.trace.enable()
+
+        @lib.trace.traced('test')
+        def restore(value):
+            return value
+
+        self.assertEqual(restore(1), 1)
+        self.assertEqual(len(get_spans('restore')), 1)
+
+    def test_only_files_over_the_threshold_are_recorded(self):
+        lib.trace.enable(file_size_threshold=10)
+        with lib.trace.file_span('copy', 'file', 'small', 9):
+            pass
+        with lib.trace.file_span('copy', 'file', 'large', 10):
+            pass
+        self.assertEqual(
+            [span['args']['path'] for span in get_spans('copy')], ['large'])
+
+    def test_copies_are_recorded_file_by_file(self):
+        lib.trace.enable(file_size_threshold=100)
+        with tempfile.TemporaryDirectory() as root:
+            source_dir = os.path.join(root, 'source')
+            write_file(os.path.join(source_dir, 'provider'), 100)
+            write_file(os.path.join(source_dir, 'main.tf'), 10)
+            lib.staging.stage_tree(source_dir, os.path.join(root, 'dest'))
+        spans = get_spans('copy')
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]['args']['size'], 100)
+
+    def test_terraform_processes_are_recorded(self):
+        lib.trace.enable()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fake_terraform_path = common.create_fake_terraform(
+                temp_dir, FAKE_TERRAFORM_SCRIPT)
+            with unittest.mock.patch.object(
+                    lib.terraform,
+                    'TERRAFORM_BIN_FILE_PATH',
+                    fake_terraform_path), \
+                    unittest.mock.patch('builtins.print'):
+                lib.terraform.init(temp_dir)
+        process_span = get_spans('terraform')[0]
+        self.assertEqual(process_span['cat'], 'subprocess')
+        self.assertEqual(process_span['args']['command'], 'init')
+        self.assertEqual(process_span['args']['exit_code'], 0)
+        self.assertIn('pid', process_span['args'])
+        self.assertEqual(len(get_spans('init')), 1)
+
+    def test_it_writes_the_trace_event_format(self):
+        lib.trace.enable()
+        with lib.trace.span('plan', 'terraform'):
+            pass
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_file_path = os.path.join(temp_dir, 'trace', 'trace.json')
+            with unittest.mock.patch('builtins.print'):
+                lib.trace.write_trace(trace_file_path)
+            with open(trace_file_path) as trace_file:
+                trace = json.load(trace_file)
+        self.assertEqual(
+            [event['name'] for event in trace['traceEvents']],
+            ['thread_name', 'plan'])
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == '__main__':
+    unittest.main()
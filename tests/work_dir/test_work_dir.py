@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+# stdlib
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+# local
+import lib.terraform_dir
+import lib.work_dir
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_parsing_sizes(unittest.TestCase):
+    def test_it_accepts_binary_suffixes(self):
+        self.assertEqual(512, lib.work_dir.parse_size('512'))
+        self.assertEqual(2048, lib.work_dir.parse_size('2K'))
+        self.assertEqual(3 * 1024 ** 2, lib.work_dir.parse_size('3MiB'))
+        self.assertEqual(1024 ** 3, lib.work_dir.parse_size('1g'))
+
+    def test_it_rejects_invalid_sizes(self):
+        with self.assertRaises(ValueError):
+            lib.work_dir.parse_size('lots')
+
+
+class when_choosing_a_work_dir_root(unittest.TestCase):
+    def setUp(self):
+        self.tmpfs_root = tempfile.TemporaryDirectory()
+        self.disk_root = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpfs_root.cleanup()
+        self.disk_root.cleanup()
+
+    def choose(self, estimated_size, memory_budget, tmpfs_root=None):
+        return lib.work_dir.choose_work_dir_root(
+            estimated_size,
+            memory_budget,
+            tmpfs_root=tmpfs_root or self.tmpfs_root.name,
+            disk_root=self.disk_root.name)
+
+    def test_it_uses_memory_when_the_tree_fits_the_budget(self):
+        self.assertEqual(self.tmpfs_root.name, self.choose(1024, 4096))
+
+    def test_it_uses_disk_when_the_tree_exceeds_the_budget(self):
+        self.assertEqual(self.disk_root.name, self.choose(8192, 4096))
+
+    def test_it_uses_disk_without_a_budget_or_tmpfs(self):
+        self.assertEqual(self.disk_root.name, self.choose(1, None))
+        self.assertEqual(
+            self.disk_root.name,
+            self.choose(1, 4096, tmpfs_root='/nonexistent/shm'))
+
+    def test_it_estimates_size_with_headroom(self):
+        with open(os.path.join(self.disk_root.name, 'main.tf'), 'w') as f:
+            f.write('x' * 1000)
+        os.symlink('main.tf', os.path.join(self.disk_root.name, 'link.tf'))
+        self.assertEqual(
+            1500,
+            lib.work_dir.estimate_work_dir_size([self.disk_root.name, '']))
+
+
+class when_creating_work_dirs(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        patcher = unittest.mock.patch.multiple(
+            'lib.work_dir',
+            _current_work_dir=None,
+            _current_work_dir_created=False,
+            _current_lock_file=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # the root restored work dirs must be within
+        env_patcher = unittest.mock.patch.dict(
+            os.environ,
+            {lib.work_dir.WORK_DIR_DISK_ROOT_VAR: self.root.name})
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+        self.addCleanup(self.root.cleanup)
+        self.addCleanup(lib.work_dir._remove_current_work_dir)
+
+    def test_each_run_gets_a_unique_locked_work_dir(self):
+        work_dir = lib.work_dir.create_work_dir(self.root.name)
+        self.assertTrue(
+            os.path.basename(work_dir).startswith('tfwork-'))
+        self.assertEqual(work_dir, lib.work_dir.get_current_work_dir())
+        self.assertEqual(
+            work_dir, lib.work_dir.create_work_dir(self.root.name))
+        # another run cannot take the lock, so does not consider it stale
+        self.assertEqual(
+            [], lib.work_dir.cleanup_stale_work_dirs(self.root.name))
+        self.assertTrue(os.path.isdir(work_dir))
+
+    def test_it_removes_stale_work_dirs(self):
+        stale_work_dir = os.path.join(self.root.name, 'tfwork-stale')
+        creating_work_dir = os.path.join(self.root.name, 'tfwork-creating')
+        other_dir = os.path.join(self.root.name, 'other')
+        os.makedirs(stale_work_dir)
+        os.makedirs(creating_work_dir)
+        os.makedirs(other_dir)
+        open(os.path.join(stale_work_dir, '.tfwork.lock'), 'w').close()
+        work_dir = lib.work_dir.create_work_dir(self.root.name)
+        self.assertFalse(os.path.exists(stale_work_dir))
+        self.assertTrue(os.path.isdir(creating_work_dir))
+        self.assertTrue(os.path.isdir(other_dir))
+        self.assertTrue(os.path.isdir(work_dir))
+
+    def test_plan_archives_restore_to_their_original_work_dir(self):
+        work_dir = lib.work_dir.create_work_dir(self.root.name)
+        terraform_dir = lib.terraform_dir.get_terraform_dir()
+        self.assertEqual(os.path.join(work_dir, 'terraform'), terraform_dir)
+        os.makedirs(terraform_dir)
+        with open(os.path.join(terraform_dir, 'main.tf'), 'w') as f:
+            f.write('# test')
+        with tempfile.TemporaryDirectory() as archive_dir:
+            archive_file_path = lib.terraform_dir.archive_terraform_dir(
+                terraform_dir, archive_dir, source_ref='test')
+            self.assertEqual(
+                work_dir,
+                lib.terraform_dir._get_archive_work_dir(archive_file_path))
+            lib.work_dir._remove_current_work_dir()
+            self.assertFalse(os.path.exists(work_dir))
+            restored_terraform_dir = lib.terraform_dir.restore_terraform_dir(
+                archive_dir)
+        self.assertEqual(terraform_dir, restored_terraform_dir)
+        self.assertTrue(
+            os.path.isfile(os.path.join(restored_terraform_dir, 'main.tf')))
+
+    def test_it_refuses_archive_work_dirs_outside_the_roots(self):
+        with tempfile.TemporaryDirectory() as other_root:
+            for work_dir in [
+                # not a work dir at all
+                os.path.join(other_root, 'data'),
+                # a work dir, but not within a configured root
+                os.path.join(other_root, 'tfwork-abc123'),
+                os.path.join(self.root.name, 'nested', 'tfwork-abc123'),
+            ]:
+                terraform_dir = os.path.join(work_dir, 'terraform')
+                os.makedirs(terraform_dir)
+                victim_file_path = os.path.join(terraform_dir, 'main.tf')
+                with open(victim_file_path, 'w') as f:
+                    f.write('# victim')
+                with tempfile.TemporaryDirectory() as archive_dir:
+                    lib.terraform_dir.archive_terraform_dir(
+                        terraform_dir, archive_dir, source_ref='test')
+                    with self.assertRaises(ValueError):
+                        lib.terraform_dir.restore_terraform_dir(archive_dir)
+                lib.work_dir._remove_current_work_dir()
+                self.assertTrue(os.path.isfile(victim_file_path))
+                self.assertIsNone(lib.work_dir.get_current_work_dir())
+
+    def test_it_only_removes_work_dirs_it_created(self):
+        existing_work_dir = os.path.join(self.root.name, 'tfwork-existing')
+        os.makedirs(existing_work_dir)
+        work_dir = lib.work_dir.create_work_dir(
+            self.root.name, work_dir=existing_work_dir)
+        self.assertEqual(existing_work_dir, work_dir)
+        lib.work_dir._remove_current_work_dir()
+        self.assertTrue(os.path.isdir(existing_work_dir))
+
+    def test_it_refuses_work_dirs_in_use_by_another_run(self):
+        in_use_work_dir = os.path.join(self.root.name, 'tfwork-inuse')
+        os.makedirs(in_use_work_dir)
+        lock_file = lib.work_dir._lock_work_dir(in_use_work_dir)
+        self.addCleanup(lock_file.close)
+        with self.assertRaises(ValueError):
+            lib.work_dir.create_work_dir(
+                self.root.name, work_dir=in_use_work_dir)
+        self.assertIsNone(lib.work_dir.get_current_work_dir())
+        lib.work_dir._remove_current_work_dir()
+        self.assertTrue(os.path.isdir(in_use_work_dir))
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+# stdlib
+import os
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+# local
+import lib.cli
+import lib.staging
+import lib.workstation
+import tests.common as common
+
+
+# =============================================================================
+#
+# test classes
+#
+# =============================================================================
+
+class when_syncing_changes(unittest.TestCase):
+    def test_it_copies_changed_files(self):
+        with tempfile.TemporaryDirectory() as source_dir, \
+                tempfile.TemporaryDirectory() as destination_dir:
+            common.write_file(
+                os.path.join(source_dir, 'modules/foo/main.tf'), 'foo')
+            lib.workstation._sync_changes(
+                source_dir,
+                destination_dir,
+                {'modules/foo/main.tf'})
+            self.assertEqual(
+                'foo',
+                common.read_file(
+                    os.path.join(destination_dir, 'modules/foo/main.tf')))
+
+    def test_it_syncs_files_staged_as_symlinks(self):
+        with tempfile.TemporaryDirectory() as source_dir, \
+                tempfile.TemporaryDirectory() as destination_dir:
+            common.write_file(os.path.join(source_dir, 'main.tf'), 'old')
+            common.write_file(
+                os.path.join(source_dir, 'modules/foo/main.tf'), 'foo')
+            lib.staging.stage_tree(
+                source_dir,
+                destination_dir,
+                staging_mode=lib.staging.SYMLINK)
+            common.write_file(os.path.join(source_dir, 'main.tf'), 'new')
+            common.write_file(
+                os.path.join(source_dir, 'modules/foo/main.tf'), 'bar')
+            lib.workstation._sync_changes(
+                source_dir,
+                destination_dir,
+                {'main.tf', 'modules'})
+            self.assertEqual(
+                'new', common.read_file(
+                    os.path.join(destination_dir, 'main.tf')))
+            self.assertEqual(
+                'bar',
+                common.read_file(
+                    os.path.join(destination_dir, 'modules/foo/main.tf')))
+
+    def test_it_removes_deleted_files(self):
+        with tempfile.TemporaryDirectory() as source_dir, \
+                tempfile.TemporaryDirectory() as destination_dir:
+            common.write_file(os.path.join(destination_dir, 'old.tf'), 'old')
+            lib.workstation._sync_changes(
+                source_dir,
+                destination_dir,
+                {'old.tf'})
+            self.assertFalse(
+                os.path.exists(os.path.join(destination_dir, 'old.tf')))
+
+    def test_it_copies_new_directories(self):
+        with tempfile.TemporaryDirectory() as source_dir, \
+                tempfile.TemporaryDirectory() as destination_dir:
+            common.write_file(os.path.join(source_dir, 'new/a.tf'), 'a')
+            common.write_file(os.path.join(source_dir, 'new/b.tf'), 'b')
+            lib.workstation._sync_changes(
+                source_dir,
+                destination_dir,
+                {'new'})
+            self.assertEqual(
+                ['a.tf', 'b.tf'],
+                sorted(os.listdir(os.path.join(destination_dir, 'new'))))
+
+    def test_it_leaves_unchanged_files_alone(self):
+        with tempfile.TemporaryDirectory() as source_dir, \
+                tempfile.TemporaryDirectory() as destination_dir:
+            common.write_file(os.path.join(source_dir, 'a.tf'), 'a')
+            common.write_file(
+                os.path.join(destination_dir, '.terraform/x'), 'x')
+            lib.workstation._sync_changes(
+                source_dir,
+                destination_dir,
+                {'a.tf'})
+            self.assertTrue(
+                os.path.exists(os.path.join(destination_dir, '.terraform/x')))
+
+
+class when_polling_for_changes(unittest.TestCase):
+    def test_it_reports_modified_files(self):
+        with tempfile.TemporaryDirectory() as source_dir:
+            common.write_file(os.path.join(source_dir, 'a.tf'), 'a')
+            watcher = lib.workstation.PollingWatcher(source_dir)
+            common.write_file(os.path.join(source_dir, 'a.tf'), 'aa')
+            self.assertEqual({'a.tf'}, watcher.wait_for_changes(1))
+
+    def test_it_ignores_the_git_dir(self):
+        with tempfile.TemporaryDirectory() as source_dir:
+            watcher = lib.workstation.PollingWatcher(source_dir)
+            common.write_file(os.path.join(source_dir, '.git/HEAD'), 'ref')
+            self.assertEqual(set(), watcher.wait_for_changes(0))
+
+
+class when_watching_with_inotify(unittest.TestCase):
+    def test_it_reports_changes_in_new_directories(self):
+        with tempfile.TemporaryDirectory() as source_dir:
+            watcher = lib.workstation._create_watcher(source_dir)
+            try:
+                os.makedirs(os.path.join(source_dir, 'new'))
+                changes = watcher.wait_for_changes(1)
+                # give a new directory's watch a chance to be registered
+                changes.update(watcher.wait_for_changes(0.2))
+                common.write_file(os.path.join(source_dir, 'new/a.tf'), 'a')
+                changes.update(
+                    lib.workstation._wait_for_quiet_period(watcher, 0.5))
+            finally:
+                watcher.close()
+            self.assertIn('new', changes)
+            self.assertIn(os.path.join('new', 'a.tf'), changes)
+
+
+class when_debouncing_changes(unittest.TestCase):
+    def test_it_collects_a_burst_of_changes(self):
+        with tempfile.TemporaryDirectory() as source_dir:
+            watcher = lib.workstation._create_watcher(source_dir)
+
+            def write_burst():
+                for index in range(3):
+                    common.write_file(
+                        os.path.join(source_dir, f'{index}.tf'), 'x')
+                    time.sleep(0.05)
+
+            try:
+                writer = threading.Thread(target=write_burst)
+                writer.start()
+                changes = watcher.wait_for_changes(2)
+                changes.update(
+                    lib.workstation._wait_for_quiet_period(watcher, 1.5))
+                writer.join()
+            finally:
+                watcher.close()
+            self.assertEqual({'0.tf', '1.tf', '2.tf'}, changes)
+
+
+class when_running_a_session(unittest.TestCase):
+    def test_it_re_plans_after_a_change(self):
+        with tempfile.TemporaryDirectory() as source_dir, \
+                tempfile.TemporaryDirectory() as terraform_dir:
+            def edit_source():
+                time.sleep(0.2)
+                common.write_file(os.path.join(source_dir, 'main.tf'), 'x')
+
+            with unittest.mock.patch(
+                    'lib.terraform_dir.plan_terraform_dir') as plan:
+                editor = threading.Thread(target=edit_source)
+                editor.start()
+                lib.workstation.run_session(
+                    source_dir,
+                    0.02,
+                    terraform_dir=terraform_dir,
+                    debounce_seconds=0.1)
+                editor.join()
+            plan.assert_called()
+            self.assertEqual(
+                'x',
+                common.read_file(os.path.join(terraform_dir, 'main.tf')))
+
+
+class when_a_watched_command_ends(unittest.TestCase):
+    def setUp(self):
+        for patcher in [
+            unittest.mock.patch.dict(os.environ, {
+                lib.cli.WORKSTATION_MODE: 'true',
+                lib.cli.WORKSTATION_MODE_WATCH: 'true',
+                lib.cli.WORKSTATION_MODE_TIMEOUT: '0',
+            }),
+            unittest.mock.patch('builtins.print'),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        os.environ.pop(lib.cli.TERRAFORM_SOURCE_DIR, None)
+        session_patcher = unittest.mock.patch(
+            'lib.cli.do_workstation_session')
+        self.session = session_patcher.start()
+        self.addCleanup(session_patcher.stop)
+
+    def test_a_failed_command_keeps_its_error_and_is_not_watched(self):
+        os.environ[lib.cli.TERRAFORM_SOURCE_DIR] = '/tmp/example'
+        with unittest.mock.patch(
+                'lib.cli.process_args_with_profile',
+                side_effect=ValueError('plan failed')):
+            with self.assertRaisesRegex(ValueError, 'plan failed'):
+                lib.cli.main(['plan'])
+        self.session.assert_not_called()
+
+    def test_commands_without_a_source_dir_are_not_watched(self):
+        with unittest.mock.patch('lib.cli.process_args_with_profile'):
+            lib.cli.main(['show-plan'])
+        self.session.assert_not_called()
+
+    def test_a_successful_command_is_watched(self):
+        os.environ[lib.cli.TERRAFORM_SOURCE_DIR] = '/tmp/example'
+        with unittest.mock.patch('lib.cli.process_args_with_profile'):
+            lib.cli.main(['plan'])
+        self.session.assert_called_once_with(0)
+
+
+# =============================================================================
+#
+# main
+#
+# =============================================================================
+
+if __name__ == "__main__":
+    unittest.main()